@@ -0,0 +1,107 @@
+'''
+Statistics of images in rectangular blocks and running medians,
+used for CCD background estimates
+'''
+
+import numpy as np
+import numba
+from scipy.ndimage import median_filter
+
+def _block_apply(image, bins0, bins1, func) :
+    '''
+    Apply func to every rectangular block of image
+
+    Args:
+       image : 2D array
+       bins0 : 1D array of integer bin edges along axis 0
+       bins1 : 1D array of integer bin edges along axis 1
+       func : function of a 2D block returning a scalar
+
+    Returns 2D array of shape (len(bins0)-1, len(bins1)-1) with func of each block
+    '''
+    bins0 = np.asarray(bins0, dtype=int)
+    bins1 = np.asarray(bins1, dtype=int)
+    result = np.zeros((bins0.size-1, bins1.size-1))
+    for i in range(bins0.size-1) :
+        for j in range(bins1.size-1) :
+            result[i,j] = func(image[bins0[i]:bins0[i+1],bins1[j]:bins1[j+1]])
+    return result
+
+def block_median(image, bins0, bins1) :
+    '''
+    Median of image in rectangular blocks
+
+    Args:
+       image : 2D array
+       bins0 : 1D array of integer bin edges along axis 0
+       bins1 : 1D array of integer bin edges along axis 1
+
+    Returns 2D array of shape (len(bins0)-1, len(bins1)-1) where element
+    [i,j] = np.median(image[bins0[i]:bins0[i+1],bins1[j]:bins1[j+1]])
+
+    Bins do not need to have the same size. For patches of thousands of
+    pixels, np.median (one selection per contiguous block copy) is faster
+    than gathering all blocks into a single array.
+    '''
+    return _block_apply(image, bins0, bins1, np.median)
+
+@numba.jit(nopython=True)
+def _sliding_rank(padded, width, rank, n) :
+    '''
+    Element of given rank of padded[i:i+width] for i in range(n),
+    updating a sorted window one value at a time
+    '''
+    out = np.zeros(n)
+    window = np.sort(padded[:width])
+    out[0] = window[rank]
+    for i in range(1, n) :
+        # remove the value leaving the window
+        j = np.searchsorted(window, padded[i-1])
+        for k in range(j, width-1) :
+            window[k] = window[k+1]
+        # insert the value entering the window
+        value = padded[i+width-1]
+        j = np.searchsorted(window[:width-1], value)
+        for k in range(width-1, j, -1) :
+            window[k] = window[k-1]
+        window[j] = value
+        out[i] = window[rank]
+    return out
+
+#- scipy.ndimage boundary modes -> np.pad modes
+_pad_modes = {'reflect':'symmetric', 'mirror':'reflect', 'nearest':'edge',
+              'wrap':'wrap', 'constant':'constant'}
+
+def running_median(x, width, mode='reflect', cval=0.) :
+    '''
+    Running median of a 1D array
+
+    Args:
+       x : 1D array
+       width : integer size of the median window
+
+    Options:
+       mode : boundary mode, as in scipy.ndimage.median_filter
+       cval : value beyond the edges for mode='constant'
+
+    Returns 1D array, identical to scipy.ndimage.median_filter(x, width, mode=mode, cval=cval)
+    but with a cost that scales with the array size times log(width) for the
+    search plus a memory move, instead of a selection over the whole window
+    at every pixel.
+    '''
+    x = np.asarray(x, dtype=float)
+    width = int(width)
+    if mode not in _pad_modes :
+        raise ValueError('unsupported mode {}'.format(mode))
+    if x.size == 0 :
+        return x.copy()
+    if mode != 'constant' and x.size < width :
+        #- scipy extends short arrays differently from np.pad
+        return median_filter(x, width, mode=mode)
+    before = width//2
+    after = width-1-before
+    if mode == 'constant' :
+        padded = np.pad(x, (before, after), mode='constant', constant_values=cval)
+    else :
+        padded = np.pad(x, (before, after), mode=_pad_modes[mode])
+    return _sliding_rank(padded, width, width//2, x.size)
@@ -7,6 +7,7 @@ Reading and selecting calibration data from $DESI_SPECTRO_CALIB using content of
 
 import re
 import os
+import copy
 import numpy as np
 import yaml
 import os.path
@@ -49,6 +50,23 @@ def _load_smsp():
     _sp2sm = tmp_sp2sm
     _sm2sp = tmp_sm2sp
 
+#- parsed calibration yaml files, keyed by filename
+_yaml_cache = dict()
+
+def _read_calib_yaml(filename):
+    """
+    Return parsed content of calibration yaml file, cached until the file
+    modification time or size changes
+    """
+    global _yaml_cache
+    st = os.stat(filename)
+    version = (st.st_mtime_ns, st.st_size)
+    if filename not in _yaml_cache or _yaml_cache[filename][0] != version:
+        with open(filename, 'r') as stream:
+            _yaml_cache[filename] = (version, yaml.safe_load(stream))
+
+    return _yaml_cache[filename][1]
+
 def sp2sm(sp):
     """
     Converts spectrograph sp logical number to sm hardware number
@@ -245,9 +263,7 @@ class CalibFinder() :
 
         log.debug("reading calib data in {}".format(yaml_file))
 
-        stream = open(yaml_file, 'r')
-        data   = yaml.safe_load(stream)
-        stream.close()
+        data = _read_calib_yaml(yaml_file)
 
 
         if not cameraid in data :
@@ -306,7 +322,8 @@ class CalibFinder() :
             raise KeyError("Didn't find matching calibration data in %s"%(yaml_file))
 
 
-        self.data = matching_data
+        #- copy so that the cached yaml content is not modified
+        self.data = copy.deepcopy(matching_data)
 
     def haskey(self,key) :
         """
@@ -10,7 +10,7 @@ import numpy as np
 from scipy.signal import savgol_filter
 
 from desispec import io
-from desispec.preproc import masked_median
+from desispec.maskedmedian import ImageStack
 # from desispec.preproc import parse_sec_keyword, calc_overscan
 from desispec.preproc import parse_sec_keyword, get_amp_ids
 from desispec.preproc import subtract_peramp_overscan
@@ -23,7 +23,7 @@ from desiutil.log import get_logger
 from desiutil.depend import add_dependencies
 
 def compute_dark_file(rawfiles, outfile, camera, bias=None, nocosmic=False,
-                 scale=False, exptime=None):
+                 scale=False, exptime=None, max_memory=2.0, scratchdir=None):
     """
     Compute classic dark model from input dark images
 
@@ -37,6 +37,9 @@ def compute_dark_file(rawfiles, outfile, camera, bias=None, nocosmic=False,
         nocosmic (bool): use medians instead of cosmic identification
         scale (bool): apply scale correction for EM0 teststand data
         exptime (float): write EXPTIME header keyword; all inputs must match
+        max_memory (float): memory budget in GB for the median and mean images
+        scratchdir (str): directory for the temporary image stack file;
+            default is the directory of outfile
 
     Note: if bias is None, no bias correction is applied.  If it is a single
     file, then use that bias for all darks.  If it is a list, it must have
@@ -50,13 +53,11 @@ def compute_dark_file(rawfiles, outfile, camera, bias=None, nocosmic=False,
     log = get_logger()
     log.info("read images ...")
 
-    shape=None
-    images=[]
+    if scratchdir is None :
+        scratchdir = os.path.dirname(os.path.abspath(outfile))
+
+    stack = None
     first_image_header = None
-    if nocosmic :
-        masks=None
-    else :
-        masks=[]
 
     for ifile, filename in enumerate(rawfiles):
         log.info(f'Reading {filename} camera {camera}')
@@ -111,46 +112,40 @@ def compute_dark_file(rawfiles, outfile, camera, bias=None, nocosmic=False,
             if k in img.meta and k not in first_image_header:
                 first_image_header[k] = img.meta[k]
 
-        if shape is None :
-            shape=img.pix.shape
+        if stack is None :
+            #- preprocessed images are kept in a scratch file instead of memory
+            stack = ImageStack(len(rawfiles), img.pix.shape, masks=(not nocosmic),
+                               scratchdir=scratchdir)
         log.info("adding dark %s divided by exposure time %f s"%(filename,thisexptime))
-        images.append(img.pix.ravel()/thisexptime)
-        if masks is not None :
-            masks.append(img.mask.ravel())
-
-    images=np.array(images)
-    if masks is not None :
-        masks=np.array(masks)
-        smask=np.sum(masks,axis=0)
-    else :
-        smask=np.zeros(images[0].shape)
+        stack.set(ifile, img.pix/thisexptime, img.mask)
 
     log.info("compute median image ...")
-    medimage=masked_median(images,masks)
+    medimage=stack.median(max_memory=max_memory)
 
     if scale :
         log.info("compute a scale per image ...")
-        sm2=np.sum((smask==0)*medimage**2)
-        ok=(medimage>0.6*np.median(medimage))*(smask==0)
-        for i,image in enumerate(rawfiles) :
-            s=np.sum((smask==0)*medimage*image)/sm2
-            #s=np.median(image[ok]/medimage[ok])
+        sm2=0.
+        sprod=np.zeros(stack.nimages)
+        for rows in stack.stripes(max_memory) :
+            if stack.masks is not None :
+                good=(np.sum(stack.masks[:,rows],axis=0)==0)
+            else :
+                good=np.ones(medimage[rows].shape, dtype=bool)
+            sm2+=np.sum(good*medimage[rows]**2)
+            for i in range(stack.nimages) :
+                sprod[i]+=np.sum(good*medimage[rows]*stack.data[i,rows])
+        for i in range(stack.nimages) :
+            s=sprod[i]/sm2
             log.info("image %d scale = %f"%(i,s))
-            images[i] /= s
+            stack.data[i] /= s
         log.info("recompute median image after scaling ...")
-        medimage=masked_median(images,masks)
-
-    if True :
-        log.info("compute mask ...")
-        ares=np.abs(images-medimage)
-        nsig=4.
-        mask=(ares<nsig*1.4826*np.median(ares,axis=0))
-        # average (not median)
-        log.info("compute average ...")
-        meanimage=np.sum(images*mask,axis=0)/np.sum(mask,axis=0)
-        meanimage=meanimage.reshape(shape)
-    else :
-        meanimage=medimage.reshape(shape)
+        medimage=stack.median(max_memory=max_memory)
+
+    log.info("compute mask and average ...")
+    # average (not median) of pixels within 4 sigma of the median
+    medimage, meanimage = stack.clipped_mean(nsig=4., median=medimage,
+                                             max_memory=max_memory)
+    stack.close()
 
     log.info("write result in %s ..."%outfile)
     hdulist=pyfits.HDUList([pyfits.PrimaryHDU(meanimage.astype('float32'))])
@@ -197,7 +192,7 @@ def compute_dark_file(rawfiles, outfile, camera, bias=None, nocosmic=False,
 
 
 def compute_bias_file(rawfiles, outfile, camera, explistfile=None,
-        extraheader=None):
+        extraheader=None, max_memory=2.0, scratchdir=None):
     """
     Compute a bias file from input ZERO rawfiles
 
@@ -209,6 +204,9 @@ def compute_bias_file(rawfiles, outfile, camera, explistfile=None,
     Options:
         explistfile: filename with text list of NIGHT EXPID to use
         extraheader: dict-like key/value header keywords to add
+        max_memory (float): memory budget in GB for the median and mean images
+        scratchdir (str): directory for the temporary image stack file;
+            default is the directory of outfile
 
     Notes: explistfile is only used if rawfiles=None; it should have
     one NIGHT EXPID entry per line.
@@ -236,11 +234,13 @@ def compute_bias_file(rawfiles, outfile, camera, explistfile=None,
 
                 rawfiles.append(filename)
 
+    if scratchdir is None :
+        scratchdir = os.path.dirname(os.path.abspath(outfile))
+
     log.info("read %s images ...", camera)
-    images=[]
-    shape=None
+    stack=None
     first_image_header = None
-    for filename in rawfiles :
+    for ifile, filename in enumerate(rawfiles) :
         log.info("reading %s %s", filename, camera)
         fitsfile=pyfits.open(filename)
 
@@ -263,30 +263,21 @@ def compute_bias_file(rawfiles, outfile, camera, explistfile=None,
 
         subtract_peramp_overscan(image, image_header)
 
-        if shape is None :
-            shape=image.shape
-        images.append(image.ravel())
+        if stack is None :
+            #- images are kept in a scratch file instead of memory
+            stack=ImageStack(len(rawfiles), image.shape, scratchdir=scratchdir)
+        stack.set(ifile, image)
 
         fitsfile.close()
 
-    images=np.array(images)
-    log.debug('%s images.shape=%s', camera, str(images.shape))
-
-    # compute a mask
-    log.info(f"compute median {camera} image ...")
-    medimage=np.median(images,axis=0) #.reshape(shape)
-    log.info(f"compute {camera} mask ...")
-    ares=np.abs(images-medimage)
-    nsig=4.
-    mask=(ares<nsig*1.4826*np.median(ares,axis=0))
-    # average (not median)
-    log.info(f"compute {camera} average ...")
-    meanimage=np.sum(images*mask,axis=0)/np.sum(mask,axis=0)
-    meanimage=meanimage.reshape(shape)
-
-    # cleanup memory
-    del images
-    del mask
+    log.debug('%s images.shape=%s', camera, str((stack.nimages,)+stack.shape))
+
+    # median, then average (not median) of pixels within 4 sigma of the median
+    log.info(f"compute median and average {camera} image ...")
+    medimage, meanimage = stack.clipped_mean(nsig=4., max_memory=max_memory)
+
+    # cleanup scratch file
+    stack.close()
     del medimage
 
     log.info(f"write {camera} result to {outfile} ...")
@@ -435,7 +426,7 @@ def _find_zeros(night, cameras, nzeros=25, nskip=2, anyzeros=False):
     return expdict
 
 def compute_nightly_bias(night, cameras, outdir=None, nzeros=25, minzeros=15,
-        nskip=2, anyzeros=False, comm=None):
+        nskip=2, anyzeros=False, comm=None, max_memory=2.0, scratchdir=None):
     """Create nightly biases for cameras on night
 
     Args:
@@ -449,6 +440,9 @@ def compute_nightly_bias(night, cameras, outdir=None, nzeros=25, minzeros=15,
         nskip (int): number of initial zeros to skip
         anyzeros (bool): allow any ZEROs, not just those taken for CCD calib seq
         comm: MPI communicator for parallelism
+        max_memory (float): memory budget in GB per camera for the bias image statistics
+        scratchdir (str): directory for temporary image stack files;
+            default is the output directory
 
     Returns:
         nfail (int): number of cameras that failed across all ranks
@@ -456,8 +450,10 @@ def compute_nightly_bias(night, cameras, outdir=None, nzeros=25, minzeros=15,
     Writes biasnight*.fits files in outdir or
     $DESI_SPECTRO_REDUX/$SPECPROD/calibnight/night/
 
-    Note: compute_bias_file requires ~12 GB memory per camera, so limit
-    the size of the MPI communicator depending upon the memory available.
+    Note: compute_bias_file keeps the input images in a scratch file and
+    uses about max_memory GB per camera to compute their statistics,
+    so limit the size of the MPI communicator and max_memory depending
+    upon the memory available.
     """
     #- only import fitsio if needed, not upon package import
     import fitsio
@@ -534,7 +530,8 @@ def compute_nightly_bias(night, cameras, outdir=None, nzeros=25, minzeros=15,
             log.info(f'Rank {rank} computing nightly bias for {night} {camera}')
             try:
                 compute_bias_file(rawfiles, testbias, camera,
-                                  extraheader=dict(NIGHT=night))
+                                  extraheader=dict(NIGHT=night),
+                                  max_memory=max_memory, scratchdir=scratchdir)
             except Exception as ex:
                 nfail+=1
                 log.error(f'Rank {rank} camera {camera} raised {type(ex)} exception {ex}')
@@ -17,7 +17,7 @@ import multiprocessing
 
 from desiutil.log import get_logger
 
-from desispec.interpolation import resample_flux
+from desispec.interpolation import resample_flux_batch
 from desispec.spectra import Spectra
 from desispec.resolution import Resolution
 from desispec.fiberbitmasking import get_all_fiberbitmask_with_amp, get_all_nonamp_fiberbitmask_val, get_justamps_fiberbitmask
@@ -316,6 +316,209 @@ def coadd_fibermap(fibermap, onetile=False):
 
     return tfmap, exp_fibermap
 
+class TargetGroups(object):
+    """
+    Sort-based group-by index of spectra rows sharing the same TARGETID
+
+    This is built once per Spectra object and shared by all bands, instead
+    of scanning the fibermap with ``np.where(TARGETID==tid)`` for every target.
+
+    Args:
+        targetids: array of TARGETID, one per spectrum
+
+    Attributes:
+        targets: unique TARGETIDs in the order they first appear
+        ntarget: number of unique targets
+        group: index in `targets` of each input row
+    """
+    def __init__(self, targetids):
+        targetids = np.asarray(targetids)
+        unique, first, inverse = np.unique(targetids,
+                return_index=True, return_inverse=True)
+        ii = np.argsort(first)
+        rank = np.empty(ii.size, dtype=np.int64)
+        rank[ii] = np.arange(ii.size)
+
+        self.targets = unique[ii]
+        self.ntarget = self.targets.size
+        self.group = rank[np.ravel(inverse)]
+        #- stable sort keeps the input order of rows within each target
+        self._rows = np.argsort(self.group, kind='stable')
+
+    def select(self, good=None):
+        """
+        Return input rows grouped by target, optionally keeping only `good` rows
+
+        Options:
+            good: boolean array, one per input row
+
+        Returns (rows, groups, starts, counts) where `rows` are the row
+        indices sorted by target, `groups` are the indices in `self.targets`
+        of the targets with at least one selected row, and
+        ``rows[starts[i]:starts[i]+counts[i]]`` are the rows of `groups[i]`
+        """
+        rows = self._rows
+        if good is not None:
+            rows = rows[np.asarray(good)[rows]]
+        groups, starts, counts = np.unique(self.group[rows],
+                return_index=True, return_counts=True)
+        return rows, groups, starts, counts
+
+def _groupby_reduce(data, starts, counts, ufunc=np.add):
+    """
+    Reduce consecutive segments of rows of `data` with `ufunc`
+
+    Args:
+        data: array[nrows, ...] with rows sorted by group
+        starts: first row of each group
+        counts: number of rows of each group
+
+    Options:
+        ufunc: numpy ufunc used for the reduction (default np.add)
+
+    Returns array[ngroups, ...]
+
+    This is vectorized over groups and accumulates the rows of each group
+    in order, so that the result is identical to
+    ``ufunc.reduce(data[start:start+count], axis=0)`` for every group.
+    """
+    result = data[starts].copy()
+    for k in range(1, np.max(counts, initial=1)):
+        ii = np.where(counts > k)[0]
+        result[ii] = ufunc(result[ii], data[starts[ii]+k])
+
+    return result
+
+def _interp_bad_pixels(wave, data, good):
+    """
+    Replace bad pixels of each row of `data` by linear interpolation
+
+    Args:
+        wave: 1D[nwave] wavelength array
+        data: 2D[nrows, nwave] array, modified in place
+        good: 2D[nrows, nwave] boolean array of good pixels
+
+    Every row must have at least one good pixel. Bad pixels beyond the
+    first/last good pixel of a row take that pixel's value, and the
+    interpolation uses the same arithmetic as ``np.interp`` so that the
+    result is identical to calling it row by row.
+    """
+    nrows, nwave = data.shape
+    index = np.broadcast_to(np.arange(nwave), (nrows, nwave))
+    #- previous and next good pixel of every pixel
+    prev = np.maximum.accumulate(np.where(good, index, -1), axis=1)
+    next = np.minimum.accumulate(np.where(good, index, nwave)[:,::-1], axis=1)[:,::-1]
+
+    ii, jj = np.where(~good)
+    jprev = prev[ii, jj]
+    jnext = next[ii, jj]
+    left = (jprev < 0)
+    right = (jnext >= nwave)
+    inside = ~(left | right)
+
+    values = np.empty(ii.size, dtype=data.dtype)
+    values[left] = data[ii[left], jnext[left]]
+    values[right] = data[ii[right], jprev[right]]
+    ii, jj, jprev, jnext = ii[inside], jj[inside], jprev[inside], jnext[inside]
+    slope = (data[ii, jnext] - data[ii, jprev]) / (wave[jnext] - wave[jprev])
+    values[inside] = slope*(wave[jj] - wave[jprev]) + data[ii, jprev]
+
+    bad = ~good
+    data[bad] = values
+
+def _mask_cosmics(wave, flux, ivar, mask, ivarjj, starts, counts, cosmics_nsig):
+    """
+    Mask cosmic ray outliers in the spectra of all targets at once
+
+    Args:
+        wave: 1D[nwave] wavelength array
+        flux: 2D[nrows, nwave] flux, rows sorted by target
+        ivar: 2D[nrows, nwave] ivar, rows sorted by target
+        mask: 2D[nrows, nwave] mask, rows sorted by target, or None
+        ivarjj: 2D[nrows, nwave] masked ivar, modified in place
+        starts: first row of each target
+        counts: number of rows of each target
+        cosmics_nsig: float, nsigma clipping threshold for cosmics rays
+
+    Returns array of the number of masked wavelength bins per target
+
+    Only targets with more than 2 spectra are considered. At each wavelength
+    where the chi2 of the flux gradients across the spectra of a target is
+    above `cosmics_nsig**2`, the ivar of the most discrepant spectrum is set
+    to 0 in `ivarjj`.
+    """
+    nmasked = np.zeros(counts.size, dtype=np.int32)
+    nrows, nwave = flux.shape
+    rowgroup = np.repeat(np.arange(counts.size), counts)
+
+    if mask is not None :
+        good = (ivar*(mask==0) > 0)
+    else :
+        good = (ivar > 0)
+
+    #- spectra without any good pixel do not enter the gradient statistics
+    valid = np.any(good, axis=1) & (counts > 2)[rowgroup]
+    if not np.any(valid) :
+        return nmasked
+
+    # interpolate over bad measurements
+    # to be able to compute gradient next
+    # to a bad pixel and identify outlier
+    # many cosmics residuals are on edge
+    # of cosmic ray trace, and so can be
+    # next to a masked flux bin
+    vgood = good[valid]
+    grad = flux[valid].copy()
+    _interp_bad_pixels(wave, grad, vgood)
+    ttivar = ivar[valid].copy()
+    _interp_bad_pixels(wave, ttivar, vgood)
+    gradvar = 1./(ttivar+(ttivar==0))
+    grad[:,1:] = grad[:,1:]-grad[:,:-1]
+    gradvar[:,1:] = gradvar[:,1:]+gradvar[:,:-1]
+    grad[:,0] = 0
+    gradivar = (gradvar>0)/(gradvar+(gradvar==0))
+
+    #- re-segment the valid rows by target
+    vgroup = rowgroup[valid]
+    vtargets, vstarts, vcounts = np.unique(vgroup,
+            return_index=True, return_counts=True)
+    vindex = np.searchsorted(vtargets, vgroup)
+    sgradivar = np.add.reduceat(np.sum(gradivar, axis=1), vstarts)
+    ok = (sgradivar > 0)
+
+    meangrad = _groupby_reduce(gradivar*grad, vstarts, vcounts)
+    meangrad[ok] /= sgradivar[ok, None]
+    deltagrad = grad - meangrad[vindex]
+    chi2dev = gradivar*deltagrad**2
+    chi2 = _groupby_reduce(chi2dev, vstarts, vcounts)
+    with np.errstate(divide='ignore', invalid='ignore') :
+        chi2 /= (vcounts[:,None]-1)
+    bad = (chi2 > cosmics_nsig**2) & ok[:,None]
+    if not np.any(bad) :
+        return nmasked
+
+    #- most discrepant spectrum of each target at each bad wavelength,
+    #- taking the first one in case of ties like np.argmax
+    maxdev = _groupby_reduce(chi2dev, vstarts, vcounts, np.maximum)
+    position = np.where(chi2dev == maxdev[vindex], np.arange(vgroup.size)[:,None], vgroup.size)
+    kmax = _groupby_reduce(position, vstarts, vcounts, np.minimum)
+
+    gbad, wbad = np.where(bad)
+    vrows = np.where(valid)[0]
+    ivarjj[vrows[kmax[gbad, wbad]], wbad] = 0.
+    nmasked[vtargets] = np.sum(bad, axis=1)
+
+    return nmasked
+
+def _log_cosmics(band, nmasked):
+    """
+    Log a one-line summary of the cosmic ray masking of a band
+    """
+    log = get_logger()
+    if np.any(nmasked > 0) :
+        log.info("band '{}': masked {} values for {} targets".format(
+            band, np.sum(nmasked), np.count_nonzero(nmasked)))
+
 def coadd(spectra, cosmics_nsig=0.0, onetile=False) :
     """
     Coadd spectra for each target and each camera, modifying input spectra obj.
@@ -327,15 +530,24 @@ def coadd(spectra, cosmics_nsig=0.0, onetile=False) :
        cosmics_nsig: float, nsigma clipping threshold for cosmics rays
        onetile: bool, if True, inputs are from a single tile
 
+    Returns:
+       Table with TARGETID and the number of wavelength bins masked as
+       cosmic rays NCOSMIC_B, NCOSMIC_R, ... for each band
+
     Notes: if `onetile` is True, additional tile-specific columns
        like LOCATION and FIBER are included the FIBERMAP; otherwise
        these are only in the EXP_FIBERMAP since for the same target they could
        be different on different tiles.
     """
     log = get_logger()
-    targets = ordered_unique(spectra.fibermap["TARGETID"])
-    ntarget=targets.size
+    tgroups = TargetGroups(spectra.fibermap["TARGETID"])
+    targets = tgroups.targets
+    ntarget = tgroups.ntarget
     log.debug("number of targets= {}".format(ntarget))
+    cosmics = Table()
+    cosmics['TARGETID'] = targets
+    for b in spectra.bands :
+        cosmics['NCOSMIC_'+b.upper()] = np.zeros(ntarget, dtype=np.int32)
     for b in spectra.bands :
         log.debug("coadding band '{}'".format(b))
         nwave=spectra.wave[b].size
@@ -354,88 +566,49 @@ def coadd(spectra, cosmics_nsig=0.0, onetile=False) :
             fiberstatus = spectra.fibermap['COADD_FIBERSTATUS']
 
         good_fiberstatus = ( (fiberstatus & fiberstatus_bits) == 0 )
-        for i,tid in enumerate(targets) :
-            jj=np.where( (spectra.fibermap["TARGETID"]==tid) & good_fiberstatus )[0]
-
-            #- if all spectra were flagged as bad (FIBERSTATUS != 0), contine
-            #- to next target, leaving tflux and tivar=0 for this target
-            if len(jj) == 0:
-                continue
-
-            if cosmics_nsig is not None and cosmics_nsig > 0  and len(jj)>2 :
-                # interpolate over bad measurements
-                # to be able to compute gradient next
-                # to a bad pixel and identify outlier
-                # many cosmics residuals are on edge
-                # of cosmic ray trace, and so can be
-                # next to a masked flux bin
-                grad=[]
-                gradvar=[]
-                for j in jj :
-                    if spectra.mask is not None :
-                        ttivar = spectra.ivar[b][j]*(spectra.mask[b][j]==0)
-                    else :
-                        ttivar = spectra.ivar[b][j]
-                    good = (ttivar>0)
-                    bad  = ~good
-                    if np.sum(good)==0 :
-                        continue
-                    nbad = np.sum(bad)
-                    ttflux = spectra.flux[b][j].copy()
-                    if nbad>0 :
-                        ttflux[bad] = np.interp(spectra.wave[b][bad],spectra.wave[b][good],ttflux[good])
-                    ttivar = spectra.ivar[b][j].copy()
-                    if nbad>0 :
-                        ttivar[bad] = np.interp(spectra.wave[b][bad],spectra.wave[b][good],ttivar[good])
-                    ttvar = 1./(ttivar+(ttivar==0))
-                    ttflux[1:] = ttflux[1:]-ttflux[:-1]
-                    ttvar[1:]  = ttvar[1:]+ttvar[:-1]
-                    ttflux[0]  = 0
-                    grad.append(ttflux)
-                    gradvar.append(ttvar)
-
-            tivar_unmasked= np.sum(spectra.ivar[b][jj],axis=0)
-            if spectra.mask is not None :
-                ivarjj=spectra.ivar[b][jj]*(spectra.mask[b][jj]==0)
-            else :
-                ivarjj=spectra.ivar[b][jj]
-            if cosmics_nsig is not None and cosmics_nsig > 0 and len(jj)>2  :
-                grad=np.array(grad)
-                gradvar=np.array(gradvar)
-                gradivar=(gradvar>0)/np.array(gradvar+(gradvar==0))
-                nspec=grad.shape[0]
-                sgradivar=np.sum(gradivar)
-                if sgradivar>0 :
-                    meangrad=np.sum(gradivar*grad,axis=0)/sgradivar
-                    deltagrad=grad-meangrad
-                    chi2=np.sum(gradivar*deltagrad**2,axis=0)/(nspec-1)
-
-                    bad  = (chi2>cosmics_nsig**2)
-                    nbad = np.sum(bad)
-                    if nbad>0 :
-                        log.info("masking {} values for targetid={}".format(nbad,tid))
-                        badindex=np.where(bad)[0]
-                        for bi in badindex  :
-                            k=np.argmax(gradivar[:,bi]*deltagrad[:,bi]**2)
-                            ivarjj[k,bi]=0.
-                            log.debug("masking spec {} wave={}".format(k,spectra.wave[b][bi]))
-
-            tivar[i]=np.sum(ivarjj,axis=0)
-            tflux[i]=np.sum(ivarjj*spectra.flux[b][jj],axis=0)
-            for r in range(spectra.resolution_data[b].shape[1]) :
-                trdata[i,r]=np.sum((spectra.ivar[b][jj]*spectra.resolution_data[b][jj,r]),axis=0) # not sure applying mask is wise here
-            bad=(tivar[i]==0)
-            if np.sum(bad)>0 :
-                tivar[i][bad] = np.sum(spectra.ivar[b][jj][:,bad],axis=0) # if all masked, keep original ivar
-                tflux[i][bad] = np.sum(spectra.ivar[b][jj][:,bad]*spectra.flux[b][jj][:,bad],axis=0)
-            ok=(tivar[i]>0)
-            if np.sum(ok)>0 :
-                tflux[i][ok] /= tivar[i][ok]
-            ok=(tivar_unmasked>0)
-            if np.sum(ok)>0 :
-                trdata[i][:,ok] /= tivar_unmasked[ok]
-            if spectra.mask is not None :
-                tmask[i]      = np.bitwise_and.reduce(spectra.mask[b][jj],axis=0)
+
+        #- targets for which all spectra were flagged as bad (FIBERSTATUS != 0)
+        #- are not in groups, leaving tflux and tivar=0 for them
+        rows, groups, starts, counts = tgroups.select(good_fiberstatus)
+        flux = spectra.flux[b][rows]
+        ivar = spectra.ivar[b][rows]
+        if spectra.mask is not None :
+            mask = spectra.mask[b][rows]
+            ivarjj = ivar*(mask==0)
+        else :
+            mask = None
+            ivarjj = ivar.copy()
+
+        if cosmics_nsig is not None and cosmics_nsig > 0 :
+            nmasked = _mask_cosmics(spectra.wave[b], flux, ivar, mask, ivarjj,
+                    starts, counts, cosmics_nsig)
+            cosmics['NCOSMIC_'+b.upper()][groups] = nmasked
+            _log_cosmics(b, nmasked)
+
+        gtivar_unmasked = _groupby_reduce(ivar, starts, counts)
+        gtivar = _groupby_reduce(ivarjj, starts, counts)
+        gtflux = _groupby_reduce(ivarjj*flux, starts, counts)
+
+        bad = (gtivar==0)
+        if np.any(bad) :
+            # if all masked, keep original ivar
+            gtivar[bad] = gtivar_unmasked[bad]
+            gtflux[bad] = _groupby_reduce(ivar*flux, starts, counts)[bad]
+        ok = (gtivar>0)
+        gtflux[ok] /= gtivar[ok]
+        tivar[groups] = gtivar
+        tflux[groups] = gtflux
+
+        ok = (gtivar_unmasked>0)
+        for r in range(spectra.resolution_data[b].shape[1]) :
+            # not sure applying mask is wise here
+            gtrdata = _groupby_reduce(ivar*spectra.resolution_data[b][rows,r], starts, counts)
+            gtrdata[ok] /= gtivar_unmasked[ok]
+            trdata[groups,r] = gtrdata
+
+        if spectra.mask is not None :
+            tmask[groups] = _groupby_reduce(mask, starts, counts, np.bitwise_and)
+
         spectra.flux[b] = tflux
         spectra.ivar[b] = tivar
         if spectra.mask is not None :
@@ -453,6 +626,7 @@ def coadd(spectra, cosmics_nsig=0.0, onetile=False) :
     spectra.scores=None
     compute_coadd_scores(spectra, orig_scores, update_coadd=True)
 
+    return cosmics
 
 def coadd_cameras(spectra, cosmics_nsig=0., onetile=False) :
     """
@@ -470,7 +644,9 @@ def coadd_cameras(spectra, cosmics_nsig=0., onetile=False) :
     these are only in the EXP_FIBERMAP since for the same target they could
     be different on different tiles.
 
-    Note: unlike `coadd`, this does not modify the input spectra object
+    Note: unlike `coadd`, this does not modify the input spectra object.
+    The numbers of values masked as cosmic rays are only logged; use
+    the table returned by `coadd` to get them per target and band.
     """
 
     #check_alignement_of_camera_wavelength(spectra)
@@ -507,8 +683,9 @@ def coadd_cameras(spectra, cosmics_nsig=0., onetile=False) :
         windict[b] = windices
 
     # targets
-    targets = ordered_unique(spectra.fibermap["TARGETID"])
-    ntarget=targets.size
+    tgroups = TargetGroups(spectra.fibermap["TARGETID"])
+    targets = tgroups.targets
+    ntarget = tgroups.ntarget
     log.debug("number of targets= {}".format(ntarget))
 
 
@@ -546,90 +723,51 @@ def coadd_cameras(spectra, cosmics_nsig=0., onetile=False) :
             fiberstatus = spectra.fibermap['COADD_FIBERSTATUS']
 
         good_fiberstatus = ( (fiberstatus & fiberstatus_bits) == 0 )
-        for i,tid in enumerate(targets) :
-            jj=np.where( (spectra.fibermap["TARGETID"]==tid) & good_fiberstatus )[0]
-
-            #- if all spectra were flagged as bad (FIBERSTATUS != 0), contine
-            #- to next target, leaving tflux and tivar=0 for this target
-            if len(jj) == 0:
-                continue
-
-            if cosmics_nsig is not None and cosmics_nsig > 0 and len(jj)>2 :
-                # interpolate over bad measurements
-                # to be able to compute gradient next
-                # to a bad pixel and identify oulier
-                # many cosmics residuals are on edge
-                # of cosmic ray trace, and so can be
-                # next to a masked flux bin
-                grad=[]
-                gradvar=[]
-                for j in jj :
-                    if spectra.mask is not None :
-                        ttivar = spectra.ivar[b][j]*(spectra.mask[b][j]==0)
-                    else :
-                        ttivar = spectra.ivar[b][j]
-                    good = (ttivar>0)
-                    bad  = ~good
-                    ttflux = spectra.flux[b][j].copy()
-                    ttflux[bad] = np.interp(spectra.wave[b][bad],spectra.wave[b][good],ttflux[good])
-                    ttivar = spectra.ivar[b][j].copy()
-                    ttivar[bad] = np.interp(spectra.wave[b][bad],spectra.wave[b][good],ttivar[good])
-                    ttvar = 1./(ttivar+(ttivar==0))
-                    ttflux[1:] = ttflux[1:]-ttflux[:-1]
-                    ttvar[1:]  = ttvar[1:]+ttvar[:-1]
-                    ttflux[0]  = 0
-                    grad.append(ttflux)
-                    gradvar.append(ttvar)
-
-            ivar_unmasked[i,windices] += np.sum(spectra.ivar[b][jj],axis=0)
-
-            if spectra.mask is not None :
-                ivarjj=spectra.ivar[b][jj]*(spectra.mask[b][jj]==0)
-            else :
-                ivarjj=spectra.ivar[b][jj]
-
-            if cosmics_nsig is not None and cosmics_nsig > 0 and len(jj)>2  :
-                grad=np.array(grad)
-                gradivar=1/np.array(gradvar)
-                nspec=grad.shape[0]
-                meangrad=np.sum(gradivar*grad,axis=0)/np.sum(gradivar)
-                deltagrad=grad-meangrad
-                chi2=np.sum(gradivar*deltagrad**2,axis=0)/(nspec-1)
-                bad  = (chi2>cosmics_nsig**2)
-                nbad = np.sum(bad)
-                if nbad>0 :
-                    log.info("masking {} values for targetid={}".format(nbad,tid))
-                    badindex=np.where(bad)[0]
-                    for bi in badindex  :
-                        k=np.argmax(gradivar[:,bi]*deltagrad[:,bi]**2)
-                        ivarjj[k,bi]=0.
-                        log.debug("masking spec {} wave={}".format(k,spectra.wave[b][bi]))
-
-            ivar[i,windices] += np.sum(ivarjj,axis=0)
-            flux[i,windices] += np.sum(ivarjj*spectra.flux[b][jj],axis=0)
-            for r in range(band_ndiag) :
-                rdata[i,r+(ndiag-band_ndiag)//2,windices] += np.sum((spectra.ivar[b][jj]*spectra.resolution_data[b][jj,r]),axis=0)
-            if spectra.mask is not None :
-                # this deserves some attention ...
-
-                tmpmask=np.bitwise_and.reduce(spectra.mask[b][jj],axis=0)
-
-                # directly copy mask where no overlap
-                jj=(number_of_overlapping_cameras[windices]==1)
-                mask[i,windices[jj]] = tmpmask[jj]
-
-                # 'and' in overlapping regions
-                jj=(number_of_overlapping_cameras[windices]>1)
-                mask[i,windices[jj]] = mask[i,windices[jj]] & tmpmask[jj]
 
+        #- targets for which all spectra were flagged as bad (FIBERSTATUS != 0)
+        #- are not in groups, leaving flux and ivar=0 for them
+        rows, groups, starts, counts = tgroups.select(good_fiberstatus)
+        ii = groups[:,None]
 
-    for i,tid in enumerate(targets) :
-        ok=(ivar[i]>0)
-        if np.sum(ok)>0 :
-            flux[i][ok] /= ivar[i][ok]
-        ok=(ivar_unmasked[i]>0)
-        if np.sum(ok)>0 :
-            rdata[i][:,ok] /= ivar_unmasked[i][ok]
+        bflux = spectra.flux[b][rows]
+        bivar = spectra.ivar[b][rows]
+        if spectra.mask is not None :
+            bmask = spectra.mask[b][rows]
+            ivarjj = bivar*(bmask==0)
+        else :
+            bmask = None
+            ivarjj = bivar.copy()
+
+        if cosmics_nsig is not None and cosmics_nsig > 0 :
+            nmasked = _mask_cosmics(spectra.wave[b], bflux, bivar, bmask, ivarjj,
+                    starts, counts, cosmics_nsig)
+            _log_cosmics(b, nmasked)
+
+        ivar_unmasked[ii,windices] += _groupby_reduce(bivar, starts, counts)
+        ivar[ii,windices] += _groupby_reduce(ivarjj, starts, counts)
+        flux[ii,windices] += _groupby_reduce(ivarjj*bflux, starts, counts)
+        for r in range(band_ndiag) :
+            rdata[ii,r+(ndiag-band_ndiag)//2,windices] += _groupby_reduce(
+                    bivar*spectra.resolution_data[b][rows,r], starts, counts)
+
+        if spectra.mask is not None :
+            # this deserves some attention ...
+
+            tmpmask = _groupby_reduce(bmask, starts, counts, np.bitwise_and)
+
+            # directly copy mask where no overlap
+            jj=(number_of_overlapping_cameras[windices]==1)
+            mask[ii,windices[jj]] = tmpmask[:,jj]
+
+            # 'and' in overlapping regions
+            jj=(number_of_overlapping_cameras[windices]>1)
+            mask[ii,windices[jj]] = mask[ii,windices[jj]] & tmpmask[:,jj]
+
+    ok=(ivar>0)
+    flux[ok] /= ivar[ok]
+    ok=(ivar_unmasked>0)
+    np.divide(rdata, ivar_unmasked[:,None,:], out=rdata,
+            where=np.broadcast_to(ok[:,None,:], rdata.shape))
 
     if 'COADD_NUMEXP' in spectra.fibermap.colnames:
         fibermap = spectra.fibermap
@@ -669,6 +807,115 @@ def coadd_cameras(spectra, cosmics_nsig=0., onetile=False) :
 
     return res
 
+def get_coadd_chunks(targetids, max_rows):
+    """
+    Split spectra into chunks of rows holding all the spectra of their targets
+
+    Args:
+        targetids: array of TARGETID, one per spectrum
+        max_rows: maximum number of rows per chunk
+
+    Returns list of sorted arrays of row indices, one per chunk
+
+    Targets are kept in the order they first appear, so that the
+    concatenation of the coadds of the chunks is in the same order as the
+    coadd of all the spectra. A target with more than `max_rows` spectra
+    is put alone in its own chunk.
+    """
+    tgroups = TargetGroups(targetids)
+    rows, groups, starts, counts = tgroups.select()
+
+    chunks = list()
+    first, nrows = 0, 0
+    for i in range(tgroups.ntarget):
+        if nrows > 0 and nrows + counts[i] > max_rows:
+            chunks.append(np.sort(rows[starts[first]:starts[i]]))
+            first, nrows = i, 0
+        nrows += counts[i]
+
+    if nrows > 0:
+        chunks.append(np.sort(rows[starts[first]:]))
+
+    return chunks
+
+#- Peak memory of coadding a chunk, in units of the size of its input
+#- flux, ivar, mask and resolution arrays in single precision:
+#-   1 for the input spectra, which stay in memory for the whole coadd,
+#-   1 for the row-sorted working copies of flux, ivar and mask of a band
+#-     (`spectra.flux[b][rows]`, ...), plus the masked ivar `ivarjj`,
+#-   1 for the temporary products like ivarjj*flux and ivar*resolution,
+#-   1 for the coadded output arrays, at most as large as the input.
+#- The working copies only exist for one band at a time, so this is an
+#- upper bound for spectra with several bands.
+COADD_MEMORY_FACTOR = 4
+
+def coadd_spectra_file(infile, outfile, max_memory=4.0, cosmics_nsig=0.,
+        onetile=False, cameras=False, meta=None) :
+    """
+    Coadd a spectra file chunk by chunk, with bounded memory
+
+    Args:
+       infile: input spectra file
+       outfile: output coadd file
+
+    Options:
+       max_memory: float, memory budget in GB for coadding a chunk, including
+             the working copies counted by `COADD_MEMORY_FACTOR`
+       cosmics_nsig: float, nsigma clipping threshold for cosmics rays
+       onetile: bool, if True, inputs are from a single tile
+       cameras: bool, if True, also coadd across cameras (see `coadd_cameras`)
+       meta: dict, header keywords of the output file; default is the
+             header of the input file
+
+    The input file is read in chunks of rows containing all the spectra of
+    consecutive targets, each chunk is coadded with `coadd` (or
+    `coadd_cameras`) and written to `outfile` before reading the next one.
+    The output is the same as coadding the full spectra file in memory,
+    except that the `extra` and `extra_catalog` data are not propagated.
+    """
+    #- local imports to avoid circular imports with desispec.io
+    import fitsio
+    from desiutil.io import encode_table
+    from desispec.io import read_spectra, write_spectra_chunks
+    from desispec.io.util import checkgzip
+
+    log = get_logger()
+    infile = checkgzip(infile)
+
+    #- memory footprint of one input spectrum in single precision
+    bytes_per_spectrum = 0
+    with fitsio.FITS(infile) as fx:
+        if meta is None:
+            meta = dict(fx[0].read_header())
+        fibermap = encode_table(Table(fx['FIBERMAP'].read(), copy=True).as_array())
+        for hdu in fx[1:]:
+            extname = hdu.get_extname()
+            if extname.endswith(('_FLUX', '_IVAR', '_MASK', '_RESOLUTION')):
+                bytes_per_spectrum += 4*np.prod(hdu.get_dims()[1:])
+
+    bytes_per_spectrum *= COADD_MEMORY_FACTOR
+    max_rows = max(1, int(max_memory*1024**3 / max(1, bytes_per_spectrum)))
+    chunks = get_coadd_chunks(fibermap['TARGETID'], max_rows)
+    log.info('Coadding {} spectra in {} chunks of at most {} spectra'.format(
+        len(fibermap), len(chunks), max_rows))
+
+    tfmap, exp_fibermap = coadd_fibermap(fibermap, onetile=onetile)
+
+    def _coadd_chunks():
+        for i, rows in enumerate(chunks):
+            log.debug('Coadding chunk {}/{} with {} spectra'.format(
+                i+1, len(chunks), len(rows)))
+            spectra = read_spectra(infile, single=True, rows=rows)
+            if cameras:
+                spectra = coadd_cameras(spectra, cosmics_nsig=cosmics_nsig,
+                        onetile=onetile)
+            else:
+                coadd(spectra, cosmics_nsig=cosmics_nsig, onetile=onetile)
+            yield spectra
+
+    return write_spectra_chunks(outfile, _coadd_chunks(), tfmap,
+            exp_fibermap=exp_fibermap, meta=meta)
+
 def get_resampling_matrix(global_grid,local_grid,sparse=False):
     """Build the rectangular matrix that linearly resamples from the global grid to a local grid.
 
@@ -987,9 +1234,9 @@ def fast_resample_spectra(spectra, wave) :
             tivar=spectra.ivar[b]*(spectra.mask[b]==0)
         else :
             tivar=spectra.ivar[b]
-        for i in range(ntarget) :
-            ivar[i]  += resample_flux(wave,spectra.wave[b],tivar[i])
-            flux[i]  += resample_flux(wave,spectra.wave[b],tivar[i]*spectra.flux[b][i])
+        #- all targets at once with the cached sparse resampling operator
+        ivar += resample_flux_batch(wave,spectra.wave[b],tivar)
+        flux += resample_flux_batch(wave,spectra.wave[b],tivar*spectra.flux[b])
         bands += b
     for i in range(ntarget) :
         ok=(ivar[i]>0)
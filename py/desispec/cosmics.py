@@ -67,12 +67,14 @@ def reject_cosmic_rays_1d(frame,nsig=3,psferr=0.05) :
     chi2m=dfm**2*(dfm>0)*(tflux>0)/(vm+(vm==0))
 
     for fiber in range(chi2m.shape[0]) :
-        R=frame.R[fiber]
 
         # potential cosmics
         selection=np.where( ( (chi2p[fiber]>nsig**2) | (chi2m[fiber]>nsig**2) ) & (peaks[fiber]>0) )[0]
         if selection.size==0 : continue # no potential cosmic
 
+        #- only create the resolution matrix of fibers with candidates
+        R=frame.R[fiber]
+
         # loop on peaks
         for i in selection :
 
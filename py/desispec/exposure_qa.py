@@ -16,7 +16,7 @@ from desiutil.log import get_logger
 
 from desispec.io import findfile,specprod_root,read_fibermap,read_xytraceset,read_stdstar_models,read_frame,read_flux_calibration
 from desispec.maskbits import fibermask
-from desispec.interpolation import resample_flux
+from desispec.interpolation import resample_flux_batch
 from desispec.tsnr import tsnr2_to_efftime
 from desispec.preproc import get_amp_ids,parse_sec_keyword
 _qa_params = None
@@ -273,10 +273,10 @@ def compute_exposure_qa(night, expid, specprod_dir):
                 goodfibers_indices=goodfibers%500
                 scale=np.zeros(ngood)
                 wave=np.linspace(6000,7500,100) # coarse
+                mflux=resample_flux_batch(wave,modelwave,modelflux)
+                dflux,ivar=resample_flux_batch(wave,cframe.wave,cframe.flux[goodfibers_indices],cframe.ivar[goodfibers_indices])
                 for i in range(ngood) :
-                    mflux=resample_flux(wave,modelwave,modelflux[i])
-                    dflux,ivar=resample_flux(wave,cframe.wave,cframe.flux[goodfibers_indices[i]],cframe.ivar[goodfibers_indices[i]])
-                    scale[i] = np.sum(ivar*dflux*mflux)/np.sum(ivar*mflux**2)
+                    scale[i] = np.sum(ivar[i]*dflux[i]*mflux[i])/np.sum(ivar[i]*mflux[i]**2)
                 log.debug("scale={}".format(scale))
                 calib_rms=np.sqrt(np.mean((scale-1)**2))*np.sqrt(ngood/(ngood-1.))
                 petalqa_table["STARRMS"][petal]=calib_rms
@@ -0,0 +1,171 @@
+"""
+desispec.filecache
+==================
+
+Process-wide least-recently-used cache of objects read from files,
+e.g. the calibration images used by preprocessing.
+
+Entries are keyed by the file path, modification time and size, so that
+a file that is rewritten is read again.
+"""
+
+import os
+from collections import OrderedDict
+
+import numpy as np
+from desiutil.log import get_logger
+
+def _nbytes(value):
+    """
+    Approximate memory size in bytes of numpy arrays in value,
+    which can be an array or a (nested) tuple, list or dict of arrays
+    """
+    if isinstance(value, np.ndarray):
+        return value.nbytes
+    elif isinstance(value, (tuple, list)):
+        return sum([_nbytes(v) for v in value])
+    elif isinstance(value, dict):
+        return sum([_nbytes(v) for v in value.values()])
+    else:
+        return 0
+
+def file_key(filename):
+    """
+    Return (abspath, mtime_ns, size) identifying the current version of filename
+    """
+    filename = os.path.abspath(filename)
+    st = os.stat(filename)
+    return (filename, st.st_mtime_ns, st.st_size)
+
+class FileCache(object):
+    """
+    LRU cache of values read from files with a maximum size in bytes
+
+    Args:
+        max_bytes: maximum total size of the cached numpy arrays;
+            0 disables caching
+
+    Values must not be modified by the callers; use `get(..., copy=True)`
+    when the result is going to be updated in place.
+    """
+    def __init__(self, max_bytes):
+        self.max_bytes = int(max_bytes)
+        self._entries = OrderedDict()
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, filename, reader, *args, copy=False):
+        """
+        Return reader(filename, *args), reading the file only if needed
+
+        Args:
+            filename: path of the file to read
+            reader: function of (filename, *args) returning the value to cache
+            args: additional hashable arguments of reader, included in the key
+
+        Options:
+            copy: if True, return a deep copy of the cached value
+
+        Returns the (cached) value
+        """
+        key = file_key(filename) + (reader.__module__, reader.__qualname__) + args
+        if key in self._entries:
+            self.hits += 1
+            self._entries.move_to_end(key)
+            value = self._entries[key][0]
+        else:
+            self.misses += 1
+            value = reader(filename, *args)
+            #- nobody else has a reference to a value that is not cached
+            if not self._add(key, value):
+                return value
+
+        if copy:
+            return _copy(value)
+        else:
+            return value
+
+    def _add(self, key, value):
+        """Add value to the cache; returns True if it was cached"""
+        nbytes = _nbytes(value)
+        if self.max_bytes <= 0 or nbytes > self.max_bytes:
+            return False
+
+        #- drop stale versions of the same file
+        for oldkey in [k for k in self._entries if k[0] == key[0] and k[1:3] != key[1:3]]:
+            self._remove(oldkey)
+
+        while self.nbytes + nbytes > self.max_bytes:
+            oldkey = next(iter(self._entries))
+            self._remove(oldkey)
+            self.evictions += 1
+
+        self._entries[key] = (value, nbytes)
+        self.nbytes += nbytes
+        return True
+
+    def _remove(self, key):
+        value, nbytes = self._entries.pop(key)
+        self.nbytes -= nbytes
+
+    def clear(self):
+        """Remove all entries; statistics are preserved"""
+        self._entries.clear()
+        self.nbytes = 0
+
+    def resize(self, max_bytes):
+        """Change the maximum size, evicting entries if needed"""
+        self.max_bytes = int(max_bytes)
+        while self.nbytes > self.max_bytes:
+            self._remove(next(iter(self._entries)))
+            self.evictions += 1
+
+    def stats(self):
+        """
+        Return dict with the number of hits, misses, evictions, entries,
+        and the current and maximum size in bytes
+        """
+        return dict(hits=self.hits, misses=self.misses,
+                    evictions=self.evictions, entries=len(self._entries),
+                    nbytes=self.nbytes, max_bytes=self.max_bytes)
+
+    def log_stats(self, name='file cache'):
+        """Log the cache statistics at info level"""
+        log = get_logger()
+        s = self.stats()
+        log.info('{}: {} hits, {} misses, {} evictions, {} entries, {:.1f}/{:.1f} MB'.format(
+            name, s['hits'], s['misses'], s['evictions'], s['entries'],
+            s['nbytes']/1024**2, s['max_bytes']/1024**2))
+
+def _copy(value):
+    if isinstance(value, np.ndarray):
+        return value.copy()
+    elif isinstance(value, tuple):
+        return tuple([_copy(v) for v in value])
+    elif isinstance(value, list):
+        return [_copy(v) for v in value]
+    elif isinstance(value, dict):
+        return {k:_copy(v) for k, v in value.items()}
+    else:
+        return value
+
+#- maximum size of the calibration image cache in MB; off by default since
+#- every MPI rank has its own cache and the images are copied on each hit
+_calib_cache = FileCache(max_bytes=float(os.getenv('DESI_CALIB_CACHE_MB', 0))*1024**2)
+
+def get_calib_cache():
+    """
+    Return the process-wide FileCache of calibration images
+
+    Its size in MB can be set with $DESI_CALIB_CACHE_MB (default 0=no cache)
+    or changed with `get_calib_cache().resize(max_bytes)`.  Each process
+    has its own cache, and cached images are copied when they are returned,
+    so the peak memory per process can reach twice the cache size plus
+    the image being processed.
+    """
+    return _calib_cache
@@ -6,9 +6,9 @@ Flux calibration routines.
 """
 from __future__ import absolute_import
 import numpy as np
-from .resolution import Resolution
+from .resolution import Resolution, ResolutionList
 from .linalg import cholesky_solve, cholesky_solve_and_invert, spline_fit
-from .interpolation import resample_flux
+from .interpolation import resample_flux, resample_flux_batch
 from desiutil.log import get_logger
 from .io.filters import load_legacy_survey_filter
 from desispec import util
@@ -17,9 +17,11 @@ from desispec.io.fluxcalibration import read_average_flux_calibration
 from desispec.calibfinder import findcalibfile
 from desitarget.targets import main_cmx_or_sv
 from desispec.fiberfluxcorr import flat_to_psf_flux_correction,psf_to_fiber_flux_correction
-import scipy, scipy.sparse, scipy.ndimage
+import scipy, scipy.sparse, scipy.ndimage, scipy.signal
 import sys
+import os
 import time
+import hashlib
 from astropy import units
 import multiprocessing
 from pkg_resources import resource_exists, resource_filename
@@ -190,7 +192,187 @@ def _func2(arg) :
     """ Used for multiprocessing.Pool """
     return _smooth_template(**arg)
 
-def redshift_fit(wave, flux, ivar, resolution_data, stdwave, stdflux, z_max=0.005, z_res=0.00005, template_error=0.):
+def _resample_templates(waves, stdwave, stdflux, z=0., nblock=64) :
+    """Resample all templates, redshifted by z, on several wavelength grids at once.
+
+    This is a vectorized equivalent of calling
+    ``resample_flux(wave, stdwave*(1+z), stdflux[i])`` for every template i
+    and every wave in waves, using the cumulative integral of the
+    piecewise-linear templates.
+
+    Args:
+        waves : list of 1D output wavelength grids [Angstroms]
+        stdwave : 1D[nstdwave] template wavelengths [Angstroms]
+        stdflux : 2D[nstd, nstdwave] template flux
+        z : redshift applied to the templates
+        nblock : number of templates processed at a time, to bound memory
+
+    Returns:
+        list of 2D[nstd, nwave] resampled template fluxes, one per wave in waves
+    """
+    # nodes with zero flux at both ends, as resample_flux with extrapolate=False
+    x = np.concatenate([[2*stdwave[0]-stdwave[1]], stdwave, [2*stdwave[-1]-stdwave[-2]]])*(1+z)
+    dx = np.diff(x)
+
+    # output bin edges and their location among the nodes
+    edges = []
+    for wave in waves :
+        bins = np.zeros(wave.size+1)
+        bins[1:-1] = (wave[:-1]+wave[1:])/2.
+        bins[0] = 1.5*wave[0]-0.5*wave[1]
+        bins[-1] = 1.5*wave[-1]-0.5*wave[-2]
+        k = np.clip(np.searchsorted(x, bins, side='right')-1, 0, x.size-2)
+        t = np.clip(bins-x[k], 0, dx[k])
+        edges.append((bins, k, t))
+
+    nstd = stdflux.shape[0]
+    output = [np.zeros((nstd, wave.size)) for wave in waves]
+    for b in range(0, nstd, nblock) :
+        y = np.zeros((min(nblock, nstd-b), x.size))
+        y[:, 1:-1] = stdflux[b:b+nblock]
+        cumul = np.zeros(y.shape)
+        cumul[:, 1:] = np.cumsum(0.5*(y[:, 1:]+y[:, :-1])*dx, axis=1)
+        for out, (bins, k, t) in zip(output, edges) :
+            integral = cumul[:, k] + y[:, k]*t + 0.5*(y[:, k+1]-y[:, k])*t**2/dx[k]
+            out[b:b+nblock] = np.diff(integral, axis=1)/np.diff(bins)
+
+    return output
+
+def compute_stdstar_template_norms(wave, stdwave, stdflux, ncpu=1) :
+    """Continuum (median filtered flux) of the templates on a wavelength grid.
+
+    These are the normalizations that :func:`match_templates` divides the
+    resampled templates by, evaluated once at zero redshift and before
+    convolution by the resolution of a particular fiber.
+
+    Args:
+        wave : 1D[nwave] camera wavelength grid [Angstroms]
+        stdwave : 1D[nstdwave] template wavelengths [Angstroms]
+        stdflux : 2D[nstd, nstdwave] template flux
+        ncpu : number of cpu for multiprocessing
+
+    Returns:
+        norm : 2D[nstd, nwave] template continuum on wave
+    """
+    flux = _resample_templates([wave,], stdwave, stdflux)[0]
+    if ncpu > 1 :
+        pool = multiprocessing.Pool(ncpu)
+        norm = pool.map(applySmoothingFilter, flux)
+        pool.close()
+        pool.join()
+    else :
+        norm = [applySmoothingFilter(f) for f in flux]
+    return np.array(norm)
+
+def _stdstar_template_file_hash(stellarmodelfile) :
+    """sha256 hex digest of the content of a standard star template file"""
+    h = hashlib.sha256()
+    with open(stellarmodelfile, 'rb') as fx :
+        for block in iter(lambda: fx.read(2**24), b'') :
+            h.update(block)
+    return h.hexdigest()
+
+def get_stdstar_template_norms(stellarmodelfile, waves, stdwave, stdflux, cachedir, ncpu=1) :
+    """Template continua per camera grid, read from or added to an on-disk cache.
+
+    Cache files are keyed by the hash of the template file content and of
+    the wavelength grid, so they can be shared by all exposures and petals
+    that use the same templates and grid.
+
+    Args:
+        stellarmodelfile : standard star template file, as read into stdwave, stdflux
+        waves : dict of 1D wavelength grids [Angstroms], e.g. one per camera
+        stdwave : 1D[nstdwave] template wavelengths [Angstroms]
+        stdflux : 2D[nstd, nstdwave] template flux
+        cachedir : directory for the cache files
+        ncpu : number of cpu for multiprocessing when computing missing entries
+
+    Returns:
+        dict with the same keys as waves of 2D[nstd, nwave] template continua,
+        see :func:`compute_stdstar_template_norms`
+    """
+    from desispec.io.fluxcalibration import (read_stdstar_template_norms,
+                                             write_stdstar_template_norms)
+    from desispec.io.util import checkgzip
+    log = get_logger()
+
+    stellarmodelfile = checkgzip(stellarmodelfile)
+    filehash = _stdstar_template_file_hash(stellarmodelfile)
+
+    norms = dict()
+    norm_per_file = dict()
+    for key, wave in waves.items() :
+        h = hashlib.sha256(filehash.encode())
+        h.update(np.asarray(wave, dtype='f8').tobytes())
+        cachefile = os.path.join(cachedir, 'stdstar-norms-{}.fits'.format(h.hexdigest()[:16]))
+        if cachefile in norm_per_file :
+            norms[key] = norm_per_file[cachefile]
+            continue
+        if os.path.exists(cachefile) :
+            cachewave, norm, _ = read_stdstar_template_norms(cachefile)
+            if norm.shape == (stdflux.shape[0], wave.size) and np.allclose(cachewave, wave) :
+                norms[key] = norm_per_file[cachefile] = norm.astype(float)
+                continue
+            log.warning("Ignoring inconsistent template cache file {}".format(cachefile))
+
+        log.info("Computing template continua for {} on {} pixels".format(key, wave.size))
+        norm = compute_stdstar_template_norms(wave, stdwave, stdflux, ncpu=ncpu)
+        header = dict(TEMPLATE=os.path.basename(stellarmodelfile), TMPLHASH=filehash,
+                      NTEMPLAT=stdflux.shape[0])
+        write_stdstar_template_norms(cachefile, wave, norm, header=header)
+        norms[key] = norm_per_file[cachefile] = norm
+
+    return norms
+
+def _resample_templates_with_norms(wave, resolution_data, stdwave, stdflux, z, template_norms) :
+    """Equivalent of :func:`resample_template` for all templates at once using cached continua.
+
+    Args:
+        wave : dictionary of 1D data wavelengths [Angstroms], one entry per camera and exposure
+        resolution_data : dictionary of resolution data for the fiber, same keys as wave
+        stdwave : 1D[nstdwave] template wavelengths [Angstroms]
+        stdflux : 2D[nstd, nstdwave] template flux
+        z : redshift applied to the templates
+        template_norms : dictionary of 2D[nstd, nwave] template continua on wave
+            at zero redshift, same keys as wave
+
+    Returns:
+        output_wave : 1D concatenated wavelengths of the sorted keys of wave
+        output_flux : 2D[nstd, output_wave.size] normalized template flux
+        output_norm : 2D[nstd, output_wave.size] template continuum
+
+    Notes:
+      - The template flux is resampled at redshift z and convolved by the
+        resolution of the fiber exactly as in :func:`resample_template`, but
+        the continuum it is divided by is approximate: it is the median
+        filter of the unconvolved template at zero redshift, shifted to z by
+        linear interpolation, instead of the median filter of each convolved,
+        redshifted template.
+      - The difference is small because the 200 pixel median filter hardly
+        depends on the resolution and the redshifts of standard stars are
+        |z| < 0.005; the best template and its coefficients found by
+        :func:`match_templates` agree within 1e-2 with those of the exact
+        computation, see test_flux_calibration.
+    """
+    sorted_keys = sorted(wave.keys())
+    resampled = _resample_templates([wave[cam] for cam in sorted_keys], stdwave, stdflux, z)
+    output_flux = []
+    output_norm = []
+    for cam, flux1 in zip(sorted_keys, resampled) :
+        flux2 = Resolution(resolution_data[cam]).dot(flux1.T).T
+        # redshift the cached continuum by linear interpolation
+        ww = wave[cam]
+        x = np.clip(ww/(1+z), ww[0], ww[-1])
+        i = np.clip(np.searchsorted(ww, x)-1, 0, ww.size-2)
+        f = (x-ww[i])/(ww[i+1]-ww[i])
+        norm = template_norms[cam]
+        norme = norm[:, i]*(1-f) + norm[:, i+1]*f
+        output_flux.append(flux2/(norme+(norme==0)))
+        output_norm.append(norme)
+    output_wave = np.concatenate([wave[cam] for cam in sorted_keys])
+    return output_wave, np.hstack(output_flux), np.hstack(output_norm)
+
+def redshift_fit(wave, flux, ivar, resolution_data, stdwave, stdflux, z_max=0.005, z_res=0.00005, template_error=0., return_chi2=False):
     """ Redshift fit of a single template
 
     Args:
@@ -203,10 +385,13 @@ def redshift_fit(wave, flux, ivar, resolution_data, stdwave, stdflux, z_max=0.00
         z_max : float, maximum blueshift and redshift in scan, has to be positive
         z_res : float, step of of redshift scan between [-z_max,+z_max]
         template_error : float, assumed template flux relative error
+        return_chi2 : if True, also return the redshift grid and chi2 of the scan
 
     Returns:
         redshift : redshift of standard star
 
+        if return_chi2 is True, returns (redshift, zgrid, chi2) with zgrid
+        and chi2 1D arrays over the scanned redshifts
 
     Notes:
       - wave and stdwave can be on different grids that don't
@@ -215,9 +400,53 @@ def redshift_fit(wave, flux, ivar, resolution_data, stdwave, stdflux, z_max=0.00
         can be supported by concatenating their wave and flux arrays
     """
     cameras = list(flux.keys())
+    result = redshift_fit_batch(wave,
+        {cam: flux[cam][None, :] for cam in cameras},
+        {cam: ivar[cam][None, :] for cam in cameras},
+        {cam: resolution_data[cam][None, :, :] for cam in cameras},
+        stdwave, stdflux, z_max=z_max, z_res=z_res,
+        template_error=template_error, return_chi2=return_chi2)
+    if return_chi2 :
+        redshift, zgrid, chi2 = result
+        return redshift[0], zgrid, chi2[0]
+    else :
+        return result[0]
+
+def redshift_fit_batch(wave, flux, ivar, resolution_data, stdwave, stdflux, z_max=0.005, z_res=0.00005, template_error=0., return_chi2=False):
+    """ Redshift fit of several stars at once, e.g. all standard stars of a frame
+
+    Args:
+        wave : A dictionary of 1D array of vacuum wavelengths [Angstroms], one entry per camera
+        flux : A dictionary of 2D[nstar, nwave] observed flux of the stars
+        ivar : A dictionary of 2D[nstar, nwave] inverse variance of flux
+        resolution_data: A dictionary of 3D[nstar, ndiag, nwave] resolution data of the star fibers
+        stdwave : 1D standard star template wavelengths [Angstroms]
+        stdflux : 1D[nstdwave] template flux used for all stars,
+            or 2D[nstar, nstdwave] template flux for each star
+        z_max : float, maximum blueshift and redshift in scan, has to be positive
+        z_res : float, step of of redshift scan between [-z_max,+z_max]
+        template_error : float, assumed template flux relative error
+        return_chi2 : if True, also return the redshift grid and chi2 of the scan
+
+    Returns:
+        redshift : 1D[nstar] redshift of the standard stars
+
+        if return_chi2 is True, returns (redshift, zgrid, chi2) with zgrid
+        1D[nz] the scanned redshifts and chi2 2D[nstar, nz]
+
+    Notes:
+      - The chi2 of all the redshift steps is computed at once as a weighted
+        cross-correlation of data and model on a log wavelength grid, so the
+        cost depends only weakly on z_res through the grid size.
+    """
+    cameras = list(flux.keys())
     log = get_logger()
     log.debug(time.asctime())
 
+    nstar = flux[cameras[0]].shape[0]
+    if stdflux.ndim == 1 :
+        stdflux = np.tile(stdflux, (nstar, 1))
+
     # resampling on a log wavelength grid
     #####################################
     # need to go fast so we resample both data and model on a log grid
@@ -239,72 +468,95 @@ def redshift_fit(wave, flux, ivar, resolution_data, stdwave, stdflux, z_max=0.00
     resampled_wave=10**resampled_lwave
 
     # map data on grid
-    resampled_data={}
-    resampled_ivar={}
-    resampled_model={}
+    chi2=np.zeros((nstar, 2*margin+1))
     for cam in cameras :
-        tmp_flux,tmp_ivar=resample_flux(resampled_wave,wave[cam],flux[cam],ivar[cam])
-        resampled_data[cam]=tmp_flux
-        resampled_ivar[cam]=tmp_ivar
+        resampled_data=np.zeros((nstar, resampled_wave.size))
+        resampled_ivar=np.zeros((nstar, resampled_wave.size))
+        resampled_model=np.zeros((nstar, resampled_wave.size))
 
         # we need to have the model on a larger grid than the data wave for redshifting
         dwave=wave[cam][-1]-wave[cam][-2]
         npix=int((wave[cam][-1]*z_max)/dwave+2)
         extended_cam_wave=np.append( wave[cam][0]+dwave*np.arange(-npix,0) ,  wave[cam])
         extended_cam_wave=np.append( extended_cam_wave, wave[cam][-1]+dwave*np.arange(1,npix+1))
-        # ok now we also need to increase the resolution
-        tmp_res=np.zeros((resolution_data[cam].shape[0],resolution_data[cam].shape[1]+2*npix))
-        tmp_res[:,:npix] = np.tile(resolution_data[cam][:,0],(npix,1)).T
-        tmp_res[:,npix:-npix] = resolution_data[cam]
-        tmp_res[:,-npix:] = np.tile(resolution_data[cam][:,-1],(npix,1)).T
-        # resampled model at camera resolution, with margin
-        tmp=resample_flux(extended_cam_wave,stdwave,stdflux)
-        tmp=Resolution(tmp_res).dot(tmp)
-        # map on log lam grid
-        resampled_model[cam]=resample_flux(resampled_wave,extended_cam_wave,tmp)
-
-        # we now normalize both model and data
-        tmp=applySmoothingFilter(resampled_data[cam])
-        resampled_data[cam]/=(tmp+(tmp==0))
-        resampled_ivar[cam]*=tmp**2
-
-        if template_error>0 :
-            ok=np.where(resampled_ivar[cam]>0)[0]
-            if ok.size > 0 :
-                resampled_ivar[cam][ok] = 1./ ( 1/resampled_ivar[cam][ok] + template_error**2 )
-
-        tmp=applySmoothingFilter(resampled_model[cam])
-        resampled_model[cam]/=(tmp+(tmp==0))
-        resampled_ivar[cam]*=(tmp!=0)
-
-    # fit the best redshift
-    chi2=np.zeros((2*margin+1))
-    ndata=np.zeros((2*margin+1))
-    for i in range(-margin,margin+1) :
-        for cam in cameras :
-            ndata[i+margin] += np.sum(resampled_ivar[cam][margin:-margin]>0)
-            if i<margin :
-                chi2[i+margin] += np.sum(resampled_ivar[cam][margin:-margin]*(resampled_data[cam][margin:-margin]-resampled_model[cam][margin+i:-margin+i])**2)
-            else :
-                chi2[i+margin] += np.sum(resampled_ivar[cam][margin:-margin]*(resampled_data[cam][margin:-margin]-resampled_model[cam][margin+i:])**2)
 
-    i=np.argmin(chi2)-margin
-    z=10**(-i*lstep)-1
-    log.debug("Best z=%f"%z)
-    '''
-    log.debug("i=%d"%i)
-    log.debug("lstep=%f"%lstep)
-    log.debug("margin=%d"%margin)
-    plt.figure()
-    #plt.plot(chi2)
-    for cam in cameras :
-        ok=np.where(resampled_ivar[cam]>0)[0]
-        #plt.plot(resampled_wave[ok],resampled_data[cam][ok],"o",c="gray")
-        plt.errorbar(resampled_wave[ok],resampled_data[cam][ok],1./np.sqrt(resampled_ivar[cam][ok]),fmt="o",color="gray")
-        plt.plot(resampled_wave[margin:-margin],resampled_model[cam][margin+i:-margin+i],"-",c="r")
-    plt.show()
-    '''
-    return z
+        for star in range(nstar) :
+            tmp_flux,tmp_ivar=resample_flux(resampled_wave,wave[cam],flux[cam][star],ivar[cam][star])
+            resampled_data[star]=tmp_flux
+            resampled_ivar[star]=tmp_ivar
+
+            # ok now we also need to increase the resolution
+            rdata=resolution_data[cam][star]
+            tmp_res=np.zeros((rdata.shape[0],rdata.shape[1]+2*npix))
+            tmp_res[:,:npix] = np.tile(rdata[:,0],(npix,1)).T
+            tmp_res[:,npix:-npix] = rdata
+            tmp_res[:,-npix:] = np.tile(rdata[:,-1],(npix,1)).T
+            # resampled model at camera resolution, with margin
+            tmp=resample_flux(extended_cam_wave,stdwave,stdflux[star])
+            tmp=Resolution(tmp_res).dot(tmp)
+            # map on log lam grid
+            resampled_model[star]=resample_flux(resampled_wave,extended_cam_wave,tmp)
+
+            # we now normalize both model and data
+            tmp=_smooth_nonzero(resampled_data[star])
+            resampled_data[star]/=(tmp+(tmp==0))
+            resampled_ivar[star]*=tmp**2
+
+            if template_error>0 :
+                ok=np.where(resampled_ivar[star]>0)[0]
+                if ok.size > 0 :
+                    resampled_ivar[star][ok] = 1./ ( 1/resampled_ivar[star][ok] + template_error**2 )
+
+            tmp=_smooth_nonzero(resampled_model[star])
+            resampled_model[star]/=(tmp+(tmp==0))
+            resampled_ivar[star]*=(tmp!=0)
+
+        chi2 += _redshift_scan_chi2(resampled_data, resampled_ivar, resampled_model, margin)
+
+    # chi2[:, i+margin] is the chi2 of a model shifted by i pixels
+    zgrid=np.array([10**(-i*lstep)-1 for i in range(-margin,margin+1)])
+    redshift=zgrid[np.argmin(chi2, axis=1)]
+    log.debug("Best z={}".format(redshift))
+
+    if return_chi2 :
+        return redshift, zgrid, chi2
+    else :
+        return redshift
+
+def _smooth_nonzero(flux, width=200) :
+    """Same as applySmoothingFilter(flux, width) for a flux that is zero outside a
+    limited range of indices, only filtering around that range.
+    """
+    nonzero=np.where(flux!=0)[0]
+    smooth=np.zeros(flux.shape)
+    if nonzero.size>0 :
+        begin=max(nonzero[0]-width,0)
+        end=min(nonzero[-1]+width+1,flux.size)
+        smooth[begin:end]=applySmoothingFilter(flux[begin:end],width)
+    return smooth
+
+def _redshift_scan_chi2(data, ivar, model, margin) :
+    """chi2 of data vs model shifted by -margin to +margin pixels
+
+    Args:
+        data : 2D[nstar, ngrid] normalized data
+        ivar : 2D[nstar, ngrid] inverse variance of data
+        model : 2D[nstar, ngrid] normalized model on the same grid
+        margin : maximum shift in pixels
+
+    Returns:
+        chi2 : 2D[nstar, 2*margin+1] where chi2[:, i+margin] is
+        sum_j ivar[j]*(data[j]-model[j+i])**2 over j in [margin, ngrid-margin)
+
+    The three terms of the expanded chi2 are computed for all shifts at once
+    as cross-correlations with FFTs.
+    """
+    w = ivar[:, margin:ivar.shape[1]-margin]
+    d = data[:, margin:data.shape[1]-margin]
+    chi2 = np.sum(w*d**2, axis=1)[:, None]
+    chi2 = chi2 - 2*scipy.signal.fftconvolve(model, (w*d)[:, ::-1], mode='valid', axes=1)
+    chi2 = chi2 + scipy.signal.fftconvolve(model**2, w[:, ::-1], mode='valid', axes=1)
+    return chi2
 
 
 def _compute_coef(coord,node_coords) :
@@ -567,7 +819,7 @@ def interpolate_on_parameter_grid(data_wave, data_flux, data_ivar, template_flux
     return final_coefficients,chi2
 
 
-def match_templates(wave, flux, ivar, resolution_data, stdwave, stdflux, teff, logg, feh, ncpu=1, z_max=0.005, z_res=0.00002, template_error=0, comm=None):
+def match_templates(wave, flux, ivar, resolution_data, stdwave, stdflux, teff, logg, feh, ncpu=1, z_max=0.005, z_res=0.00002, template_error=0, comm=None, template_norms=None):
     """For each input spectrum, identify which standard star template is the closest
     match, factoring out broadband throughput/calibration differences.
 
@@ -583,6 +835,10 @@ def match_templates(wave, flux, ivar, resolution_data, stdwave, stdflux, teff, l
         feh : 1D[nstd] model metallicity
         ncpu : number of cpu for multiprocessing
         comm : MPI communicator; if given, ncpu will be ignored and only rank 0 will return results that are not None
+        template_norms : optional dictionary of 2D[nstd, nwave] template continua with the same keys as wave,
+            from :func:`get_stdstar_template_norms`; if given, all templates are resampled and convolved
+            in a single vectorized step instead of one :func:`resample_template` call per template,
+            with an approximate continuum, see :func:`_resample_templates_with_norms`
 
     Returns:
         coef : numpy.array of linear coefficient of standard stars
@@ -704,54 +960,63 @@ def match_templates(wave, flux, ivar, resolution_data, stdwave, stdflux, teff, l
 
     ntemplates=stdflux.shape[0]
 
-    # here we take into account the redshift once and for all
-    shifted_stdwave=stdwave*(1+z)
-
-    func_args = []
-    # need to parallelize the model resampling
-    for template_id in range(ntemplates) :
-        arguments={"data_wave_per_camera":wave,
-                   "resolution_data_per_camera":resolution_data,
-                   "template_wave":shifted_stdwave,
-                   "template_flux":stdflux[template_id],
-                   "template_id":template_id}
-        func_args.append( arguments )
-
-    if comm is not None and comm.Get_size() > 1: # MPI mode & more than one rank per star
-        results = list(map(_func, func_args[rank::size]))
-        # All reduce here because we'll need to divide the work out again
-        results = comm.allreduce(results, op=MPI.SUM)
-    elif ncpu > 1:
-        log.debug("creating multiprocessing pool with %d cpus"%ncpu); sys.stdout.flush()
-        pool = multiprocessing.Pool(ncpu)
-        log.debug("Running pool.map() for {} items".format(len(func_args))); sys.stdout.flush()
-        results  =  pool.map(_func, func_args)
-        log.debug("Finished pool.map()"); sys.stdout.flush()
-        pool.close()
-        pool.join()
-        log.debug("Finished pool.join()"); sys.stdout.flush()
-    else:
-        log.debug("Not using multiprocessing for {} cpus".format(ncpu))
-
-        results = [_func(x) for x in func_args]
-        log.debug("Finished serial loop")
-
-    # collect results
-    # in case the exit of the multiprocessing pool is not ordered as the input
-    # we returned the template_id
-    template_flux=np.zeros((ntemplates,data_flux.size))
-    template_norm=np.zeros((ntemplates,data_flux.size))
-    for result in results :
-        template_id       = result[0]
-        template_tmp_wave = result[1]
-        template_tmp_flux = result[2]
-        template_tmp_norm = result[3]
+    if template_norms is not None :
+        log.debug("resampling templates using cached continua")
+        template_tmp_wave, template_flux, template_norm = _resample_templates_with_norms(
+            wave, resolution_data, stdwave, stdflux, z, template_norms)
         mdiff=np.max(np.abs(data_wave-template_tmp_wave)) # just a safety check
         if mdiff>1.e-5 :
-            log.error("error indexing of wave and flux somewhere above, checking if it's just an ordering issue, max diff=%f"%mdiff)
-            raise ValueError("wavelength array difference cannot be fixed with reordering, ordered max diff=%f"%mdiff)
-        template_flux[template_id] = template_tmp_flux
-        template_norm[template_id] = template_tmp_norm
+            log.error("error indexing of wave and flux, max diff=%f"%mdiff)
+            raise ValueError("wavelength array difference, max diff=%f"%mdiff)
+    else :
+        # here we take into account the redshift once and for all
+        shifted_stdwave=stdwave*(1+z)
+
+        func_args = []
+        # need to parallelize the model resampling
+        for template_id in range(ntemplates) :
+            arguments={"data_wave_per_camera":wave,
+                       "resolution_data_per_camera":resolution_data,
+                       "template_wave":shifted_stdwave,
+                       "template_flux":stdflux[template_id],
+                       "template_id":template_id}
+            func_args.append( arguments )
+
+        if comm is not None and comm.Get_size() > 1: # MPI mode & more than one rank per star
+            results = list(map(_func, func_args[rank::size]))
+            # All reduce here because we'll need to divide the work out again
+            results = comm.allreduce(results, op=MPI.SUM)
+        elif ncpu > 1:
+            log.debug("creating multiprocessing pool with %d cpus"%ncpu); sys.stdout.flush()
+            pool = multiprocessing.Pool(ncpu)
+            log.debug("Running pool.map() for {} items".format(len(func_args))); sys.stdout.flush()
+            results  =  pool.map(_func, func_args)
+            log.debug("Finished pool.map()"); sys.stdout.flush()
+            pool.close()
+            pool.join()
+            log.debug("Finished pool.join()"); sys.stdout.flush()
+        else:
+            log.debug("Not using multiprocessing for {} cpus".format(ncpu))
+
+            results = [_func(x) for x in func_args]
+            log.debug("Finished serial loop")
+
+        # collect results
+        # in case the exit of the multiprocessing pool is not ordered as the input
+        # we returned the template_id
+        template_flux=np.zeros((ntemplates,data_flux.size))
+        template_norm=np.zeros((ntemplates,data_flux.size))
+        for result in results :
+            template_id       = result[0]
+            template_tmp_wave = result[1]
+            template_tmp_flux = result[2]
+            template_tmp_norm = result[3]
+            mdiff=np.max(np.abs(data_wave-template_tmp_wave)) # just a safety check
+            if mdiff>1.e-5 :
+                log.error("error indexing of wave and flux somewhere above, checking if it's just an ordering issue, max diff=%f"%mdiff)
+                raise ValueError("wavelength array difference cannot be fixed with reordering, ordered max diff=%f"%mdiff)
+            template_flux[template_id] = template_tmp_flux
+            template_norm[template_id] = template_tmp_norm
 
     # compute model chi2
     template_chi2=np.zeros(ntemplates)
@@ -945,7 +1210,7 @@ def compute_flux_calibration(frame, input_model_wave, input_model_flux,
     tframe.ivar = add_margin_2d_dim1(frame.ivar,margin)
     tframe.mask = add_margin_2d_dim1(frame.mask,margin)
     tframe.resolution_data = add_margin_3d_dim2(frame.resolution_data,margin)
-    tframe.R = np.array( [Resolution(r) for r in tframe.resolution_data] )
+    tframe.R = ResolutionList(tframe.resolution_data)
 
     #- Compute point source flux correction and fiber flux correction
     log.info("compute point source flux correction for seeing FWHM = {:4.2f} arcsec".format(exposure_seeing_fwhm))
@@ -993,13 +1258,9 @@ def compute_flux_calibration(frame, input_model_wave, input_model_flux,
     dwave=(stdstars.wave-np.mean(stdstars.wave))/(stdstars.wave[-1]-stdstars.wave[0]) # normalized wave for polynomial fit
 
     # resample model to data grid and convolve by resolution
-    model_flux=np.zeros((nstds, nwave))
-    convolved_model_flux=np.zeros((nstds, nwave))
-
-    for star in range(nstds) :
-        model_flux_index = np.where(input_model_fibers == stdfibers[star])[0][0]
-        model_flux[star]=resample_flux(stdstars.wave,input_model_wave,input_model_flux[model_flux_index])
-        convolved_model_flux[star]=stdstars.R[star].dot(model_flux[star])
+    model_flux_indices = [np.where(input_model_fibers == stdfibers[star])[0][0] for star in range(nstds)]
+    model_flux=resample_flux_batch(stdstars.wave,input_model_wave,input_model_flux[model_flux_indices])
+    convolved_model_flux=stdstars.R.dot(model_flux)
 
     # check S/N before doing anything else
     ii=(stdstars.ivar>0)*(stdstars.mask==0)
@@ -1297,11 +1558,9 @@ def compute_flux_calibration(frame, input_model_wave, input_model_flux,
     R = Resolution(mean_res_data)
     # compute convolved calib
     ccalibration = np.zeros(tframe.flux.shape)
-    for i in range(tframe.nspec):
-        norme = tframe.R[i].dot(np.ones(calibration.shape))
-        ok=np.where(norme>0)[0]
-        if ok.size :
-            ccalibration[i][ok]=tframe.R[i].dot(calibration)[ok]/norme[ok]
+    norme = tframe.R.dot(np.ones(calibration.shape))
+    ok = norme>0
+    ccalibration[ok] = tframe.R.dot(calibration)[ok]/norme[ok]
 
     # Use diagonal of mean calibration covariance for output.
     ccalibcovar=R.dot(calibcovar).dot(R.T.todense())
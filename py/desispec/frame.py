@@ -8,10 +8,11 @@ Lightweight wrapper class for spectra, to be returned by io.read_frame
 from __future__ import absolute_import, division
 
 import numbers
+from functools import partial
 import numpy as np
 
 from desispec import util
-from desispec.resolution import Resolution
+from desispec.resolution import ResolutionList
 from desiutil.log import get_logger
 from desispec import util
 
@@ -38,6 +39,11 @@ class Spectrum(object):
             self.R = R
 
 
+def _quick_resolution(sigma, ndiag):
+    """Return QuickResolution matrix for sigma widths of a fiber"""
+    from desispec.quicklook.qlresolution import QuickResolution
+    return QuickResolution(sigma=sigma, ndiag=ndiag)
+
 class Frame(object):
     def __init__(self, wave, flux, ivar, mask=None, resolution_data=None,
                 fibers=None, spectrograph=None, meta=None, fibermap=None,
@@ -57,7 +63,8 @@ class Frame(object):
         Optional:
             mask: 2D[nspec, nwave] integer bitmask of flux.  0=good.
             resolution_data: 3D[nspec, ndiag, nwave]
-                             diagonals of resolution matrix data
+                             diagonals of resolution matrix data, or a
+                             function returning it when first accessed
             fibers: ndarray of which fibers these spectra are
             spectrograph: integer, which spectrograph [0-9]
             meta: dict-like object (e.g. FITS header)
@@ -81,8 +88,8 @@ class Frame(object):
             nspec : number of spectra, flux.shape[0]
             nwave : number of wavelengths, flux.shape[1]
             specmin : minimum fiber number
-            R: array of sparse Resolution matrix objects converted
-               from resolution_data
+            R: ResolutionList of sparse Resolution matrix objects converted
+               from resolution_data when first accessed
             fibermap: fibermap table if provided
         """
         assert wave.ndim == 1
@@ -103,6 +110,7 @@ class Frame(object):
         self.scores  = scores
         self.scores_comments  = scores_comments
         self.ndiag=ndiag
+        self._R = None
         fibers_per_spectrograph = 500   #- hardcode; could get from desimodel
 
         if mask is None:
@@ -110,11 +118,8 @@ class Frame(object):
         else:
             self.mask = util.mask32(mask)
 
-        if resolution_data is not None:
-            if resolution_data.ndim != 3 or \
-               resolution_data.shape[0] != self.nspec or \
-               resolution_data.shape[2] != self.nwave:
-               raise ValueError("Wrong dimensions for resolution_data[nspec, ndiag, nwave]")
+        if resolution_data is not None and not callable(resolution_data):
+            self._check_resolution_data(resolution_data)
 
         #- Maybe setup non-None identity matrix resolution matrix instead?
         self.wsigma=wsigma
@@ -122,14 +127,10 @@ class Frame(object):
         if resolution_data is not None:
             self.wsigma=None #ignore width coefficients if resolution data is given explicitly
             self.ndiag=None 
-            self.R = np.array( [Resolution(r) for r in resolution_data] )
+            #- Resolution matrices are created when R is first accessed
         elif wsigma is not None:
-            from desispec.quicklook.qlresolution import QuickResolution
             assert ndiag is not None
-            r=[]
-            for sigma in wsigma:
-                r.append(QuickResolution(sigma=sigma,ndiag=self.ndiag))
-            self.R=np.array(r)
+            self.R = ResolutionList(wsigma, builder=partial(_quick_resolution, ndiag=self.ndiag))
         else:
             #SK I believe this should be error, but looking at the
             #tests frame objects are allowed to not to have resolution data
@@ -170,6 +171,46 @@ class Frame(object):
         if self.meta is not None:
             self.meta['FIBERMIN'] = np.min(self.fibers)
 
+    def _check_resolution_data(self, resolution_data):
+        if resolution_data.ndim != 3 or \
+           resolution_data.shape[0] != self.nspec or \
+           resolution_data.shape[2] != self.nwave:
+           raise ValueError("Wrong dimensions for resolution_data[nspec, ndiag, nwave]")
+
+    @property
+    def resolution_data(self):
+        """
+        3D[nspec, ndiag, nwave] resolution matrix diagonals or None;
+        deferred data are read when first accessed
+        """
+        if callable(self._resolution_data):
+            resolution_data = self._resolution_data()
+            self._check_resolution_data(resolution_data)
+            self._resolution_data = resolution_data
+        return self._resolution_data
+
+    @resolution_data.setter
+    def resolution_data(self, value):
+        self._resolution_data = value
+
+    @property
+    def R(self):
+        """
+        ResolutionList of per-fiber sparse Resolution matrices, created
+        when first accessed; R.dot(model) convolves all fibers at once
+        """
+        if self._R is None and self._resolution_data is not None:
+            self._R = ResolutionList(self.resolution_data)
+        if self._R is None:
+            raise AttributeError("Frame has no resolution data")
+        return self._R
+
+    @R.setter
+    def R(self, value):
+        if value is not None and not isinstance(value, ResolutionList):
+            value = ResolutionList(value, builder=None)
+        self._R = value
+
     def vet(self):
         """ Perform very basic checks on the frame
         Generally run before writing to disk (or when read)
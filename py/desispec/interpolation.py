@@ -5,7 +5,11 @@ desispec.interpolation
 Utility functions for interpolation of spectra over different wavelength grids.
 """
 
+import hashlib
+from collections import OrderedDict
+
 import numpy as np
+import scipy.sparse
 import sys
 from desiutil.log import get_logger
 
@@ -226,3 +230,164 @@ def _unweighted_resample(output_x,input_x,input_flux_density, extrapolate=False)
     
     return np.histogram(trapeze_centers, bins=bins, weights=trapeze_integrals)[0] / binsize
 
+
+#- resampling operators, keyed by a hash of the grids, see resampling_matrix
+_resampling_matrices = OrderedDict()
+_max_resampling_matrices = 16
+
+def _grid_key(xout, x, extrapolate):
+    """Hash of the input and output grids"""
+    h = hashlib.sha1()
+    for a in (xout, x):
+        a = np.ascontiguousarray(a, dtype=np.float64)
+        h.update(str(a.size).encode())
+        h.update(a.tobytes())
+    return (h.hexdigest(), bool(extrapolate))
+
+def _interp_matrix(tx, ix):
+    """
+    Sparse matrix [tx.size, ix.size] such that
+    matrix.dot(iy) = np.interp(tx, ix, iy) for any iy
+    """
+    n = ix.size
+    #- index j of the left node, with ix[j] <= tx < ix[j+1]
+    j = np.clip(np.searchsorted(ix, tx, side='right')-1, 0, n-2)
+    w = (tx-ix[j])/(ix[j+1]-ix[j])
+    #- np.interp uses the edge values outside of the range
+    w[tx<ix[0]] = 0.
+    w[tx>=ix[-1]] = 1.
+    rows = np.arange(tx.size)
+    return scipy.sparse.csr_matrix(
+        (np.concatenate([1-w, w]), (np.concatenate([rows, rows]), np.concatenate([j, j+1]))),
+        shape=(tx.size, n))
+
+def _build_resampling_matrix(xout, x, extrapolate=False):
+    """
+    Sparse matrix M such that M.dot(flux) = _unweighted_resample(xout, x, flux, extrapolate)
+    """
+    ox = np.asarray(xout, dtype=np.float64)
+    nin = x.size
+
+    #- boundary of output bins, as in _unweighted_resample
+    bins=np.zeros(ox.size+1)
+    bins[1:-1]=(ox[:-1]+ox[1:])/2.
+    bins[0]=1.5*ox[0]-0.5*ox[1]
+    bins[-1]=1.5*ox[-1]-0.5*ox[-2]
+    binsize = bins[1:]-bins[:-1]
+    if np.any(binsize<=0)  :
+        raise ValueError("Zero or negative bin size")
+
+    #- input nodes, with zero flux nodes at both ends if not extrapolating;
+    #- node values are expressed as a matrix applied to the input flux
+    ix = np.asarray(x, dtype=np.float64)
+    node_values = scipy.sparse.identity(nin, format='csr')
+    if not extrapolate :
+        ix = np.concatenate([[2*ix[0]-ix[1]], ix, [2*ix[-1]-ix[-2]]])
+        zero = scipy.sparse.csr_matrix((1, nin))
+        node_values = scipy.sparse.vstack([zero, node_values, zero], format='csr')
+
+    #- temporary nodes: bin boundaries and input nodes within them
+    tx = bins.copy()
+    ty = _interp_matrix(tx, ix).dot(node_values)
+    k = np.where((ix>=tx[0])&(ix<=tx[-1]))[0]
+    if k.size :
+        tx = np.append(tx, ix[k])
+        ty = scipy.sparse.vstack([ty, node_values[k]], format='csr')
+    p = tx.argsort()
+    tx = tx[p]
+    ty = ty[p]
+
+    #- trapeze integrals, summed in each output bin
+    ntrap = tx.size-1
+    dx = (tx[1:]-tx[:-1])/2.
+    trapezes = scipy.sparse.csr_matrix(
+        (np.concatenate([dx, dx]),
+         (np.concatenate([np.arange(ntrap), np.arange(ntrap)]),
+          np.concatenate([np.arange(1, ntrap+1), np.arange(ntrap)]))),
+        shape=(ntrap, tx.size))
+    centers = (tx[1:]+tx[:-1])/2.
+    #- same binning as np.histogram (the last bin includes its right edge)
+    ibin = np.searchsorted(bins, centers, side='right')-1
+    ibin[centers==bins[-1]] = ox.size-1
+    ok = (ibin>=0)&(ibin<ox.size)
+    histogram = scipy.sparse.csr_matrix(
+        (1./binsize[ibin[ok]], (ibin[ok], np.where(ok)[0])), shape=(ox.size, ntrap))
+
+    return (histogram.dot(trapezes).dot(ty)).tocsr()
+
+def resampling_matrix(xout, x, extrapolate=False):
+    """
+    Return the flux conserving resampling from grid x to grid xout as a sparse matrix
+
+    Args:
+        xout: output SORTED vector, not necessarily linearly spaced
+        x: input SORTED vector, not necessarily linearly spaced
+
+    Options:
+        extrapolate: extrapolate using edge values of input array, default is False
+
+    Returns:
+        scipy.sparse.csr_matrix M[xout.size, x.size] such that
+        M.dot(flux) = resample_flux(xout, x, flux, extrapolate=extrapolate)
+        up to rounding errors
+
+    Matrices are cached by a hash of the grids, so calling this repeatedly
+    for the same grids is cheap; callers must not modify the result.
+    """
+    key = _grid_key(xout, x, extrapolate)
+    if key in _resampling_matrices:
+        _resampling_matrices.move_to_end(key)
+        return _resampling_matrices[key]
+
+    matrix = _build_resampling_matrix(np.asarray(xout), np.asarray(x), extrapolate=extrapolate)
+    _resampling_matrices[key] = matrix
+    while len(_resampling_matrices) > _max_resampling_matrices:
+        _resampling_matrices.popitem(last=False)
+
+    return matrix
+
+def resample_flux_batch(xout, x, flux, ivar=None, extrapolate=False):
+    """
+    Flux conserving resampling of several spectra sharing the same grids
+
+    Args:
+        xout: output SORTED vector, not necessarily linearly spaced
+        x: input SORTED vector, not necessarily linearly spaced
+        flux: 2D[nspec, x.size] or 1D[x.size] input flux densities
+
+    Options:
+        ivar: weights for flux, same shape as flux; default is unweighted resampling
+        extrapolate: extrapolate using edge values of input array, default is False
+
+    Returns:
+        if ivar is None, returns outflux[nspec, xout.size]
+        if ivar is not None, returns outflux, outivar
+
+    Row i of the results is the same as resample_flux(xout, x, flux[i], ivar[i])
+    (up to rounding errors), but for all spectra with one sparse
+    matrix product using resampling_matrix(xout, x).
+    """
+    if ivar is not None and extrapolate :
+        raise ValueError("Cannot extrapolate ivar. Either set ivar=None and extrapolate=True or the opposite")
+
+    matrix = resampling_matrix(xout, x, extrapolate=extrapolate)
+    flux = np.asarray(flux)
+
+    #- (M.F^T)^T for 2D inputs
+    def _apply(values):
+        return matrix.dot(np.asarray(values, dtype=np.float64).T).T
+
+    if ivar is None:
+        return _apply(flux)
+
+    ivar = np.asarray(ivar)
+    a = _apply(flux*ivar)
+    b = _apply(ivar)
+    mask = (b>0)
+    outflux = np.zeros(a.shape)
+    outflux[mask] = a[mask] / b[mask]
+    dx = np.gradient(x)
+    dxout = np.gradient(xout)
+    outivar = _apply(ivar/dx)*dxout
+
+    return outflux, outivar
@@ -0,0 +1,205 @@
+"""
+desispec.io.asyncwrite
+======================
+
+Opt-in writing of pipeline outputs in background threads, so that
+computing can continue on the next camera or exposure while the previous
+outputs are written, checksummed and renamed into place.
+
+Usage::
+
+    from desispec.io.asyncwrite import write_async, flush_writes
+
+    for camera in cameras:
+        frame = ...
+        write_async(write_frame, framefile, frame)
+
+    flush_writes()   #- barrier; raises AsyncWriteError if any write failed
+
+`write_async` calls the writer immediately unless background writes are
+enabled with $DESI_ASYNC_WRITE set to the number of writer threads.
+Objects passed to `write_async` must not be modified afterwards.
+The writers keep logging their own iotime messages.
+"""
+
+import os
+import atexit
+import threading
+import concurrent.futures
+
+from desiutil.log import get_logger
+
+class AsyncWriteError(RuntimeError):
+    """
+    Raised by AsyncWriter.flush if background writes failed
+
+    Attributes:
+        errors: list of (description, exception) of the failed writes
+    """
+    def __init__(self, errors):
+        self.errors = list(errors)
+        msg = '{} background write(s) failed: {}'.format(len(self.errors),
+                '; '.join(['{}: {}'.format(desc, err) for desc, err in self.errors]))
+        super().__init__(msg)
+
+def _describe(writer, args):
+    """Short description of writer(*args) for log messages"""
+    name = getattr(writer, '__name__', repr(writer))
+    if len(args) > 0 and isinstance(args[0], str):
+        return '{}({})'.format(name, os.path.basename(args[0]))
+    else:
+        return name
+
+class AsyncWriter(object):
+    """
+    Thread pool running writer functions with a bounded number of pending writes
+
+    Args:
+        nthreads: number of writer threads
+        max_pending: maximum number of queued writes not yet started;
+            submit() blocks when it is reached, bounding the memory held
+            by objects waiting to be written
+    """
+    def __init__(self, nthreads=1, max_pending=4):
+        self.nthreads = int(nthreads)
+        self.max_pending = int(max_pending)
+        self._executor = None
+        self._slots = threading.BoundedSemaphore(self.nthreads + self.max_pending)
+        self._lock = threading.Lock()
+        self._futures = list()
+        self._errors = list()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+        else:
+            #- don't hide the original exception with write errors
+            try:
+                self.close()
+            except AsyncWriteError as err:
+                get_logger().error(str(err))
+
+    def submit(self, writer, *args, **kwargs):
+        """
+        Call writer(*args, **kwargs) in a background thread
+
+        Returns a concurrent.futures.Future of the writer result.
+        Blocks while max_pending writes are waiting for a thread.
+        """
+        self._slots.acquire()
+        try:
+            with self._lock:
+                #- threads are (re)started on demand after a flush
+                if self._executor is None:
+                    self._executor = concurrent.futures.ThreadPoolExecutor(
+                        max_workers=self.nthreads, thread_name_prefix='desi_write')
+                future = self._executor.submit(self._run, writer, args, kwargs)
+                self._futures.append(future)
+        except Exception:
+            self._slots.release()
+            raise
+
+        return future
+
+    def _run(self, writer, args, kwargs):
+        try:
+            return writer(*args, **kwargs)
+        except Exception as err:
+            desc = _describe(writer, args)
+            get_logger().error('Background {} failed: {}'.format(desc, err))
+            with self._lock:
+                self._errors.append((desc, err))
+            raise
+        finally:
+            self._slots.release()
+
+    def pending(self):
+        """Number of submitted writes that are not finished"""
+        with self._lock:
+            return len([f for f in self._futures if not f.done()])
+
+    def flush(self):
+        """
+        Wait for all submitted writes to finish and stop the writer threads
+
+        The threads are restarted by the next submit(), so that no thread is
+        left running between flushes, e.g. when forking a process pool.
+        Raises AsyncWriteError if any of them failed since the previous flush
+        """
+        with self._lock:
+            futures = self._futures
+            self._futures = list()
+            executor = self._executor
+            self._executor = None
+
+        concurrent.futures.wait(futures)
+        if executor is not None:
+            executor.shutdown(wait=True)
+
+        with self._lock:
+            errors = self._errors
+            self._errors = list()
+
+        if len(errors) > 0:
+            raise AsyncWriteError(errors)
+
+    def close(self):
+        """Flush and stop the writer threads"""
+        self.flush()
+
+#- process-wide writer, created on first use if $DESI_ASYNC_WRITE > 0
+_async_writer = None
+_async_writer_pid = None
+
+def get_async_writer():
+    """
+    Return the process-wide AsyncWriter, or None if background writes are
+    not enabled with $DESI_ASYNC_WRITE=<number of threads>
+
+    The maximum number of pending writes can be set with $DESI_ASYNC_WRITE_PENDING
+    (default 4).
+    """
+    global _async_writer, _async_writer_pid
+    nthreads = int(os.getenv('DESI_ASYNC_WRITE', '0'))
+    if nthreads <= 0:
+        return None
+
+    #- threads don't survive a fork, e.g. into a multiprocessing pool
+    if _async_writer is None or _async_writer_pid != os.getpid():
+        max_pending = int(os.getenv('DESI_ASYNC_WRITE_PENDING', '4'))
+        _async_writer = AsyncWriter(nthreads, max_pending)
+        _async_writer_pid = os.getpid()
+
+    return _async_writer
+
+def write_async(writer, *args, **kwargs):
+    """
+    Call writer(*args, **kwargs) in the background if enabled, otherwise now
+
+    Returns the writer result if called now, or a Future of it.
+    Errors of background writes are raised by `flush_writes`.
+    """
+    aw = get_async_writer()
+    if aw is None:
+        return writer(*args, **kwargs)
+    else:
+        return aw.submit(writer, *args, **kwargs)
+
+def flush_writes():
+    """
+    Wait for the background writes of this process to finish
+
+    Raises AsyncWriteError if any of them failed
+    """
+    if _async_writer is not None and _async_writer_pid == os.getpid():
+        _async_writer.flush()
+
+@atexit.register
+def _flush_at_exit():
+    try:
+        flush_writes()
+    except AsyncWriteError as err:
+        get_logger().error(str(err))
@@ -347,3 +347,59 @@ def read_stdstar_templates(stellarmodelfile):
     log.info(iotime.format('read', stellarmodelfile, duration))
 
     return wavebins,fluxData,templateid,teff,logg,feh
+
+
+def write_stdstar_template_norms(outfile, wave, norm, header=None):
+    """Writes cached continuum norms of standard star templates.
+
+    Args:
+        outfile : output file path
+        wave : 1D[nwave] camera wavelength grid [Angstroms]
+        norm : 2D[nstd, nwave] median-filtered continuum of each template
+
+    Options:
+        header : dict-like object of key/value pairs to include in header
+    """
+    log = get_logger()
+    hdr = fitsheader(header)
+    add_dependencies(hdr)
+
+    hdr['EXTNAME'] = 'NORM'
+    hx = fits.HDUList()
+    hx.append(fits.PrimaryHDU(norm.astype('f4'), header=hdr))
+    hx.append(fits.ImageHDU(wave.astype('f8'), name='WAVELENGTH'))
+    hx[-1].header['BUNIT'] = 'Angstrom'
+
+    t0 = time.time()
+    outfile = makepath(outfile)
+    tmpfile = get_tempfilename(outfile)
+    hx.writeto(tmpfile, overwrite=True, checksum=True)
+    os.rename(tmpfile, outfile)
+    duration = time.time() - t0
+    log.info(iotime.format('write', outfile, duration))
+
+    return outfile
+
+
+def read_stdstar_template_norms(filename):
+    """Read cached continuum norms of standard star templates.
+
+    Args:
+        filename (str): File written by :func:`write_stdstar_template_norms`
+
+    Returns (wave, norm, header) tuple:
+        wave : 1D[nwave] camera wavelength grid [Angstroms]
+        norm : 2D[nstd, nwave] median-filtered continuum of each template
+        header : primary header
+    """
+    log = get_logger()
+    t0 = time.time()
+    with fits.open(filename, memmap=False) as fx:
+        header = fx['NORM'].header
+        norm = native_endian(fx['NORM'].data)
+        wave = native_endian(fx['WAVELENGTH'].data)
+
+    duration = time.time() - t0
+    log.info(iotime.format('read', filename, duration))
+
+    return wave, norm, header
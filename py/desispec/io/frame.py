@@ -6,6 +6,7 @@ I/O routines for Frame objects
 """
 import os.path
 import time
+from functools import partial
 
 import numpy as np
 import scipy, scipy.sparse
@@ -21,7 +22,7 @@ from ..frame import Frame
 from .fibermap import read_fibermap
 from .meta import findfile, get_nights, get_exposures
 from .util import fitsheader, native_endian, makepath, checkgzip
-from .util import get_tempfilename
+from .util import get_tempfilename, read_image_rows, read_image_hdu
 from . import iotime
 
 def write_frame(outfile, frame, header=None, fibermap=None, units=None):
@@ -141,7 +142,8 @@ def read_meta_frame(filename, extname=0):
     return hdr
 
 
-def read_frame(filename, nspec=None, skip_resolution=False):
+def read_frame(filename, nspec=None, skip_resolution=False, rows=None,
+        targets=None, dtype='f8', lazy_resolution=False):
     """Reads a frame fits file and returns its data.
 
     Args:
@@ -149,8 +151,17 @@ def read_frame(filename, nspec=None, skip_resolution=False):
             night = string YEARMMDD
             expid = integer exposure ID
             camera = b0, r1, .. z9
+        nspec: int, optional; only read the first nspec spectra
         skip_resolution: bool, option
             Speed up read time (>5x) by avoiding the Resolution matrix
+        rows: array-like, optional; only read these rows (spectra indices
+            in the file), returned in increasing order
+        targets: array-like, optional; only read the rows of these
+            TARGETIDs of the fibermap, combined with `rows` if both are set
+        dtype: type of the flux, ivar, chi2pix and resolution arrays;
+            'f4' keeps the on-disk single precision
+        lazy_resolution: bool, optional; if True, the RESOLUTION HDU is only
+            read when frame.resolution_data or frame.R is first accessed
 
     Returns:
         desispec.Frame object with attributes wave, flux, ivar, etc.
@@ -168,11 +179,41 @@ def read_frame(filename, nspec=None, skip_resolution=False):
     t0 = time.time()
     fx = fitsio.FITS(filename)
     hdr = fx[0].read_header()
-    flux = native_endian(fx['FLUX'].read().astype('f8'))
-    ivar = native_endian(fx['IVAR'].read().astype('f8'))
+
+    #- nspec is a special case of rows
+    if nspec is not None:
+        nrows = fx['FLUX'].get_dims()[0]
+        nspec_rows = np.arange(min(nspec, nrows))
+        if rows is None:
+            rows = nspec_rows
+        else:
+            rows = np.intersect1d(rows, nspec_rows)
+
+    if rows is not None:
+        rows = np.unique(rows)
+
+    if 'FIBERMAP' in fx:
+        fibermap = read_fibermap(fx)
+    else:
+        fibermap = None
+
+    if targets is not None:
+        if fibermap is None:
+            raise ValueError('{} has no fibermap to select targets'.format(filename))
+        target_rows = np.where(np.isin(fibermap['TARGETID'], targets))[0]
+        if rows is None:
+            rows = target_rows
+        else:
+            rows = np.intersect1d(rows, target_rows)
+
+    if fibermap is not None and rows is not None:
+        fibermap = fibermap[rows]
+
+    flux = native_endian(read_image_rows(fx['FLUX'], rows).astype(dtype))
+    ivar = native_endian(read_image_rows(fx['IVAR'], rows).astype(dtype))
     wave = native_endian(fx['WAVELENGTH'].read().astype('f8'))
     if 'MASK' in fx:
-        mask = native_endian(fx['MASK'].read().astype(np.uint32))
+        mask = native_endian(read_image_rows(fx['MASK'], rows).astype(np.uint32))
     else:
         mask = None   #- let the Frame object create the default mask
 
@@ -180,7 +221,6 @@ def read_frame(filename, nspec=None, skip_resolution=False):
     resolution_data=None
     qwsigma=None
     qndiag=None
-    fibermap = None
     chi2pix = None
     scores = None
     scores_comments = None
@@ -188,24 +228,22 @@ def read_frame(filename, nspec=None, skip_resolution=False):
     if skip_resolution:
         pass
     elif 'RESOLUTION' in fx:
-        resolution_data = native_endian(fx['RESOLUTION'].read().astype('f8'))
+        if lazy_resolution:
+            resolution_data = partial(read_image_hdu, filename, 'RESOLUTION', rows, dtype)
+        else:
+            resolution_data = native_endian(read_image_rows(fx['RESOLUTION'], rows).astype(dtype))
     elif 'QUICKRESOLUTION' in fx:
         qr=fx['QUICKRESOLUTION'].header
         qndiag =qr['NDIAG']
-        qwsigma=native_endian(fx['QUICKRESOLUTION'].read().astype('f4'))
-
-    if 'FIBERMAP' in fx:
-        fibermap = read_fibermap(fx)
-    else:
-        fibermap = None
+        qwsigma=native_endian(read_image_rows(fx['QUICKRESOLUTION'], rows).astype('f4'))
 
     if 'CHI2PIX' in fx:
-        chi2pix = native_endian(fx['CHI2PIX'].read().astype('f8'))
+        chi2pix = native_endian(read_image_rows(fx['CHI2PIX'], rows).astype(dtype))
     else:
         chi2pix = None
 
     if 'SCORES' in fx:
-        scores = fx['SCORES'].read()
+        scores = fx['SCORES'].read(rows=rows)
         # I need to open the header to read the comments
         scores_comments = dict()
         head   = fx['SCORES'].read_header()
@@ -220,20 +258,14 @@ def read_frame(filename, nspec=None, skip_resolution=False):
     duration = time.time() - t0
     log.info(iotime.format('read', filename, duration))
 
-    if nspec is not None:
-        flux = flux[0:nspec]
-        ivar = ivar[0:nspec]
-        if resolution_data is not None:
-            resolution_data = resolution_data[0:nspec]
-        else:
-            qwsigma=qwsigma[0:nspec]
-        if chi2pix is not None:
-            chi2pix = chi2pix[0:nspec]
-        if mask is not None:
-            mask = mask[0:nspec]
+    #- without a fibermap, fibers are otherwise FIBERMIN + 0..nspec-1
+    fibers = None
+    if fibermap is None and rows is not None and 'FIBERMIN' in hdr:
+        fibers = hdr['FIBERMIN'] + rows
 
     # return flux,ivar,wave,resolution_data, hdr
-    frame = Frame(wave, flux, ivar, mask, resolution_data, meta=hdr, fibermap=fibermap, chi2pix=chi2pix,
+    frame = Frame(wave, flux, ivar, mask, resolution_data, fibers=fibers,
+                  meta=hdr, fibermap=fibermap, chi2pix=chi2pix,
                   scores=scores,scores_comments=scores_comments,
                   wsigma=qwsigma,ndiag=qndiag, suppress_res_warning=skip_resolution)
 
@@ -7,6 +7,8 @@ import re
 import datetime
 import numpy as np
 
+from desispec.metrics import record_io
+
 def format(readwrite, filename, duration):
     """Return standardized I/O timing message string for logging
 
@@ -20,7 +22,11 @@ def format(readwrite, filename, duration):
     Note: this function does not call log.info() itself so that the logging
     source file and line number can be associated with the I/O function itself
     instead of this utility formatting function.
+
+    The I/O is also recorded in the structured timing records of
+    desispec.metrics, so that they don't have to be parsed back from logs.
     """
+    record_io(readwrite, filename, duration)
     basename = os.path.basename(filename)
     timestamp = datetime.datetime.now().isoformat()
     msg = f"iotime {duration:.3f} sec to {readwrite} {basename} at {timestamp}"
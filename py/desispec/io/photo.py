@@ -6,6 +6,7 @@ Simple methods for gathering photometric and targeting catalogs.
 
 """
 import os, pdb
+import functools
 from glob import glob
 import numpy as np
 import fitsio
@@ -135,6 +136,219 @@ def gather_targetdirs(tileid, fiberassign_dir=None):
         
     return targetdirs
 
+def _targetdir_files(targetdir):
+    """Return the list of all target files in a targeting directory.
+
+    Args:
+        targetdir (str): targeting directory or ToO filename, e.g. from
+          `gather_targetdirs`
+
+    Uses the same selection of secondary target catalogs as
+    `gather_targetphot`, and returns all the HEALPix files of primary
+    targeting directories.
+
+    """
+    if 'secondary' in targetdir:
+        if 'sv1' in targetdir: # special case
+            if 'dedicated' in targetdir:
+                targetfiles = glob(os.path.join(targetdir, 'DC3R2_GAMA_priorities.fits'))
+            else:
+                targetfiles = glob(os.path.join(targetdir, '*-secondary-dr9photometry.fits')) # use??
+                #targetfiles = glob(os.path.join(targetdir, '*-secondary.fits'))
+        else:
+            targetfiles = glob(os.path.join(targetdir, '*-secondary.fits'))
+    elif 'ToO' in targetdir:
+        targetfiles = [targetdir]
+    else:
+        targetfiles = glob(os.path.join(targetdir, '*-hp-*.fits'))
+
+    return sorted(targetfiles)
+
+def _targets_extname(tinfo):
+    """Return the name (or number) of the targets extension of an open fitsio.FITS."""
+    for _tinfo in tinfo:
+        extname = _tinfo.get_extname()
+        if 'TARGETS' in extname:
+            break
+    if extname == '':
+        extname = 1
+    return extname
+
+class TargetPhotIndex(object):
+    """Index of TARGETID to (target file, row) over targeting directories.
+
+    Args:
+        targetid (int array): TARGETIDs, sorted
+        fileid (int array): index in `filenames` of the file of each TARGETID
+        row (int array): row of each TARGETID in its file
+        filenames (str list): target filenames
+        extnames (str list): targets extension name (or number) of each file;
+          '' for ToO (ecsv) files
+        targetdirs (str list): targeting directory (or ToO filename) of each file
+
+    Use `TargetPhotIndex.build` to create an index and `write` / `read` to
+    store it as a FITS file with TARGETINDEX and FILES extensions.
+
+    """
+    def __init__(self, targetid, fileid, row, filenames, extnames, targetdirs):
+        self.targetid = np.asarray(targetid, dtype=np.int64)
+        self.fileid = np.asarray(fileid, dtype=np.int32)
+        self.row = np.asarray(row, dtype=np.int64)
+        self.filenames = [str(f) for f in filenames]
+        self.extnames = [str(e) for e in extnames]
+        self.targetdirs = [os.path.normpath(str(d)) for d in targetdirs]
+
+    def __len__(self):
+        return len(self.targetid)
+
+    @classmethod
+    def build(cls, targetdirs):
+        """Build the index of all the target files in a list of targeting directories.
+
+        Args:
+            targetdirs (str list): targeting directories or ToO filenames,
+              e.g. from `gather_targetdirs`
+
+        Returns a TargetPhotIndex, sorted by TARGETID and then by the order of
+        the files in `targetdirs`.
+
+        """
+        targetids, fileids, rows = [], [], []
+        filenames, extnames, filedirs = [], [], []
+        for targetdir in np.atleast_1d(targetdirs):
+            targetdir = os.path.normpath(str(targetdir))
+            if targetdir in filedirs:
+                continue
+            for targetfile in _targetdir_files(targetdir):
+                if 'ToO' in targetfile:
+                    extname = ''
+                    targetid = Table.read(targetfile, guess=False, format='ascii.ecsv')['TARGETID']
+                else:
+                    with fitsio.FITS(targetfile) as tinfo:
+                        extname = _targets_extname(tinfo)
+                        targetid = tinfo[extname].read(columns='TARGETID')
+                        extname = str(extname)
+
+                log.debug('Indexed {} targets in {}'.format(len(targetid), targetfile))
+                targetids.append(np.asarray(targetid, dtype=np.int64))
+                fileids.append(np.full(len(targetid), len(filenames), dtype=np.int32))
+                rows.append(np.arange(len(targetid), dtype=np.int64))
+                filenames.append(targetfile)
+                extnames.append(extname)
+                filedirs.append(targetdir)
+
+        if len(filenames) == 0:
+            log.warning('No target files found in {}'.format(targetdirs))
+            return cls(np.zeros(0), np.zeros(0), np.zeros(0), [], [], [])
+
+        targetid = np.hstack(targetids)
+        fileid = np.hstack(fileids)
+        row = np.hstack(rows)
+        srt = np.argsort(targetid, kind='stable')
+        log.info('Indexed {} targets in {} files'.format(len(targetid), len(filenames)))
+
+        return cls(targetid[srt], fileid[srt], row[srt], filenames, extnames, filedirs)
+
+    def write(self, filename):
+        """Write the index to a FITS file."""
+        from desispec.io.util import get_tempfilename
+        index = np.zeros(len(self), dtype=[('TARGETID', 'i8'), ('FILEID', 'i4'), ('ROW', 'i8')])
+        index['TARGETID'] = self.targetid
+        index['FILEID'] = self.fileid
+        index['ROW'] = self.row
+
+        files = Table()
+        files['FILENAME'] = np.array(self.filenames, dtype=str)
+        files['EXTNAME'] = np.array(self.extnames, dtype=str)
+        files['TARGETDIR'] = np.array(self.targetdirs, dtype=str)
+
+        tmpfile = get_tempfilename(filename)
+        with fitsio.FITS(tmpfile, 'rw', clobber=True) as fx:
+            fx.write(index, extname='TARGETINDEX')
+            fx.write(files.as_array(), extname='FILES')
+        os.rename(tmpfile, filename)
+        log.info('Wrote {}'.format(filename))
+
+    @classmethod
+    def read(cls, filename):
+        """Read an index written by `TargetPhotIndex.write`."""
+        with fitsio.FITS(filename) as fx:
+            index = fx['TARGETINDEX'].read()
+            files = fx['FILES'].read()
+
+        return cls(index['TARGETID'], index['FILEID'], index['ROW'],
+                   np.char.strip(files['FILENAME']), np.char.strip(files['EXTNAME']),
+                   np.char.strip(files['TARGETDIR']))
+
+    def has_targetdir(self, targetdir):
+        """Return True if targetdir (directory or ToO file) was indexed."""
+        return os.path.normpath(str(targetdir)) in self.targetdirs
+
+    def match(self, targetids, targetdir=None):
+        """Find the files and rows of a set of TARGETIDs.
+
+        Args:
+            targetids (int array): TARGETIDs to find
+            targetdir (str, optional): only return files of this targeting
+              directory (or ToO file)
+
+        Returns a dict of filename: sorted array of the rows of `targetids`
+        in that file, for the files with at least one match.
+
+        """
+        targetids = np.unique(np.asarray(targetids, dtype=np.int64))
+        lo = np.searchsorted(self.targetid, targetids, side='left')
+        hi = np.searchsorted(self.targetid, targetids, side='right')
+
+        # expand the [lo, hi) ranges of duplicate TARGETIDs
+        counts = hi - lo
+        ntot = np.sum(counts)
+        idx = np.repeat(lo, counts) + np.arange(ntot) - np.repeat(np.cumsum(counts) - counts, counts)
+
+        fileid = self.fileid[idx]
+        row = self.row[idx]
+        if targetdir is not None:
+            targetdir = os.path.normpath(str(targetdir))
+            keep = np.array([self.targetdirs[i] == targetdir for i in range(len(self.filenames))], dtype=bool)
+            if len(keep) > 0:
+                ok = keep[fileid]
+                fileid, row = fileid[ok], row[ok]
+
+        matches = dict()
+        for i in np.unique(fileid):
+            matches[self.filenames[i]] = np.sort(row[fileid == i])
+
+        return matches
+
+def build_targetphot_index(outfile, targetdirs=None, tileids=None, fiberassign_dir=None):
+    """Build and write the TARGETID index of targeting directories.
+
+    Args:
+        outfile (str): output FITS filename
+        targetdirs (str list, optional): targeting directories or ToO files
+        tileids (int list, optional): also index the targeting directories of
+          these tiles, see `gather_targetdirs`
+        fiberassign_dir (str, optional): top-level directory to fiberassign
+          tables
+
+    Returns the TargetPhotIndex, to be used with `gather_targetphot(...,
+    targetindex=outfile)`.
+
+    """
+    alldirs = []
+    if targetdirs is not None:
+        alldirs += [os.path.normpath(d) for d in np.atleast_1d(targetdirs)]
+    if tileids is not None:
+        for tileid in np.unique(tileids):
+            for targetdir in gather_targetdirs(tileid, fiberassign_dir=fiberassign_dir):
+                targetdir = os.path.normpath(str(targetdir))
+                if targetdir not in alldirs:
+                    alldirs.append(targetdir)
+
+    index = TargetPhotIndex.build(alldirs)
+    index.write(outfile)
+    return index
+
 def targetphot_datamodel(from_file=False):
     """Initialize the targetphot data model.
 
@@ -310,7 +524,8 @@ def targetphot_datamodel(from_file=False):
     return datamodel
 
 def gather_targetphot(input_cat, photocache=None, racolumn='TARGET_RA',
-                      deccolumn='TARGET_DEC', columns=None, fiberassign_dir=None):
+                      deccolumn='TARGET_DEC', columns=None, fiberassign_dir=None,
+                      targetindex=None):
     """Find and stack the photometric targeting information given a set of targets.
 
     Args:
@@ -325,6 +540,9 @@ def gather_targetphot(input_cat, photocache=None, racolumn='TARGET_RA',
         columns (str array): return this subset of columns
         fiberassign_dir (str, optional): top-level directory to fiberassign
           tables
+        targetindex (str or TargetPhotIndex, optional): TARGETID index of the
+          targeting directories, see `build_targetphot_index`; target files are
+          then read only at the matching rows instead of being scanned.
 
     Returns a table of targeting photometry using a consistent data model across
     primary (DR9) targets, secondary targets, and targets of opportunity. The
@@ -350,6 +568,9 @@ def gather_targetphot(input_cat, photocache=None, racolumn='TARGET_RA',
 
     tileids = input_cat['TILEID']
 
+    if isinstance(targetindex, str):
+        targetindex = TargetPhotIndex.read(targetindex)
+
     for tileid in np.unique(tileids):
         log.debug('Working on tile {}'.format(tileid))
 
@@ -363,18 +584,18 @@ def gather_targetphot(input_cat, photocache=None, racolumn='TARGET_RA',
         targetdirs = gather_targetdirs(tileid, fiberassign_dir=fiberassign_dir)
         
         for targetdir in targetdirs:
-            # Handle secondary targets, which have a (very!) different data model.
-            if 'secondary' in targetdir:
-                if 'sv1' in targetdir: # special case
-                    if 'dedicated' in targetdir:
-                        targetfiles = glob(os.path.join(targetdir, 'DC3R2_GAMA_priorities.fits'))
-                    else:
-                        targetfiles = glob(os.path.join(targetdir, '*-secondary-dr9photometry.fits')) # use??
-                        #targetfiles = glob(os.path.join(targetdir, '*-secondary.fits'))
+            indexrows = None
+            if targetindex is not None:
+                if targetindex.has_targetdir(targetdir):
+                    indexrows = targetindex.match(input_cat1['TARGETID'], targetdir)
                 else:
-                    targetfiles = glob(os.path.join(targetdir, '*-secondary.fits'))
-            elif 'ToO' in targetdir:
-                targetfiles = targetdir
+                    log.warning('Targeting directory {} not in index; scanning its files'.format(targetdir))
+
+            if indexrows is not None:
+                targetfiles = list(indexrows.keys())
+            # Handle secondary targets, which have a (very!) different data model.
+            elif 'secondary' in targetdir or 'ToO' in targetdir:
+                targetfiles = _targetdir_files(targetdir)
             else:
                 alltargetfiles = glob(os.path.join(targetdir, '*-hp-*.fits'))
                 filenside = fitsio.read_header(alltargetfiles[0], ext=1)['FILENSID']
@@ -424,7 +645,10 @@ def gather_targetphot(input_cat, photocache=None, racolumn='TARGET_RA',
     
                 if 'ToO' in targetfile:
                     photo1 = Table.read(targetfile, guess=False, format='ascii.ecsv')
-                    I = np.where(np.isin(photo1['TARGETID'], input_cat1['TARGETID']))[0]
+                    if indexrows is not None:
+                        I = indexrows[targetfile]
+                    else:
+                        I = np.where(np.isin(photo1['TARGETID'], input_cat1['TARGETID']))[0]
                     log.debug('Matched {} TOO targets'.format(len(I)))
                     if len(I) > 0:
                         photo1 = photo1[I]
@@ -439,16 +663,17 @@ def gather_targetphot(input_cat, photocache=None, racolumn='TARGET_RA',
     
                 # get the correct extension name or number
                 tinfo = fitsio.FITS(targetfile)
-                for _tinfo in tinfo:
-                    extname = _tinfo.get_extname()
-                    if 'TARGETS' in extname:
-                        break
-                if extname == '':
-                    extname = 1
-                    
-                # fitsio does not preserve the order of the rows but we'll sort later.
-                photo_targetid = tinfo[extname].read(columns='TARGETID')
-                I = np.where(np.isin(photo_targetid, input_cat1['TARGETID']))[0]
+                if indexrows is not None:
+                    extname = targetindex.extnames[targetindex.filenames.index(targetfile)]
+                    if extname.isdigit():
+                        extname = int(extname)
+                    I = indexrows[targetfile]
+                else:
+                    extname = _targets_extname(tinfo)
+
+                    # fitsio does not preserve the order of the rows but we'll sort later.
+                    photo_targetid = tinfo[extname].read(columns='TARGETID')
+                    I = np.where(np.isin(photo_targetid, input_cat1['TARGETID']))[0]
     
                 log.debug('Matched {} targets in {}'.format(len(I), targetfile))
                 if len(I) > 0:
@@ -716,6 +941,47 @@ def tractorphot_datamodel(from_file=False):
 
     return datamodel 
 
+@functools.lru_cache(maxsize=None)
+def _tractor_bricks(dr9dir, region, raslice):
+    """Return the set of bricknames with a Tractor catalog in one RA slice of a region.
+
+    The listing of each dr9dir/region/tractor/raslice directory is cached so
+    that locating the catalog of each brick does not stat the file system.
+
+    """
+    tractordir = os.path.join(dr9dir, region, 'tractor', raslice)
+    if not os.path.isdir(tractordir):
+        return frozenset()
+    bricks = [f[len('tractor-'):-len('.fits')] for f in os.listdir(tractordir)
+              if f.startswith('tractor-') and f.endswith('.fits')]
+    return frozenset(bricks)
+
+def _tractorfile(dr9dir, region, brick):
+    """Return the Tractor catalog filename of brick in region, or None if it does not exist."""
+    if brick in _tractor_bricks(dr9dir, region, brick[:3]):
+        return os.path.join(dr9dir, region, 'tractor', brick[:3], 'tractor-{}.fits'.format(brick))
+    else:
+        return None
+
+def _read_tractor_rows(tractorfile, rows):
+    """Read rows of a Tractor catalog, only the columns of the tractorphot data model.
+
+    Returns a table with the tractorphot data model and one row per entry of
+    `rows`, in the same order.
+
+    """
+    datamodel = tractorphot_datamodel()
+    urows, inverse = np.unique(rows, return_inverse=True)
+    with fitsio.FITS(tractorfile) as fx:
+        columns = [col for col in fx[1].get_colnames() if col.upper() in datamodel.colnames]
+        data = fx[1].read(rows=urows, columns=columns, upper=True)
+
+    out = Table(np.hstack(np.repeat(datamodel, len(rows))))
+    for col in data.dtype.names:
+        out[col][:] = data[col][inverse]
+
+    return out
+
 def _gather_tractorphot_onebrick(input_cat, dr9dir, radius_match, racolumn, deccolumn):
     """Support routine for gather_tractorphot."""
 
@@ -741,9 +1007,10 @@ def _gather_tractorphot_onebrick(input_cat, dr9dir, radius_match, racolumn, decc
             region = 'north'
     
         #raslice = np.array(['{:06d}'.format(int(ra*1000))[:3] for ra in input_cat['RA']])
-        tractorfile = os.path.join(dr9dir, region, 'tractor', brick[:3], 'tractor-{}.fits'.format(brick))
+        tractorfile = _tractorfile(dr9dir, region, brick)
     
-        if not os.path.isfile(tractorfile):
+        if tractorfile is None:
+            tractorfile = os.path.join(dr9dir, region, 'tractor', brick[:3], 'tractor-{}.fits'.format(brick))
             errmsg = 'Unable to find Tractor catalog {}'.format(tractorfile)
             log.critical(errmsg)
             raise IOError(errmsg)
@@ -770,14 +1037,11 @@ def _gather_tractorphot_onebrick(input_cat, dr9dir, radius_match, racolumn, decc
         #if len(I) == 0: 
         #    return Table()
 
-        tractor_dr9 = Table(fitsio.read(tractorfile, rows=I, upper=True))
-    
         # sort explicitly in order to ensure order
-        srt = np.hstack([np.where(objid == tractor_dr9['OBJID'])[0] for objid in input_cat['BRICK_OBJID'][idr9]])
-        tractor_dr9 = tractor_dr9[srt]
+        srt = np.hstack([np.where(objid == _tractor['OBJID'][I])[0] for objid in input_cat['BRICK_OBJID'][idr9]])
+        tractor_dr9 = _read_tractor_rows(tractorfile, I[srt])
         assert(np.all((tractor_dr9['BRICKID'] == input_cat['BRICKID'][idr9])*(tractor_dr9['OBJID'] == input_cat['BRICK_OBJID'][idr9])))
 
-        tractor_dr9['LS_ID'] = np.int64(0) # will be filled in at the end
         tractor_dr9['TARGETID'] = input_cat['TARGETID'][idr9]
 
         out[idr9] = tractor_dr9
@@ -788,18 +1052,18 @@ def _gather_tractorphot_onebrick(input_cat, dr9dir, radius_match, racolumn, decc
         rad = radius_match * u.arcsec
 
         # resolve north/south
-        tractorfile_north = os.path.join(dr9dir, 'north', 'tractor', brick[:3], 'tractor-{}.fits'.format(brick))
-        tractorfile_south = os.path.join(dr9dir, 'south', 'tractor', brick[:3], 'tractor-{}.fits'.format(brick))
-        if os.path.isfile(tractorfile_north) and not os.path.isfile(tractorfile_south):
+        tractorfile_north = _tractorfile(dr9dir, 'north', brick)
+        tractorfile_south = _tractorfile(dr9dir, 'south', brick)
+        if tractorfile_north is not None and tractorfile_south is None:
             tractorfile = tractorfile_north
-        elif not os.path.isfile(tractorfile_north) and os.path.isfile(tractorfile_south):
+        elif tractorfile_north is None and tractorfile_south is not None:
             tractorfile = tractorfile_south
-        elif os.path.isfile(tractorfile_north) and os.path.isfile(tractorfile_south):
+        elif tractorfile_north is not None and tractorfile_south is not None:
             if np.median(input_cat[deccolumn][ipos]) < desitarget_resolve_dec():
                 tractorfile = tractorfile_south
             else:
                 tractorfile = tractorfile_north
-        elif not os.path.isfile(tractorfile_north) and not os.path.isfile(tractorfile_south):
+        else:
             return out
                 
         _tractor = fitsio.read(tractorfile, columns=['RA', 'DEC', 'BRICK_PRIMARY'], upper=True)
@@ -807,8 +1071,8 @@ def _gather_tractorphot_onebrick(input_cat, dr9dir, radius_match, racolumn, decc
         _tractor = _tractor[iprimary] 
         coord_tractor = SkyCoord(ra=_tractor['RA']*u.deg, dec=_tractor['DEC']*u.deg)
 
-        # Some targets can appear twice (with different targetids), so
-        # to make sure we do it right, we have to loop. Example:
+        # Some targets can appear twice (with different targetids); each one
+        # is matched independently. Example:
         #
         #     TARGETID    SURVEY PROGRAM     TARGET_RA          TARGET_DEC    OBJID BRICKID RELEASE  SKY  GAIADR    RA     DEC   GROUP BRICKNAME
         #      int64       str7    str6       float64            float64      int64  int64   int64  int64 int64  float64 float64 int64    str8
@@ -816,17 +1080,15 @@ def _gather_tractorphot_onebrick(input_cat, dr9dir, radius_match, racolumn, decc
         # 234545047666699    sv1   other 150.31145983340912 2.587887211205909    11  345369      53     0      0     0.0     0.0     0  1503p025
         # 243341140688909    sv1   other 150.31145983340912 2.587887211205909    13  345369      55     0      0     0.0     0.0     0  1503p025
 
-        for indx_cat, (ra, dec, targetid) in enumerate(zip(input_cat[racolumn][ipos],
-                                                           input_cat[deccolumn][ipos],
-                                                           input_cat['TARGETID'][ipos])):
-            
-            coord_cat = SkyCoord(ra=ra*u.deg, dec=dec*u.deg)
+        if len(coord_tractor) > 0:
+            coord_cat = SkyCoord(ra=np.asarray(input_cat[racolumn][ipos])*u.deg,
+                                 dec=np.asarray(input_cat[deccolumn][ipos])*u.deg)
             indx_tractor, d2d, _ = coord_cat.match_to_catalog_sky(coord_tractor)
-            if d2d < rad:
-                _tractor = Table(fitsio.read(tractorfile, rows=iprimary[indx_tractor], upper=True))
-                _tractor['LS_ID'] = np.int64(0) # will be filled in at the end
-                _tractor['TARGETID'] = targetid
-                out[ipos[indx_cat]] = _tractor[0]
+            imatch = np.where(d2d < rad)[0]
+            if len(imatch) > 0:
+                _tractor = _read_tractor_rows(tractorfile, iprimary[indx_tractor[imatch]])
+                _tractor['TARGETID'] = input_cat['TARGETID'][ipos[imatch]]
+                out[ipos[imatch]] = _tractor
 
     # Add a unique DR9 identifier.
     out['LS_ID'] = (out['RELEASE'].astype(np.int64) << 40) | (out['BRICKID'].astype(np.int64) << 16) | (out['OBJID'].astype(np.int64))
@@ -836,7 +1098,8 @@ def _gather_tractorphot_onebrick(input_cat, dr9dir, radius_match, racolumn, decc
     return out
 
 def gather_tractorphot(input_cat, racolumn='TARGET_RA', deccolumn='TARGET_DEC',
-                       dr9dir=None, radius_match=1.0, columns=None):
+                       dr9dir=None, radius_match=1.0, columns=None, nproc=1,
+                       comm=None):
     """Retrieve the Tractor catalog for all the objects in this catalog (one brick).
 
     Args:
@@ -847,6 +1110,9 @@ def gather_tractorphot(input_cat, racolumn='TARGET_RA', deccolumn='TARGET_DEC',
         dr9dir (str): full path to the location of the DR9 Tractor catalogs
         radius_match (float, arcsec): matching radius (default, 1 arcsec)
         columns (str array): return this subset of columns
+        nproc (int, optional): number of processes matching bricks in parallel
+        comm (optional): MPI communicator; bricks are split over its ranks
+          and the full table is returned on every rank
 
     Returns a table of Tractor photometry. Matches are identified either using
     BRICKID and BRICK_OBJID or using positional matching (1 arcsec radius).
@@ -905,10 +1171,29 @@ def gather_tractorphot(input_cat, racolumn='TARGET_RA', deccolumn='TARGET_DEC',
     # Split into unique brickname(s).
     bricknames = input_cat['BRICKNAME']
 
+    # Largest bricks first to balance the processes.
+    ubricks, inverse, counts = np.unique(bricknames, return_inverse=True, return_counts=True)
+    brickrows = [np.where(inverse == i)[0] for i in np.argsort(-counts, kind='stable')]
+
+    if comm is not None:
+        brickrows = brickrows[comm.rank::comm.size]
+
+    args = [(input_cat[I], dr9dir, radius_match, racolumn, deccolumn) for I in brickrows]
+    if nproc > 1 and len(args) > 1:
+        import multiprocessing
+        with multiprocessing.Pool(nproc) as pool:
+            results = pool.starmap(_gather_tractorphot_onebrick, args)
+    else:
+        results = [_gather_tractorphot_onebrick(*arg) for arg in args]
+
+    if comm is not None:
+        allresults = comm.allgather(list(zip(brickrows, results)))
+        brickrows = [I for rankresults in allresults for I, _ in rankresults]
+        results = [out1 for rankresults in allresults for _, out1 in rankresults]
+
     out = Table(np.hstack(np.repeat(tractorphot_datamodel(), len(np.atleast_1d(input_cat)))))
-    for brickname in set(bricknames):
-        I = np.where(brickname == bricknames)[0]
-        out[I] = _gather_tractorphot_onebrick(input_cat[I], dr9dir, radius_match, racolumn, deccolumn)
+    for I, out1 in zip(brickrows, results):
+        out[I] = out1
 
     if columns is not None:
         out = out[columns]
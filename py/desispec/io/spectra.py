@@ -14,6 +14,7 @@ import re
 import warnings
 import time
 import glob
+from functools import partial
 
 import numpy as np
 import astropy.units as u
@@ -27,55 +28,28 @@ from desiutil.io import encode_table
 from desiutil.log import get_logger
 
 from .util import fitsheader, native_endian, add_columns, checkgzip
+from .util import read_image_rows, read_image_hdu
 from .util import get_tempfilename
 from . import iotime
 
 from .frame import read_frame
+from .spectra_hdf5 import is_hdf5, read_spectra_hdf5, write_spectra_hdf5
 from .fibermap import fibermap_comments
 
 from ..spectra import Spectra, stack
 from .meta import specprod_root
 
-def write_spectra(outfile, spec, units=None):
+def _fibermap_hdus(fibermap, exp_fibermap=None):
     """
-    Write Spectra object to FITS file.
-
-    This places the metadata into the header of the (empty) primary HDU.
-    The first extension contains the fibermap, and then HDUs are created for
-    the different data arrays for each band.
-
-    Floating point data is converted to 32 bits before writing.
+    Return list of FIBERMAP and optional EXP_FIBERMAP BinTableHDUs
 
     Args:
-        outfile (str): path to write
-        spec (Spectra): the object containing the data
-        units (str): optional string to use for the BUNIT key of the flux
-            HDUs for each band.
-
-    Returns:
-        The absolute path to the file that was written.
-
+        fibermap: fibermap Table
+        exp_fibermap: optional exposure-fibermap Table, used in coadds
     """
-    log = get_logger()
-    outfile = os.path.abspath(outfile)
-
-    # Create the parent directory, if necessary.
-    dir, base = os.path.split(outfile)
-    if not os.path.exists(dir):
-        os.makedirs(dir)
-
-    # Create HDUs from the data
-    all_hdus = fits.HDUList()
+    hdus = list()
 
-    # metadata goes in empty primary HDU
-    hdr = fitsheader(spec.meta)
-    hdr['LONGSTRN'] = 'OGIP 1.0'
-    add_dependencies(hdr)
-
-    all_hdus.append(fits.PrimaryHDU(header=hdr))
-
-    # Next is the fibermap
-    fmap = encode_table(spec.fibermap.copy())
+    fmap = encode_table(fibermap.copy())
     fmap.meta['EXTNAME'] = 'FIBERMAP'
     fmap.meta['LONGSTRN'] = 'OGIP 1.0'
     add_dependencies(fmap.meta)
@@ -94,11 +68,11 @@ def write_spectra(outfile, spec, units=None):
             comment = fibermap_comments[name]
             hdu.header[key] = (name, comment)
 
-    all_hdus.append(hdu)
+    hdus.append(hdu)
 
     # Optional: exposure-fibermap, used in coadds
-    if spec.exp_fibermap is not None:
-        expfmap = encode_table(spec.exp_fibermap.copy())
+    if exp_fibermap is not None:
+        expfmap = encode_table(exp_fibermap.copy())
         expfmap.meta["EXTNAME"] = "EXP_FIBERMAP"
         with warnings.catch_warnings():
             #- nanomaggies aren't an official IAU unit but don't complain
@@ -114,6 +88,64 @@ def write_spectra(outfile, spec, units=None):
                 comment = fibermap_comments[name]
                 hdu.header[key] = (name, comment)
 
+        hdus.append(hdu)
+
+    return hdus
+
+def _flux_units(units=None):
+    """
+    Return (flux, ivar) BUNIT header values for `units` (default 1e-17 cgs)
+    """
+    if units is None:
+        return ("10**-17 erg/(s cm2 Angstrom)",
+                '10**+34 (s2 cm4 Angstrom2) / erg2')
+    else:
+        return (units, ((u.Unit(units, format='fits'))**-2).to_string('fits'))
+
+def write_spectra(outfile, spec, units=None):
+    """
+    Write Spectra object to FITS file.
+
+    This places the metadata into the header of the (empty) primary HDU.
+    The first extension contains the fibermap, and then HDUs are created for
+    the different data arrays for each band.
+
+    Floating point data is converted to 32 bits before writing.
+
+    Args:
+        outfile (str): path to write
+        spec (Spectra): the object containing the data
+        units (str): optional string to use for the BUNIT key of the flux
+            HDUs for each band.
+
+    Returns:
+        The absolute path to the file that was written.
+
+    Files with a .h5 or .hdf5 extension are written in HDF5 format with
+    desispec.io.spectra_hdf5.write_spectra_hdf5 instead.
+    """
+    if is_hdf5(outfile):
+        return write_spectra_hdf5(outfile, spec, units=units)
+
+    log = get_logger()
+    outfile = os.path.abspath(outfile)
+
+    # Create the parent directory, if necessary.
+    dir, base = os.path.split(outfile)
+    if not os.path.exists(dir):
+        os.makedirs(dir)
+
+    # Create HDUs from the data
+    all_hdus = fits.HDUList()
+
+    # metadata goes in empty primary HDU
+    hdr = fitsheader(spec.meta)
+    hdr['LONGSTRN'] = 'OGIP 1.0'
+    add_dependencies(hdr)
+
+    all_hdus.append(fits.PrimaryHDU(header=hdr))
+
+    for hdu in _fibermap_hdus(spec.fibermap, spec.exp_fibermap):
         all_hdus.append(hdu)
 
     # Now append the data for all bands
@@ -125,18 +157,12 @@ def write_spectra(outfile, spec, units=None):
         all_hdus.append(hdu)
 
         hdu = fits.ImageHDU(name="{}_FLUX".format(band.upper()))
-        if units is None:
-            hdu.header["BUNIT"] = "10**-17 erg/(s cm2 Angstrom)"
-        else:
-            hdu.header["BUNIT"] = units
+        hdu.header["BUNIT"] = _flux_units(units)[0]
         hdu.data = spec.flux[band].astype("f4")
         all_hdus.append(hdu)
 
         hdu = fits.ImageHDU(name="{}_IVAR".format(band.upper()))
-        if units is None:
-            hdu.header["BUNIT"] = '10**+34 (s2 cm4 Angstrom2) / erg2'
-        else:
-            hdu.header["BUNIT"] = ((u.Unit(units, format='fits'))**-2).to_string('fits')
+        hdu.header["BUNIT"] = _flux_units(units)[1]
         hdu.data = spec.ivar[band].astype("f4")
         all_hdus.append(hdu)
 
@@ -186,7 +212,141 @@ def write_spectra(outfile, spec, units=None):
     return outfile
 
 
-def read_spectra(infile, single=False):
+def write_spectra_chunks(outfile, chunks, fibermap, exp_fibermap=None,
+        meta=None, units=None):
+    """
+    Write a spectra file incrementally from chunks of Spectra rows.
+
+    The FIBERMAP and EXP_FIBERMAP HDUs are written first, then the
+    WAVELENGTH/FLUX/IVAR/MASK/RESOLUTION HDUs are created with the full
+    number of rows and filled one chunk at a time, so that only one chunk
+    needs to be in memory.  The SCORES of all chunks are written at the end.
+
+    Args:
+        outfile (str): path to write
+        chunks: iterable of Spectra objects, whose rows are consecutive
+            rows of `fibermap`
+        fibermap: fibermap Table of the full output file
+        exp_fibermap: optional exposure-fibermap Table, used in coadds
+        meta (dict): metadata for the primary header
+        units (str): optional string to use for the BUNIT key of the flux
+            HDUs for each band.
+
+    Returns:
+        The absolute path to the file that was written.
+
+    Notes: `extra` and `extra_catalog` of the chunks are not written.
+    """
+    log = get_logger()
+    outfile = os.path.abspath(outfile)
+
+    # Create the parent directory, if necessary.
+    dir, base = os.path.split(outfile)
+    if not os.path.exists(dir):
+        os.makedirs(dir)
+
+    nspec = len(fibermap)
+
+    # metadata goes in empty primary HDU
+    hdr = fitsheader(meta)
+    hdr['LONGSTRN'] = 'OGIP 1.0'
+    add_dependencies(hdr)
+
+    all_hdus = fits.HDUList()
+    all_hdus.append(fits.PrimaryHDU(header=hdr))
+    for hdu in _fibermap_hdus(fibermap, exp_fibermap):
+        all_hdus.append(hdu)
+
+    t0 = time.time()
+    tmpfile = get_tempfilename(outfile)
+    all_hdus.writeto(tmpfile, overwrite=True)
+    del all_hdus
+
+    fx = fitsio.FITS(tmpfile, 'rw')
+    bands = None
+    scores = list()
+    scores_comments = None
+    row = 0
+    for spec in chunks:
+        n = spec.num_spectra()
+        if bands is None:
+            bands = spec.bands
+            for band in bands:
+                B = band.upper()
+                nwave = spec.wave[band].size
+                fx.write(spec.wave[band].astype('f8'),
+                        extname=B+'_WAVELENGTH', header={'BUNIT': 'Angstrom'})
+                fx.create_image_hdu(dims=(nspec, nwave), dtype='f4',
+                        extname=B+'_FLUX')
+                fx[-1].write_key('BUNIT', _flux_units(units)[0])
+                fx.create_image_hdu(dims=(nspec, nwave), dtype='f4',
+                        extname=B+'_IVAR')
+                fx[-1].write_key('BUNIT', _flux_units(units)[1])
+                if spec.mask is not None:
+                    fx.create_image_hdu(dims=(nspec, nwave), dtype='i4',
+                            extname=B+'_MASK')
+                if spec.resolution_data is not None:
+                    ndiag = spec.resolution_data[band].shape[1]
+                    fx.create_image_hdu(dims=(nspec, ndiag, nwave), dtype='f4',
+                            extname=B+'_RESOLUTION')
+        elif spec.bands != bands:
+            fx.close()
+            os.remove(tmpfile)
+            raise ValueError('Inconsistent bands {} != {} in chunks'.format(
+                spec.bands, bands))
+
+        if row + n > nspec:
+            fx.close()
+            os.remove(tmpfile)
+            raise ValueError('Chunks have more than {} rows'.format(nspec))
+
+        for band in bands:
+            B = band.upper()
+            fx[B+'_FLUX'].write(spec.flux[band].astype('f4'), start=[row, 0])
+            fx[B+'_IVAR'].write(spec.ivar[band].astype('f4'), start=[row, 0])
+            if spec.mask is not None:
+                fx[B+'_MASK'].write(spec.mask[band].astype(np.int32),
+                        start=[row, 0])
+            if spec.resolution_data is not None:
+                fx[B+'_RESOLUTION'].write(
+                        spec.resolution_data[band].astype('f4'),
+                        start=[row, 0, 0])
+
+        if spec.scores is not None:
+            scores.append(Table(spec.scores))
+            if hasattr(spec, 'scores_comments'):
+                scores_comments = spec.scores_comments
+
+        row += n
+
+    if row != nspec:
+        fx.close()
+        os.remove(tmpfile)
+        raise ValueError('Chunks have {} rows instead of {}'.format(row, nspec))
+
+    if len(scores) > 0:
+        scores_tbl = encode_table(astropy.table.vstack(scores))
+        fx.write(scores_tbl.as_array(), extname='SCORES')
+        # add comments in header
+        if scores_comments is not None:
+            for i, colname in enumerate(scores_tbl.colnames):
+                if colname in scores_comments:
+                    fx[-1].write_key('TTYPE{}'.format(i+1), colname,
+                            comment=scores_comments[colname])
+
+    for hdu in fx:
+        hdu.write_checksum()
+    fx.close()
+
+    os.rename(tmpfile, outfile)
+    duration = time.time() - t0
+    log.info(iotime.format('write', outfile, duration))
+
+    return outfile
+
+
+def read_spectra(infile, single=False, rows=None, targets=None, bands=None,
+        columns=None, dtype=None, lazy_resolution=False):
     """
     Read Spectra object from FITS file.
 
@@ -196,13 +356,39 @@ def read_spectra(infile, single=False):
     Args:
         infile (str): path to read
         single (bool): if True, keep spectra as single precision in memory.
+        rows (array-like): if not None, only read these rows (spectra
+            indices in the file), returned in increasing order.
+        targets (array-like): if not None, only read the rows of these
+            TARGETIDs, found with a first pass on the FIBERMAP TARGETID
+            column; combined with `rows` if both are set.
+        bands (list of str): if not None, only read these bands.
+        columns (list of str): if not None, only read these FIBERMAP
+            columns (TARGETID is always included).
+        dtype: np.float32 or np.float64 type of flux, ivar, resolution and
+            extra arrays; np.float32 is the same as single=True and keeps
+            the on-disk precision.
+        lazy_resolution (bool): if True, RESOLUTION HDUs are only read
+            when spectra.resolution_data or spectra.R is first accessed.
 
     Returns (Spectra):
         The object containing the data read from disk.
 
+    Files with a .h5 or .hdf5 extension are read from HDF5 format with
+    desispec.io.spectra_hdf5.read_spectra_hdf5 instead.
     """
+    if is_hdf5(infile):
+        return read_spectra_hdf5(infile, single=single, rows=rows,
+                targets=targets, bands=bands, columns=columns, dtype=dtype,
+                lazy_resolution=lazy_resolution)
+
     log = get_logger()
     infile = checkgzip(infile)
+    if dtype is not None:
+        dtype = np.dtype(dtype)
+        if dtype not in (np.float32, np.float64):
+            raise ValueError('dtype must be float32 or float64, not {}'.format(dtype))
+        single = (dtype == np.float32)
+
     ftype = np.float64
     if single:
         ftype = np.float32
@@ -211,10 +397,42 @@ def read_spectra(infile, single=False):
     if not os.path.isfile(infile):
         raise IOError("{} is not a file".format(infile))
 
+    bands_to_read = None
+    if bands is not None:
+        bands_to_read = [b.lower() for b in np.atleast_1d(bands)]
+
+    if rows is not None:
+        rows = np.unique(rows)
+
     t0 = time.time()
     hdus = fitsio.FITS(infile, mode='r')
     nhdu = len(hdus)
 
+    #- fibermap-only pass to convert TARGETIDs into rows
+    if targets is not None:
+        targetids = hdus['FIBERMAP'].read(columns=['TARGETID'])['TARGETID']
+        targets = np.asarray(targets)
+        target_rows = np.where(np.isin(targetids, targets))[0]
+        nmissing = np.count_nonzero(~np.isin(targets, targetids))
+        if nmissing > 0:
+            log.warning('{} of {} targets not found in {}'.format(
+                nmissing, len(targets), infile))
+        if rows is None:
+            rows = target_rows
+        else:
+            rows = np.intersect1d(rows, target_rows)
+
+    if columns is not None:
+        columns = list(columns)
+        if 'TARGETID' not in columns:
+            columns.insert(0, 'TARGETID')
+
+    def _read_data(hdu, columns=None):
+        if hdu.get_exttype() == 'IMAGE_HDU':
+            return read_image_rows(hdu, rows)
+        else:
+            return hdu.read(rows=rows, columns=columns)
+
     # load the metadata.
 
     meta = dict(hdus[0].read_header())
@@ -241,13 +459,13 @@ def read_spectra(infile, single=False):
     for h in range(1, nhdu):
         name = hdus[h].read_header()["EXTNAME"]
         if name == "FIBERMAP":
-            fmap = encode_table(Table(hdus[h].read(), copy=True).as_array())
+            fmap = encode_table(Table(_read_data(hdus[h], columns), copy=True).as_array())
         elif name == "EXP_FIBERMAP":
             expfmap = encode_table(Table(hdus[h].read(), copy=True).as_array())
         elif name == "SCORES":
-            scores = encode_table(Table(hdus[h].read(), copy=True).as_array())
+            scores = encode_table(Table(_read_data(hdus[h]), copy=True).as_array())
         elif name == 'EXTRA_CATALOG':
-            extra_catalog = encode_table(Table(hdus[h].read(), copy=True).as_array())
+            extra_catalog = encode_table(Table(_read_data(hdus[h]), copy=True).as_array())
         else:
             # Find the band based on the name
             mat = re.match(r"(.*)_(.*)", name)
@@ -255,6 +473,8 @@ def read_spectra(infile, single=False):
                 raise RuntimeError("FITS extension name {} does not contain the band".format(name))
             band = mat.group(1).lower()
             type = mat.group(2)
+            if bands_to_read is not None and band not in bands_to_read:
+                continue
             if band not in bands:
                 bands.append(band)
             if type == "WAVELENGTH":
@@ -265,31 +485,44 @@ def read_spectra(infile, single=False):
             elif type == "FLUX":
                 if flux is None:
                     flux = {}
-                flux[band] = native_endian(hdus[h].read().astype(ftype))
+                flux[band] = native_endian(_read_data(hdus[h]).astype(ftype))
             elif type == "IVAR":
                 if ivar is None:
                     ivar = {}
-                ivar[band] = native_endian(hdus[h].read().astype(ftype))
+                ivar[band] = native_endian(_read_data(hdus[h]).astype(ftype))
             elif type == "MASK":
                 if mask is None:
                     mask = {}
-                mask[band] = native_endian(hdus[h].read().astype(np.uint32))
+                mask[band] = native_endian(_read_data(hdus[h]).astype(np.uint32))
             elif type == "RESOLUTION":
                 if res is None:
                     res = {}
-                res[band] = native_endian(hdus[h].read().astype(ftype))
+                if lazy_resolution:
+                    res[band] = partial(read_image_hdu, infile, name, rows, ftype)
+                else:
+                    res[band] = native_endian(_read_data(hdus[h]).astype(ftype))
             else:
                 # this must be an "extra" HDU
                 if extra is None:
                     extra = {}
                 if band not in extra:
                     extra[band] = {}
-                extra[band][type] = native_endian(hdus[h].read().astype(ftype))
+                extra[band][type] = native_endian(_read_data(hdus[h]).astype(ftype))
 
     hdus.close()
     duration = time.time() - t0
     log.info(iotime.format('read', infile, duration))
 
+    if bands_to_read is not None:
+        missing = [b for b in bands_to_read if b not in bands]
+        if len(missing) > 0:
+            raise ValueError('bands {} not in {}'.format(missing, infile))
+
+    #- EXP_FIBERMAP isn't row-matched; keep the entries of the selected targets
+    if rows is not None and expfmap is not None:
+        keep = np.isin(expfmap['TARGETID'], fmap['TARGETID'])
+        expfmap = expfmap[keep]
+
     # Construct the Spectra object from the data.  If there are any
     # inconsistencies in the sizes of the arrays read from the file,
     # they will be caught by the constructor.
@@ -0,0 +1,398 @@
+# Licensed under a 3-clause BSD style license - see LICENSE.rst
+# -*- coding: utf-8 -*-
+"""
+desispec.io.spectra_hdf5
+========================
+
+HDF5 format for Spectra and SpectraLite objects, as an alternative to FITS
+for random access to a few targets and for incrementally appended files.
+
+The file layout is::
+
+    /                   attrs BANDS and META (json encoded)
+    /TARGETID           TARGETID of each row, to select targets without
+                        reading the fibermap
+    /FIBERMAP           fibermap table, row-matched to the spectra
+    /EXP_FIBERMAP       optional per-exposure fibermap table
+    /SCORES             optional scores table, row-matched
+    /EXTRA_CATALOG      optional extra catalog, row-matched
+    /<band>/WAVELENGTH  wavelength grid of each band (float64)
+    /<band>/FLUX        [nspec, nwave] float32
+    /<band>/IVAR        [nspec, nwave] float32
+    /<band>/MASK        optional [nspec, nwave] uint32
+    /<band>/RESOLUTION  optional [nspec, ndiag, nwave] float32
+    /<band>/<other>     optional extra [nspec, nwave] float32 arrays
+
+All row-matched datasets are chunked along the spectra and resizable,
+so that rows can be read and appended without touching the others.
+
+h5py is only imported when these files are read or written.
+"""
+
+import os
+import json
+import time
+from functools import partial
+
+import numpy as np
+from numpy.lib import recfunctions as rfn
+from astropy.table import Table
+
+from desiutil.depend import add_dependencies
+from desiutil.io import encode_table
+from desiutil.log import get_logger
+
+from .util import fitsheader, native_endian, get_tempfilename
+from . import iotime
+
+from ..spectra import Spectra
+
+#- file extensions dispatched to this module by read_spectra/write_spectra
+hdf5_extensions = ('.h5', '.hdf5')
+
+_standard_types = ('WAVELENGTH', 'FLUX', 'IVAR', 'MASK', 'RESOLUTION')
+_row_tables = ('FIBERMAP', 'SCORES', 'EXTRA_CATALOG')
+
+def is_hdf5(filename):
+    """Return True if filename has an HDF5 extension (.h5 or .hdf5)"""
+    return os.path.splitext(filename)[1].lower() in hdf5_extensions
+
+def _table_array(table):
+    """Return table as a numpy structured array with bytes strings"""
+    table = encode_table(Table(table))
+    return np.asarray(table.as_array())
+
+def _meta_json(meta):
+    """Return json string of header-like meta, with DEPNAM/DEPVER keywords"""
+    hdr = fitsheader(meta)
+    add_dependencies(hdr)
+    return json.dumps({key:value for key, value in hdr.items()}, default=str)
+
+def _create_rows(group, name, data, chunk_targets, compression):
+    """
+    Create dataset `name` in `group` with data, chunked and resizable
+    along the first axis
+    """
+    data = np.asarray(data)
+    chunks = (chunk_targets,) + data.shape[1:]
+    maxshape = (None,) + data.shape[1:]
+    if compression is not None:
+        return group.create_dataset(name, data=data, chunks=chunks,
+                maxshape=maxshape, compression=compression, shuffle=True)
+    else:
+        return group.create_dataset(name, data=data, chunks=chunks,
+                maxshape=maxshape)
+
+def _append_rows(dset, data):
+    """Append data rows at the end of resizable dataset dset"""
+    data = np.asarray(data)
+    if data.dtype.names is not None:
+        #- match the columns of the existing table
+        missing = set(dset.dtype.names) - set(data.dtype.names)
+        if len(missing) > 0:
+            raise ValueError('{} is missing columns {}'.format(dset.name, sorted(missing)))
+        data = rfn.repack_fields(data[list(dset.dtype.names)]).astype(dset.dtype)
+    elif data.shape[1:] != dset.shape[1:]:
+        raise ValueError('{} rows of shape {} instead of {}'.format(
+            dset.name, data.shape[1:], dset.shape[1:]))
+    n = dset.shape[0]
+    dset.resize(n + data.shape[0], axis=0)
+    dset[n:] = data
+
+def _row_datasets(spec):
+    """
+    Yield (path, data, dtype) of the row-matched arrays of spec
+    """
+    yield 'TARGETID', np.asarray(spec.fibermap['TARGETID']), np.int64
+    yield 'FIBERMAP', _table_array(spec.fibermap), None
+    if spec.scores is not None:
+        yield 'SCORES', _table_array(spec.scores), None
+    if getattr(spec, 'extra_catalog', None) is not None:
+        yield 'EXTRA_CATALOG', _table_array(spec.extra_catalog), None
+
+    for band in spec.bands:
+        yield band+'/FLUX', spec.flux[band], np.float32
+        yield band+'/IVAR', spec.ivar[band], np.float32
+        if spec.mask is not None:
+            yield band+'/MASK', spec.mask[band], np.uint32
+        if spec.resolution_data is not None:
+            yield band+'/RESOLUTION', spec.resolution_data[band], np.float32
+        if getattr(spec, 'extra', None) is not None:
+            for name, data in spec.extra[band].items():
+                yield band+'/'+name, data, np.float32
+
+def write_spectra_hdf5(outfile, spec, units=None, chunk_targets=64,
+        compression=None):
+    """
+    Write a Spectra or SpectraLite object to an HDF5 file
+
+    Args:
+        outfile (str): path to write
+        spec: Spectra or SpectraLite object
+
+    Options:
+        units (str): BUNIT attribute of the flux datasets
+        chunk_targets (int): number of spectra per chunk of each dataset
+        compression (str): None, 'gzip' or 'lzf' lossless compression
+
+    Returns:
+        The absolute path to the file that was written.
+
+    Floating point data are converted to 32 bits, as for FITS files.
+    """
+    import h5py
+    from .spectra import _flux_units
+
+    log = get_logger()
+    outfile = os.path.abspath(outfile)
+    os.makedirs(os.path.dirname(outfile), exist_ok=True)
+    chunk_targets = max(1, int(chunk_targets))
+    flux_units, ivar_units = _flux_units(units)
+
+    t0 = time.time()
+    tmpfile = get_tempfilename(outfile)
+    with h5py.File(tmpfile, 'w') as fx:
+        fx.attrs['BANDS'] = json.dumps(list(spec.bands))
+        fx.attrs['META'] = _meta_json(spec.meta)
+
+        for band in spec.bands:
+            group = fx.create_group(band)
+            group.create_dataset('WAVELENGTH', data=np.asarray(spec.wave[band], dtype=np.float64))
+            group['WAVELENGTH'].attrs['BUNIT'] = 'Angstrom'
+
+        for path, data, dtype in _row_datasets(spec):
+            if dtype is not None:
+                data = np.asarray(data).astype(dtype)
+            _create_rows(fx, path, data, chunk_targets, compression)
+
+        for band in spec.bands:
+            fx[band+'/FLUX'].attrs['BUNIT'] = flux_units
+            fx[band+'/IVAR'].attrs['BUNIT'] = ivar_units
+
+        if spec.exp_fibermap is not None:
+            _create_rows(fx, 'EXP_FIBERMAP', _table_array(spec.exp_fibermap),
+                    chunk_targets, compression)
+
+    os.rename(tmpfile, outfile)
+    duration = time.time() - t0
+    log.info(iotime.format('write', outfile, duration))
+
+    return outfile
+
+def append_spectra_hdf5(outfile, spec):
+    """
+    Append the spectra of a Spectra or SpectraLite object to an HDF5 file
+
+    Args:
+        outfile (str): existing file written by write_spectra_hdf5
+        spec: Spectra or SpectraLite object with the same bands, wavelength
+            grids, fibermap columns and optional arrays as the file
+
+    Returns:
+        The absolute path to the file that was updated.
+
+    Unlike write_spectra_hdf5, the file is updated in place; meta of spec
+    is ignored.
+    """
+    import h5py
+
+    log = get_logger()
+    outfile = os.path.abspath(outfile)
+
+    t0 = time.time()
+    with h5py.File(outfile, 'r+') as fx:
+        bands = json.loads(fx.attrs['BANDS'])
+        if list(spec.bands) != bands:
+            raise ValueError('bands {} do not match {} in {}'.format(
+                list(spec.bands), bands, outfile))
+        for band in bands:
+            if not np.allclose(fx[band+'/WAVELENGTH'][()], spec.wave[band]):
+                raise ValueError('band {} has an incompatible wavelength grid'.format(band))
+
+        rows = list(_row_datasets(spec))
+        paths = [path for path, data, dtype in rows]
+        for path in _row_paths(fx):
+            if path not in paths:
+                raise ValueError('{} is missing {}'.format(type(spec).__name__, path))
+        for path, data, dtype in rows:
+            if path not in fx:
+                raise ValueError('{} is not in {}'.format(path, outfile))
+            if dtype is not None:
+                data = np.asarray(data).astype(dtype)
+            _append_rows(fx[path], data)
+
+        if spec.exp_fibermap is not None:
+            if 'EXP_FIBERMAP' not in fx:
+                raise ValueError('EXP_FIBERMAP is not in {}'.format(outfile))
+            _append_rows(fx['EXP_FIBERMAP'], _table_array(spec.exp_fibermap))
+
+    duration = time.time() - t0
+    log.info(iotime.format('write', outfile, duration))
+
+    return outfile
+
+def _row_paths(fx):
+    """List the paths of the row-matched datasets of an open HDF5 file"""
+    paths = [name for name in ('TARGETID',) + _row_tables if name in fx]
+    for band in json.loads(fx.attrs['BANDS']):
+        paths.extend([band+'/'+name for name in fx[band] if name != 'WAVELENGTH'])
+    return paths
+
+def _read_rows(dset, rows=None):
+    """
+    Read rows (sorted indices along the first axis) of an h5py dataset;
+    each run of consecutive rows is read with a single slice
+    """
+    if rows is None:
+        return dset[()]
+
+    rows = np.asarray(rows, dtype=np.int64)
+    if rows.size == 0:
+        return np.zeros((0,)+dset.shape[1:], dtype=dset.dtype)
+
+    breaks = np.where(np.diff(rows) != 1)[0] + 1
+    runstart = np.concatenate([[0,], breaks])
+    runstop = np.concatenate([breaks, [rows.size,]])
+    return np.concatenate([dset[rows[i]:rows[j-1]+1] for i, j in zip(runstart, runstop)])
+
+def read_hdf5_rows(filename, path, rows=None, dtype=None):
+    """
+    Open filename and read rows of dataset path as a native endian array
+
+    Used with functools.partial to defer reading RESOLUTION datasets
+    """
+    import h5py
+    with h5py.File(filename, 'r') as fx:
+        data = _read_rows(fx[path], rows)
+    if dtype is not None:
+        data = data.astype(dtype, copy=False)
+    return native_endian(data)
+
+def read_spectra_hdf5(infile, single=False, rows=None, targets=None, bands=None,
+        columns=None, dtype=None, lazy_resolution=False, lite=False):
+    """
+    Read a Spectra object from an HDF5 file written by write_spectra_hdf5
+
+    Args:
+        infile (str): path to read
+
+    Options:
+        single, rows, targets, bands, columns, dtype, lazy_resolution:
+            as for desispec.io.read_spectra
+        lite (bool): if True, return a desispec.pixgroup.SpectraLite object
+            with the on-disk float32 precision instead of a Spectra object
+
+    Returns (Spectra or SpectraLite):
+        The object containing the data read from disk.
+    """
+    import h5py
+
+    log = get_logger()
+    if dtype is not None:
+        dtype = np.dtype(dtype)
+        if dtype not in (np.float32, np.float64):
+            raise ValueError('dtype must be float32 or float64, not {}'.format(dtype))
+        single = (dtype == np.float32)
+
+    ftype = np.float32 if (single or lite) else np.float64
+
+    infile = os.path.abspath(infile)
+    if not os.path.isfile(infile):
+        raise IOError("{} is not a file".format(infile))
+
+    if rows is not None:
+        rows = np.unique(rows)
+
+    if columns is not None:
+        columns = list(columns)
+        if 'TARGETID' not in columns:
+            columns.insert(0, 'TARGETID')
+
+    t0 = time.time()
+    with h5py.File(infile, 'r') as fx:
+        meta = json.loads(fx.attrs['META'])
+        file_bands = json.loads(fx.attrs['BANDS'])
+        if bands is None:
+            bands = file_bands
+        else:
+            bands = [b.lower() for b in np.atleast_1d(bands)]
+            missing = [b for b in bands if b not in file_bands]
+            if len(missing) > 0:
+                raise ValueError('bands {} not in {}'.format(missing, infile))
+            #- keep the file order
+            bands = [b for b in file_bands if b in bands]
+
+        #- the TARGETID dataset is the index to select targets
+        if targets is not None:
+            targetids = fx['TARGETID'][()]
+            targets = np.asarray(targets)
+            target_rows = np.where(np.isin(targetids, targets))[0]
+            nmissing = np.count_nonzero(~np.isin(targets, targetids))
+            if nmissing > 0:
+                log.warning('{} of {} targets not found in {}'.format(
+                    nmissing, len(targets), infile))
+            if rows is None:
+                rows = target_rows
+            else:
+                rows = np.intersect1d(rows, target_rows)
+
+        tables = dict()
+        for name in _row_tables:
+            if name in fx:
+                data = _read_rows(fx[name], rows)
+                if name == 'FIBERMAP' and columns is not None:
+                    data = rfn.repack_fields(data[columns])
+                tables[name] = encode_table(Table(data, copy=True).as_array())
+            else:
+                tables[name] = None
+
+        if 'EXP_FIBERMAP' in fx:
+            expfmap = encode_table(Table(fx['EXP_FIBERMAP'][()], copy=True).as_array())
+            if rows is not None:
+                keep = np.isin(expfmap['TARGETID'], tables['FIBERMAP']['TARGETID'])
+                expfmap = expfmap[keep]
+        else:
+            expfmap = None
+
+        wave = dict()
+        flux = dict()
+        ivar = dict()
+        mask = None
+        res = None
+        extra = None
+        for band in bands:
+            group = fx[band]
+            wave[band] = native_endian(group['WAVELENGTH'][()])
+            flux[band] = native_endian(_read_rows(group['FLUX'], rows).astype(ftype))
+            ivar[band] = native_endian(_read_rows(group['IVAR'], rows).astype(ftype))
+            if 'MASK' in group:
+                if mask is None:
+                    mask = dict()
+                mask[band] = native_endian(_read_rows(group['MASK'], rows).astype(np.uint32))
+            if 'RESOLUTION' in group:
+                if res is None:
+                    res = dict()
+                if lazy_resolution and not lite:
+                    res[band] = partial(read_hdf5_rows, infile, band+'/RESOLUTION', rows, ftype)
+                else:
+                    res[band] = native_endian(_read_rows(group['RESOLUTION'], rows).astype(ftype))
+            for name in group:
+                if name not in _standard_types:
+                    if extra is None:
+                        extra = dict()
+                    if band not in extra:
+                        extra[band] = dict()
+                    extra[band][name] = native_endian(_read_rows(group[name], rows).astype(ftype))
+
+    duration = time.time() - t0
+    log.info(iotime.format('read', infile, duration))
+
+    if lite:
+        from ..pixgroup import SpectraLite
+        return SpectraLite(bands, wave, flux, ivar, mask, res,
+                tables['FIBERMAP'], exp_fibermap=expfmap, scores=tables['SCORES'])
+
+    return Spectra(bands, wave, flux, ivar, mask=mask, resolution_data=res,
+        fibermap=tables['FIBERMAP'], exp_fibermap=expfmap,
+        meta=meta, extra=extra, extra_catalog=tables['EXTRA_CATALOG'],
+        single=single, scores=tables['SCORES'])
@@ -7,6 +7,7 @@ Utility functions for desispec IO.
 import os
 import glob
 import time
+import threading
 import datetime
 import subprocess
 import fitsio
@@ -119,6 +120,57 @@ def native_endian(data):
     else:
         return data.byteswap().newbyteorder()
 
+def read_image_rows(hdu, rows=None):
+    """
+    Read a subset of rows (first axis) of a fitsio image HDU
+
+    Args:
+        hdu: fitsio ImageHDU
+        rows: sorted array of row indices; None reads the full image
+
+    Each run of consecutive rows is read with a single slice, so only the
+    requested rows are decoded from disk.
+    """
+    if rows is None:
+        return hdu.read()
+
+    ndim = len(hdu.get_dims())
+    rows = np.asarray(rows, dtype=np.int64)
+    if rows.size == 0:
+        shape = [0,] + list(hdu.get_dims()[1:])
+        return np.zeros(shape, dtype=hdu[0:1].dtype)
+
+    breaks = np.where(np.diff(rows) != 1)[0] + 1
+    runstart = np.concatenate([[0,], breaks])
+    runstop = np.concatenate([breaks, [rows.size,]])
+    data = list()
+    for i, j in zip(runstart, runstop):
+        index = (slice(rows[i], rows[j-1]+1),) + (slice(None),)*(ndim-1)
+        data.append(hdu[index])
+
+    return np.concatenate(data)
+
+def read_image_hdu(filename, extname, rows=None, dtype=None):
+    """
+    Open filename and read rows of image HDU extname as a native endian array
+
+    Args:
+        filename: path to a FITS file
+        extname: extension name or number
+
+    Options:
+        rows: sorted array of row indices; None reads all rows
+        dtype: if not None, convert the data to this type
+
+    Used with functools.partial to defer reading large HDUs such as
+    RESOLUTION until they are needed.
+    """
+    with fitsio.FITS(filename) as fx:
+        data = read_image_rows(fx[extname], rows)
+    if dtype is not None:
+        data = data.astype(dtype, copy=False)
+    return native_endian(data)
+
 def add_columns(data, colnames, colvals):
     '''
     Adds extra columns to a data table
@@ -783,11 +835,16 @@ def get_tempfilename(filename):
     goes wrong with the I/O it doesn't leave a corrupted partially written
     file with the final name.  The tempfile includes the PID to provide some
     race condition protection (the last one do do os.rename wins, but at least
-    different processes won't corrupt each other's files).
+    different processes won't corrupt each other's files).  Files written
+    from background threads (see desispec.io.asyncwrite) also include the
+    thread ID.
     """
     base, extension = os.path.splitext(filename)
     pid = os.getpid()
-    tempfile = f'{base}_tmp{pid}{extension}'
+    if threading.current_thread() is threading.main_thread():
+        tempfile = f'{base}_tmp{pid}{extension}'
+    else:
+        tempfile = f'{base}_tmp{pid}_{threading.get_ident()}{extension}'
     return tempfile
 
 def addkeys(hdr1, hdr2, skipkeys=None):
@@ -5,7 +5,7 @@ desispec.linalg
 Some linear algebra functions.
 """
 import numpy as np
-import scipy,scipy.linalg,scipy.interpolate
+import scipy,scipy.linalg,scipy.interpolate,scipy.sparse
 from desiutil.log import get_logger
 
 def cholesky_solve(A,B,overwrite=False,lower=False):
@@ -66,6 +66,89 @@ def cholesky_invert(A) :
     return inv
 
 
+def sparse_to_banded(A, bandwidth) :
+    """
+    returns the upper diagonals of a symmetric sparse matrix
+    in LAPACK banded storage
+
+    Args :
+         A : 2D (real symmetric) (nxn) scipy.sparse matrix
+         bandwidth (int) : number of upper diagonals to keep
+
+    Returns:
+         ab : 2D (bandwidth+1,n) array with ab[bandwidth+i-j,j] = A[i,j] for i<=j,
+              as used by scipy.linalg.cholesky_banded
+    """
+    n = A.shape[0]
+    dia = scipy.sparse.dia_matrix(A)
+    ab = np.zeros((bandwidth+1, n))
+    for offset, data in zip(dia.offsets, dia.data) :
+        if offset < 0 :
+            continue
+        if offset > bandwidth :
+            if np.any(data[offset:] != 0) :
+                raise ValueError("matrix has non-zero values beyond bandwidth {}".format(bandwidth))
+            continue
+        ab[bandwidth-offset, offset:] = data[offset:n]
+    return ab
+
+def cholesky_solve_banded_bordered(ab, B, border=None, corner=None, return_covariance=False) :
+    """
+    returns the solution X of the linear system A.X=B
+    for a positive definite matrix A made of a banded block bordered
+    by a few dense rows and columns,
+
+    A = | A11   A12 |    with A11 banded (n1xn1)
+        | A12^T A22 |    and A22 small (n2xn2)
+
+    using a banded Cholesky decomposition of A11 (LAPACK pbtrf)
+    and the Schur complement of A11 for the border.
+
+    Args :
+         ab : 2D (bandwidth+1,n1) upper diagonals of A11 in LAPACK banded storage
+         B : 1D vector, must have dimension n1+n2  (numpy.ndarray)
+
+    Options :
+         border : 2D (n1,n2) block A12, or None
+         corner : 2D (n2,n2) block A22, or None
+         return_covariance : if True, also return the (n1,n1) block of the
+             inverse of A
+
+    Returns :
+         X : 1D vector, same dimension as B  (numpy.ndarray)
+         or X,cov11 if return_covariance
+
+    Raises :
+         numpy.linalg.LinAlgError if A is not positive definite
+    """
+    n1 = ab.shape[1]
+    cb = scipy.linalg.cholesky_banded(ab, lower=False)
+
+    if border is None or border.shape[1] == 0 :
+        X = scipy.linalg.cho_solve_banded((cb, False), B[:n1])
+        if return_covariance :
+            cov11 = scipy.linalg.cho_solve_banded((cb, False), np.eye(n1))
+            return X, cov11
+        return X
+
+    # Z = A11^-1 A12 and X1 = A11^-1 B1 with the same factorization
+    Y = scipy.linalg.cho_solve_banded((cb, False), np.column_stack([B[:n1], border]))
+    X1 = Y[:,0]
+    Z = Y[:,1:]
+
+    # Schur complement of A11 is also positive definite
+    S = corner - border.T.dot(Z)
+    S_factor = scipy.linalg.cho_factor(S)
+    X2 = scipy.linalg.cho_solve(S_factor, B[n1:] - border.T.dot(X1))
+    X = np.concatenate([X1 - Z.dot(X2), X2])
+
+    if return_covariance :
+        cov11 = scipy.linalg.cho_solve_banded((cb, False), np.eye(n1))
+        cov11 += Z.dot(scipy.linalg.cho_solve(S_factor, Z.T))
+        return X, cov11
+
+    return X
+
 def spline_fit(output_wave,input_wave,input_flux,required_resolution,input_ivar=None,order=3,max_resolution=None):
     """Performs spline fit of input_flux vs. input_wave and resamples at output_wave
 
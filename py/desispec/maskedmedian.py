@@ -2,9 +2,42 @@
 Utility function to perform a median of images with masks
 '''
 
+import os
+import tempfile
+
 from desiutil.log import get_logger
 import numpy as np
 
+def _masked_median(images, masks=None) :
+    '''
+    Median along axis 0 of images, ignoring pixels with masks!=0
+
+    Args:
+       images : 2D numpy array [nimages, npix]
+    Options:
+       masks : 2D numpy array of same shape as images
+
+    Returns : 1D array [npix], identical to masked_median(images, masks)
+    but without going through numpy masked arrays
+    '''
+    if masks is None :
+        return np.median(images,axis=0)
+
+    masks = (masks!=0)
+    #- masked values sorted to the end of each column
+    data = np.where(masks, np.inf, images)
+    data.sort(axis=0)
+    counts = images.shape[0] - np.sum(masks, axis=0)
+    low  = np.maximum(counts-1, 0)//2
+    high = np.maximum(counts, 1)//2
+    pix = np.arange(images.shape[1])
+    median = (data[low,pix] + data[high,pix])/2.
+    #- NaN sort after the masked values, and propagate as in np.ma.median
+    median[np.isnan(data[-1])] = np.nan
+    #- same as the data of a fully masked np.ma.median
+    median[counts==0] = 0.
+    return median
+
 def masked_median(images,masks=None) :
     '''
     Perfomes a median of an list of input images. If a list of mask is provided,
@@ -24,4 +57,134 @@ def masked_median(images,masks=None) :
         return np.median(images,axis=0)
     else :
         log.info("masked array median of %d images"%len(images))
-        return np.ma.median(np.ma.masked_array(data=images,mask=(masks!=0)),axis=0).data
+        images = np.asarray(images)
+        shape = images.shape[1:]
+        nimages = images.shape[0]
+        median = _masked_median(images.reshape(nimages, -1),
+                np.asarray(masks).reshape(nimages, -1))
+        return median.reshape(shape)
+
+class ImageStack :
+    '''
+    Stack of images of the same shape stored in a memory mapped scratch file,
+    with statistics over the stack computed one stripe of rows at a time.
+
+    Args:
+       nimages : number of images in the stack
+       shape : shape of each image
+
+    Options:
+       masks : if True, also store a boolean mask for each image
+       dtype : data type of the stored images
+       scratchdir : directory of the scratch files (default: system temp dir)
+
+    The scratch files are removed when the stack is closed. Usage::
+
+        with ImageStack(len(files), shape, masks=True) as stack :
+            for i, filename in enumerate(files) :
+                stack.set(i, image, mask)
+            median = stack.median(max_memory=2.)
+    '''
+    def __init__(self, nimages, shape, masks=False, dtype='f8', scratchdir=None) :
+        self.nimages = int(nimages)
+        self.shape = tuple(shape)
+        self._files = list()
+        self.data = self._scratch((self.nimages,)+self.shape, dtype, scratchdir)
+        if masks :
+            self.masks = self._scratch((self.nimages,)+self.shape, bool, scratchdir)
+        else :
+            self.masks = None
+
+    def _scratch(self, shape, dtype, scratchdir) :
+        if scratchdir is not None :
+            os.makedirs(scratchdir, exist_ok=True)
+        #- unlinked on creation; disk space is released when closed
+        fx = tempfile.TemporaryFile(dir=scratchdir)
+        self._files.append(fx)
+        return np.memmap(fx, dtype=dtype, mode='w+', shape=shape)
+
+    def __enter__(self) :
+        return self
+
+    def __exit__(self, *args) :
+        self.close()
+
+    def close(self) :
+        '''Release the scratch files'''
+        self.data = None
+        self.masks = None
+        for fx in self._files :
+            fx.close()
+        self._files = list()
+
+    def set(self, i, image, mask=None) :
+        '''
+        Store image (and mask if the stack has masks) at index i
+        '''
+        self.data[i] = image
+        if self.masks is not None :
+            self.masks[i] = (mask!=0)
+
+    def stripes(self, max_memory=2.0, nbuffers=4) :
+        '''
+        Generate slices of rows covering all the images
+
+        Options:
+           max_memory : memory budget in GB for the stack values of one stripe
+           nbuffers : number of copies of the stripe values assumed to be
+              in memory at once when computing statistics
+
+        Yields slice objects along the first image axis
+        '''
+        nrows = self.shape[0]
+        bytes_per_row = self.nimages * int(np.prod(self.shape[1:])) * self.data.itemsize
+        rows = max(1, int(max_memory*1024**3 / max(1, nbuffers*bytes_per_row)))
+        for r0 in range(0, nrows, rows) :
+            yield slice(r0, min(r0+rows, nrows))
+
+    def _read(self, rows) :
+        '''Stripe values and masks reshaped to [nimages, npix]'''
+        data = np.array(self.data[:, rows]).reshape(self.nimages, -1)
+        if self.masks is not None :
+            masks = np.array(self.masks[:, rows]).reshape(self.nimages, -1)
+        else :
+            masks = None
+        return data, masks
+
+    def median(self, max_memory=2.0) :
+        '''
+        Median image of the stack, ignoring masked pixels
+
+        Options:
+           max_memory : memory budget in GB
+
+        Returns median image, identical to masked_median(data, masks)
+        '''
+        median = np.zeros(self.shape)
+        for rows in self.stripes(max_memory) :
+            data, masks = self._read(rows)
+            median[rows] = _masked_median(data, masks).reshape(median[rows].shape)
+        return median
+
+    def clipped_mean(self, nsig=4., median=None, max_memory=2.0) :
+        '''
+        Mean image of the stack, excluding outliers from the median
+
+        Options:
+           nsig : pixels further than nsig*1.4826*MAD from the median image are excluded
+           median : precomputed median image; computed if None
+           max_memory : memory budget in GB
+
+        Returns (median, mean) images. Masks are used for the median only,
+        as in desispec.ccdcalib.
+        '''
+        if median is None :
+            median = self.median(max_memory)
+        mean = np.zeros(self.shape)
+        for rows in self.stripes(max_memory) :
+            data, _ = self._read(rows)
+            med = median[rows].ravel()
+            ares = np.abs(data-med)
+            mask = (ares<nsig*1.4826*np.median(ares,axis=0))
+            mean[rows] = (np.sum(data*mask,axis=0)/np.sum(mask,axis=0)).reshape(mean[rows].shape)
+        return median, mean
@@ -0,0 +1,334 @@
+"""
+desispec.metrics
+================
+
+Structured timing records of pipeline steps and file I/O, kept in a
+per-process in-memory buffer that can be written as JSON lines or a FITS
+table, gathered over MPI ranks, and exported in the Chrome trace event
+format (chrome://tracing or https://ui.perfetto.dev) to look at
+I/O vs. compute overlap and imbalance between ranks.
+
+Recording is off by default so that long-running processes don't grow
+the buffer; enable it with $DESI_METRICS=1 or ``set_context(enabled=True)``.
+Every `desispec.io.iotime.format` call then records a read or write; steps
+can be timed with::
+
+    from desispec import metrics
+
+    metrics.set_context(rank=comm.rank, enabled=True)
+    with metrics.timed('extract', camera='b0'):
+        ...
+
+    @metrics.timed_function('fit_stdstars')
+    def fit(...):
+        ...
+
+Each record is a dict with keys kind ('step', 'read' or 'write'), step,
+start (Unix time), duration (seconds), filename, nbytes, rank, camera,
+function, pid and thread.  Call `clear` after writing the records.
+"""
+
+import os
+import re
+import sys
+import json
+import time
+import functools
+import threading
+from contextlib import contextmanager
+
+_records = list()
+_context = dict(rank=0)
+_enabled = os.getenv('DESI_METRICS', '0') not in ('', '0')
+
+#- camera in DESI filenames, e.g. frame-b0-00012345.fits
+_camera_regex = re.compile(r'-([brz]\d)-')
+
+def set_context(enabled=None, **kwargs):
+    """
+    Set default values of record fields for this process, e.g. rank=comm.rank
+
+    Options:
+        enabled (bool): turn recording on or off; default unchanged
+    """
+    global _enabled
+    if enabled is not None:
+        _enabled = bool(enabled)
+    _context.update(kwargs)
+
+def is_enabled():
+    """Return True if records are added to the buffer of this process"""
+    return _enabled
+
+def get_records():
+    """Return the list of records of this process"""
+    return list(_records)
+
+def clear():
+    """Remove all records of this process"""
+    del _records[:]
+
+def _camera_from_filename(filename):
+    if filename is None:
+        return None
+    m = _camera_regex.search(os.path.basename(filename))
+    return m.group(1) if m is not None else None
+
+def record(step, duration, start=None, kind='step', filename=None,
+        nbytes=None, camera=None, function=None, **kwargs):
+    """
+    Add a record to the buffer of this process, if recording is enabled
+
+    Args:
+        step (str): name of the step or I/O operation
+        duration (float): duration in seconds
+
+    Options:
+        start (float): Unix start time; default now - duration
+        kind (str): 'step', 'read' or 'write'
+        filename (str): file that was read or written
+        nbytes (int): size of the file; default the size of filename
+        camera (str): camera, e.g. 'b0'; default parsed from filename
+        function (str): name of the function doing the step
+        kwargs: additional fields, overriding those of set_context
+
+    Returns the record dict, also when it is not added to the buffer
+    """
+    if start is None:
+        start = time.time() - duration
+    if filename is not None:
+        if nbytes is None and os.path.exists(filename):
+            nbytes = os.path.getsize(filename)
+        if camera is None:
+            camera = _camera_from_filename(filename)
+
+    rec = dict(kind=kind, step=step, start=float(start), duration=float(duration),
+            filename=filename, nbytes=nbytes, camera=camera, function=function,
+            pid=os.getpid(), thread=threading.get_native_id())
+    rec.update(_context)
+    rec.update(kwargs)
+    if _enabled:
+        _records.append(rec)
+    return rec
+
+def record_io(readwrite, filename, duration, function=None):
+    """
+    Record a file read or write of `duration` seconds that just finished
+
+    Called by desispec.io.iotime.format; function defaults to the name of
+    the function that called iotime.format.
+
+    Returns the record dict, or None if recording is disabled
+    """
+    if not _enabled:
+        return None
+    if function is None:
+        try:
+            function = sys._getframe(2).f_code.co_name
+        except ValueError:
+            function = 'unknown'
+    return record(function, duration, kind=readwrite,
+            filename=os.path.abspath(filename), function=function)
+
+@contextmanager
+def timed(step, **kwargs):
+    """
+    Context manager recording the duration of the enclosed block
+
+    Args:
+        step (str): name of the step
+
+    Options:
+        kwargs: additional record fields, e.g. camera or filename
+
+    The record is added even if the block raises an exception
+    """
+    start = time.time()
+    try:
+        yield
+    finally:
+        record(step, time.time()-start, start=start, **kwargs)
+
+def timed_function(step=None, **kwargs):
+    """
+    Decorator recording the duration of each call of a function
+
+    Options:
+        step (str): name of the step; default the function name
+        kwargs: additional record fields
+    """
+    def decorator(func):
+        name = func.__name__ if step is None else step
+        @functools.wraps(func)
+        def wrapper(*args, **kw):
+            with timed(name, function=func.__name__, **kwargs):
+                return func(*args, **kw)
+        return wrapper
+    return decorator
+
+def from_timer(timer, **kwargs):
+    """
+    Convert the finished timers of a desiutil.timer.Timer into step records
+
+    Args:
+        timer: desiutil.timer.Timer object
+
+    Options:
+        kwargs: additional record fields
+
+    Returns list of records; they are not added to the buffer
+    """
+    records = list()
+    for name, t in timer.timers.items():
+        if 'stop' not in t:
+            continue
+        rec = dict(kind='step', step=name, start=t['start'], duration=t['duration'],
+                filename=None, nbytes=None, camera=None, function=None,
+                pid=os.getpid(), thread=threading.get_native_id())
+        rec.update(_context)
+        rec.update(kwargs)
+        records.append(rec)
+    return records
+
+def gather(comm, records=None, root=0):
+    """
+    Gather records of all MPI ranks
+
+    Args:
+        comm: MPI communicator, or None for a single process
+
+    Options:
+        records: list of records of this rank; default get_records()
+        root: rank receiving the records
+
+    Returns list of the records of all ranks on root, None on other ranks
+    """
+    if records is None:
+        records = get_records()
+    if comm is None:
+        return records
+    allrecords = comm.gather(records, root=root)
+    if comm.rank == root:
+        return [rec for records in allrecords for rec in records]
+    else:
+        return None
+
+def _json_default(value):
+    """Convert numpy scalars and other objects for json.dumps"""
+    if hasattr(value, 'item'):
+        return value.item()
+    else:
+        return str(value)
+
+def write_jsonl(filename, records=None, append=True):
+    """
+    Write records as JSON lines, one record per line
+
+    Args:
+        filename (str): output file
+
+    Options:
+        records: list of records; default get_records()
+        append (bool): append to filename if it already exists
+    """
+    if records is None:
+        records = get_records()
+    with open(filename, 'a' if append else 'w') as fx:
+        for rec in records:
+            fx.write(json.dumps(rec, default=_json_default) + '\n')
+
+def read_jsonl(filenames):
+    """
+    Read records from one or more JSON lines files
+
+    Returns list of records
+    """
+    if isinstance(filenames, str):
+        filenames = [filenames,]
+    records = list()
+    for filename in filenames:
+        with open(filename) as fx:
+            for line in fx:
+                line = line.strip()
+                if line != '':
+                    records.append(json.loads(line))
+    return records
+
+def to_table(records=None):
+    """
+    Return an astropy Table of records, e.g. to write as a FITS table
+
+    Missing values are replaced by '' for strings and -1 for numbers
+    """
+    from astropy.table import Table
+    if records is None:
+        records = get_records()
+    columns = ['kind', 'step', 'start', 'duration', 'filename', 'nbytes',
+               'rank', 'camera', 'function', 'pid', 'thread']
+    for rec in records:
+        for key in rec:
+            if key not in columns:
+                columns.append(key)
+
+    table = Table()
+    for col in columns:
+        values = [rec.get(col) for rec in records]
+        known = [v for v in values if v is not None]
+        if len(known) > 0 and all([isinstance(v, (int, float)) and not isinstance(v, bool) for v in known]):
+            missing = -1
+        else:
+            missing = ''
+            values = [v if v is None else str(v) for v in values]
+        table[col.upper()] = [missing if v is None else v for v in values]
+
+    return table
+
+def to_chrome_trace(records=None):
+    """
+    Return dict of records in the Chrome trace event format
+
+    Each process is a trace process labelled with its rank, and each
+    thread a trace thread, so that background writes show up separately.
+    """
+    if records is None:
+        records = get_records()
+
+    events = list()
+    processes = dict()
+    for rec in records:
+        pid = rec.get('pid', 0)
+        processes[pid] = rec.get('rank', 0)
+        args = {key:rec[key] for key in ('filename', 'nbytes', 'camera', 'function')
+                if rec.get(key) is not None}
+        events.append(dict(name=rec['step'], cat=rec.get('kind', 'step'), ph='X',
+                ts=rec['start']*1e6, dur=rec['duration']*1e6,
+                pid=pid, tid=rec.get('thread', 0), args=args))
+
+    for pid, rank in processes.items():
+        events.append(dict(name='process_name', ph='M', pid=pid,
+                args=dict(name='rank {} (pid {})'.format(rank, pid))))
+        events.append(dict(name='process_sort_index', ph='M', pid=pid,
+                args=dict(sort_index=rank)))
+
+    return dict(traceEvents=events, displayTimeUnit='ms')
+
+def write_chrome_trace(filename, records=None):
+    """Write records to filename in the Chrome trace event (json) format"""
+    with open(filename, 'w') as fx:
+        json.dump(to_chrome_trace(records), fx, default=_json_default)
+
+#-----
+#- for convenience, optionally use this as a script to combine the records
+#- of many jobs, e.g. of a whole night, into a single trace
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(
+            description='combine JSON lines timing records into a Chrome trace')
+    parser.add_argument("-i", "--infiles", type=str, nargs="+", required=True,
+                        help="input JSON lines files")
+    parser.add_argument("-o", "--outfile", type=str, required=True,
+                        help="output trace json file")
+
+    args = parser.parse_args()
+    write_chrome_trace(args.outfile, read_jsonl(args.infiles))
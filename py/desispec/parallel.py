@@ -330,21 +330,89 @@ def weighted_partition(weights, n, groups_per_node=None):
     if groups_per_node is None:
         return groups
     else:
-        distributed_groups = [None,] * len(groups)
-        num_nodes = (n + groups_per_node - 1) // groups_per_node
-        i = 0
-        for noderank in range(groups_per_node):
-            for inode in range(num_nodes):
-                j = inode*groups_per_node + noderank
-                if i < n and j < n:
-                    distributed_groups[j] = groups[i]
-                    i += 1
-
-        #- do a final check that all groups were assigned
-        for i in range(len(distributed_groups)):
-            assert distributed_groups[i] is not None, 'group {} not set'.format(i)
-
-        return distributed_groups
+        return _spread_groups(groups, groups_per_node)
+
+def _spread_groups(groups, groups_per_node):
+    '''
+    Reorder `groups` (sorted from largest to smallest) so that consecutive
+    groups go to different nodes of `groups_per_node` groups each
+    '''
+    n = len(groups)
+    distributed_groups = [None,] * n
+    num_nodes = (n + groups_per_node - 1) // groups_per_node
+    i = 0
+    for noderank in range(groups_per_node):
+        for inode in range(num_nodes):
+            j = inode*groups_per_node + noderank
+            if i < n and j < n:
+                distributed_groups[j] = groups[i]
+                i += 1
+
+    #- do a final check that all groups were assigned
+    for i in range(len(distributed_groups)):
+        assert distributed_groups[i] is not None, 'group {} not set'.format(i)
+
+    return distributed_groups
+
+def karmarkar_karp_partition(weights, n, groups_per_node=None):
+    '''
+    Partition `weights` into `n` groups with approximately same sum(weights)
+    using the Karmarkar-Karp largest differencing method
+
+    Args:
+        weights: array-like weights
+        n: number of groups
+
+    Options:
+        groups_per_node: spread the largest groups over nodes of this many
+            groups, as in `weighted_partition`
+
+    Returns list of lists of indices of weights for each group
+
+    Notes:
+        Each item starts as a partial partition with the item in one group
+        and n-1 empty groups.  The two partial partitions with the largest
+        spread (max-min group sum) are repeatedly merged by combining the
+        largest group of one with the smallest group of the other.  This
+        usually balances better than `weighted_partition` (greedy longest
+        processing time first) when there are few items per group.
+    '''
+    import heapq
+    weights = np.asarray(weights, dtype=float)
+
+    #- heap of (-spread, counter, sums, groups) with sums sorted descending
+    heap = list()
+    for i in range(len(weights)):
+        sums = np.zeros(n)
+        sums[0] = weights[i]
+        groups = [[i,],] + [list() for j in range(n-1)]
+        heap.append((-weights[i], i, sums, groups))
+    heapq.heapify(heap)
+
+    counter = len(weights)
+    while len(heap) > 1:
+        _, _, sums1, groups1 = heapq.heappop(heap)
+        _, _, sums2, groups2 = heapq.heappop(heap)
+        #- largest of one with smallest of the other
+        sums = sums1 + sums2[::-1]
+        groups = [g1 + g2 for g1, g2 in zip(groups1, groups2[::-1])]
+        order = np.argsort(-sums, kind='stable')
+        sums = sums[order]
+        groups = [groups[j] for j in order]
+        heapq.heappush(heap, (-(sums[0]-sums[-1]), counter, sums, groups))
+        counter += 1
+
+    if len(heap) == 0:
+        groups = [list() for j in range(n)]
+    else:
+        groups = [sorted(g) for g in heap[0][3]]
+
+    assert len(groups) == n
+
+    if groups_per_node is None:
+        return groups
+    else:
+        return _spread_groups(groups, groups_per_node)
 
 @contextmanager
 def stdouterr_redirected(to=None, comm=None):
@@ -536,3 +604,146 @@ def take_turns(comm, at_a_time, func, *args, **kwargs):
         comm_group.barrier()
 
     return ret
+
+
+class SharedCounter(object):
+    """
+    Counter shared by all processes of a communicator.
+
+    The counter lives in an MPI one-sided communication (RMA) window on
+    rank 0 and is incremented with an atomic fetch-and-add, so that any
+    process can take the next value without the other processes taking
+    part.  Creating and freeing the counter are collective operations.
+
+    Args:
+        comm:  mpi4py.MPI.Comm or None for a process-local counter.
+
+    Options:
+        start (int): the first value returned by `next`.
+    """
+    def __init__(self, comm, start=0):
+        self.comm = comm
+        self._value = start
+        self._win = None
+        if comm is not None and comm.size > 1:
+            import mpi4py.MPI as MPI
+            itemsize = MPI.INT64_T.Get_size()
+            nbytes = itemsize if comm.rank == 0 else 0
+            self._win = MPI.Win.Allocate(nbytes, itemsize, comm=comm)
+            if comm.rank == 0:
+                self._win.Lock(0, MPI.LOCK_EXCLUSIVE)
+                self._win.Put([np.array([start], dtype=np.int64), MPI.INT64_T], 0)
+                self._win.Unlock(0)
+            comm.barrier()
+
+    def next(self, increment=1):
+        """Return the current value and add `increment` to the counter"""
+        if self._win is None:
+            value = self._value
+            self._value += increment
+            return value
+
+        import mpi4py.MPI as MPI
+        value = np.zeros(1, dtype=np.int64)
+        self._win.Lock(0, MPI.LOCK_SHARED)
+        self._win.Fetch_and_op([np.array([increment], dtype=np.int64), MPI.INT64_T],
+                               [value, MPI.INT64_T], 0, 0, MPI.SUM)
+        self._win.Unlock(0)
+        return int(value[0])
+
+    def free(self):
+        """Free the MPI window; collective over the communicator"""
+        if self._win is not None:
+            self._win.Free()
+            self._win = None
+
+
+def _abort_on_uncaught_exception(comm):
+    """
+    Make an uncaught exception abort all the processes of comm, after
+    printing its traceback, instead of leaving them waiting for this one
+    """
+    hook = sys.excepthook
+    def excepthook(exc_type, exc_value, exc_traceback):
+        hook(exc_type, exc_value, exc_traceback)
+        sys.stdout.flush()
+        sys.stderr.flush()
+        comm.Abort(1)
+
+    sys.excepthook = excepthook
+
+
+def dynamic_range(n, comm=None, schedule='dynamic', step=None, names=None):
+    """
+    Iterate over the indices of `n` items shared by the processes of `comm`.
+
+    With schedule='dynamic' each process takes the next item from a
+    `SharedCounter` when it has finished its previous item, so that slow
+    items do not leave the other processes idle.  With schedule='static',
+    or if MPI one-sided communication is not available, process `rank`
+    takes items rank, rank+size, rank+2*size...  All processes of comm must
+    iterate until the end since the counter is created and freed
+    collectively.  If a process leaves the loop early, e.g. because of an
+    exception in the loop body, the counter is not freed and an uncaught
+    exception aborts all the processes of comm, since the others would
+    otherwise wait for this one until the job is killed.
+
+    Args:
+        n (int): number of items
+        comm:  mpi4py.MPI.Comm or None to iterate over all items.
+
+    Options:
+        schedule (str): 'dynamic' or 'static'
+        step (str): if not None, record the duration of each item with
+            `desispec.metrics` under this step name
+        names (list): names of the items for the metrics records
+
+    Yields:
+        item indices
+    """
+    from . import metrics
+
+    if comm is None:
+        rank, size = 0, 1
+    else:
+        rank, size = comm.rank, comm.size
+
+    counter = None
+    if schedule == 'dynamic' and size > 1:
+        try:
+            counter = SharedCounter(comm)
+        except (ImportError, NotImplementedError, AttributeError) as err:
+            if rank == 0:
+                log = get_logger()
+                log.warning('Dynamic scheduling unavailable ({}); using static'.format(err))
+    elif schedule not in ('dynamic', 'static'):
+        raise ValueError("Unknown schedule '{}'".format(schedule))
+
+    if counter is None:
+        indices = iter(range(rank, n, size))
+        nextindex = lambda : next(indices, n)
+    else:
+        nextindex = counter.next
+
+    completed = False
+    i = None
+    try:
+        i = nextindex()
+        while i < n:
+            start = time.time()
+            yield i
+            if step is not None:
+                task = names[i] if names is not None else i
+                metrics.record(step, time.time()-start, start=start, task=task)
+            i = nextindex()
+        completed = True
+    finally:
+        if counter is not None:
+            if completed:
+                counter.free()
+            else:
+                #- no collective call: the other processes may never get here
+                item = names[i] if (names is not None and i is not None) else i
+                get_logger().error('Rank {} left the loop{} at item {} before '
+                    'the end'.format(rank, '' if step is None else ' of '+step, item))
+                _abort_on_uncaught_exception(comm)
@@ -0,0 +1,383 @@
+#
+# See top-level LICENSE.rst file for Copyright information
+#
+# -*- coding: utf-8 -*-
+"""
+desispec.pipeline.costmodel
+===========================
+
+Runtime cost model of pipeline tasks, fitted from the durations of tasks
+that have already run, and a replay of past tasks to predict the makespan
+of a job for different node counts.
+
+`desispec.pipeline.run.run_task` records the duration of every task with
+`desispec.metrics` (kind 'task'), together with the features returned by
+`task_features` (exposure time of the raw data, number of spectra of a
+healpix pixel); if ``$DESI_PIPE_TASK_TIMES`` is set these records are
+appended to that JSON lines file.  A model is then fitted with::
+
+    from desispec import metrics
+    from desispec.pipeline.costmodel import TaskCostModel
+
+    records = metrics.read_jsonl('tasktimes.jsonl')
+    model = TaskCostModel.fit(records)
+    model.write('costmodel.yaml')
+
+and used by `desispec.pipeline.run.run_dist` to balance workers when
+``$DESI_PIPE_RUN_COSTMODEL`` points to the model file.
+"""
+
+from __future__ import absolute_import, division, print_function
+
+import numpy as np
+
+from desiutil.log import get_logger
+
+from ..parallel import weighted_partition, karmarkar_karp_partition
+
+from .prod import yaml_read, yaml_write
+
+#- Per-task quantities which may be used as linear terms of the model
+features = ('nspec', 'exptime')
+
+
+def task_band(name):
+    """Return the camera band ('b', 'r' or 'z') of a task name, or None"""
+    for field in name.split('_')[1:]:
+        if field in ('b', 'r', 'z'):
+            return field
+    return None
+
+
+#- exposure time of each (night, expid), read once per process
+_exptime_cache = dict()
+
+def _raw_exptime(night, expid):
+    """Return EXPTIME of the raw data file of night, expid, or None"""
+    key = (int(night), int(expid))
+    if key not in _exptime_cache:
+        import fitsio
+        from .. import io
+        exptime = None
+        try:
+            rawfile = io.findfile('raw', night=key[0], expid=key[1])
+            with fitsio.FITS(rawfile) as fx:
+                #- EXPTIME is typically in HDU 1 ('SPEC') since HDU 0 is empty
+                for hdu in fx:
+                    header = hdu.read_header()
+                    if 'EXPTIME' in header:
+                        exptime = float(header['EXPTIME'])
+                        break
+        except (OSError, IOError, ValueError, KeyError):
+            pass
+        _exptime_cache[key] = exptime
+
+    return _exptime_cache[key]
+
+
+def task_features(name, db=None):
+    """Return the cost model features of a task
+
+    Args:
+        name (str): the task name.
+
+    Options:
+        db (DataBase): used to count the spectra of healpix pixel tasks.
+
+    Returns:
+        dict: with exptime (seconds, from the raw data header) for tasks
+            of an exposure, and nspec (number of spectra, from the
+            healpix_frame table of db) for tasks of a healpix pixel;
+            features which are not available are not included.
+    """
+    from .tasks.base import task_classes, task_type
+    props = task_classes[task_type(name)].name_split(name)
+    result = dict()
+    if 'night' in props and 'expid' in props:
+        exptime = _raw_exptime(props['night'], props['expid'])
+        if exptime is not None:
+            result['exptime'] = exptime
+    if 'nside' in props and 'pixel' in props and db is not None:
+        frames = db.select_healpix_frame(dict(nside=props['nside'],
+                                              pixel=props['pixel']))
+        if len(frames) > 0:
+            result['nspec'] = int(np.sum([f['ntargets'] for f in frames]))
+
+    return result
+
+
+def task_records(records):
+    """Return the successful task records from a list of metrics records
+
+    Args:
+        records: list of `desispec.metrics` record dicts
+
+    Returns list of records with kind 'task' which did not fail
+    """
+    return [rec for rec in records
+            if rec.get('kind') == 'task' and not rec.get('failed', False)]
+
+
+class TaskCostModel(object):
+    """Predict the runtime of pipeline tasks from past task durations.
+
+    For each task type and camera band, the runtime in process-minutes
+    (duration times number of processes) is modelled as a linear function
+    of the per-task features (number of spectra, exposure time) when they
+    were recorded, and as the mean runtime otherwise.  Tasks of a type
+    which has no records fall back to the static estimate of
+    `desispec.pipeline.tasks.base.BaseTask.run_time`.
+
+    Args:
+        terms (dict): for each key 'tasktype' or 'tasktype:band', a dict with
+            the intercept, the slopes and means of the features, and the
+            number of samples nsamp.
+    """
+
+    def __init__(self, terms=None):
+        self.terms = dict() if terms is None else dict(terms)
+
+    @staticmethod
+    def _key(tasktype, band=None):
+        return tasktype if band is None else '{}:{}'.format(tasktype, band)
+
+    @classmethod
+    def fit(cls, records, min_samples=3):
+        """Fit a model from task duration records.
+
+        Args:
+            records: list of record dicts with at least step (the task
+                type) and duration (seconds); optional fields are task (the
+                task name), procs, camera, nspec and exptime.
+
+        Options:
+            min_samples (int): minimum number of records to fit the slopes
+                of the features; with fewer, only the mean is used.
+
+        Returns:
+            TaskCostModel
+        """
+        log = get_logger()
+        samples = dict()
+        for rec in task_records(records):
+            tasktype = rec['step']
+            band = None
+            if rec.get('camera'):
+                band = rec['camera'][0]
+            elif rec.get('task'):
+                band = task_band(rec['task'])
+            procminutes = rec['duration'] / 60.0 * rec.get('procs', 1)
+            for key in set([cls._key(tasktype), cls._key(tasktype, band)]):
+                samples.setdefault(key, list()).append((procminutes, rec))
+
+        terms = dict()
+        for key, values in samples.items():
+            y = np.array([v[0] for v in values])
+            used = [f for f in features
+                    if all([v[1].get(f) is not None for v in values])]
+            X = np.array([[float(v[1][f]) for f in used] for v in values])
+            X = X.reshape(len(values), len(used))
+            means = X.mean(axis=0) if len(values) > 0 else np.zeros(len(used))
+            #- only fit features which vary, with enough samples
+            used_fit = [i for i in range(len(used)) if np.ptp(X[:, i]) > 0]
+            slopes = np.zeros(len(used))
+            if len(used_fit) > 0 and len(values) >= max(min_samples, len(used_fit)+1):
+                A = np.hstack([np.ones((len(values), 1)),
+                               X[:, used_fit] - means[used_fit]])
+                coeff = np.linalg.lstsq(A, y, rcond=None)[0]
+                slopes[used_fit] = coeff[1:]
+            terms[key] = dict(
+                intercept=float(np.mean(y)),
+                slopes={f:float(s) for f, s in zip(used, slopes)},
+                means={f:float(m) for f, m in zip(used, means)},
+                minimum=float(np.min(y)),
+                nsamp=len(values))
+            log.debug('cost model {}: {:.2f} proc-minutes from {} tasks'.format(
+                key, terms[key]['intercept'], len(values)))
+
+        return cls(terms)
+
+    def has_tasktype(self, tasktype):
+        """Return True if the model has records of tasktype"""
+        return tasktype in self.terms
+
+    def predict(self, name, procs, db=None, **kwargs):
+        """Predict the runtime of a task.
+
+        Args:
+            name (str): the task name.
+            procs (int): the number of processes running the task.
+
+        Options:
+            db (DataBase): passed to the fallback run_time estimate.
+            kwargs: feature values, e.g. nspec or exptime; missing features
+                are replaced by their mean over the fitted tasks.
+
+        Returns:
+            float: the runtime in minutes.
+        """
+        from .tasks.base import task_type
+        tasktype = task_type(name)
+        band = task_band(name)
+        term = self.terms.get(self._key(tasktype, band))
+        if term is None:
+            term = self.terms.get(self._key(tasktype))
+        if term is None:
+            from .tasks.base import task_classes
+            return task_classes[tasktype].run_time(name, procs, db=db)
+
+        procminutes = term['intercept']
+        for f, slope in term['slopes'].items():
+            if kwargs.get(f) is not None:
+                procminutes += slope * (float(kwargs[f]) - term['means'][f])
+        #- a linear extrapolation should never predict (nearly) free tasks
+        procminutes = max(procminutes, 0.5*term['minimum'])
+        return procminutes / procs
+
+    def write(self, filename):
+        """Write the model to a yaml file"""
+        yaml_write(filename, self.terms)
+
+    @classmethod
+    def read(cls, filename):
+        """Read a model written by `TaskCostModel.write`"""
+        return cls(yaml_read(filename))
+
+
+def partition(weights, nworker, method='lpt', groups_per_node=None):
+    """Partition task weights over workers.
+
+    Args:
+        weights: array-like task runtimes
+        nworker (int): number of workers
+
+    Options:
+        method (str): 'lpt' (longest processing time first) or 'kk'
+            (Karmarkar-Karp largest differencing)
+        groups_per_node (int): workers per node, to spread the largest
+            workers over nodes
+
+    Returns list of lists of indices of weights for each worker
+    """
+    if method == 'lpt':
+        return weighted_partition(weights, nworker,
+                                  groups_per_node=groups_per_node)
+    elif method == 'kk':
+        return karmarkar_karp_partition(weights, nworker,
+                                        groups_per_node=groups_per_node)
+    else:
+        raise ValueError("Unknown partition method '{}'".format(method))
+
+
+def simulate_makespan(records, node_counts, procs_per_node, model=None,
+                      method='lpt', worker_size=None, startup=0.0):
+    """Replay recorded tasks to predict the makespan for several node counts.
+
+    The task types are run one after the other, in the order in which they
+    were first started, as in a desi_pipe chain of jobs.  For each task
+    type the tasks are partitioned over the workers using the runtimes
+    predicted by `model` (or the recorded runtimes if model is None),
+    and each worker then takes the recorded runtime of its tasks, scaled
+    to the worker size; the makespan is the sum over the task types of
+    the slowest worker.
+
+    Args:
+        records: list of task records, see `TaskCostModel.fit`
+        node_counts: list of numbers of nodes
+        procs_per_node (int): processes per node
+
+    Options:
+        model (TaskCostModel): model used to partition the tasks
+        method (str): partition method 'lpt' or 'kk'
+        worker_size (dict): processes per worker for each task type;
+            default the most common number of processes of the records
+        startup (float): startup overhead in minutes for each worker
+
+    Returns:
+        dict: for each node count, a dict with the makespan in minutes, the
+            makespan of each task type and the imbalance (slowest/mean
+            worker time) of each task type.
+    """
+    tasks = task_records(records)
+    tasktypes = list()
+    for rec in sorted(tasks, key=lambda r: r.get('start', 0.0)):
+        if rec['step'] not in tasktypes:
+            tasktypes.append(rec['step'])
+
+    results = dict()
+    for nodes in node_counts:
+        nproc = nodes * procs_per_node
+        result = dict(makespan=0.0, tasktypes=dict(), imbalance=dict())
+        for tasktype in tasktypes:
+            trecs = [r for r in tasks if r['step'] == tasktype]
+            if worker_size is not None and tasktype in worker_size:
+                wsize = worker_size[tasktype]
+            else:
+                procs, counts = np.unique([r.get('procs', 1) for r in trecs],
+                                          return_counts=True)
+                wsize = int(procs[np.argmax(counts)])
+            wsize = min(wsize, nproc)
+            nworker = min(max(nproc // wsize, 1), len(trecs))
+
+            actual = np.array([r['duration'] / 60.0 * r.get('procs', 1) / wsize
+                               for r in trecs])
+            if model is None:
+                weights = actual
+            else:
+                weights = np.array([model.predict(r['task'], wsize,
+                    **{f:r.get(f) for f in features}) for r in trecs])
+
+            dist = partition(weights, nworker, method=method,
+                             groups_per_node=max(procs_per_node // wsize, 1))
+            workertimes = np.array([startup + np.sum(actual[ii]) for ii in dist])
+            result['tasktypes'][tasktype] = float(np.max(workertimes))
+            result['imbalance'][tasktype] = float(
+                np.max(workertimes) / np.mean(workertimes))
+            result['makespan'] += result['tasktypes'][tasktype]
+        results[nodes] = result
+
+    return results
+
+
+#-----
+#- for convenience, optionally use this as a script to fit a model or to
+#- replay the tasks of a night, e.g.
+#-   python -m desispec.pipeline.costmodel -i tasktimes.jsonl --fit model.yaml
+#-   python -m desispec.pipeline.costmodel -i tasktimes.jsonl --nodes 1 2 4 8
+if __name__ == '__main__':
+    import argparse
+    from .. import metrics
+
+    parser = argparse.ArgumentParser(
+            description='fit a task cost model or replay recorded tasks')
+    parser.add_argument("-i", "--infiles", type=str, nargs="+", required=True,
+                        help="input JSON lines files of task records")
+    parser.add_argument("--fit", type=str, default=None,
+                        help="output yaml model file")
+    parser.add_argument("--model", type=str, default=None,
+                        help="yaml model file used to partition the replayed tasks")
+    parser.add_argument("--nodes", type=int, nargs="+", default=None,
+                        help="node counts for which to replay the tasks")
+    parser.add_argument("--procs-per-node", type=int, default=32,
+                        help="processes per node")
+    parser.add_argument("--method", type=str, default='lpt',
+                        choices=['lpt', 'kk'], help="partition method")
+
+    args = parser.parse_args()
+    records = metrics.read_jsonl(args.infiles)
+    model = None
+    if args.fit is not None:
+        model = TaskCostModel.fit(records)
+        model.write(args.fit)
+    if args.model is not None:
+        model = TaskCostModel.read(args.model)
+    if args.nodes is not None:
+        results = simulate_makespan(records, args.nodes, args.procs_per_node,
+                                    model=model, method=args.method)
+        for nodes in args.nodes:
+            res = results[nodes]
+            print('{:5d} nodes: makespan {:8.1f} min'.format(
+                nodes, res['makespan']))
+            for tasktype, minutes in res['tasktypes'].items():
+                print('      {:16s} {:8.1f} min  imbalance {:.2f}'.format(
+                    tasktype, minutes, res['imbalance'][tasktype]))
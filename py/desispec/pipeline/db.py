@@ -372,11 +372,60 @@ def check_tasks(tasklist, db=None, inputs=None):
 class DataBase:
     """Class for tracking pipeline processing objects and state.
     """
+    #: placeholder for bound parameters in SQL commands of this backend
+    _param = "?"
+
     def __init__(self):
         self._conn = None
         return
 
 
+    def _load_names(self, cur, names):
+        """Load a set of task names into the temporary table pipe_names.
+
+        This is used to join a large set of names with a task table,
+        instead of building a huge "where name in (...)" command.
+
+        Args:
+            cur (DB cursor): an open cursor.
+            names (list): list of task names.
+
+        """
+        cur.execute("create temporary table if not exists pipe_names "
+            "(name text primary key)")
+        cur.execute("delete from pipe_names")
+        cur.executemany("insert into pipe_names (name) values ({})"\
+            .format(self._param), [ (x, ) for x in set(names) ])
+        return
+
+
+    def create_indexes(self):
+        """Create the indexes used by the state queries, if they do not exist.
+
+        Task tables with a night column are indexed on (night, state),
+        spectra and redshift tables and the healpix_frame table on
+        (nside, pixel).
+        """
+        from .tasks.base import task_classes
+        with self.cursor() as cur:
+            for tt, tc in task_classes.items():
+                if "night" in tc._cols:
+                    cur.execute("create index if not exists {0}_night_state "
+                        "on {0} (night, state)".format(tt))
+                if "pixel" in tc._cols:
+                    cur.execute("create index if not exists {0}_nside_pixel "
+                        "on {0} (nside, pixel)".format(tt))
+                    cur.execute("create index if not exists {0}_pixel_state "
+                        "on {0} (pixel, state)".format(tt))
+            cur.execute("create index if not exists healpix_frame_nside_pixel "
+                "on healpix_frame (nside, pixel)")
+            cur.execute("create index if not exists healpix_frame_pixel_state "
+                "on healpix_frame (pixel, state)")
+            cur.execute("create index if not exists healpix_frame_night "
+                "on healpix_frame (night)")
+        return
+
+
     def get_states_type(self, tasktype, tasks):
         """Efficiently get the state of many tasks of a single type.
 
@@ -389,16 +438,16 @@ class DataBase:
 
         """
         states = None
-        namelist = ",".join([ "'{}'".format(x) for x in tasks ])
 
         log = get_logger()
         log.debug("opening db")
 
         with self.cursor() as cur:
             log.debug("selecting in db")
+            self._load_names(cur, tasks)
             cur.execute(\
-                'select name, state from {} where name in ({})'.format(tasktype,
-                namelist))
+                'select t.name, t.state from {} t join pipe_names n on t.name = n.name'\
+                .format(tasktype))
             st = cur.fetchall()
             log.debug("done")
             states = { x[0] : task_int_to_state[x[1]] for x in st }
@@ -468,10 +517,14 @@ class DataBase:
 
         with self.cursor() as cur:
             log.debug("updating in db")
-            for tsk in tasks:
-                cur.execute("update {} set state = {} where name = '{}'".format(tasktype, task_state_to_int[tsk[1]], tsk[0]))
-                if postprocessing and tsk[1]=="done" :
-                    task_classes[tasktype].postprocessing(db=self,name=tsk[0],cur=cur)
+            cur.executemany("update {} set state = {} where name = {}"\
+                .format(tasktype, self._param, self._param),
+                [ (task_state_to_int[tsk[1]], tsk[0]) for tsk in tasks ])
+            if postprocessing:
+                for tsk in tasks:
+                    if tsk[1] == "done":
+                        task_classes[tasktype].postprocessing(db=self,
+                            name=tsk[0], cur=cur)
             log.debug("done")
         return
 
@@ -527,10 +580,10 @@ class DataBase:
         for t, tlist in taskbytype.items():
             if (t == "spectra") or (t == "redshift"):
                 raise RuntimeError("spectra and redshift tasks do not have submitted flag.")
-            namelist = ",".join([ "'{}'".format(x) for x in tlist ])
             with self.cursor() as cur:
+                self._load_names(cur, tlist)
                 cur.execute(\
-                    'select name, submitted from {} where name in ({})'.format(t, namelist))
+                    'select t.name, t.submitted from {} t join pipe_names n on t.name = n.name'.format(t))
                 sb = cur.fetchall()
                 submitted.update({ x[0] : x[1] for x in sb })
         return submitted
@@ -553,8 +606,8 @@ class DataBase:
         if unset:
             val = 0
         with self.cursor() as cur:
-            for tsk in tasks:
-                cur.execute("update {} set submitted = {} where name = '{}'".format(tasktype, val, tsk))
+            cur.executemany("update {} set submitted = {} where name = {}"\
+                .format(tasktype, val, self._param), [ (x, ) for x in tasks ])
         return
 
 
@@ -578,7 +631,7 @@ class DataBase:
         for t, tlist in taskbytype.items():
             if (t == "spectra") or (t == "redshift"):
                 raise RuntimeError("spectra and redshift tasks do not have submitted flag.")
-            self.set_submitted_type(tlist, unset=unset)
+            self.set_submitted_type(t, tlist, unset=unset)
         return
 
 
@@ -604,20 +657,23 @@ class DataBase:
         with self.cursor() as cur:
             # insert or ignore all healpix_frames
             log.debug("updating healpix_frame ...")
+            cur.execute("select expid, spec, nside, pixel from healpix_frame")
+            have_rows = set(cur.fetchall())
+            newrows = list()
             for entry in healpix_frames:
-                # see if we already have this entry
-                cmd = "select exists(select 1 from healpix_frame where (expid = {} and spec = {} and nside = {} and pixel = {} ))".format(entry["expid"], entry["spec"], entry["nside"], entry["pixel"])
-                cur.execute(cmd)
-                have_row = cur.fetchone()[0]
-
-                if not have_row:
-                    cur.execute("insert into healpix_frame (night,expid,spec,nside,pixel,ntargets,state) values({},{},{},{},{},{},{})".format(entry["night"],entry["expid"],entry["spec"],entry["nside"],entry["pixel"],entry["ntargets"],0))
+                key = (entry["expid"], entry["spec"], entry["nside"],
+                    entry["pixel"])
+                if key not in have_rows:
+                    have_rows.add(key)
+                    newrows.append(tuple([ int(entry[k]) for k in ["night",
+                        "expid", "spec", "nside", "pixel", "ntargets"] ]) + (0,))
+            cur.executemany("insert into healpix_frame (night,expid,spec,nside,pixel,ntargets,state) values({})".format(",".join([self._param,]*7)), newrows)
 
             # read what is already in db
             tasks_in_db = {}
             for tt in all_task_types():
                 cur.execute("select name from {}".format(tt))
-                tasks_in_db[tt] = [ x for (x, ) in cur.fetchall()]
+                tasks_in_db[tt] = set([ x for (x, ) in cur.fetchall()])
 
             for tt in all_task_types():
                 log.debug("updating {} ...".format(tt))
@@ -698,71 +754,59 @@ class DataBase:
                     red_exists[row["pixel"]] = False
                     break
 
-        # Now use all this info.  Some internal helpers to avoid code
-        # duplication
-        def set_hpx_frame_0(row, spec, red, cur):
-            self.update_healpix_frame_state(row, 0, cur)
-            task_classes["spectra"].state_set(
-                self, spec, "waiting", cur)
-            task_classes["redshift"].state_set(
-                self, red, "waiting", cur)
-            return
-
-        def set_hpx_frame_1(row, spec, red, cur):
-            self.update_healpix_frame_state(row, 1, cur)
-            # getready() will do this for us:
-            #task_classes["spectra"].state_set(
-            #    self, spec, "ready", cur)
-            task_classes["redshift"].state_set(
-                self, red, "waiting", cur)
-            return
-
-        def set_hpx_frame_2(row, spec, red, cur):
-            self.update_healpix_frame_state(row, 2, cur)
-            task_classes["spectra"].state_set(
-                self, spec, "done", cur)
-            # getready() will do this:
-            #task_classes["redshift"].state_set(
-            #    self, red, "ready", cur)
-            return
-
-        def set_hpx_frame_3(row, spec, red, cur):
-            self.update_healpix_frame_state(row, 3, cur)
-            task_classes["spectra"].state_set(
-                self, spec, "done", cur)
-            task_classes["redshift"].state_set(
-                self, red, "done", cur)
-            return
+        # Now use all this info.  Collect the new healpix_frame state of each
+        # row and the new states of the spectra and redshift tasks, then
+        # update them in bulk:
+        #   0: the cframes do not exist, spectra and redshift are waiting
+        #   1: the cframes exist, redshift is waiting (getready() will set
+        #      spectra to ready)
+        #   2: the spectra exist and are done (getready() will set redshift
+        #      to ready)
+        #   3: the spectra and redshifts are done
+        hpx_states = list()
+        pixtask_states = { "spectra" : list(), "redshift" : list() }
+        for row in pixrows:
+            cfdone = True
+            cfprops = row.copy()
+            for band in ["b", "r", "z"]:
+                cfprops["band"] = band
+                cf_name = task_classes["cframe"].name_join(cfprops)
+                if cfstates[cf_name] != "done":
+                    cfdone = False
 
-        with self.cursor() as cur:
-            for row in pixrows:
-                cfdone = True
-                cfprops = row.copy()
-                for band in ["b", "r", "z"]:
-                    cfprops["band"] = band
-                    cf_name = task_classes["cframe"].name_join(cfprops)
-                    if cfstates[cf_name] != "done":
-                        cfdone = False
-
-                spec_name = task_classes["spectra"].name_join(row)
-                red_name = task_classes["redshift"].name_join(row)
-
-                if (not cfdone) and (not specdone) :
-                    # The cframes do not exist, so reset the state of the
-                    # spectra and redshift tasks.
-                    set_hpx_frame_0(row, spec_name, red_name, cur)
+            spec_name = task_classes["spectra"].name_join(row)
+            red_name = task_classes["redshift"].name_join(row)
+
+            if (not cfdone) and (not specdone) :
+                # The cframes do not exist, so reset the state of the
+                # spectra and redshift tasks.
+                state = 0
+                pixtask_states["spectra"].append((spec_name, "waiting"))
+                pixtask_states["redshift"].append((red_name, "waiting"))
+            elif spec_exists[row["pixel"]]:
+                if red_exists[row["pixel"]]:
+                    # We are all done (state 3)
+                    state = 3
+                    pixtask_states["spectra"].append((spec_name, "done"))
+                    pixtask_states["redshift"].append((red_name, "done"))
                 else:
-                    # The cframe exists...
-                    if spec_exists[row["pixel"]]:
-                        if red_exists[row["pixel"]]:
-                            # We are all done (state 3)
-                            set_hpx_frame_3(row, spec_name, red_name, cur)
-                        else:
-                            # We are only at state 2
-                            set_hpx_frame_2(row, spec_name, red_name, cur)
-                    else:
-                        # We are at just at state 1
-                        set_hpx_frame_1(row, spec_name, red_name, cur)
+                    # We are only at state 2
+                    state = 2
+                    pixtask_states["spectra"].append((spec_name, "done"))
+            else:
+                # We are at just at state 1
+                state = 1
+                pixtask_states["redshift"].append((red_name, "waiting"))
+
+            hpx_states.append((state, row["expid"], row["spec"], row["state"]))
+
+        # Apply the updates in the same order as the rows, as before.
+        with self.cursor() as cur:
+            cur.executemany("update healpix_frame set state = {0} where expid = {0} and spec = {0} and state = {0}".format(self._param), hpx_states)
+            for tt in ["spectra", "redshift"]:
+                cur.executemany("update {} set state = {} where name = {}"\
+                    .format(tt, self._param, self._param),
+                    [ (task_state_to_int[st], name) for name, st in pixtask_states[tt] ])
 
         # Update ready state of tasks
         self.getready(night=night)
@@ -893,32 +937,28 @@ class DataBase:
                 if tt == "spectra":
                     required_healpix_frame_state = 1
                     # means we have a cframe
+                    done_healpix_frame_state = 2
                 elif tt == "redshift":
                     required_healpix_frame_state = 2
                     # means we have an updated spectra file
+                    done_healpix_frame_state = 3
 
-                cur.execute('select nside,pixel from healpix_frame where state = {}'.format(required_healpix_frame_state))
-                entries = cur.fetchall()
-                for entry in entries :
-                    log.debug("{} of pixel {} is ready to run".format(tt,entry[1]))
-                    cur.execute('update {} set state = {} where nside = {} and pixel = {}'.format(tt,task_state_to_int["ready"],entry[0],entry[1]))
+                # tasks of pixels with a frame in the required state are ready
+                cur.execute("update {0} set state = {1} where exists "
+                    "(select 1 from healpix_frame h where h.state = {2} "
+                    "and h.nside = {0}.nside and h.pixel = {0}.pixel)".format(
+                    tt, task_state_to_int["ready"],
+                    required_healpix_frame_state))
 
+                # tasks of waiting pixels with all their frames in the done
+                # state are done
                 log.debug("checking waiting {} tasks to see if they are done...".format(tt))
-                cmd = "select pixel from {} where state = {}".format(tt, task_state_to_int["waiting"])
-                cur.execute(cmd)
-                pixels = [ x for (x, ) in cur.fetchall()]
-                if len(pixels) > 0:
-                    log.debug("checking {} {} ...".format(len(pixels),tt))
-                    if tt == "spectra":
-                        required_healpix_frame_state = 2
-                    elif tt == "redshift":
-                        required_healpix_frame_state = 3
-                    for pixel in pixels:
-                        cur.execute('select pixel from healpix_frame where pixel = {} and state != {}'.format(pixel,required_healpix_frame_state))
-                        entries = cur.fetchall()
-                        if len(entries)==0 :
-                            log.debug("{} task of pixel {} is done".format(tt,pixel))
-                            cur.execute('update {} set state = {} where pixel = {}'.format(tt,task_state_to_int["done"],pixel))
+                cur.execute("update {0} set state = {1} where pixel in "
+                    "(select w.pixel from {0} w where w.state = {2} "
+                    "and not exists (select 1 from healpix_frame h "
+                    "where h.pixel = w.pixel and h.state != {3}))".format(
+                    tt, task_state_to_int["done"],
+                    task_state_to_int["waiting"], done_healpix_frame_state))
         return
 
 
@@ -1002,6 +1042,9 @@ class DataBaseSqlite(DataBase):
 
         if create:
             self.initdb()
+        elif self._mode == 'w':
+            # Add the indexes to databases created before they existed.
+            self.create_indexes()
         return
 
 
@@ -1081,6 +1124,8 @@ class DataBaseSqlite(DataBase):
 
         if "healpix_frame" not in tables_in_db:
             self.create_healpix_frame_table()
+
+        self.create_indexes()
         return
 
 
@@ -1101,6 +1146,8 @@ class DataBasePostgres(DataBase):
             additional roles that should be granted access.
 
     """
+    _param = "%s"
+
     def __init__(self, host, port, dbname, user, schema=None, authorize=None):
         super(DataBasePostgres, self).__init__()
 
@@ -1275,6 +1322,8 @@ class DataBasePostgres(DataBase):
         if "healpix_frame" not in tables_in_db:
             self.create_healpix_frame_table()
 
+        self.create_indexes()
+
         return
 
 
@@ -23,7 +23,7 @@ from desiutil.log import get_logger
 from .. import io
 
 from ..parallel import (dist_uniform, dist_discrete, dist_discrete_all,
-    weighted_partition, stdouterr_redirected, use_mpi)
+    stdouterr_redirected, use_mpi)
 
 from .prod import task_read, task_write
 
@@ -139,7 +139,8 @@ def worker_times(tasktimes, workerdist, startup=0.0):
 
 
 def compute_worker_tasks(tasktype, tasklist, tfactor, nworker,
-                         workersize, startup=0.0, db=None, num_nodes=None):
+                         workersize, startup=0.0, db=None, num_nodes=None,
+                         costmodel=None, method='lpt'):
     """Compute the distribution of tasks for specified workers.
 
     Args:
@@ -154,6 +155,10 @@ def compute_worker_tasks(tasktype, tasklist, tfactor, nworker,
         db (DataBase): the database to pass to the task runtime
             calculation.
         num_nodes (int): number of nodes over which the workers are distributed
+        costmodel (TaskCostModel): model of the task runtimes fitted from
+            previous runs; default the static run_time of the task class.
+        method (str): partition method, 'lpt' (longest processing time
+            first) or 'kk' (Karmarkar-Karp).
 
     Returns:
         (tuple):  The (sorted tasks, sorted runtime weights, dist) results
@@ -163,11 +168,18 @@ def compute_worker_tasks(tasktype, tasklist, tfactor, nworker,
 
     """
     from .tasks.base import task_classes, task_type
+    from .costmodel import partition, task_features
     log = get_logger()
 
     # Run times for each task at this concurrency
-    tasktimes = [(x, tfactor * task_classes[tasktype].run_time(
-                    x, workersize, db=db)) for x in tasklist]
+    if costmodel is not None and costmodel.has_tasktype(tasktype):
+        def runtime(name, procs, db=None):
+            return costmodel.predict(name, procs, db=db,
+                                     **task_features(name, db=db))
+    else:
+        runtime = task_classes[tasktype].run_time
+    tasktimes = [(x, tfactor * runtime(x, workersize, db=db))
+                 for x in tasklist]
 
     # Sort the tasks by runtime to improve the partitioning
     # NOTE: sorting is unnecessary when using weighted_partition instead of
@@ -193,7 +205,7 @@ def compute_worker_tasks(tasktype, tasklist, tfactor, nworker,
         else:
             workers_per_node = None
 
-        workdist = weighted_partition(workweights, nworker,
+        workdist = partition(workweights, nworker, method=method,
             groups_per_node=workers_per_node)
 
     # Find the runtime for each worker
@@ -23,8 +23,10 @@ from desiutil.log import get_logger
 
 from .. import io
 
+from .. import metrics
+
 from ..parallel import (dist_uniform, dist_discrete, dist_discrete_all,
-    stdouterr_redirected)
+    stdouterr_redirected, SharedCounter)
 
 from .prod import load_prod
 
@@ -34,6 +36,8 @@ from .scriptgen import parse_job_env
 
 from .plan import compute_worker_tasks, worker_times
 
+from .costmodel import task_features
+
 
 #- TimeoutError and timeout handler to prevent runaway tasks
 class TimeoutError(Exception):
@@ -131,6 +135,27 @@ def run_task(name, opts, comm=None, logfile=None, db=None):
     #- Restore previous signal handler
     signal.signal(signal.SIGALRM, old_sighandler)
     if rank == 0:
+        #- Record the task duration, e.g. to fit a pipeline.costmodel
+        props = dict()
+        try:
+            props = task_classes[ttype].name_split(name)
+        except Exception:
+            pass
+        camera = None
+        if ("band" in props) and ("spec" in props):
+            camera = "{}{}".format(props["band"], props["spec"])
+        duration = time.time() - task_start_time
+        features = dict()
+        try:
+            features = task_features(name, db=db)
+        except Exception as err:
+            log.debug("No cost model features for {}: {}".format(name, err))
+        rec = metrics.record(ttype, duration, start=task_start_time,
+            kind="task", camera=camera, task=name, procs=nproc,
+            failed=(failcount > 0), **features)
+        tasktimes = os.getenv("DESI_PIPE_TASK_TIMES")
+        if tasktimes is not None:
+            metrics.write_jsonl(tasktimes, [rec,])
         log.debug("Finished with task {} sigalarm reset".format(name))
         log.debug("Task {} returning failcount {}".format(name, failcount))
 
@@ -234,6 +259,12 @@ def run_dist(tasktype, tasklist, db, nproc, procs_per_node, force=False):
             "DESI_PIPE_RUN_WORKER_SIZE not found in environment, using {}."
             .format(worker_size)
         )
+    costmodel = None
+    if "costmodel" in job_env:
+        from .costmodel import TaskCostModel
+        costmodel = TaskCostModel.read(job_env["costmodel"])
+        log.info("Using task cost model {}".format(job_env["costmodel"]))
+    method = job_env.get("partition", "lpt")
     nworker = 0
     if "workers" in job_env:
         nworker = job_env["workers"]
@@ -284,7 +315,7 @@ def run_dist(tasktype, tasklist, db, nproc, procs_per_node, force=False):
 
     (worktasks, worktimes, workdist) = compute_worker_tasks(
         tasktype, runtasks, tfactor, nworker, worker_size,
-        startup=startup, db=db)
+        startup=startup, db=db, costmodel=costmodel, method=method)
 
     # Compute the times for each worker- just for information
     workertimes, workermin, workermax = worker_times(
@@ -309,7 +340,47 @@ def run_dist(tasktype, tasklist, db, nproc, procs_per_node, force=False):
     return worker_size, groups, worktasks, dist
 
 
-def run_task_list(tasktype, tasklist, opts, comm=None, db=None, force=False):
+def _task_logfile(name, logdir):
+    """Return the log file of a task, making its directory if needed.
+
+    If the task has the "night" key in its name, then use that subdirectory.
+    Otherwise, if it has the "pixel" key, use the appropriate subdirectory.
+    Tasks with neither key are not logged to a file (None is returned).
+    """
+    from .tasks.base import task_classes, task_type
+
+    tt = task_type(name)
+    fields = task_classes[tt].name_split(name)
+
+    tasklog = None
+    if "night" in fields:
+        tasklogdir = os.path.join(logdir, io.get_pipe_nightdir(),
+                                  "{:08d}".format(fields["night"]))
+        # (this directory should have been made during the prod update)
+        tasklog = os.path.join(tasklogdir, "{}.log".format(name))
+    elif "pixel" in fields:
+        tasklogdir = os.path.join(logdir, "healpix",
+            io.healpix_subdirectory(fields["nside"],fields["pixel"]))
+        # When creating this directory, there MIGHT be conflicts from
+        # multiple processes working on pixels in the same
+        # sub-directories...
+        try :
+            if not os.path.isdir(os.path.dirname(tasklogdir)):
+                os.makedirs(os.path.dirname(tasklogdir))
+        except FileExistsError:
+            pass
+        try :
+            if not os.path.isdir(tasklogdir):
+                os.makedirs(tasklogdir)
+        except FileExistsError:
+            pass
+        tasklog = os.path.join(tasklogdir, "{}.log".format(name))
+
+    return tasklog
+
+
+def run_task_list(tasktype, tasklist, opts, comm=None, db=None, force=False,
+                  schedule=None):
     """Run a collection of tasks of the same type.
 
     This function requires that the DESI environment variables are set to
@@ -319,7 +390,10 @@ def run_task_list(tasktype, tasklist, opts, comm=None, db=None, force=False):
     per task to split the communicator and form groups of processes of
     the desired size.  It then takes the list of tasks and uses their relative
     run time estimates to assign tasks to the process groups.  Each process
-    group loops over its assigned tasks.
+    group loops over its assigned tasks.  With the "dynamic" schedule, the
+    process groups instead take the next task, from the longest to the
+    shortest, whenever they finish a task, so that a few slow tasks do not
+    leave the other groups idle.
 
     If the database is not specified, no state tracking will be done and the
     filesystem will be checked as needed to determine the current state.
@@ -337,6 +411,9 @@ def run_task_list(tasktype, tasklist, opts, comm=None, db=None, force=False):
         db (pipeline.db.DB): The optional database to update.
         force (bool): If True, ignore database and filesystem state and just
             run the tasks regardless.
+        schedule (str): "static" or "dynamic".  Default from
+            DESI_PIPE_RUN_SCHEDULE, else "static".  Without MPI, the tasks
+            are always run in order by the single process.
 
     Returns:
         tuple: the number of ready tasks, number that are done, and the number
@@ -410,53 +487,77 @@ def run_task_list(tasktype, tasklist, opts, comm=None, db=None, force=False):
     failcount = 0
     group_failcount = 0
 
+    # With dynamic scheduling, the groups take the tasks (sorted from the
+    # longest to the shortest) one at a time from a shared counter as they
+    # finish their previous task, instead of running the tasks assigned to
+    # them by run_dist.  All groups that run_dist assigned tasks to take part.
+
+    if schedule is None:
+        schedule = parse_job_env().get("schedule", "static")
+    if schedule not in ("static", "dynamic"):
+        raise ValueError("Unknown schedule '{}'".format(schedule))
+
+    counter = None
+    if schedule == "dynamic" and comm is not None and len(worktasks) > 0:
+        try:
+            counter = SharedCounter(comm)
+        except (ImportError, NotImplementedError, AttributeError) as err:
+            if rank == 0:
+                log.warning("Dynamic scheduling unavailable ({}); using "
+                    "the static task distribution".format(err))
+
+    def _next_tasks():
+        while True:
+            t = None
+            if group_rank == 0:
+                t = counter.next()
+            if comm_group is not None:
+                t = comm_group.bcast(t, root=0)
+            if t >= len(worktasks):
+                return
+            yield t
+
+    if counter is None:
+        group_tasks = dist[group]
+    else:
+        group_tasks = _next_tasks()
+
     if group_ntask > 0:
         if group_rank == 0:
-            log.debug(
-                "Group {}, running {} tasks".format(group, len(dist[group]))
-            )
-
-        for t in dist[group]:
-            # For this task, determine the output log file.  If the task has
-            # the "night" key in its name, then use that subdirectory.
-            # Otherwise, if it has the "pixel" key, use the appropriate
-            # subdirectory.
-            tt = task_type(worktasks[t])
-            fields = task_classes[tt].name_split(worktasks[t])
-
-            tasklog = None
-            if "night" in fields:
-                tasklogdir = os.path.join(logdir, io.get_pipe_nightdir(),
-                                          "{:08d}".format(fields["night"]))
-                # (this directory should have been made during the prod update)
-                tasklog = os.path.join(tasklogdir,
-                    "{}.log".format(worktasks[t]))
-            elif "pixel" in fields:
-                tasklogdir = os.path.join(logdir, "healpix",
-                    io.healpix_subdirectory(fields["nside"],fields["pixel"]))
-                # When creating this directory, there MIGHT be conflicts from
-                # multiple processes working on pixels in the same
-                # sub-directories...
-                try :
-                    if not os.path.isdir(os.path.dirname(tasklogdir)):
-                        os.makedirs(os.path.dirname(tasklogdir))
-                except FileExistsError:
-                    pass
-                try :
-                    if not os.path.isdir(tasklogdir):
-                        os.makedirs(tasklogdir)
-                except FileExistsError:
-                    pass
-                tasklog = os.path.join(tasklogdir,
-                    "{}.log".format(worktasks[t]))
-
-            failedprocs = run_task(worktasks[t], options, comm=comm_group,
-                logfile=tasklog, db=db)
-
-            if failedprocs > 0:
-                group_failcount += 1
-                log.debug("{} failed; group_failcount now {}".format(
-                    worktasks[t], group_failcount))
+            if counter is None:
+                log.debug(
+                    "Group {}, running {} tasks".format(group, len(dist[group]))
+                )
+            else:
+                log.debug("Group {}, running tasks dynamically".format(group))
+
+        try:
+            for t in group_tasks:
+                tasklog = _task_logfile(worktasks[t], logdir)
+
+                task_start_time = time.time()
+                failedprocs = run_task(worktasks[t], options, comm=comm_group,
+                    logfile=tasklog, db=db)
+                if group_rank == 0:
+                    log.debug("Group {} ran {} in {:.1f} sec".format(
+                        group, worktasks[t], time.time() - task_start_time))
+
+                if failedprocs > 0:
+                    group_failcount += 1
+                    log.debug("{} failed; group_failcount now {}".format(
+                        worktasks[t], group_failcount))
+        except Exception:
+            if counter is not None:
+                # The other groups would wait forever for this process in
+                # the collective counter.free(), so abort the whole job.
+                import traceback
+                log.error("Aborting after error in dynamic task loop:\n{}".format(
+                    traceback.format_exc()))
+                comm.Abort(1)
+            raise
+
+    if counter is not None:
+        counter.free()
 
     failcount = group_failcount
 
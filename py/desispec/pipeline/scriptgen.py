@@ -52,6 +52,12 @@ def parse_job_env():
         par["workers"] = int(os.environ["DESI_PIPE_RUN_WORKERS"])
     if "DESI_PIPE_RUN_WORKER_SIZE" in os.environ:
         par["workersize"] = int(os.environ["DESI_PIPE_RUN_WORKER_SIZE"])
+    if "DESI_PIPE_RUN_COSTMODEL" in os.environ:
+        par["costmodel"] = os.environ["DESI_PIPE_RUN_COSTMODEL"]
+    if "DESI_PIPE_RUN_PARTITION" in os.environ:
+        par["partition"] = os.environ["DESI_PIPE_RUN_PARTITION"]
+    if "DESI_PIPE_RUN_SCHEDULE" in os.environ:
+        par["schedule"] = os.environ["DESI_PIPE_RUN_SCHEDULE"]
     return par
 
 
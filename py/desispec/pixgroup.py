@@ -5,6 +5,7 @@ Tools to regroup spectra in individual exposures by healpix on the sky
 import glob, os, sys, time, json
 from collections import Counter, OrderedDict
 import gzip, shutil
+import concurrent.futures
 
 import numpy as np
 
@@ -182,6 +183,22 @@ class FrameLite(object):
         self.header = header
         self.meta = header  #- for compatibility with Frame objects
         self.scores = scores
+        self._healpix = dict()
+
+    def healpix(self, nside=64):
+        '''
+        Return NESTED healpix of TARGET_RA,TARGET_DEC for each spectrum,
+        -1 for NaN coordinates; computed once per nside
+        '''
+        if nside not in self._healpix:
+            ra = np.asarray(self.fibermap['TARGET_RA'], dtype=float)
+            dec = np.asarray(self.fibermap['TARGET_DEC'], dtype=float)
+            ok = ~np.isnan(ra) & ~np.isnan(dec)
+            allpix = np.full(len(ra), -1, dtype=np.int64)
+            allpix[ok] = radec2pix(nside, ra[ok], dec[ok])
+            self._healpix[nside] = allpix
+
+        return self._healpix[nside]
 
     def __getitem__(self, index):
         '''Return a subset of the original FrameLight'''
@@ -465,7 +482,12 @@ class SpectraLite(object):
     def read(cls, filename):
         '''
         Return a SpectraLite object read from `filename`
+
+        .h5 or .hdf5 files are read with desispec.io.spectra_hdf5
         '''
+        if io.spectra_hdf5.is_hdf5(filename):
+            return io.spectra_hdf5.read_spectra_hdf5(filename, lite=True)
+
         with fitsio.FITS(filename) as fx:
             wave = dict()
             flux = dict()
@@ -570,6 +592,8 @@ def add_missing_frames(frames):
             frames[(night,expid,bandcam)] = FrameLite(
                 wave[band], flux, ivar, mask, resolution_data,
                 frame.fibermap, header, scores)
+            #- same fibermap, same healpix
+            frames[(night,expid,bandcam)]._healpix = frame._healpix
 
 def frames2spectra(frames, pix=None, nside=64):
     '''
@@ -658,12 +682,7 @@ def frames2spectra(frames, pix=None, nside=64):
         for spec,night,expid,cam in band_keys:
             bandframe = frames[(night,expid,cam)]
             if pix is not None:
-                ra, dec = bandframe.fibermap['TARGET_RA'], bandframe.fibermap['TARGET_DEC']
-                ok = ~np.isnan(ra) & ~np.isnan(dec)
-                ra[~ok] = 0.0
-                dec[~ok] = 0.0
-                allpix = radec2pix(nside, ra, dec)
-                ii = (allpix == pix) & ok
+                ii = bandframe.healpix(nside) == pix
             else:
                 ii = np.ones(bandframe.flux.shape[0]).astype(bool)
                 
@@ -765,7 +784,210 @@ def frames2spectra(frames, pix=None, nside=64):
     return SpectraLite(bands, wave, flux, ivar, mask, resolution_data,
             fibermap, scores=scores)
 
-def update_frame_cache(frames, framekeys, specprod_dir=None):
+def frames2healpix_spectra(frames, nside=64, pixels=None):
+    '''
+    Regroup a dict of FrameLite into a SpectraLite per healpix in one pass
+
+    Args:
+        frames: dict of FrameLight, keyed by (night, expid, camera)
+
+    Options:
+        nside: Healpix nside, must be power of 2
+        pixels: only these NESTED healpix; default all pixels of the frames
+
+    Yields (healpix, SpectraLite) for each pixel with spectra, in increasing
+    pixel order.  The healpix of each fiber are computed once per frame,
+    and only one SpectraLite is in memory at a time if the caller writes
+    it and drops it before requesting the next one.
+    '''
+    log = get_logger()
+
+    #- add blank frames once instead of for every pixel
+    frames = frames.copy()
+    add_missing_frames(frames)
+
+    allpix = set()
+    for frame in frames.values():
+        framepix = frame.healpix(nside)
+        allpix.update(np.unique(framepix[framepix >= 0]).tolist())
+
+    if pixels is None:
+        pixels = sorted(allpix)
+    else:
+        missing = sorted(set(pixels) - allpix)
+        if len(missing) > 0:
+            log.warning(f'No spectra for nside={nside} healpix {missing}')
+        pixels = sorted(set(pixels) & allpix)
+
+    log.info(f'Regrouping {len(frames)} frames into {len(pixels)} nside={nside} healpix')
+    for pix in pixels:
+        yield pix, frames2spectra(frames, pix=pix, nside=nside)
+
+def _frame_nbytes(frame):
+    """Approximate memory size in bytes of a FrameLite"""
+    nbytes = 0
+    for x in (frame.wave, frame.flux, frame.ivar, frame.mask,
+              frame.resolution_data, frame.fibermap, frame.scores):
+        if x is not None:
+            nbytes += np.asarray(x).nbytes
+    return nbytes
+
+class FrameCache(object):
+    """
+    LRU cache of FrameLite objects keyed by (night, expid, camera),
+    with a maximum size in bytes and background read-ahead
+
+    Options:
+        max_bytes: maximum total size of the cached frames; default
+            $DESI_FRAME_CACHE_MB (default 8192) MB
+        nthreads: number of threads reading frames in the background;
+            0 reads every frame when it is needed
+        specprod_dir: override $DESI_SPECTRO_REDUX/$SPECPROD
+
+    Frames being prefetched are not counted in the cache size until they
+    are requested.  Cached frames must not be modified by the callers.
+    """
+    def __init__(self, max_bytes=None, nthreads=2, specprod_dir=None):
+        if max_bytes is None:
+            max_bytes = float(os.getenv('DESI_FRAME_CACHE_MB', 8192))*1024**2
+
+        self.max_bytes = int(max_bytes)
+        self.nthreads = int(nthreads)
+        self.specprod_dir = specprod_dir
+        self._frames = OrderedDict()
+        self._frame_nbytes = dict()
+        self._pending = dict()
+        self._executor = None
+        self.nbytes = 0
+        self.hits = 0
+        self.prefetch_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.bytes_read = 0
+
+    def __len__(self):
+        return len(self._frames)
+
+    def __contains__(self, key):
+        return key in self._frames
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def filename(self, key):
+        """Return the cframe filename of key (night, expid, camera)"""
+        night, expid, camera = key
+        return io.findfile('cframe', night, expid, camera,
+                specprod_dir=self.specprod_dir)
+
+    @staticmethod
+    def _read(filename):
+        frame = FrameLite.read(filename)
+        return frame, os.path.getsize(filename)
+
+    def prefetch(self, framekeys):
+        """
+        Start reading the frames of framekeys that are not cached yet
+        in background threads
+
+        Pending reads of frames not in framekeys are cancelled, or added
+        to the cache if they already finished.
+        """
+        if self.nthreads <= 0:
+            return
+
+        if self._executor is None:
+            self._executor = concurrent.futures.ThreadPoolExecutor(
+                    max_workers=self.nthreads, thread_name_prefix='desi_prefetch')
+
+        framekeys = list(framekeys)
+        for key in list(self._pending.keys()):
+            if key not in framekeys:
+                future = self._pending.pop(key)
+                if not future.cancel() and future.exception() is None:
+                    frame, filesize = future.result()
+                    self.bytes_read += filesize
+                    self._add(key, frame)
+
+        for key in framekeys:
+            if key not in self._frames and key not in self._pending:
+                self._pending[key] = self._executor.submit(self._read, self.filename(key))
+
+    def get(self, key, keep=()):
+        """
+        Return the FrameLite of key (night, expid, camera), reading it if needed
+
+        Options:
+            keep: keys of frames that must not be evicted to make room for it
+        """
+        if key in self._frames:
+            self.hits += 1
+            self._frames.move_to_end(key)
+            return self._frames[key]
+
+        if key in self._pending:
+            self.prefetch_hits += 1
+            frame, filesize = self._pending.pop(key).result()
+        else:
+            self.misses += 1
+            frame, filesize = self._read(self.filename(key))
+
+        self.bytes_read += filesize
+        self._add(key, frame, keep=keep)
+        return frame
+
+    def _add(self, key, frame, keep=()):
+        nbytes = _frame_nbytes(frame)
+        for oldkey in list(self._frames.keys()):
+            if self.nbytes + nbytes <= self.max_bytes:
+                break
+            if oldkey not in keep:
+                self._remove(oldkey)
+                self.evictions += 1
+
+        #- frames that are needed now are kept even if over budget
+        self._frames[key] = frame
+        self._frame_nbytes[key] = nbytes
+        self.nbytes += nbytes
+
+    def _remove(self, key):
+        del self._frames[key]
+        self.nbytes -= self._frame_nbytes.pop(key)
+
+    def close(self):
+        """Cancel pending reads and stop the reader threads"""
+        for future in self._pending.values():
+            future.cancel()
+        self._pending.clear()
+        if self._executor is not None:
+            self._executor.shutdown(wait=True)
+            self._executor = None
+
+    def stats(self):
+        """
+        Return dict with the number of hits, prefetch_hits, misses,
+        evictions, entries, bytes_read, and the current and maximum size
+        """
+        return dict(hits=self.hits, prefetch_hits=self.prefetch_hits,
+                    misses=self.misses, evictions=self.evictions,
+                    entries=len(self._frames), bytes_read=self.bytes_read,
+                    nbytes=self.nbytes, max_bytes=self.max_bytes)
+
+    def log_stats(self):
+        """Log the cache statistics at info level"""
+        log = get_logger()
+        s = self.stats()
+        log.info('Frame cache: {} hits, {} prefetched, {} misses, {} evictions, '
+                 '{} entries, {:.1f}/{:.1f} MB, {:.1f} MB read'.format(
+            s['hits'], s['prefetch_hits'], s['misses'], s['evictions'],
+            s['entries'], s['nbytes']/1024**2, s['max_bytes']/1024**2,
+            s['bytes_read']/1024**2))
+
+def update_frame_cache(frames, framekeys, specprod_dir=None, cache=None,
+        prefetch=None):
     '''
     Update a cache of FrameLite objects to match requested frameskeys
 
@@ -773,6 +995,13 @@ def update_frame_cache(frames, framekeys, specprod_dir=None):
         frames: dict of FrameLite objects, keyed by (night, expid, camera)
         framekeys: list of desired (night, expid, camera)
 
+    Options:
+        specprod_dir: override $DESI_SPECTRO_REDUX/$SPECPROD
+        cache: FrameCache to get the frames from, keeping frames that are
+            dropped from `frames` for later requests
+        prefetch: list of (night, expid, camera) to read ahead in the
+            background, e.g. the frames of the next healpix; requires cache
+
     Updates `frames` in-place
 
     Notes:
@@ -791,16 +1020,105 @@ def update_frame_cache(frames, framekeys, specprod_dir=None):
 
     nkeep = len(frames)
 
+    #- read the new frames in parallel
+    newkeys = [key for key in framekeys if key not in frames]
+    if cache is not None:
+        cache.prefetch(newkeys)
+
     #- Read and add the new frames that we do need
     nadd = 0
-    for key in framekeys:
-        if key not in frames.keys():
+    for key in newkeys:
+        nadd += 1
+        if cache is not None:
+            frames[key] = cache.get(key, keep=framekeys)
+        else:
             night, expid, camera = key
             framefile = io.findfile('cframe', night, expid, camera,
                     specprod_dir=specprod_dir)
             log.debug('  Reading {}'.format(os.path.basename(framefile)))
-            nadd += 1
             frames[key] = FrameLite.read(framefile)
 
+    if cache is not None and prefetch is not None:
+        cache.prefetch(prefetch)
+
     log.debug('Frame cache: {} kept, {} added, {} dropped, now have {}'.format(
          nkeep, nadd, ndrop, len(frames)))
+
+def healpix_framekeys(exp2pix, cameras='brz', specprod_dir=None):
+    '''
+    Return the frames covering each healpix of an exposure -> healpix map
+
+    Args:
+        exp2pix: table with columns NIGHT EXPID SPECTRO HEALPIX,
+            e.g. from `get_exp2healpix_map`
+
+    Options:
+        cameras: bands of the frames, e.g. 'brz'
+        specprod_dir: if not None, only include frames with an existing cframe
+            file under this production directory
+
+    Returns OrderedDict of healpix -> list of (night, expid, camera),
+    in increasing healpix order
+    '''
+    pixkeys = dict()
+    for night, expid, spectro, pix in exp2pix['NIGHT', 'EXPID', 'SPECTRO', 'HEALPIX']:
+        keys = pixkeys.setdefault(int(pix), list())
+        for band in cameras:
+            key = (int(night), int(expid), f'{band}{spectro}')
+            if key not in keys:
+                keys.append(key)
+
+    if specprod_dir is not None:
+        exists = dict()
+        for keys in pixkeys.values():
+            for key in keys:
+                if key not in exists:
+                    night, expid, camera = key
+                    exists[key] = os.path.exists(io.findfile('cframe', night,
+                        expid, camera, specprod_dir=specprod_dir))
+        pixkeys = {pix: [k for k in keys if exists[k]] for pix, keys in pixkeys.items()}
+
+    return OrderedDict([(pix, pixkeys[pix]) for pix in sorted(pixkeys)])
+
+def iter_healpix_frames(exp2pix, cache=None, cameras='brz', specprod_dir=None):
+    '''
+    Iterate over the frames of each healpix, reading the frames of the
+    next healpix in the background
+
+    Args:
+        exp2pix: table with columns NIGHT EXPID SPECTRO HEALPIX,
+            e.g. from `get_exp2healpix_map`
+
+    Options:
+        cache: FrameCache; default a new FrameCache(specprod_dir=specprod_dir)
+        cameras: bands of the frames, e.g. 'brz'
+        specprod_dir: override $DESI_SPECTRO_REDUX/$SPECPROD
+
+    Yields (healpix, frames) with frames a dict of FrameLite keyed by
+    (night, expid, camera), e.g. for `frames2spectra(frames, pix=healpix)`.
+    Missing cframe files are skipped.  The same frames dict is updated for
+    each healpix, so it must not be modified by the caller.
+    '''
+    if specprod_dir is None:
+        specprod_dir = io.specprod_root()
+
+    own_cache = cache is None
+    if own_cache:
+        cache = FrameCache(specprod_dir=specprod_dir)
+
+    pixkeys = healpix_framekeys(exp2pix, cameras=cameras, specprod_dir=specprod_dir)
+    pixels = list(pixkeys.keys())
+    frames = dict()
+    try:
+        for i, pix in enumerate(pixels):
+            if i+1 < len(pixels):
+                prefetch = pixkeys[pixels[i+1]]
+            else:
+                prefetch = list()
+
+            update_frame_cache(frames, pixkeys[pix], cache=cache, prefetch=prefetch)
+            yield pix, frames
+    finally:
+        if own_cache:
+            cache.log_stats()
+            cache.close()
@@ -26,8 +26,10 @@ from desispec.io.xytraceset import read_xytraceset
 from desispec.io import read_fiberflat, shorten_filename, findfile
 from desispec.io.util import addkeys
 from desispec.maskedmedian import masked_median
+from desispec.blockstats import block_median, running_median
 from desispec.image_model import compute_image_model
 from desispec.util import header2night
+from desispec.filecache import get_calib_cache
 
 def get_amp_ids(header):
     '''
@@ -242,18 +244,30 @@ def _global_background(image,patch_width=200) :
 
     Returns background image with same shape as input image
     '''
-    bkg=np.zeros_like(image)
     bins0=np.linspace(0,image.shape[0],image.shape[0]//patch_width).astype(int)
     bins1=np.linspace(0,image.shape[1],image.shape[1]//patch_width).astype(int)
-    bkg_grid=np.zeros((bins0.size-1,bins1.size-1))
-    for j in range(bins1.size-1) :
-        for i in range(bins0.size-1) :
-            bkg_grid[i,j]=np.median(image[bins0[i]:bins0[i+1],bins1[j]:bins1[j+1]])
+    bkg_grid=block_median(image,bins0,bins1)
 
     nodes0=bins0[:-1]+(bins0[1]-bins0[0])/2.
     nodes1=bins1[:-1]+(bins1[1]-bins0[0])/2.
     spline=scipy.interpolate.RectBivariateSpline(nodes0,nodes1,bkg_grid,kx=2, ky=2, s=0)
-    return spline(np.arange(0,image.shape[0]),np.arange(0,image.shape[1]))
+    return _evaluate_spline_on_grid(spline,np.arange(0,image.shape[0]),np.arange(0,image.shape[1]))
+
+def _evaluate_spline_on_grid(spline,x0,x1) :
+    '''
+    Evaluate a scipy.interpolate.RectBivariateSpline on the grid x0 x x1
+    as a product of B-spline design matrices, which is faster than
+    spline(x0,x1) for large grids. Like spline(x0,x1), values outside
+    of the spline bounding box are those at the box edges.
+    '''
+    if not hasattr(scipy.interpolate.BSpline,'design_matrix') : # scipy<1.8
+        return spline(x0,x1)
+    t0,t1=spline.get_knots()
+    k0,k1=spline.degrees
+    b0=scipy.interpolate.BSpline.design_matrix(np.clip(x0,t0[k0],t0[-k0-1]),t0,k0).toarray()
+    b1=scipy.interpolate.BSpline.design_matrix(np.clip(x1,t1[k1],t1[-k1-1]),t1,k1).toarray()
+    coeffs=spline.get_coeffs().reshape(b0.shape[1],b1.shape[1])
+    return b0.dot(coeffs).dot(b1.T)
 
 
 def _background(image,header,patch_width=200,stitch_width=10,stitch=False) :
@@ -297,13 +311,12 @@ def _background(image,header,patch_width=200,stitch_width=10,stitch=False) :
             ii0=parse_sec_keyword(header['CCDSEC%d'%amp0])
             ii1=parse_sec_keyword(header['CCDSEC%d'%amp1])
             pos=ii0[axis].stop
-            bins=np.linspace(ii0[axis-1].start,ii0[axis-1].stop,float(ii0[axis-1].stop-ii0[axis-1].start)/patch_width).astype(int)
-            delta=np.zeros((bins.size-1))
-            for i in range(bins.size-1) :
-                if axis==0 :
-                    delta[i]=np.median(tmp_image[pos-stitch_width:pos,bins[i]:bins[i+1]])-np.median(tmp_image[pos:pos+stitch_width,bins[i]:bins[i+1]])
-                else :
-                    delta[i]=np.median(tmp_image[bins[i]:bins[i+1],pos-stitch_width:pos])-np.median(tmp_image[bins[i]:bins[i+1],pos:pos+stitch_width])
+            bins=np.linspace(ii0[axis-1].start,ii0[axis-1].stop,(ii0[axis-1].stop-ii0[axis-1].start)//patch_width).astype(int)
+            edge_bins=[pos-stitch_width,pos,pos+stitch_width]
+            if axis==0 :
+                delta=-np.diff(block_median(tmp_image,edge_bins,bins),axis=0)[0]
+            else :
+                delta=-np.diff(block_median(tmp_image,bins,edge_bins),axis=1)[:,0]
             nodes=bins[:-1]+(bins[1]-bins[0])/2.
 
             log.info("AMPS %d:%d mean diff=%f"%(amp0,amp1,np.mean(delta)))
@@ -488,7 +501,7 @@ def compute_background_between_fiber_blocks(image,xyset) :
                 vb = np.interp(image_yy,image_yy[inamp],vb[inamp])
 
             # median filter
-            vb = median_filter(vb,mwidth)
+            vb = running_median(vb,mwidth)
 
             xinterblock.append(image_xb)
             vinterblock.append(vb)
@@ -1346,6 +1359,26 @@ def preproc(rawimage, header, primary_header, bias=True, dark=True, pixflat=True
 #- The following I/O routines are here instead of desispec.io to avoid a
 #- circular dependency between io and preproc:
 #- io.read_raw -> preproc.preproc -> io.read_bias (bad)
+#-
+#- Calibration images are read through a process-wide cache keyed by
+#- (path, mtime, size), see desispec.filecache.get_calib_cache
+
+def _read_hdu0(filename):
+    """Return the data of the first HDU of filename"""
+    from astropy.io import fits
+    return fits.getdata(filename, 0, memmap=False)
+
+def _read_dark_hdus(filename):
+    """
+    Return list of (EXTNAME, data) for each HDU of a dark model file;
+    EXTNAME is None for single HDU files
+    """
+    from astropy.io import fits
+    with fits.open(filename, memmap=False) as hdus:
+        if len(hdus) == 1:
+            return [(None, hdus[0].data)]
+        else:
+            return [(hdu.header['EXTNAME'], hdu.data) for hdu in hdus]
 
 def read_bias(filename=None, camera=None, dateobs=None):
     '''
@@ -1359,12 +1392,11 @@ def read_bias(filename=None, camera=None, dateobs=None):
     Notes:
         must provide filename, or both camera and dateobs
     '''
-    from astropy.io import fits
     if filename is None:
         #- use camera and dateobs to derive what bias file should be used
         raise NotImplementedError
     else:
-        return fits.getdata(filename, 0)
+        return get_calib_cache().get(filename, _read_hdu0, copy=True)
 
 def read_pixflat(filename=None, camera=None, dateobs=None):
     '''
@@ -1378,20 +1410,20 @@ def read_pixflat(filename=None, camera=None, dateobs=None):
     Notes:
         must provide filename, or both camera and dateobs
     '''
-    from astropy.io import fits
     if filename is None:
         #- use camera and dateobs to derive what pixflat file should be used
         raise NotImplementedError
     else:
-        return fits.getdata(filename, 0)
+        return get_calib_cache().get(filename, _read_hdu0, copy=True)
 
 def recover_2d_dark(hdus,exptime,extname):
-    log=get_logger()
-    shape=hdus[0].data.shape
+    return _recover_2d_dark(hdus[0].data.shape, hdus[extname].data)
+
+def _recover_2d_dark(shape,profiles):
     nx=shape[0]
     ny=shape[1]
-    profileLeft=hdus[extname].data[0]
-    profileRight=hdus[extname].data[1]
+    profileLeft=profiles[0]
+    profileRight=profiles[1]
     profile_2d_Left=np.transpose(np.tile(profileLeft,(int(ny/2),1)))
     profile_2d_Right=np.transpose(np.tile(profileRight,(int(ny/2),1)))
     profile_2d=np.concatenate((profile_2d_Left,profile_2d_Right),axis=1)
@@ -1412,7 +1444,6 @@ def read_dark(filename=None, camera=None, dateobs=None, exptime=None):
     Notes:
         must provide filename
     '''
-    from astropy.io import fits
     log=get_logger()
 
     if filename is None:
@@ -1424,23 +1455,25 @@ def read_dark(filename=None, camera=None, dateobs=None, exptime=None):
         raise ValueError("Need exposure time for dark")
     exptime = float(exptime) # will throw exception if cannot cast to float
 
-    hdus = fits.open(filename)
+    hdus = get_calib_cache().get(filename, _read_dark_hdus)
     if len(hdus)==1 :
         log.info("Single dark frame")
-        return exptime * hdus[0].data
+        return exptime * hdus[0][1]
     else :
         log.info("Exposure time dependent dark")
+        shape=hdus[0][1].shape
+        data=dict(hdus)
         exptime_arr=[]
         ext_arr={}
-        for hdu in hdus:
-            if hdu.header['EXTNAME'] == 'DARK' or hdu.header['EXTNAME'] == 'ZERO':
+        for extname, _ in hdus:
+            if extname == 'DARK' or extname == 'ZERO':
                 pass
-            #elif hdu.header['EXTNAME'] == 'ZERO':
-            #    ext_arr['0']=hdu.header['EXTNAME']
+            #elif extname == 'ZERO':
+            #    ext_arr['0']=extname
             #    exptime_arr.append(0)
             else:
-                ext_arr[hdu.header['EXTNAME'][1:]]=hdu.header['EXTNAME']
-                exptime_arr.append(float(hdu.header['EXTNAME'][1:]))
+                ext_arr[extname[1:]]=extname
+                exptime_arr.append(float(extname[1:]))
 
         exptime_arr = np.array(exptime_arr)
         min_exptime = np.min(exptime_arr)
@@ -1449,13 +1482,13 @@ def read_dark(filename=None, camera=None, dateobs=None, exptime=None):
         if exptime==0.:
             profile_2d=0.
         elif exptime in exptime_arr:
-            profile_2d = recover_2d_dark(hdus,exptime,ext_arr[str(int(exptime))])
+            profile_2d = _recover_2d_dark(shape,data[ext_arr[str(int(exptime))]])
         elif exptime < min_exptime :
             log.warning("Use 2D dark profile at min. exptime={}".format(min_exptime))
-            profile_2d = recover_2d_dark(hdus,min_exptime,ext_arr[str(int(min_exptime))])
+            profile_2d = _recover_2d_dark(shape,data[ext_arr[str(int(min_exptime))]])
         elif exptime > max_exptime :
             log.warning("Use 2D dark profile at max. exptime={}".format(max_exptime))
-            profile_2d = recover_2d_dark(hdus,max_exptime,ext_arr[str(int(max_exptime))])
+            profile_2d = _recover_2d_dark(shape,data[ext_arr[str(int(max_exptime))]])
         else: # Interpolate
             exptime_arr=np.sort(exptime_arr)
             ind=np.where(exptime_arr>exptime)
@@ -1464,11 +1497,11 @@ def read_dark(filename=None, camera=None, dateobs=None, exptime=None):
             log.info('Interpolate between '+str(exptime_arr[ind1])+' and '+str(exptime_arr[ind2]))
             precision=(exptime-exptime_arr[ind1])/(exptime_arr[ind2]-exptime_arr[ind1])
             # Run interpolation
-            image1=recover_2d_dark(hdus,exptime_arr[ind1],ext_arr[str(int(exptime_arr[ind1]))])
-            image2=recover_2d_dark(hdus,exptime_arr[ind2],ext_arr[str(int(exptime_arr[ind2]))])
+            image1=_recover_2d_dark(shape,data[ext_arr[str(int(exptime_arr[ind1]))]])
+            image2=_recover_2d_dark(shape,data[ext_arr[str(int(exptime_arr[ind2]))]])
             profile_2d = image1*(1-precision)+image2*precision
 
-        return profile_2d + exptime * hdus['DARK'].data
+        return profile_2d + exptime * data['DARK']
 
 def read_mask(filename=None, camera=None, dateobs=None):
     '''
@@ -1482,9 +1515,8 @@ def read_mask(filename=None, camera=None, dateobs=None):
     Notes:
         must provide filename, or both camera and dateobs
     '''
-    from astropy.io import fits
     if filename is None:
         #- use camera and dateobs to derive what mask file should be used
         raise NotImplementedError
     else:
-        return fits.getdata(filename, 0)
+        return get_calib_cache().get(filename, _read_hdu0, copy=True)
@@ -12,6 +12,7 @@ from __future__ import division, absolute_import
 import numpy as np
 import scipy.sparse
 import scipy.special
+import numba
 
 # The total number of diagonals that we keep in the sparse formats when
 # converting from a dense matrix
@@ -180,5 +181,168 @@ def _gauss_pix(x, mean=0.0, sigma=1.0):
     return (y[1:] - y[:-1])/2
 
 
+def _resolution_offsets(resolution_data):
+    """Offsets of the diagonals of resolution_data[..., ndiag, nwave]"""
+    ndiag = resolution_data.shape[-2]
+    if ndiag%2 == 0:
+        raise ValueError("Number of diagonals ({}) should be odd".format(ndiag))
+    return np.arange(ndiag//2, -(ndiag//2)-1, -1)
+
+@numba.jit(nopython=True, cache=False)
+def _apply_resolution(resolution_data, offsets, flux, result, transpose):
+    """
+    result[i] = R_i.dot(flux[i]) (or R_i.T.dot(flux[i]) if transpose) where
+    R_i is the dia matrix of resolution_data[i] with the given offsets;
+    flux can have a single row shared by all spectra
+    """
+    nspec, ndiag, nwave = resolution_data.shape
+    for i in range(nspec):
+        fi = i if flux.shape[0] > 1 else 0
+        for j in range(nwave):
+            #- sum over diagonals in the same order as scipy.sparse
+            value = result[i, j]
+            for k in range(ndiag):
+                if transpose:
+                    jj = j - offsets[k]
+                    if jj >= 0 and jj < nwave:
+                        value += resolution_data[i, k, j] * flux[fi, jj]
+                else:
+                    jj = j + offsets[k]
+                    if jj >= 0 and jj < nwave:
+                        value += resolution_data[i, k, jj] * flux[fi, jj]
+            result[i, j] = value
+
+def _native(array):
+    """Return array with native byte order (e.g. data read from FITS)"""
+    array = np.asarray(array)
+    if not array.dtype.isnative:
+        array = array.astype(array.dtype.newbyteorder('='))
+    return array
+
+def apply_resolution(resolution_data, flux, transpose=False):
+    """
+    Convolve flux with the resolution matrices of all spectra
+
+    Args:
+        resolution_data: 3D[nspec, ndiag, nwave] diagonals of the resolution
+            matrices, as in Frame.resolution_data
+        flux: 2D[nspec, nwave] or 1D[nwave] model, the same for all spectra
+
+    Options:
+        transpose: if True, multiply by the transposed matrices
+
+    Returns:
+        2D[nspec, nwave] array with row i = Resolution(resolution_data[i]).dot(flux[i]),
+        or Resolution(resolution_data[i]).T.dot(flux[i]) if transpose
+
+    The diagonals are summed in the same order as scipy.sparse, so the
+    result is identical to the per-spectrum sparse matrix products.
+    """
+    resolution_data = _native(resolution_data)
+    flux = _native(flux)
+    nspec, ndiag, nwave = resolution_data.shape
+    if flux.shape[-1] != nwave:
+        raise ValueError("flux has {} wavelengths instead of {}".format(flux.shape[-1], nwave))
+    if flux.ndim == 1:
+        flux = flux[np.newaxis, :]
+    elif flux.shape[0] != nspec:
+        raise ValueError("flux has {} spectra instead of {}".format(flux.shape[0], nspec))
+    result = np.zeros((nspec, nwave), dtype=np.result_type(resolution_data, flux))
+    _apply_resolution(resolution_data, _resolution_offsets(resolution_data),
+                      flux, result, transpose)
+    return result
+
+def apply_resolution_transpose(resolution_data, flux):
+    """
+    Multiply flux by the transposed resolution matrices of all spectra
+
+    Args:
+        resolution_data: 3D[nspec, ndiag, nwave] diagonals of the resolution
+            matrices, as in Frame.resolution_data
+        flux: 2D[nspec, nwave] or 1D[nwave] array, the same for all spectra
+
+    Returns:
+        2D[nspec, nwave] array with row i = Resolution(resolution_data[i]).T.dot(flux[i])
+    """
+    return apply_resolution(resolution_data, flux, transpose=True)
+
+class ResolutionList(object):
+    """
+    Sequence of per-spectrum resolution matrices, built when first accessed
+
+    Args:
+        data: sequence with one entry per spectrum, e.g. resolution_data[nspec, ndiag, nwave]
+
+    Options:
+        builder: function converting data[i] into a resolution matrix;
+            default Resolution; None if data already contains the matrices
+
+    Indexing with an integer returns the (cached) matrix of that spectrum;
+    other indices return a numpy object array of matrices, as for the
+    previous np.array([Resolution(r) for r in resolution_data]).
+    """
+    def __init__(self, data, builder=Resolution):
+        self._data = data
+        self._builder = builder
+        self._matrices = [None,] * len(data)
+
+    def __len__(self):
+        return len(self._matrices)
+
+    def _get(self, i):
+        if self._matrices[i] is None:
+            if self._builder is None:
+                self._matrices[i] = self._data[i]
+            else:
+                self._matrices[i] = self._builder(self._data[i])
+        return self._matrices[i]
+
+    def __getitem__(self, index):
+        if isinstance(index, (int, np.integer)):
+            return self._get(index)
+
+        indices = np.arange(len(self))[index]
+        result = np.empty(len(indices), dtype=object)
+        for j, i in enumerate(indices):
+            result[j] = self._get(i)
+        return result
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self._get(i)
+
+    def __array__(self, dtype=None):
+        return self[:]
+
+    def sum(self, axis=None, dtype=None, out=None):
+        """Sum of the matrices, as for a numpy object array"""
+        return self[:].sum(axis=axis, dtype=dtype, out=out)
+
+    def _has_resolution_data(self):
+        return self._builder is Resolution and isinstance(self._data, np.ndarray) \
+            and self._data.ndim == 3
+
+    def dot(self, flux):
+        """
+        Return 2D[nspec, nwave] array of each matrix times the corresponding row of
+        flux[nspec, nwave], or times flux[nwave] if 1D
+        """
+        if self._has_resolution_data():
+            return apply_resolution(self._data, flux)
+        flux = np.asarray(flux)
+        return np.array([R.dot(flux[i] if flux.ndim == 2 else flux)
+                         for i, R in enumerate(self)])
+
+    def transpose_dot(self, flux):
+        """
+        Return 2D[nspec, nwave] array of each transposed matrix times the
+        corresponding row of flux[nspec, nwave], or times flux[nwave] if 1D
+        """
+        if self._has_resolution_data():
+            return apply_resolution_transpose(self._data, flux)
+        flux = np.asarray(flux)
+        return np.array([R.T.dot(flux[i] if flux.ndim == 2 else flux)
+                         for i, R in enumerate(self)])
+
 
 #- (Unit tests moved to desispec.test.test_resolution)
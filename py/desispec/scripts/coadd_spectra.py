@@ -11,7 +11,7 @@ import fitsio
 
 from desiutil.log import get_logger
 from desispec.io import read_spectra,write_spectra,read_frame
-from desispec.coaddition import coadd,coadd_cameras,resample_spectra_lin_or_log
+from desispec.coaddition import coadd,coadd_cameras,resample_spectra_lin_or_log,coadd_spectra_file
 from desispec.pixgroup import frames2spectra
 from desispec.specscore import compute_coadd_scores
 
@@ -41,6 +41,8 @@ def parse(options=None):
             help="coadd spectra of different cameras. works only if wavelength grids are aligned")
     parser.add_argument("--onetile", action="store_true",
             help="input spectra are from a single tile")
+    parser.add_argument("--max-memory", type=float, default=None,
+            help="coadd a single input spectra file in chunks of targets using at most this memory in GB")
 
 
     if options is None:
@@ -50,6 +52,18 @@ def parse(options=None):
 
     return args
 
+def _update_infiles(meta, infiles):
+    """Add input files to header dict `meta`, removing previous INFIL* first"""
+    for i in range(1000):
+        key = 'INFIL{:03d}'.format(i)
+        if key in meta:
+            del meta[key]
+        else:
+            break
+
+    for i, filename in enumerate(infiles):
+        meta['INFIL{:03d}'.format(i)] = os.path.basename(filename)
+
 def main(args=None):
 
     log = get_logger()
@@ -101,6 +115,22 @@ def main(args=None):
         sys.exit(1)
 
 
+    if args.max_memory is not None :
+        if not input_is_spectra or len(args.infile) > 1 :
+            log.critical("--max-memory requires a single input spectra file")
+            sys.exit(12)
+        if args.lin_step is not None or args.log10_step is not None :
+            log.critical("cannot resample with --max-memory")
+            sys.exit(12)
+
+        meta = dict(fitsio.read_header(args.infile[0], 0))
+        _update_infiles(meta, args.infile)
+        coadd_spectra_file(args.infile[0], args.outfile,
+                max_memory=args.max_memory, cosmics_nsig=args.nsig,
+                onetile=args.onetile, cameras=args.coadd_cameras, meta=meta)
+        log.info("done")
+        return
+
     if input_is_spectra :
         spectra = read_spectra(args.infile[0], single=True)
         for filename in args.infile[1:] :
@@ -162,19 +192,11 @@ def main(args=None):
         log.info("resampling ...")
         spectra = resample_spectra_lin_or_log(spectra, log10_step=args.log10_step, wave_min =args.wave_min, wave_max =args.wave_max, fast = args.fast, nproc = args.nproc)
 
-    #- Add input files to header, removing previous INFIL* first
+    #- Add input files to header
     if spectra.meta is None:
         spectra.meta = dict()
 
-    for i in range(1000):
-        key = 'INFIL{:03d}'.format(i)
-        if key in spectra.meta:
-            del spectra.meta[key]
-        else:
-            break
-
-    for i, filename in enumerate(args.infile):
-        spectra.meta['INFIL{:03d}'.format(i)] = os.path.basename(filename)
+    _update_infiles(spectra.meta, args.infile)
 
     log.info("writing {} ...".format(args.outfile))
     write_spectra(args.outfile,spectra)
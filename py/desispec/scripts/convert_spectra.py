@@ -0,0 +1,78 @@
+"""
+Convert spectra and coadd files between FITS and HDF5 formats
+"""
+
+from __future__ import absolute_import, division, print_function
+
+import os
+import argparse
+
+from desiutil.log import get_logger
+from desispec.io import read_spectra, write_spectra
+from desispec.io.spectra_hdf5 import is_hdf5, write_spectra_hdf5
+
+def parse(options=None):
+    parser = argparse.ArgumentParser(
+        description="Convert spectra/coadd files between FITS and HDF5 (.h5/.hdf5) formats")
+    parser.add_argument("-i", "--infiles", type=str, nargs='+', required=True,
+            help="input spectra files")
+    parser.add_argument("-o", "--outfile", type=str, default=None,
+            help="output file, for a single input file")
+    parser.add_argument("--outdir", type=str, default=None,
+            help="output directory, for multiple input files")
+    parser.add_argument("--to", type=str, choices=['hdf5', 'fits'], default='hdf5',
+            help="output format with --outdir (default %(default)s)")
+    parser.add_argument("--chunk-targets", type=int, default=64,
+            help="number of spectra per HDF5 chunk (default %(default)s)")
+    parser.add_argument("--compression", type=str, choices=['gzip', 'lzf'], default=None,
+            help="lossless compression of HDF5 datasets")
+    parser.add_argument("--overwrite", action="store_true",
+            help="overwrite existing output files")
+
+    if options is None:
+        args = parser.parse_args()
+    else:
+        args = parser.parse_args(options)
+
+    if (args.outfile is None) == (args.outdir is None):
+        parser.error('exactly one of --outfile or --outdir is required')
+    if args.outfile is not None and len(args.infiles) > 1:
+        parser.error('use --outdir with multiple input files')
+
+    return args
+
+def _outfile(infile, outdir, to):
+    """Output file in outdir for infile, with the extension of format `to`"""
+    base = os.path.basename(infile)
+    for ext in ('.gz', '.fits', '.h5', '.hdf5'):
+        if base.endswith(ext):
+            base = base[:-len(ext)]
+    ext = '.h5' if to == 'hdf5' else '.fits'
+    return os.path.join(outdir, base+ext)
+
+def main(args=None):
+    if not isinstance(args, argparse.Namespace):
+        args = parse(args)
+
+    log = get_logger()
+    nbad = 0
+    for infile in args.infiles:
+        if args.outfile is not None:
+            outfile = args.outfile
+        else:
+            outfile = _outfile(infile, args.outdir, args.to)
+
+        if os.path.exists(outfile) and not args.overwrite:
+            log.error(f'{outfile} already exists; use --overwrite to replace it')
+            nbad += 1
+            continue
+
+        spectra = read_spectra(infile)
+        if is_hdf5(outfile):
+            write_spectra_hdf5(outfile, spectra, chunk_targets=args.chunk_targets,
+                    compression=args.compression)
+        else:
+            write_spectra(outfile, spectra)
+        log.info(f'Converted {infile} -> {outfile}')
+
+    return nbad
@@ -15,8 +15,9 @@ from ..io.meta import shorten_filename
 from ..io.util import checkgzip
 from ..pixgroup import FrameLite, SpectraLite
 from ..pixgroup import (get_exp2healpix_map, add_missing_frames,
-        frames2spectra, update_frame_cache, FrameLite)
-from ..coaddition import coadd
+        frames2spectra, frames2healpix_spectra, update_frame_cache, FrameLite,
+        iter_healpix_frames)
+from ..coaddition import coadd, coadd_spectra_file
 
 def parse(options=None):
     import argparse
@@ -46,6 +47,14 @@ def parse(options=None):
             help="output coadded spectra filename")
     parser.add_argument("--onetile", action="store_true",
             help="input spectra are from a single tile")
+    parser.add_argument("--coadd-max-memory", type=float, default=None,
+            help="coadd --outfile in chunks of targets using at most this memory in GB")
+    parser.add_argument("--all-healpix", action="store_true",
+            help="write spectra of every healpix of the input frames in a single pass; "
+                 "--outfile and --coaddfile must include {healpix} "
+                 "and may include {hpixgroup}=healpix//100. If --expfile has a "
+                 "HEALPIX column (nside --nside), only the frames of one healpix "
+                 "are kept in memory, reading ahead the frames of the next one")
 
     if options is None:
         args = parser.parse_args()
@@ -54,6 +63,106 @@ def parse(options=None):
 
     return args
 
+def _stream_coadd(args, outfile, coaddfile):
+    """
+    Return True if coaddfile is coadded from outfile in chunks with
+    --coadd-max-memory instead of from the spectra in memory
+    """
+    return (coaddfile is not None and outfile is not None
+            and args.coadd_max_memory is not None)
+
+def _write_spectra(args, spectra, infiles, outfile, coaddfile):
+    """
+    Add input files and --header keywords to spectra.meta, then write
+    spectra to outfile and their coadd to coaddfile (if not None)
+
+    If `_stream_coadd` is True, the coadd is not done here: the caller
+    must release its spectra and then call `_coadd_spectra_file`.
+    """
+    log = get_logger()
+
+    #- Record input files
+    if spectra.meta is None:
+        spectra.meta = dict()
+
+    for i, filename in enumerate(infiles):
+        spectra.meta[f'INFIL{i:03d}'] = shorten_filename(filename)
+
+    #- Add optional header keywords if requested
+    if args.header is not None:
+        for keyval in args.header:
+            key, value = keyval.split('=', maxsplit=1)
+            try:
+                spectra.meta[key] = int(value)
+            except ValueError:
+                try:
+                    spectra.meta[key] = float(value)
+                except ValueError:
+                    spectra.meta[key] = value
+
+    if outfile is not None:
+        log.info('Writing {}'.format(outfile))
+        io.write_spectra(outfile, spectra)
+
+    if coaddfile is not None and not _stream_coadd(args, outfile, coaddfile):
+        log.info('Coadding spectra')
+        #- in-place coadd updates spectra object
+        coadd(spectra, onetile=args.onetile)
+        log.info('Writing {}'.format(coaddfile))
+        io.write_spectra(coaddfile, spectra)
+
+def _coadd_spectra_file(args, outfile, coaddfile):
+    """
+    Coadd the spectra written to outfile into coaddfile in chunks of at
+    most --coadd-max-memory GB
+    """
+    log = get_logger()
+    log.info('Coadding spectra from {}'.format(outfile))
+    coadd_spectra_file(outfile, coaddfile,
+            max_memory=args.coadd_max_memory, onetile=args.onetile)
+
+def _healpix_outfiles(args, pix):
+    """
+    Return (outfile, coaddfile) of healpix pix for --all-healpix
+    """
+    outfile = coaddfile = None
+    if args.outfile is not None:
+        outfile = args.outfile.format(healpix=pix, hpixgroup=pix//100)
+    if args.coaddfile is not None:
+        coaddfile = args.coaddfile.format(healpix=pix, hpixgroup=pix//100)
+
+    return outfile, coaddfile
+
+def _group_exp2healpix(args, exp2pix):
+    """
+    Write the spectra of every healpix of exposure -> healpix map exp2pix
+    (columns NIGHT EXPID SPECTRO HEALPIX), reading the frames of one
+    healpix at a time with `desispec.pixgroup.iter_healpix_frames`
+
+    Returns the number of healpix written
+    """
+    log = get_logger()
+    npix = 0
+    for pix, frames in iter_healpix_frames(exp2pix, specprod_dir=args.reduxdir):
+        spectra = frames2spectra(frames, pix=pix, nside=args.nside)
+        if spectra.num_spectra() == 0:
+            log.warning(f'No input frame spectra pass nside={args.nside} nested healpix={pix}')
+            continue
+
+        #- only record the input frames with spectra on this pixel
+        infiles = [io.findfile('cframe', night, expid, camera, specprod_dir=args.reduxdir)
+                   for (night, expid, camera), frame in frames.items()
+                   if np.any(frame.healpix(args.nside) == pix)]
+        outfile, coaddfile = _healpix_outfiles(args, pix)
+        log.info(f'Healpix {pix}: {spectra.num_spectra()} spectra from {len(infiles)} frames')
+        _write_spectra(args, spectra, infiles, outfile, coaddfile)
+        del spectra
+        if _stream_coadd(args, outfile, coaddfile):
+            _coadd_spectra_file(args, outfile, coaddfile)
+        npix += 1
+
+    return npix
+
 def main(args=None):
 
     log = get_logger()
@@ -67,6 +176,11 @@ def main(args=None):
     if (args.inframes is not None) and (args.expfile is not None):
         log.critical('Must use --inframes or --expfile but not both')
         sys.exit(1)
+    if args.all_healpix:
+        for filename in (args.outfile, args.coaddfile):
+            if filename is not None and '{healpix}' not in filename:
+                log.critical(f'--all-healpix output {filename} must include {{healpix}}')
+                sys.exit(1)
 
     log.info('Starting at {}'.format(time.asctime()))
 
@@ -101,6 +215,12 @@ def main(args=None):
             log.critical('No exposures passed filters')
             sys.exit(13)
 
+        if args.all_healpix and 'HEALPIX' in nightexp.colnames:
+            npix = _group_exp2healpix(args, nightexp)
+            log.info(f'Wrote {npix} healpix')
+            log.info('Done at {}'.format(time.asctime()))
+            return 0
+
         framefiles = list()
         for night, expid, spectro in nightexp['NIGHT', 'EXPID', 'SPECTRO']:
             for band in ['b', 'r', 'z']:
@@ -112,6 +232,7 @@ def main(args=None):
     frames = dict()
     log.info(f'Reading {len(framefiles)} framefiles')
     foundframefiles = list()
+    framefile_of = dict()
     for filename in framefiles:
         try:
             filename = checkgzip(filename)
@@ -126,11 +247,31 @@ def main(args=None):
         expid = frame.meta['EXPID']
         camera = frame.meta['CAMERA']
         frames[(night, expid, camera)] = frame
+        framefile_of[(night, expid, camera)] = filename
 
     if len(frames) == 0:
         log.critical('No input frames found')
         sys.exit(1)
 
+    if args.all_healpix:
+        pixels = None if args.healpix is None else [args.healpix,]
+        npix = 0
+        for pix, spectra in frames2healpix_spectra(frames, nside=args.nside, pixels=pixels):
+            #- only record the input frames with spectra on this pixel
+            infiles = [filename for key, filename in framefile_of.items()
+                       if np.any(frames[key].healpix(args.nside) == pix)]
+            outfile, coaddfile = _healpix_outfiles(args, pix)
+            log.info(f'Healpix {pix}: {spectra.num_spectra()} spectra from {len(infiles)} frames')
+            _write_spectra(args, spectra, infiles, outfile, coaddfile)
+            del spectra
+            if _stream_coadd(args, outfile, coaddfile):
+                _coadd_spectra_file(args, outfile, coaddfile)
+            npix += 1
+
+        log.info(f'Wrote {npix} healpix')
+        log.info('Done at {}'.format(time.asctime()))
+        return 0
+
     log.info('Combining into spectra')
     spectra = frames2spectra(frames, pix=args.healpix, nside=args.nside)
 
@@ -145,35 +286,11 @@ def main(args=None):
         log.critical(f'Input frames have nside={args.nside} healpix {input_hpix}')
         sys.exit(1)
 
-    #- Record input files
-    if spectra.meta is None:
-        spectra.meta = dict()
-
-    for i, filename in enumerate(foundframefiles):
-        spectra.meta[f'INFIL{i:03d}'] = shorten_filename(filename)
-
-    #- Add optional header keywords if requested
-    if args.header is not None:
-        for keyval in args.header:
-            key, value = keyval.split('=', maxsplit=1)
-            try:
-                spectra.meta[key] = int(value)
-            except ValueError:
-                try:
-                    spectra.meta[key] = float(value)
-                except ValueError:
-                    spectra.meta[key] = value
-
-    if args.outfile is not None:
-        log.info('Writing {}'.format(args.outfile))
-        io.write_spectra(args.outfile, spectra)
-
-    if args.coaddfile is not None:
-        log.info('Coadding spectra')
-        #- in-place coadd updates spectra object
-        coadd(spectra, onetile=args.onetile)
-        log.info('Writing {}'.format(args.coaddfile))
-        io.write_spectra(args.coaddfile, spectra)
+    del frames
+    _write_spectra(args, spectra, foundframefiles, args.outfile, args.coaddfile)
+    del spectra
+    if _stream_coadd(args, args.outfile, args.coaddfile):
+        _coadd_spectra_file(args, args.outfile, args.coaddfile)
 
     log.info('Done at {}'.format(time.asctime()))
 
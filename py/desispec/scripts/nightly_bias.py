@@ -23,6 +23,10 @@ def parse(options=None):
             help='Number of zeros at start to skip [%(default)s]')
     p.add_argument('--anyzeros', action='store_true',
             help='allow non-calib ZEROs to be used')
+    p.add_argument('--max-memory', type=float, default=2.0,
+            help='memory budget in GB per camera for the image statistics [%(default)s]')
+    p.add_argument('--scratchdir', type=str, default=None,
+            help='directory for temporary image stack files (default outdir)')
     p.add_argument('--mpi', action='store_true',
             help='use MPI for parallelism')
 
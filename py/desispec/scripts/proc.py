@@ -43,10 +43,13 @@ import desispec.io
 from desispec.io import findfile, replace_prefix, shorten_filename
 from desispec.io.util import create_camword, decode_camword, parse_cameras
 from desispec.io.util import validate_badamps, get_tempfilename
+from desispec.io.asyncwrite import write_async, flush_writes, AsyncWriteError
 from desispec.calibfinder import findcalibfile,CalibFinder,badfibers
 from desispec.fiberflat import apply_fiberflat
 from desispec.sky import subtract_sky
 from desispec.util import runcmd
+from desispec.parallel import dynamic_range
+from desispec import metrics
 import desispec.scripts.assemble_fibermap
 import desispec.scripts.preproc
 import desispec.scripts.inspect_dark
@@ -64,7 +67,7 @@ import desispec.scripts.fluxcalibration
 import desispec.scripts.procexp
 import desispec.scripts.nightly_bias
 from desispec.maskbits import ccdmask
-from desispec.util import runcmd
+from desispec.util import runcmd, runcmd_cameras
 
 from desitarget.targetmask import desi_mask
 
@@ -86,6 +89,21 @@ def parse(options=None):
     args = parser.parse_args(options)
     return args
 
+def _camera_range(args, comm, step):
+    """
+    Iterate over the indices of args.cameras processed by this rank
+
+    Args:
+        args: parsed desi_proc arguments, with cameras and schedule
+        comm: MPI communicator or None
+        step (str): step name for the per-camera metrics records
+
+    All ranks of comm must loop until the end; see
+    desispec.parallel.dynamic_range
+    """
+    return dynamic_range(len(args.cameras), comm, schedule=args.schedule,
+                         step=step, names=args.cameras)
+
 def _log_timer(timer, timingfile=None, comm=None):
     """
     Log timing info, optionally writing to json timingfile
@@ -99,6 +117,10 @@ def _log_timer(timer, timingfile=None, comm=None):
 
     If comm is not None, collect timers across ranks.
     If timmingfile already exists, read and append timing then re-write.
+
+    The step and I/O records of desispec.metrics of all ranks are also
+    appended to {timingfile base}-metrics.jsonl and written in Chrome trace
+    format to {timingfile base}-trace.json, then cleared
     """
 
     log = get_logger()
@@ -109,6 +131,14 @@ def _log_timer(timer, timingfile=None, comm=None):
         timers = [timer,]
         rank, size = 0, 1
 
+    records = metrics.gather(comm, metrics.from_timer(timer) + metrics.get_records())
+    metrics.clear()
+    if rank == 0 and timingfile:
+        base = os.path.splitext(timingfile)[0]
+        metrics.write_jsonl(base+'-metrics.jsonl', records)
+        metrics.write_chrome_trace(base+'-trace.json', records)
+        log.info(f'Timing records saved to {base}-metrics.jsonl and {base}-trace.json')
+
     if rank == 0:
         stats = desiutil.timer.compute_stats(timers)
         if timingfile:
@@ -159,6 +189,9 @@ def main(args=None, comm=None):
         log.info(f'rank 0 started {thisfile} at {thistime}')
     #- Start timer; only print log messages from rank 0 (others are silent)
     timer = desiutil.timer.Timer(silent=(rank>0))
+    #- step and I/O records are only needed for the timingfile outputs
+    metrics.set_context(rank=rank,
+            enabled=metrics.is_enabled() or args.timingfile is not None)
 
     #- Fill in timing information for steps before we had the timer created
     if args.starttime is not None:
@@ -256,6 +289,8 @@ def main(args=None, comm=None):
     #-------------------------------------------------------------------------
     #- Proceeding with running
 
+    metrics.set_context(night=args.night, expid=args.expid)
+
     #- What are we going to do?
     if rank == 0:
         log.info('----------')
@@ -372,7 +407,7 @@ def main(args=None, comm=None):
 
     if not (args.obstype in ['SCIENCE'] and args.noprestdstarfit):
         timer.start('preproc')
-        for i in range(rank, len(args.cameras), size):
+        for i in _camera_range(args, comm, 'preproc'):
             camera = args.cameras[i]
             outfile = findfile('preproc', args.night, args.expid, camera)
             outdir = os.path.dirname(outfile)
@@ -453,7 +488,7 @@ def main(args=None, comm=None):
             if rank == 0 :
                 log.info('Starting desi_inspect_dark at {}'.format(time.asctime()))
 
-            for i in range(rank, len(args.cameras), size):
+            for i in _camera_range(args, comm, 'inspect_dark'):
                 camera = args.cameras[i]
                 preprocfile = findfile('preproc', args.night, args.expid, camera)
                 badcolumnsfile = findfile('badcolumns', night=args.night, camera=camera)
@@ -491,7 +526,7 @@ def main(args=None, comm=None):
         if rank == 0 and (not args.no_traceshift) :
             log.info('Starting traceshift at {}'.format(time.asctime()))
 
-        for i in range(rank, len(args.cameras), size):
+        for i in _camera_range(args, comm, 'traceshift'):
             camera = args.cameras[i]
             preprocfile = findfile('preproc', args.night, args.expid, camera)
             inpsf  = input_psf[camera]
@@ -540,7 +575,7 @@ def main(args=None, comm=None):
         if rank == 0:
             log.info('Starting traceshift before specex PSF fit at {}'.format(time.asctime()))
 
-        for i in range(rank, len(args.cameras), size):
+        for i in _camera_range(args, comm, 'arc_traceshift'):
             camera = args.cameras[i]
             preprocfile = findfile('preproc', args.night, args.expid, camera)
             inpsf  = input_psf[camera]
@@ -625,7 +660,8 @@ def main(args=None, comm=None):
             comm.barrier()
 
         # loop on all cameras and interpolate bad fibers
-        for camera in args.cameras[rank::size]:
+        for i in _camera_range(args, comm, 'interpolate_psf'):
+            camera = args.cameras[i]
             t0 = time.time()
 
             psfname = findfile('psf', args.night, args.expid, camera)
@@ -882,7 +918,7 @@ def main(args=None, comm=None):
         if rank==0 :
             log.info('Starting desi_compute_badcolumn_mask at {}'.format(time.asctime()))
 
-        for i in range(rank, len(args.cameras), size):
+        for i in _camera_range(args, comm, 'badcolumn_mask'):
             camera     = args.cameras[i]
             outfile    = findfile('frame', args.night, args.expid, camera)
             infile     = outfile.replace(".fits","-no-badcolumn-mask.fits")
@@ -935,6 +971,7 @@ def main(args=None, comm=None):
                 log.info('Flat exposure time was greater than 10 seconds')
                 log.info('Starting fiberflats at {}'.format(time.asctime()))
 
+            camera_kwargs = dict()
             for i in range(rank, len(args.cameras), size):
                 camera = args.cameras[i]
                 framefile = findfile('frame', args.night, args.expid, camera)
@@ -944,11 +981,12 @@ def main(args=None, comm=None):
                 cmd += " -o {}".format(fiberflatfile)
                 cmdargs = cmd.split()[1:]
 
-                result, success = runcmd(desispec.scripts.fiberflat.main,
-                        args=cmdargs, inputs=[framefile,], outputs=[fiberflatfile,])
+                camera_kwargs[camera] = dict(args=cmdargs,
+                        inputs=[framefile,], outputs=[fiberflatfile,])
 
-                if not success:
-                    error_count += 1
+            timing = runcmd_cameras(desispec.scripts.fiberflat.main, camera_kwargs,
+                    ncamera_workers=args.ncamera_workers, stepname='fiberflat')
+            error_count += sum([not success for success, _ in timing.values()])
 
             timer.stop('fiberflat')
             if comm is not None:
@@ -1002,6 +1040,7 @@ def main(args=None, comm=None):
         if rank == 0:
             log.info('Flatfield correction for humidity {}'.format(time.asctime()))
 
+        camera_kwargs = dict()
         for i in range(rank, len(args.cameras), size):
             camera = args.cameras[i]
             framefile = findfile('frame', args.night, args.expid, camera)
@@ -1021,11 +1060,13 @@ def main(args=None, comm=None):
             cmd += " -o {}".format(fiberflatfile)
             cmdargs = cmd.split()[1:]
 
-            result, success = runcmd(desispec.scripts.humidity_corrected_fiberflat.main,
-                    args=cmdargs, inputs=[framefile, input_fiberflatfile], outputs=[fiberflatfile,])
+            camera_kwargs[camera] = dict(args=cmdargs,
+                    inputs=[framefile, input_fiberflatfile], outputs=[fiberflatfile,])
 
-            if not success:
-                error_count += 1
+        timing = runcmd_cameras(desispec.scripts.humidity_corrected_fiberflat.main,
+                camera_kwargs, ncamera_workers=args.ncamera_workers,
+                stepname='fiberflat_humidity_correction')
+        error_count += sum([not success for success, _ in timing.values()])
 
         timer.stop('fiberflat_humidity_correction')
         if comm is not None:
@@ -1040,7 +1081,7 @@ def main(args=None, comm=None):
         if rank == 0:
             log.info('Applying fiberflat at {}'.format(time.asctime()))
 
-        for i in range(rank, len(args.cameras), size):
+        for i in _camera_range(args, comm, 'apply_fiberflat'):
             camera = args.cameras[i]
             fframefile = findfile('fframe', args.night, args.expid, camera)
             if not os.path.exists(fframefile):
@@ -1051,8 +1092,9 @@ def main(args=None, comm=None):
                 fr.meta['FIBERFLT'] = desispec.io.shorten_filename(flatfilename)
                 apply_fiberflat(fr, ff)
                 fframefile = findfile('fframe', args.night, args.expid, camera)
-                desispec.io.write_frame(fframefile, fr)
+                write_async(desispec.io.write_frame, fframefile, fr)
 
+        flush_writes()
         timer.stop('apply_fiberflat')
         if comm is not None:
             comm.barrier()
@@ -1067,7 +1109,7 @@ def main(args=None, comm=None):
         if rank == 0:
             log.info('Picking sky fibers at {}'.format(time.asctime()))
 
-        for i in range(rank, len(args.cameras), size):
+        for i in _camera_range(args, comm, 'picksky'):
             camera = args.cameras[i]
             framefile = findfile('frame', args.night, args.expid, camera)
             orig_frame = desispec.io.read_frame(framefile)
@@ -1093,8 +1135,9 @@ def main(args=None, comm=None):
             orig_frame.fibermap['OBJTYPE'][iisky] = 'SKY'
             orig_frame.fibermap['DESI_TARGET'][iisky] |= desi_mask.SKY
 
-            desispec.io.write_frame(framefile, orig_frame)
+            write_async(desispec.io.write_frame, framefile, orig_frame)
 
+        flush_writes()
         timer.stop('picksky')
         if comm is not None:
             comm.barrier()
@@ -1107,6 +1150,7 @@ def main(args=None, comm=None):
         if rank == 0:
             log.info('Starting sky subtraction at {}'.format(time.asctime()))
 
+        camera_kwargs = dict()
         for i in range(rank, len(args.cameras), size):
             camera = args.cameras[i]
             framefile = findfile('frame', args.night, args.expid, camera)
@@ -1142,11 +1186,17 @@ def main(args=None, comm=None):
 
             cmdargs = cmd.split()[1:]
 
-            result, success = runcmd(desispec.scripts.sky.main,
-                    args=cmdargs, inputs=[framefile, fiberflatfile], outputs=[skyfile,])
+            camera_kwargs[camera] = dict(args=cmdargs,
+                    inputs=[framefile, fiberflatfile], outputs=[skyfile,])
 
-            if not success:
-                error_count += 1
+        timing = runcmd_cameras(desispec.scripts.sky.main, camera_kwargs,
+                ncamera_workers=args.ncamera_workers, stepname='skysub')
+        error_count += sum([not success for success, _ in timing.values()])
+
+        for camera in camera_kwargs:
+            framefile = findfile('frame', args.night, args.expid, camera)
+            fiberflatfile = findfile('fiberflatexp', args.night, args.expid, camera)
+            skyfile = findfile('sky', args.night, args.expid, camera)
 
             #- sframe = flatfielded sky-subtracted but not flux calibrated frame
             #- Note: this re-reads and re-does steps previously done for picking
@@ -1172,7 +1222,7 @@ def main(args=None, comm=None):
                         subtract_sky(frame, sky, apply_throughput_correction=True)
                         frame.meta['IN_SKY'] = shorten_filename(skyfile)
                         frame.meta['FIBERFLT'] = shorten_filename(fiberflatfile)
-                        desispec.io.write_frame(sframefile, frame)
+                        write_async(desispec.io.write_frame, sframefile, frame)
                     except Exception as err:
                         import traceback
                         lines = traceback.format_exception(*sys.exc_info())
@@ -1181,6 +1231,12 @@ def main(args=None, comm=None):
                         log.warning(f'Continuing without {sframefile}')
                         error_count += 1
 
+        try:
+            flush_writes()
+        except AsyncWriteError as err:
+            log.error(str(err))
+            error_count += len(err.errors)
+
         timer.stop('skysub')
         if comm is not None:
             comm.barrier()
@@ -1315,6 +1371,7 @@ def main(args=None, comm=None):
             comm.barrier()
 
         #- Compute flux calibration vectors per camera
+        camera_kwargs = dict()
         for camera in args.cameras[rank::size]:
             framefile = findfile('frame', night, expid, camera)
             skyfile = findfile('sky', night, expid, camera)
@@ -1335,11 +1392,13 @@ def main(args=None, comm=None):
             inputs = [framefile, skyfile, fiberflatfile, stdfile, calibstars]
             cmdargs = cmd.split()[1:]
 
-            result, success = runcmd(desispec.scripts.fluxcalibration.main,
-                    args=cmdargs, inputs=inputs, outputs=[calibfile,])
+            camera_kwargs[camera] = dict(args=cmdargs,
+                    inputs=inputs, outputs=[calibfile,])
 
-            if not success:
-                error_count += 1
+        timing = runcmd_cameras(desispec.scripts.fluxcalibration.main,
+                camera_kwargs, ncamera_workers=args.ncamera_workers,
+                stepname='fluxcalib')
+        error_count += sum([not success for success, _ in timing.values()])
 
         timer.stop('fluxcalib')
         if comm is not None:
@@ -1356,7 +1415,8 @@ def main(args=None, comm=None):
         if rank == 0:
             log.info('Starting cframe file creation at {}'.format(time.asctime()))
 
-        for camera in args.cameras[rank::size]:
+        for i in _camera_range(args, comm, 'applycalib'):
+            camera = args.cameras[i]
             framefile = findfile('frame', night, expid, camera)
             skyfile = findfile('sky', night, expid, camera)
             spectrograph = int(camera[1])
@@ -13,6 +13,7 @@ from desispec.io import specprod_root
 from desispec.workflow.exptable import get_exposure_table_pathname
 from desispec.workflow.tableio import load_table
 from desispec.io.util import decode_camword, create_camword, camword_union, difference_camwords
+from desispec.filecache import get_calib_cache
 
 import desispec.scripts.proc as proc
 import desispec.scripts.proc_joint_fit as proc_joint_fit
@@ -181,7 +182,8 @@ def main(args=None, comm=None):
     #-------------------------------------------------------------------------
     #- Done
 
-    if rank == 0:
+    if rank == 0 and get_calib_cache().max_bytes > 0:
+        get_calib_cache().log_stats('Rank 0 calibration image cache')
         duration_seconds = time.time() - start_time
         mm = int(duration_seconds) // 60
         ss = int(duration_seconds - mm*60)
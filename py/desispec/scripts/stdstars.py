@@ -18,6 +18,7 @@ import astropy.coordinates as acoo
 import desispec.fluxcalibration
 from desispec import io
 from desispec.fluxcalibration import match_templates,normalize_templates,isStdStar
+from desispec.fluxcalibration import get_stdstar_template_norms
 from desispec.interpolation import resample_flux
 from desiutil.log import get_logger
 from desispec.parallel import default_nproc
@@ -48,6 +49,8 @@ def parse(options=None):
                          help='List of TARGETIDs of standards overriding the targeting info')
     parser.add_argument('--mpi', action='store_true', help='Use MPI')
     parser.add_argument('--use-gpu', action='store_true', help='Use GPU, if available')
+    parser.add_argument('--template-cache-dir', type=str, default=None, required=False,
+                        help='directory of cached template continua per wavelength grid, created if needed')
 
     log = get_logger()
 
@@ -464,6 +467,20 @@ def main(args=None, comm=None) :
     log.info("reading star models in %s"%args.starmodels)
     stdwave,stdflux,templateid,teff,logg,feh=io.read_stdstar_templates(args.starmodels)
 
+    # CACHED TEMPLATE CONTINUA PER WAVELENGTH GRID
+    ############################################
+    template_norms = None
+    if args.template_cache_dir is not None :
+        if rank == 0 :
+            waves = dict()
+            for camera in frames :
+                for i,frame in enumerate(frames[camera]) :
+                    waves["%s-%d"%(camera,i)] = frame.wave
+            template_norms = get_stdstar_template_norms(args.starmodels, waves,
+                    stdwave, stdflux, args.template_cache_dir, ncpu=ncpu)
+        if comm is not None:
+            template_norms = comm.bcast(template_norms, root=0)
+
     # COMPUTE MAGS OF MODELS FOR EACH STD STAR MAG
     ############################################
 
@@ -622,7 +639,9 @@ def main(args=None, comm=None) :
             stdwave, stdflux[selection],
             teff[selection], logg[selection], feh[selection],
             ncpu=ncpu, z_max=args.z_max, z_res=args.z_res,
-            template_error=args.template_error, comm=local_comm
+            template_error=args.template_error, comm=local_comm,
+            template_norms=None if template_norms is None else \
+                {key: norm[selection] for key, norm in template_norms.items()}
             )
 
         # Only local rank 0 can perform the remaining work
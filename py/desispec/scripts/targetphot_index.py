@@ -0,0 +1,61 @@
+"""
+Build the TARGETID index of targeting directories used by gather_targetphot
+"""
+
+from __future__ import absolute_import, division, print_function
+
+import argparse
+
+import numpy as np
+from astropy.table import Table
+
+from desiutil.log import get_logger
+from desispec.io.photo import build_targetphot_index
+
+def parse(options=None):
+    parser = argparse.ArgumentParser(
+        description="Build a TARGETID -> (target file, row) index for gather_targetphot")
+    parser.add_argument("-o", "--outfile", type=str, required=True,
+            help="output index FITS file")
+    parser.add_argument("--targetdirs", type=str, nargs='+', default=None,
+            help="targeting directories or ToO files to index")
+    parser.add_argument("--tileids", type=int, nargs='+', default=None,
+            help="index the targeting directories of these tiles")
+    parser.add_argument("--tilefile", type=str, default=None,
+            help="index the targeting directories of the TILEID in this table")
+    parser.add_argument("--fiberassign-dir", type=str, default=None,
+            help="top-level directory of the fiberassign files")
+
+    if options is None:
+        args = parser.parse_args()
+    else:
+        args = parser.parse_args(options)
+
+    if args.targetdirs is None and args.tileids is None and args.tilefile is None:
+        parser.error('at least one of --targetdirs, --tileids or --tilefile is required')
+
+    return args
+
+def main(args=None):
+    if not isinstance(args, argparse.Namespace):
+        args = parse(args)
+
+    log = get_logger()
+
+    tileids = list()
+    if args.tileids is not None:
+        tileids.extend(args.tileids)
+    if args.tilefile is not None:
+        tileids.extend(Table.read(args.tilefile)['TILEID'])
+
+    if len(tileids) > 0:
+        tileids = np.unique(tileids)
+        log.info('Indexing the targeting directories of {} tiles'.format(len(tileids)))
+    else:
+        tileids = None
+
+    index = build_targetphot_index(args.outfile, targetdirs=args.targetdirs,
+            tileids=tileids, fiberassign_dir=args.fiberassign_dir)
+
+    log.info('Indexed {} targets in {} files'.format(len(index), len(index.filenames)))
+    return 0
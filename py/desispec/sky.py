@@ -12,6 +12,8 @@ from collections import OrderedDict
 from desispec.resolution import Resolution
 from desispec.linalg import cholesky_solve
 from desispec.linalg import cholesky_invert
+from desispec.linalg import sparse_to_banded
+from desispec.linalg import cholesky_solve_banded_bordered
 from desispec.linalg import spline_fit
 from desiutil.log import get_logger
 from desispec import util
@@ -219,6 +221,96 @@ def get_sector_masks(frame):
     return masks
 
 
+def _solve_sky_normal_equations(A, B, nwave, bandwidth):
+    """
+    Solve the normal equations A.param = B of the sky fit
+
+    Args:
+        A: sparse (npar,npar) matrix whose first nwave x nwave block,
+           for the deconvolved sky, is banded; the other parameters
+           (sector offsets, sky gradients) form a dense border
+        B: 1D[npar] vector
+        nwave: number of wavelength parameters
+        bandwidth: number of upper diagonals of A[:nwave,:nwave]
+
+    Returns (param, w) where w is the boolean array of the constrained
+    parameters (with A_ii>0); unconstrained parameters are set to 0.
+
+    Uses a banded Cholesky decomposition with a bordered update for
+    the extra parameters, falling back to a dense solution if it fails.
+    """
+    log = get_logger()
+
+    diagonal = A.diagonal()
+    w = diagonal > 0
+    param = np.zeros(B.shape)
+
+    # unconstrained wavelength parameters have A_ii = 0, and therefore a
+    # null row and column in A; set A_ii = 1 and B_i = 0 to keep the
+    # band structure and get param_i = 0
+    ab = sparse_to_banded(A[:nwave, :nwave], bandwidth)
+    ab[-1, ~w[:nwave]] = 1.
+    Bw = B.copy()
+    Bw[:nwave][~w[:nwave]] = 0.
+
+    extra = nwave + np.where(w[nwave:])[0]
+    border = A[:nwave][:, extra].toarray()
+    corner = A[extra][:, extra].toarray()
+    try:
+        X = cholesky_solve_banded_bordered(ab,
+                np.concatenate([Bw[:nwave], Bw[extra]]), border, corner)
+        param[:nwave] = X[:nwave]
+        param[extra] = X[nwave:]
+        param[:nwave][~w[:nwave]] = 0.
+        return param, w
+    except np.linalg.LinAlgError:
+        log.info("banded cholesky failed, using dense solver")
+
+    A_pos_def = A[w][:, w].toarray()
+    try:
+        param[w]=cholesky_solve(A_pos_def,B[w])
+    except:
+        log.info("cholesky failed, trying svd")
+        param[w]=np.linalg.lstsq(A_pos_def,B[w])[0]
+
+    return param, w
+
+def _sky_parameter_covariance(A, nwave, bandwidth):
+    """
+    Return the covariance of the deconvolved sky parameters
+
+    Args:
+        A: sparse (npar,npar) matrix of the normal equations of the sky fit,
+           see `_solve_sky_normal_equations`
+        nwave: number of wavelength parameters
+        bandwidth: number of upper diagonals of A[:nwave,:nwave]
+
+    Returns the 2D[nwave,nwave] first block of the inverse of A, with
+    zeros for the unconstrained parameters.
+    """
+    log = get_logger()
+
+    w = A.diagonal() > 0
+
+    # same treatment of the unconstrained parameters as
+    # in _solve_sky_normal_equations
+    ab = sparse_to_banded(A[:nwave, :nwave], bandwidth)
+    ab[-1, ~w[:nwave]] = 1.
+    extra = nwave + np.where(w[nwave:])[0]
+    border = A[:nwave][:, extra].toarray()
+    corner = A[extra][:, extra].toarray()
+    try:
+        X, covar = cholesky_solve_banded_bordered(ab, np.zeros(nwave+extra.size),
+                border, corner, return_covariance=True)
+        covar[~w[:nwave]] = 0.
+        covar[:, ~w[:nwave]] = 0.
+        return covar
+    except np.linalg.LinAlgError:
+        log.warning("cholesky_solve_and_invert failed, switching to np.linalg.pinv")
+
+    parameter_covar = np.linalg.pinv(A.toarray())
+    return parameter_covar[:nwave, :nwave]
+
 def compute_uniform_sky(
         frame, nsig_clipping=4., max_iterations=100, model_ivar=False,
         add_variance=True, adjust_wavelength=True, adjust_lsf=True,
@@ -339,117 +431,118 @@ def compute_uniform_sky(
     else:
         nskygradpc = 0
 
+    # the matrix A is 1/2 of the second derivative of the chi2 with respect to the parameters
+    # A_ij = 1/2 d2(chi2)/di/dj
+    # A_ij = sum_fiber sum_wave_w ivar[fiber,w] d(model)/di[fiber,w] * d(model)/dj[fiber,w]
+
+    # the vector B is 1/2 of the first derivative of the chi2 with respect to the parameters
+    # B_i  = 1/2 d(chi2)/di
+    # B_i  = sum_fiber sum_wave_w ivar[fiber,w] d(model)/di[fiber,w] * (flux[fiber,w]-model[fiber,w])
+
+    # the model is model[fiber]=R[fiber]*sky
+    # and the parameters are the unconvolved sky flux at the wavelength i
+
+    # so, d(model)/di[fiber,w] = R[fiber][w,i]
+    # this gives
+    # A_ij = sum_fiber  sum_wave_w ivar[fiber,w] R[fiber][w,i] R[fiber][w,j]
+    # A = sum_fiber ( diag(sqrt(ivar))*R[fiber] ) ( diag(sqrt(ivar))* R[fiber] )^t
+    # A = sum_fiber sqrtwR[fiber] sqrtwR[fiber]^t
+    # and
+    # B = sum_fiber sum_wave_w ivar[fiber,w] R[fiber][w] * flux[fiber,w]
+    # B = sum_fiber sum_wave_w sqrt(ivar)[fiber,w]*flux[fiber,w] sqrtwR[fiber,wave]
+
+    # Julien can do A^T C^-1 A, A^T C^-1 b himself, but I like to write it
+    # out
+    # the model is that
+    # frame = R*(sky spectrum + sum(PC * (a*(x-<x>) + b*(y-<y>)))) + offsets
+    # We could consider adding a mild prior to deal with ill-conditioned
+    # matrices.
+
+    # The design matrix d(model)/d(param) does not depend on the weights,
+    # so it is built once, and only re-weighted at each iteration.
+
+    nsector = len(sectors)
+    npar = nwave + nsector + nskygradpc*2
+
+    yy = flux.reshape(-1)
+
+    # loop on fiber to handle resolution
+    allrows = []
+    allcols = []
+    allvals = []
+    for fiber in range(nfibers):
+        if fiber % 10 == 0:
+            log.info("sky fiber %d/%d"%(fiber,nfibers))
+        R = Rsky[fiber]
+        rows, cols, vals = scipy.sparse.find(R)
+        allrows.append(rows+fiber*nwave)
+        allcols.append(cols)
+        allvals.append(vals)
+        for skygradpcind in range(nskygradpc):
+            convskygradpc = R.dot(skygradpca.deconvflux[skygradpcind])
+            allrows.append(np.arange(nwave)+fiber*nwave)
+            allcols.append(nwave + nsector + skygradpcind*2 +
+                           np.zeros(nwave, dtype='i4'))
+            allvals.append(convskygradpc * dxskygradpca[skyfibers[fiber]])
+            allrows.append(np.arange(nwave)+fiber*nwave)
+            allcols.append(nwave + nsector + skygradpcind*2 + 1 +
+                           np.zeros(nwave, dtype='i4'))
+            allvals.append(convskygradpc * dyskygradpca[skyfibers[fiber]])
+
+    for i, secmask in enumerate(sectors):
+        rows = np.flatnonzero(secmask[skyfibers])
+        cols = np.full(len(rows), nwave+i)
+        if fiberflat is not None:
+            flat = (
+                fiberflat.fiberflat[skyfibers][secmask[skyfibers]].ravel())
+        else:
+            flat = np.ones(rows.shape)
+        vals = 1/(flat + (flat == 0))
+        allrows.append(rows)
+        allcols.append(cols)
+        allvals.append(vals)
+
+    design = scipy.sparse.coo_matrix(
+        (np.concatenate(allvals),
+         (np.concatenate(allrows), np.concatenate(allcols))),
+        shape=(nwave*nfibers, npar))
+    design = design.tocsr()
+    design.sum_duplicates()
+    design.sort_indices()
+
+    # model of sky fibers without offsets and gradients
+    design_sky = design[:, :nwave]
+
+    # row of each non-zero entry of the design matrix, to re-weight it
+    design_nnz_rows = np.repeat(np.arange(design.shape[0]), np.diff(design.indptr))
+    weighted_design = design.copy()
+
+    # A[:nwave,:nwave] is banded, with the bandwidth of R^T R
+    ndiag = frame.resolution_data.shape[1]
+    bandwidth = 2*(ndiag//2)
+
     nout_tot=0
     for iteration in range(max_iterations) :
 
-        # the matrix A is 1/2 of the second derivative of the chi2 with respect to the parameters
-        # A_ij = 1/2 d2(chi2)/di/dj
-        # A_ij = sum_fiber sum_wave_w ivar[fiber,w] d(model)/di[fiber,w] * d(model)/dj[fiber,w]
-
-        # the vector B is 1/2 of the first derivative of the chi2 with respect to the parameters
-        # B_i  = 1/2 d(chi2)/di
-        # B_i  = sum_fiber sum_wave_w ivar[fiber,w] d(model)/di[fiber,w] * (flux[fiber,w]-model[fiber,w])
-
-        # the model is model[fiber]=R[fiber]*sky
-        # and the parameters are the unconvolved sky flux at the wavelength i
-
-        # so, d(model)/di[fiber,w] = R[fiber][w,i]
-        # this gives
-        # A_ij = sum_fiber  sum_wave_w ivar[fiber,w] R[fiber][w,i] R[fiber][w,j]
-        # A = sum_fiber ( diag(sqrt(ivar))*R[fiber] ) ( diag(sqrt(ivar))* R[fiber] )^t
-        # A = sum_fiber sqrtwR[fiber] sqrtwR[fiber]^t
-        # and
-        # B = sum_fiber sum_wave_w ivar[fiber,w] R[fiber][w] * flux[fiber,w]
-        # B = sum_fiber sum_wave_w sqrt(ivar)[fiber,w]*flux[fiber,w] sqrtwR[fiber,wave]
-
-        #A=scipy.sparse.lil_matrix((nwave,nwave)).tocsr()
-
-        # Julien can do A^T C^-1 A, A^T C^-1 b himself, but I like to write it
-        # out
-        # the model is that
-        # frame = R*(sky spectrum + sum(PC * (a*(x-<x>) + b*(y-<y>)))) + offsets
-        # We could consider adding a mild prior to deal with ill-conditioned
-        # matrices.
-
-        nsector = len(sectors)
-        npar = nwave + nsector + nskygradpc*2
-
-        yy = np.zeros((nwave*nfibers))
-
-        SD = scipy.sparse.dia_matrix((nwave*nfibers,nwave*nfibers))
-        SD.setdiag(current_ivar.reshape(-1))
-
-        # loop on fiber to handle resolution
-        allrows = []
-        allcols = []
-        allvals = []
-        for fiber in range(nfibers):
-            if fiber % 10 == 0:
-                log.info("iter %d sky fiber %d/%d"%(iteration,fiber,nfibers))
-            R = Rsky[fiber]
-            rows, cols, vals = scipy.sparse.find(R)
-            allrows.append(rows+fiber*nwave)
-            allcols.append(cols)
-            allvals.append(vals)
-            yy[fiber*nwave:(fiber+1)*nwave] = flux[fiber]
-            for skygradpcind in range(nskygradpc):
-                convskygradpc = R.dot(skygradpca.deconvflux[skygradpcind])
-                allrows.append(np.arange(nwave)+fiber*nwave)
-                allcols.append(nwave + nsector + skygradpcind*2 +
-                               np.zeros(nwave, dtype='i4'))
-                allvals.append(convskygradpc * dxskygradpca[skyfibers[fiber]])
-                allrows.append(np.arange(nwave)+fiber*nwave)
-                allcols.append(nwave + nsector + skygradpcind*2 + 1 +
-                               np.zeros(nwave, dtype='i4'))
-                allvals.append(convskygradpc * dyskygradpca[skyfibers[fiber]])
-
-        for i, secmask in enumerate(sectors):
-            rows = np.flatnonzero(secmask[skyfibers])
-            cols = np.full(len(rows), nwave+i)
-            if fiberflat is not None:
-                flat = (
-                    fiberflat.fiberflat[skyfibers][secmask[skyfibers]].ravel())
-            else:
-                flat = np.ones(rows.shape)
-            vals = 1/(flat + (flat == 0))
-            allrows.append(rows)
-            allcols.append(cols)
-            allvals.append(vals)
-
-
-        design = scipy.sparse.coo_matrix(
-            (np.concatenate(allvals),
-             (np.concatenate(allrows), np.concatenate(allcols))),
-            shape=(nwave*nfibers, npar))
-        design = design.tocsr()
-
-        A = design.T.dot(SD.dot(design))
-        A = A.toarray()
-        B = design.T.dot(SD.dot(yy))
+        weighted_design.data[:] = design.data * current_ivar.reshape(-1)[design_nnz_rows]
+        A = design.T.dot(weighted_design).tocsr()
+        B = weighted_design.T.dot(yy)
 
         log.info("iter %d solving"%iteration)
-        w = A.diagonal() > 0
-        A_pos_def = A[w,:]
-        A_pos_def = A_pos_def[:,w]
-        param = B*0
-        try:
-            param[w]=cholesky_solve(A_pos_def,B[w])
-        except:
-            log.info("cholesky failed, trying svd in iteration {}".format(iteration))
-            param[w]=np.linalg.lstsq(A_pos_def,B[w])[0]
+        param, w = _solve_sky_normal_equations(A, B, nwave, bandwidth)
         deconvolved_sky = param[:nwave]
 
         log.info("iter %d compute chi2"%iteration)
 
+        # the parameters are directly the unconvolve sky flux
+        # so we simply have to reconvolve it
+        convolved_sky_flux = design_sky.dot(deconvolved_sky).reshape(nfibers, nwave)
+        chi2 = current_ivar*(flux-convolved_sky_flux)**2
         medflux=np.zeros(nfibers)
         for fiber in range(nfibers) :
-            # the parameters are directly the unconvolve sky flux
-            # so we simply have to reconvolve it
-            fiber_convolved_sky_flux = Rsky[fiber].dot(deconvolved_sky)
-            chi2[fiber]=current_ivar[fiber]*(flux[fiber]-fiber_convolved_sky_flux)**2
             ok=(current_ivar[fiber]>0)
             if np.sum(ok)>0 :
-                medflux[fiber] = np.median((flux[fiber]-fiber_convolved_sky_flux)[ok])
+                medflux[fiber] = np.median((flux[fiber]-convolved_sky_flux[fiber])[ok])
 
         log.info("rejecting")
 
@@ -514,14 +607,7 @@ def compute_uniform_sky(
     log.info("compute the parameter covariance")
     # we may have to use a different method to compute this
     # covariance
-
-    try :
-        parameter_covar=cholesky_invert(A)
-        # the above is too slow
-        # maybe invert per block, sandwich by R
-    except np.linalg.linalg.LinAlgError :
-        log.warning("cholesky_solve_and_invert failed, switching to np.linalg.lstsq and np.linalg.pinv")
-        parameter_covar = np.linalg.pinv(A)
+    parameter_sky_covar = _sky_parameter_covariance(A, nwave, bandwidth)
 
     log.info("compute mean resolution")
     # we make an approximation for the variance to save CPU time
@@ -531,14 +617,10 @@ def compute_uniform_sky(
 
     log.info("compute convolved sky and ivar")
 
-    parameter_sky_covar = parameter_covar[:nwave, :nwave]
-
     # The parameters are directly the unconvolved sky
-    # First convolve with average resolution :
-    convolved_sky_covar=Rmean.dot(parameter_sky_covar).dot(Rmean.T.todense())
-
-    # and keep only the diagonal
-    convolved_sky_var=np.diagonal(convolved_sky_covar)
+    # First convolve with average resolution, and keep only the diagonal:
+    # diag(R C R^T)_i = sum_j (R C)_ij R_ij
+    convolved_sky_var=np.asarray(Rmean.multiply(Rmean.dot(parameter_sky_covar)).sum(axis=1)).ravel()
 
     # inverse
     convolved_sky_ivar=(convolved_sky_var>0)/(convolved_sky_var+(convolved_sky_var==0))
@@ -549,14 +631,12 @@ def compute_uniform_sky(
     # The sky model for each fiber (simple convolution with resolution of each fiber)
     # cskyflux = design.dot(param).reshape(frame.flux.shape)
     # this is right for the sky fibers only.
-    cskyflux = np.zeros(frame.flux.shape)
-    for i in range(frame.nspec):
-        cskyflux[i] = frame.R[i].dot(deconvolved_sky)
-        for j in range(nskygradpc):
-            pcagradspechere = skygradpca.deconvflux[j]*(
-                dxskygradpca[i]*param[nwave + nsector + 2*j] +
-                dyskygradpca[i]*param[nwave + nsector + 2*j + 1])
-            cskyflux[i] += frame.R[i].dot(pcagradspechere)
+    cskyflux = frame.R.dot(deconvolved_sky)
+    for j in range(nskygradpc):
+        pcagradspec = skygradpca.deconvflux[j]*(
+            np.asarray(dxskygradpca)[:, None]*param[nwave + nsector + 2*j] +
+            np.asarray(dyskygradpca)[:, None]*param[nwave + nsector + 2*j + 1])
+        cskyflux += frame.R.dot(pcagradspec)
 
     if nskygradpc > 0:
         log.info(('Fit with %d spatial PCs, amplitudes ' % nskygradpc) +
@@ -803,7 +883,7 @@ def compute_uniform_sky(
     # set sky flux and ivar to zero to poorly constrained regions
     # and add margins to avoid expolation issues with the resolution matrix
     # limit to sky spectrum part of A
-    wmask = (np.diagonal(A[:nwave, :nwave])<=0).astype(float)
+    wmask = (A.diagonal()[:nwave]<=0).astype(float)
     # empirically, need to account for the full width of the resolution band
     # (realized here by applying twice the resolution)
     wmask = Rmean.dot(Rmean.dot(wmask))
@@ -1095,11 +1175,8 @@ def compute_polynomial_times_sky(frame, nsig_clipping=4.,max_iterations=30,model
     cskyivar = np.tile(convolved_sky_ivar, frame.nspec).reshape(frame.nspec, nwave)
 
     # The sky model for each fiber (simple convolution with resolution of each fiber)
-    cskyflux = np.zeros(frame.flux.shape)
-
     Pol = allfibers_monomials.T.dot(coef).T
-    for fiber in range(frame.nspec):
-        cskyflux[fiber] = frame.R[fiber].dot(Pol[fiber]*parameters)
+    cskyflux = frame.R.dot(Pol*parameters)
 
     # look at chi2 per wavelength and increase sky variance to reach chi2/ndf=1
     if skyfibers.size > 1 and add_variance :
@@ -1361,7 +1438,7 @@ def compute_non_uniform_sky(frame, nsig_clipping=4.,max_iterations=10,model_ivar
 
     log.info("compute convolved sky and ivar")
 
-    cskyflux = np.zeros(frame.flux.shape)
+    unconvolved_sky_flux = np.zeros(frame.flux.shape)
     cskyivar = np.zeros(frame.flux.shape)
 
     log.info("compute convolved parameter covariance")
@@ -1420,12 +1497,14 @@ def compute_non_uniform_sky(frame, nsig_clipping=4.,max_iterations=10,model_ivar
             for k in range(ncoef) :
                 convolved_fiber_skyvar += M[p]*M[k]*convolved_parameter_covar[p,k]
 
-        # convolve sky model with this fiber's resolution
-        cskyflux[i] = frame.R[i].dot(unconvolved_fiber_sky_flux)
+        unconvolved_sky_flux[i] = unconvolved_fiber_sky_flux
 
         # save inverse of variance
         cskyivar[i] = (convolved_fiber_skyvar>0)/(convolved_fiber_skyvar+(convolved_fiber_skyvar==0))
 
+    # convolve sky model with the resolution of each fiber
+    cskyflux = frame.R.dot(unconvolved_sky_flux)
+
 
     # look at chi2 per wavelength and increase sky variance to reach chi2/ndf=1
     if skyfibers.size > 1 and add_variance :
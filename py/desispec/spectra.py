@@ -26,6 +26,15 @@ from desiutil.io import encode_table
 from .maskbits import specmask
 from .resolution import Resolution
 
+def _check_resolution_data(band, rdata, fluxshape):
+    """Raise RuntimeError if rdata isn't a [nspec, ndiag, nwave] array for fluxshape"""
+    if rdata.ndim != 3:
+        raise RuntimeError("resolution array for band {} should have dim == 3".format(band))
+    if rdata.shape[0] != fluxshape[0]:
+        raise RuntimeError("resolution array spectrum dimension for band {} does not match flux".format(band))
+    if rdata.shape[2] != fluxshape[1]:
+        raise RuntimeError("resolution array wavelength dimension for band {} does not match grid".format(band))
+
 class Spectra(object):
     """Represents a grouping of spectra.
 
@@ -48,7 +57,9 @@ class Spectra(object):
     resolution_data : :class:`dict`, optional
         Dictionary of arrays specifying the block diagonal resolution matrix.
         The object for each band must be in one of the formats supported
-        by the Resolution class constructor.
+        by the Resolution class constructor, or a function returning such
+        an array, which is only called when resolution_data or R is
+        first accessed.
     fibermap, Table-like, optional
         Extended fibermap to use. If not specified, a fake one is created.
     exp_fibermap, Table-like, optional
@@ -120,13 +131,8 @@ class Spectra(object):
                     raise RuntimeError("mask array dimensions do not match flux for band {}".format(b))
                 if mask[b].dtype not in (int, np.int64, np.int32, np.uint64, np.uint32):
                     raise RuntimeError("bad mask type {}".format(mask.dtype))
-            if resolution_data is not None:
-                if resolution_data[b].ndim != 3:
-                    raise RuntimeError("resolution array for band {} should have dim == 3".format(b))
-                if resolution_data[b].shape[0] != flux[b].shape[0]:
-                    raise RuntimeError("resolution array spectrum dimension for band {} does not match flux".format(b))
-                if resolution_data[b].shape[2] != wave[b].shape[0]:
-                    raise RuntimeError("resolution array wavelength dimension for band {} does not match grid".format(b))
+            if resolution_data is not None and not callable(resolution_data[b]):
+                _check_resolution_data(b, resolution_data[b], flux[b].shape)
             if extra is not None:
                 for ex in extra[b].items():
                     if ex[1].shape != flux[b].shape:
@@ -167,13 +173,13 @@ class Spectra(object):
         else:
             self.mask = {}
         
+        #- Resolution matrices are created when R is first accessed
+        self._R = None
         if resolution_data is None:
-            self.resolution_data = None
-            self.R = None
+            self._resolution_data = None
         else:
-            self.resolution_data = {}
-            self.R = {}
-        
+            self._resolution_data = {}
+
         if extra is None:
             self.extra = None
         else:
@@ -186,14 +192,50 @@ class Spectra(object):
             if mask is not None:
                 self.mask[b] = np.copy(mask[b])
             if resolution_data is not None:
-                self.resolution_data[b] = resolution_data[b].astype(self._ftype)
-                self.R[b] = np.array( [ Resolution(r) for r in resolution_data[b] ] )
+                if callable(resolution_data[b]):
+                    self._resolution_data[b] = resolution_data[b]
+                else:
+                    self._resolution_data[b] = resolution_data[b].astype(self._ftype)
             if extra is not None:
                 self.extra[b] = {}
                 for ex in extra[b].items():
                     self.extra[b][ex[0]] = np.copy(ex[1].astype(self._ftype))
 
 
+    @property
+    def resolution_data(self):
+        """
+        (dict): the 3D resolution data arrays for each band, or None;
+        deferred arrays are read when first accessed.
+        """
+        if self._resolution_data is not None:
+            for b, rdata in self._resolution_data.items():
+                if callable(rdata):
+                    rdata = np.asarray(rdata(), dtype=self._ftype)
+                    _check_resolution_data(b, rdata, self.flux[b].shape)
+                    self._resolution_data[b] = rdata
+        return self._resolution_data
+
+    @resolution_data.setter
+    def resolution_data(self, value):
+        self._resolution_data = value
+
+    @property
+    def R(self):
+        """
+        (dict): arrays of Resolution matrices for each band, or None;
+        created from resolution_data when first accessed.
+        """
+        if self._R is None and self._resolution_data is not None:
+            self._R = dict()
+            for b, rdata in self.resolution_data.items():
+                self._R[b] = np.array( [ Resolution(r) for r in rdata ] )
+        return self._R
+
+    @R.setter
+    def R(self, value):
+        self._R = value
+
     @property
     def bands(self):
         """
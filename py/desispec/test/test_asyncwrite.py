@@ -0,0 +1,107 @@
+"""
+tests desispec.io.asyncwrite
+"""
+
+import os
+import time
+import threading
+import unittest
+from unittest.mock import patch
+
+from desispec.io import asyncwrite
+from desispec.io.asyncwrite import AsyncWriter, AsyncWriteError, write_async, flush_writes
+from desispec.io.util import get_tempfilename
+from desispec import util
+
+def _write(results, key, value, delay=0.):
+    time.sleep(delay)
+    results[key] = value
+    return key
+
+def _fail(filename):
+    raise OSError('disk full')
+
+class TestAsyncWrite(unittest.TestCase):
+
+    def tearDown(self):
+        if asyncwrite._async_writer is not None:
+            asyncwrite._async_writer.close()
+        asyncwrite._async_writer = None
+
+    def test_writer(self):
+        """Test background writes and the flush barrier"""
+        results = dict()
+        with AsyncWriter(nthreads=2, max_pending=1) as writer:
+            futures = [writer.submit(_write, results, i, i**2, delay=0.01) for i in range(6)]
+            writer.flush()
+            self.assertEqual(results, {i:i**2 for i in range(6)})
+            self.assertEqual([f.result() for f in futures], list(range(6)))
+            self.assertEqual(writer.pending(), 0)
+
+            #- errors are raised at the barrier, once
+            writer.submit(_fail, '/blat/foo.fits')
+            writer.submit(_write, results, 'a', 1)
+            with self.assertRaises(AsyncWriteError) as cm:
+                writer.flush()
+            self.assertEqual(len(cm.exception.errors), 1)
+            self.assertIn('_fail(foo.fits)', str(cm.exception))
+            self.assertEqual(results['a'], 1)
+            writer.flush()
+
+    def test_write_async(self):
+        """Test opt-in process-wide writer"""
+        results = dict()
+        with patch.dict(os.environ, {'DESI_ASYNC_WRITE': '0'}):
+            self.assertIsNone(asyncwrite.get_async_writer())
+            self.assertEqual(write_async(_write, results, 'x', 1), 'x')
+            self.assertEqual(results['x'], 1)
+
+        with patch.dict(os.environ, {'DESI_ASYNC_WRITE': '1'}):
+            future = write_async(_write, results, 'y', 2, delay=0.05)
+            self.assertIsNotNone(asyncwrite._async_writer)
+            flush_writes()
+            self.assertTrue(future.done())
+            self.assertEqual(results['y'], 2)
+
+            write_async(_fail, 'blat.fits')
+            with self.assertRaises(AsyncWriteError):
+                flush_writes()
+
+    def test_flush_then_camera_pool(self):
+        """Test that a camera process pool can run after a flush"""
+        results = dict()
+        camera_kwargs = dict(b0=dict(args=['echo', 'b0']),
+                             r0=dict(args=['echo', 'r0']))
+        with patch.dict(os.environ, {'DESI_ASYNC_WRITE': '2'}):
+            write_async(_write, results, 'b0', 1, delay=0.05)
+            write_async(_write, results, 'r0', 2, delay=0.05)
+            self.assertGreater(threading.active_count(), 1)
+            flush_writes()
+            self.assertEqual(results, dict(b0=1, r0=2))
+
+            #- the writer threads are stopped at the barrier ...
+            self.assertEqual(threading.active_count(), 1)
+            with patch.object(util.get_logger(), 'warning') as warning:
+                timing = util.runcmd_cameras('true &&', camera_kwargs,
+                                             ncamera_workers=2)
+            warning.assert_not_called()
+            self.assertEqual([timing[c][0] for c in timing], [True, True])
+
+            #- ... and restarted by the next write
+            write_async(_write, results, 'z0', 3)
+            flush_writes()
+            self.assertEqual(results['z0'], 3)
+            self.assertEqual(threading.active_count(), 1)
+
+    def test_tempfilename(self):
+        """Test unique temporary files from writer threads"""
+        names = list()
+        thread = threading.Thread(target=lambda: names.append(get_tempfilename('/a/b.fits')))
+        thread.start()
+        thread.join()
+        main = get_tempfilename('/a/b.fits')
+        self.assertNotEqual(names[0], main)
+        self.assertTrue(names[0].endswith('.fits'))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,43 @@
+"""
+tests desispec.blockstats
+"""
+
+import unittest
+import numpy as np
+from scipy.ndimage import median_filter
+
+from desispec.blockstats import block_median, running_median
+
+class TestBlockStats(unittest.TestCase):
+
+    def test_block_median(self):
+        """Test block medians with bins of unequal sizes"""
+        rng = np.random.RandomState(0)
+        image = rng.normal(size=(103, 87))
+        bins0 = np.linspace(0, image.shape[0], 6).astype(int)
+        bins1 = np.linspace(0, image.shape[1], 5).astype(int)
+        medians = block_median(image, bins0, bins1)
+        self.assertEqual(medians.shape, (5, 4))
+        for i in range(bins0.size-1):
+            for j in range(bins1.size-1):
+                block = image[bins0[i]:bins0[i+1], bins1[j]:bins1[j+1]]
+                self.assertEqual(medians[i,j], np.median(block))
+
+    def test_running_median(self):
+        """Test running median against scipy.ndimage.median_filter"""
+        rng = np.random.RandomState(2)
+        for n in (1, 5, 50, 401):
+            x = rng.normal(size=n)
+            x[::3] = 0.5  #- include repeated values
+            for width in (1, 2, 5, 40, 200):
+                for mode in ('reflect', 'mirror', 'nearest', 'wrap', 'constant'):
+                    expected = median_filter(x, width, mode=mode, cval=0.1)
+                    result = running_median(x, width, mode=mode, cval=0.1)
+                    self.assertTrue(np.array_equal(result, expected),
+                                    'n={} width={} mode={}'.format(n, width, mode))
+
+        with self.assertRaises(ValueError):
+            running_median(np.zeros(10), 3, mode='foo')
+
+if __name__ == '__main__':
+    unittest.main()
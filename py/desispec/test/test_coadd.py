@@ -7,7 +7,8 @@ from astropy.table import Table
 from desispec.spectra import Spectra
 from desispec.io import empty_fibermap
 from desispec.coaddition import (coadd, fast_resample_spectra,
-        spectroperf_resample_spectra, coadd_fibermap, coadd_cameras)
+        spectroperf_resample_spectra, coadd_fibermap, coadd_cameras,
+        TargetGroups, _groupby_reduce, get_coadd_chunks)
 from desispec.specscore import compute_coadd_scores
 
 from desispec.maskbits import fibermask
@@ -280,6 +281,58 @@ class TestCoadd(unittest.TestCase):
         coadds = coadd_cameras(self.spectra)
         self.assertEqual(len(coadds.wave['brz']), 7781)
 
+    def test_coadd_cosmics(self):
+        """Test cosmic ray masking in coadd"""
+        nspec, nwave = 5, 20
+        s1 = self._random_spectra(nspec, nwave)
+        s1.flux['b'][:] = 1.0
+        s1.ivar['b'][:] = 1.0
+        s1.flux['b'][2, 10] = 100.0
+        cosmics = coadd(s1, cosmics_nsig=4.)
+        self.assertEqual(list(cosmics.colnames), ['TARGETID', 'NCOSMIC_B'])
+        self.assertEqual(cosmics['TARGETID'][0], 12)
+        #- the spike is masked and does not bias the coadd
+        self.assertGreater(cosmics['NCOSMIC_B'][0], 0)
+        self.assertAlmostEqual(s1.flux['b'][0, 10], 1.0)
+        self.assertAlmostEqual(s1.ivar['b'][0, 10], nspec-1)
+
+    def test_coadd_chunks(self):
+        """Test splitting spectra into chunks of whole targets"""
+        tids = np.array([30, 10, 30, 20, 10, 30, 40])
+        chunks = get_coadd_chunks(tids, 4)
+        self.assertEqual([list(c) for c in chunks], [[0, 2, 5], [1, 3, 4, 6]])
+
+        #- targets with more than max_rows spectra get their own chunk
+        chunks = get_coadd_chunks(tids, 2)
+        self.assertEqual([list(c) for c in chunks], [[0, 2, 5], [1, 4], [3, 6]])
+
+    def test_target_groups(self):
+        """Test TargetGroups and the group-by reduction"""
+        tids = np.array([30, 10, 30, 20, 10, 30])
+        tg = TargetGroups(tids)
+        self.assertEqual(list(tg.targets), [30, 10, 20])
+        self.assertEqual(tg.ntarget, 3)
+
+        rows, groups, starts, counts = tg.select()
+        self.assertEqual(list(rows), [0, 2, 5, 1, 4, 3])
+        self.assertEqual(list(groups), [0, 1, 2])
+        self.assertEqual(list(counts), [3, 2, 1])
+
+        data = np.arange(6*4).reshape(6, 4)
+        total = _groupby_reduce(data[rows], starts, counts)
+        for i, tid in enumerate(tg.targets):
+            self.assertTrue(np.all(total[i] == np.sum(data[tids==tid], axis=0)))
+
+        bits = _groupby_reduce(data[rows], starts, counts, np.bitwise_and)
+        for i, tid in enumerate(tg.targets):
+            self.assertTrue(np.all(bits[i] == np.bitwise_and.reduce(data[tids==tid], axis=0)))
+
+        #- targets with no good rows are dropped
+        good = (tids != 20)
+        rows, groups, starts, counts = tg.select(good)
+        self.assertEqual(list(groups), [0, 1])
+        self.assertEqual(list(rows), [0, 2, 5, 1, 4])
+
 
 def test_suite():
     """Allows testing of only this module with the command::
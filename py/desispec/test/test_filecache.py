@@ -0,0 +1,97 @@
+"""
+tests desispec.filecache
+"""
+
+import os
+import shutil
+import tempfile
+import unittest
+import numpy as np
+
+from desispec.filecache import FileCache
+
+class TestFileCache(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.testdir = tempfile.mkdtemp()
+
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(cls.testdir, ignore_errors=True)
+
+    def setUp(self):
+        self.nread = 0
+
+    def _write(self, name, value, n=100):
+        filename = os.path.join(self.testdir, name)
+        np.save(filename, np.full(n, value, dtype=np.float64))
+        return filename + '.npy'
+
+    def _read(self, filename):
+        self.nread += 1
+        return np.load(filename)
+
+    def test_hits_and_eviction(self):
+        """Test LRU eviction with a byte budget"""
+        files = [self._write(f'a{i}', i) for i in range(3)]
+        cache = FileCache(max_bytes=2*800)
+
+        for filename in files[0:2]:
+            cache.get(filename, self._read)
+        self.assertEqual(self.nread, 2)
+
+        #- reuse a0 so that a1 is the least recently used
+        x = cache.get(files[0], self._read)
+        self.assertEqual(self.nread, 2)
+        self.assertEqual(x[0], 0)
+
+        cache.get(files[2], self._read)
+        self.assertEqual(cache.stats()['evictions'], 1)
+        cache.get(files[0], self._read)
+        self.assertEqual(self.nread, 3)
+        cache.get(files[1], self._read)
+        self.assertEqual(self.nread, 4)
+
+        stats = cache.stats()
+        self.assertEqual(stats['hits'], 2)
+        self.assertEqual(stats['misses'], 4)
+        self.assertEqual(stats['entries'], 2)
+        self.assertEqual(stats['nbytes'], 1600)
+
+        #- values larger than the cache are not cached
+        big = self._write('big', 1., n=1000)
+        cache.get(big, self._read)
+        cache.get(big, self._read)
+        self.assertEqual(self.nread, 6)
+
+        cache.resize(800)
+        self.assertEqual(len(cache), 1)
+
+    def test_modified_file(self):
+        """Test that rewritten files are read again"""
+        filename = self._write('b', 1.)
+        cache = FileCache(max_bytes=10000)
+        x = cache.get(filename, self._read, copy=True)
+        x[0] = 10
+        self.assertEqual(cache.get(filename, self._read)[0], 1.)
+        self.assertEqual(self.nread, 1)
+
+        st = os.stat(filename)
+        self._write('b', 2.)
+        os.utime(filename, ns=(st.st_atime_ns, st.st_mtime_ns+10**9))
+        self.assertEqual(cache.get(filename, self._read)[0], 2.)
+        self.assertEqual(self.nread, 2)
+        self.assertEqual(len(cache), 1)
+
+    def test_disabled(self):
+        """Test that a cache of size 0 always reads"""
+        filename = self._write('c', 3.)
+        cache = FileCache(max_bytes=0)
+        cache.get(filename, self._read)
+        cache.get(filename, self._read)
+        self.assertEqual(self.nread, 2)
+        self.assertEqual(len(cache), 0)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -68,6 +68,175 @@ class TestFluxCalibration(unittest.TestCase):
 
             #- TODO: come up with assertions for new return values
 
+    def test_cached_template_norms(self):
+        """
+        Test matching templates with cached template continua
+        """
+        import os, tempfile, shutil
+        from astropy.io import fits
+        from desispec.interpolation import resample_flux
+        from desispec.fluxcalibration import (match_templates, _resample_templates,
+                                              get_stdstar_template_norms)
+        frame=get_frame_data()
+        wave={"b":frame.wave,"r":frame.wave+10}
+        flux={"b":frame.flux[0],"r":frame.flux[0]*1.1}
+        ivar={"b":frame.ivar[0],"r":frame.ivar[0]/1.1}
+        resol_data={"b":frame.resolution_data[0],"r":frame.resolution_data[0]}
+
+        nmodels = 4
+        modelwave,modelflux=get_models(nmodels)
+        modelflux *= np.linspace(0.8, 1.2, nmodels)[:,None]
+        teff = np.linspace(5000, 7000, nmodels)
+        logg = np.linspace(4.0, 5.0, nmodels)
+        feh = np.linspace(-2.5, -0.5, nmodels)
+
+        #- vectorized resampling of redshifted templates matches resample_flux
+        resampled = _resample_templates([wave["b"],], modelwave, modelflux, z=1e-3)[0]
+        for i in range(nmodels):
+            expected = resample_flux(wave["b"], modelwave*(1+1e-3), modelflux[i])
+            self.assertTrue(np.allclose(resampled[i], expected))
+
+        tmpdir = tempfile.mkdtemp()
+        try:
+            modelfile = os.path.join(tmpdir, 'templates.fits')
+            hx = fits.HDUList([fits.PrimaryHDU(modelflux),
+                fits.BinTableHDU.from_columns([
+                    fits.Column(name='TEMPLATEID', format='K', array=np.arange(nmodels))]),
+                fits.ImageHDU(modelwave)])
+            hx.writeto(modelfile)
+            cachedir = os.path.join(tmpdir, 'cache')
+            norms = get_stdstar_template_norms(modelfile, wave, modelwave, modelflux, cachedir)
+            self.assertEqual(len(os.listdir(cachedir)), 2)
+            cached = get_stdstar_template_norms(modelfile, wave, modelwave, modelflux, cachedir)
+            for cam in wave:
+                self.assertEqual(norms[cam].shape, (nmodels, wave[cam].size))
+                self.assertTrue(np.allclose(norms[cam], cached[cam], rtol=1e-6))
+        finally:
+            shutil.rmtree(tmpdir)
+
+        coef1, z1, chi2_1 = match_templates(wave, copy.deepcopy(flux), copy.deepcopy(ivar),
+            resol_data, modelwave, modelflux, teff, logg, feh)
+        coef2, z2, chi2_2 = match_templates(wave, copy.deepcopy(flux), copy.deepcopy(ivar),
+            resol_data, modelwave, modelflux, teff, logg, feh, template_norms=norms)
+        self.assertEqual(z1, z2)
+        self.assertTrue(np.allclose(coef1, coef2, atol=1e-3))
+        self.assertTrue(np.isclose(chi2_1, chi2_2, rtol=1e-3))
+
+    def test_cached_template_norms_realistic(self):
+        """
+        Test that cached template continua don't change the best template match
+        of a noisy, redshifted star with absorption lines on b, r, z grids
+        """
+        from desispec.interpolation import resample_flux
+        from desispec.resolution import Resolution
+        from desispec.fluxcalibration import (match_templates,
+                                              compute_stdstar_template_norms)
+        rng = np.random.RandomState(0)
+
+        #- blackbody continua with Balmer, Mg b, Na D and Ca triplet lines
+        #- (wave, depth, sigma) whose depth depends on teff and feh
+        modelwave = np.arange(3500., 9000., 1.0)
+        lines = [(6564.6, 0.6, 6.), (4862.7, 0.5, 5.), (4341.7, 0.4, 4.),
+                 (4102.9, 0.35, 4.), (5176.7, 0.3, 2.), (5891.6, 0.3, 1.5),
+                 (5897.6, 0.25, 1.5), (8500.4, 0.3, 2.), (8544.4, 0.4, 2.),
+                 (8664.5, 0.35, 2.)]
+        teff, logg, feh, modelflux = [], [], [], []
+        for t in np.linspace(5500, 7000, 4):
+            for f in (-2.0, 0.0):
+                teff.append(t)
+                logg.append(4.0+0.1*(f+1))
+                feh.append(f)
+                cont = modelwave**-5/np.expm1(1.4388e8/(modelwave*t))
+                y = np.ones(modelwave.size)
+                for w, depth, sigma in lines:
+                    if sigma > 3:
+                        depth *= (t/6000.)**2
+                    else:
+                        depth *= (t/6000.)**-2 * 10**(0.3*f)
+                    y -= min(depth, 0.9)*np.exp(-0.5*((modelwave-w)/sigma)**2)
+                modelflux.append(cont*y/np.median(cont))
+        modelflux = np.array(modelflux)
+        teff, logg, feh = np.array(teff), np.array(logg), np.array(feh)
+
+        #- template 3 at z=6e-4, S/N~50 per pixel, with a smooth throughput
+        wave = {"b":np.arange(3600., 5800., 0.8), "r":np.arange(5760., 7620., 0.8),
+                "z":np.arange(7520., 8400., 0.8)}
+        resol_data = dict()
+        flux = dict()
+        ivar = dict()
+        for i, cam in enumerate(["b", "r", "z"]):
+            ww = wave[cam]
+            xx = np.arange(5, -6, -1)
+            kernel = np.exp(-0.5*(xx/(1.0+0.1*i))**2)
+            resol_data[cam] = np.tile((kernel/kernel.sum())[:,None], (1, ww.size))
+            model = Resolution(resol_data[cam]).dot(
+                resample_flux(ww, modelwave*(1+6e-4), modelflux[3]))
+            calib = 1+0.3*np.sin(3*(ww-ww[0])/(ww[-1]-ww[0]))
+            signal = 100*model*calib
+            err = np.sqrt(signal)/5
+            flux[cam] = signal + err*rng.normal(size=ww.size)
+            ivar[cam] = 1/err**2
+
+        #- same continua as get_stdstar_template_norms caches with --template-cache-dir
+        norms = {cam:compute_stdstar_template_norms(wave[cam], modelwave, modelflux)
+                 for cam in wave}
+
+        coef1, z1, chi2_1 = match_templates(wave, copy.deepcopy(flux), copy.deepcopy(ivar),
+            resol_data, modelwave, modelflux, teff, logg, feh)
+        coef2, z2, chi2_2 = match_templates(wave, copy.deepcopy(flux), copy.deepcopy(ivar),
+            resol_data, modelwave, modelflux, teff, logg, feh, template_norms=norms)
+        self.assertEqual(np.argmax(coef1), 3)
+        self.assertEqual(np.argmax(coef2), 3)
+        self.assertEqual(z1, z2)
+        #- the approximate continua change the coefficients by ~1e-4
+        self.assertTrue(np.allclose(coef1, coef2, atol=1e-2))
+        self.assertTrue(np.isclose(chi2_1, chi2_2, rtol=1e-3))
+
+    def test_redshift_fit(self):
+        """
+        Test vectorized redshift scan against an explicit loop over shifts
+        """
+        from desispec.fluxcalibration import (redshift_fit, redshift_fit_batch,
+                                              _redshift_scan_chi2)
+        from desispec.interpolation import resample_flux
+        from desispec.resolution import Resolution
+
+        rng = np.random.RandomState(0)
+        ngrid, margin = 300, 12
+        data = rng.uniform(0.5, 1.5, (2, ngrid))
+        ivar = rng.uniform(0, 2, (2, ngrid))
+        model = rng.uniform(0.5, 1.5, (2, ngrid))
+        chi2 = _redshift_scan_chi2(data, ivar, model, margin)
+        for i in range(-margin, margin+1):
+            expected = np.sum(ivar[:, margin:-margin]*(data[:, margin:-margin]-model[:, margin+i:ngrid-margin+i])**2, axis=1)
+            self.assertTrue(np.allclose(chi2[:, i+margin], expected))
+
+        stdwave = np.linspace(3500, 6500, 6000)
+        stdflux = np.ones(stdwave.size)
+        for line in np.linspace(3700, 6300, 40):
+            stdflux *= 1 - 0.5*np.exp(-0.5*((stdwave-line)/2.)**2)
+        wave = {"b": np.arange(3800, 5000, 0.8), "r": np.arange(4900, 6000, 0.8)}
+        ztrue = [4e-4, -2e-4]
+        flux, ivar, rdata = dict(), dict(), dict()
+        for cam in wave:
+            nwave = wave[cam].size
+            kernel = np.exp(-0.5*np.arange(-5, 6)**2)
+            rdata[cam] = np.tile((kernel/kernel.sum())[:, None], (len(ztrue), 1, nwave))
+            flux[cam] = np.array([Resolution(rdata[cam][0]).dot(
+                resample_flux(wave[cam], stdwave*(1+z), stdflux)) for z in ztrue])
+            ivar[cam] = np.ones(flux[cam].shape)
+
+        z, zgrid, chi2 = redshift_fit_batch(wave, flux, ivar, rdata, stdwave, stdflux,
+                                            z_max=0.002, z_res=2e-5, return_chi2=True)
+        self.assertEqual(chi2.shape, (len(ztrue), zgrid.size))
+        self.assertTrue(np.allclose(z, ztrue, atol=3e-5))
+        for star in range(len(ztrue)):
+            zstar = redshift_fit(wave, {cam: flux[cam][star] for cam in wave},
+                                 {cam: ivar[cam][star] for cam in wave},
+                                 {cam: rdata[cam][star] for cam in wave},
+                                 stdwave, stdflux, z_max=0.002, z_res=2e-5)
+            self.assertEqual(zstar, z[star])
+
     def test_normalize_templates(self):
         """
         Test for normalization to a given magnitude for calibration
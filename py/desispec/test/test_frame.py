@@ -25,6 +25,11 @@ class TestFrame(unittest.TestCase):
         self.assertEqual(frame.nspec, nspec)
         self.assertEqual(frame.nwave, nwave)
         self.assertTrue(isinstance(frame.R[0], Resolution))
+        self.assertTrue(np.array_equal(frame.R.dot(flux)[1], frame.R[1].dot(flux[1])))
+        #- resolution matrices can also be set explicitly
+        frame.R = np.array([Resolution(r) for r in rdata])
+        self.assertTrue(isinstance(frame.R[2], Resolution))
+        self.assertEqual(frame.R.dot(flux).shape, flux.shape)
         #- check dimensionality mismatches
         self.assertRaises(AssertionError, lambda x: Frame(*x), (wave, wave, ivar, mask, rdata))
         self.assertRaises(AssertionError, lambda x: Frame(*x), (wave, flux[0:2], ivar, mask, rdata))
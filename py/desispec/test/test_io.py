@@ -436,6 +436,36 @@ class TestIO(unittest.TestCase):
             match = np.all(fibermap[name] == frame.fibermap[name])
             self.assertTrue(match, 'Fibermap column {} mismatch'.format(name))
 
+    def test_frame_read_partial(self):
+        """Test reading a subset of a Frame file, lazily or in single precision.
+        """
+        from ..io.frame import read_frame, write_frame
+        from ..io.fibermap import empty_fibermap
+        nspec, nwave, ndiag = 5, 10, 3
+        flux = np.random.uniform(size=(nspec, nwave))
+        ivar = np.random.uniform(size=(nspec, nwave))
+        mask = np.zeros((nspec, nwave), dtype=np.uint32)
+        wave = np.arange(nwave)
+        R = np.random.uniform( size=(nspec, ndiag, nwave) )
+        fibermap = empty_fibermap(nspec)
+        fibermap['TARGETID'] = np.arange(nspec)*2
+        frx = Frame(wave, flux, ivar, mask, R, fibermap=fibermap, meta=dict(FLAVOR='science'))
+        write_frame(self.testfile, frx)
+
+        frame = read_frame(self.testfile, targets=[6, 2], dtype='f4', lazy_resolution=True)
+        self.assertEqual(frame.nspec, 2)
+        self.assertTrue(np.all(frame.fibermap['TARGETID'] == [2, 6]))
+        self.assertEqual(frame.flux.dtype, np.float32)
+        self.assertTrue(np.all(frame.flux == flux[[1,3]].astype('f4')))
+        self.assertTrue(callable(frame._resolution_data))
+        self.assertEqual(len(frame.R), 2)
+        self.assertEqual(frame.resolution_data.dtype, np.float32)
+        self.assertTrue(np.all(frame.resolution_data == R[[1,3]].astype('f4')))
+
+        frame = read_frame(self.testfile, rows=[0, 2, 4], nspec=3)
+        self.assertTrue(np.all(frame.fibermap['TARGETID'] == [0, 4]))
+        self.assertTrue(np.all(frame.resolution_data == R[[0,2]].astype('f4')))
+
     def test_sky_rw(self):
         """Test reading and writing sky files.
         """
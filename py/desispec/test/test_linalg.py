@@ -9,6 +9,9 @@ import numpy.random
 from desispec.linalg import cholesky_solve
 from desispec.linalg import cholesky_solve_and_invert
 from desispec.linalg import cholesky_invert
+from desispec.linalg import sparse_to_banded
+from desispec.linalg import cholesky_solve_banded_bordered
+import scipy.sparse
 
 class TestLinalg(unittest.TestCase):
     
@@ -83,6 +86,41 @@ class TestLinalg(unittest.TestCase):
         
         
                 
+    def test_cholesky_solve_banded_bordered(self):
+        # create a random positive definite banded matrix A11
+        n1, n2, bandwidth = 30, 3, 4
+        H = numpy.random.random((3*n1, n1))
+        for i in range(3*n1) :
+            H[i, np.abs(np.arange(n1)-i//3) > bandwidth//2] = 0.
+        A11 = H.T.dot(H)
+        # add dense border
+        G = numpy.random.random((3*n1, n2))
+        A = np.zeros((n1+n2, n1+n2))
+        A[:n1,:n1] = A11
+        A[:n1,n1:] = H.T.dot(G)
+        A[n1:,:n1] = G.T.dot(H)
+        A[n1:,n1:] = G.T.dot(G) + np.eye(n2)
+
+        ab = sparse_to_banded(scipy.sparse.csr_matrix(A11), bandwidth)
+        self.assertEqual(ab.shape, (bandwidth+1, n1))
+        self.assertTrue(np.allclose(ab[-1], np.diag(A11)))
+        self.assertTrue(np.allclose(ab[-2,1:], np.diag(A11, 1)))
+
+        X = numpy.random.random(n1+n2)
+        B = A.dot(X)
+        Xs, cov = cholesky_solve_banded_bordered(ab, B, A[:n1,n1:], A[n1:,n1:],
+                return_covariance=True)
+        self.assertTrue(np.allclose(Xs, X))
+        self.assertTrue(np.allclose(cov, np.linalg.inv(A)[:n1,:n1]))
+
+        # no border
+        Xs = cholesky_solve_banded_bordered(ab, A11.dot(X[:n1]))
+        self.assertTrue(np.allclose(Xs, X[:n1]))
+
+        # non-zero values beyond bandwidth
+        with self.assertRaises(ValueError):
+            sparse_to_banded(scipy.sparse.csr_matrix(A11), bandwidth//2)
+
     def runTest(self):
         pass
                 
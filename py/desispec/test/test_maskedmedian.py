@@ -0,0 +1,65 @@
+"""
+tests desispec.maskedmedian
+"""
+
+import os
+import unittest
+import tempfile
+import numpy as np
+
+from desispec.maskedmedian import masked_median, ImageStack
+
+class TestMaskedMedian(unittest.TestCase):
+
+    def setUp(self):
+        rng = np.random.RandomState(0)
+        self.images = rng.normal(size=(6, 31, 20))
+        self.masks = (rng.uniform(size=self.images.shape) < 0.3).astype(np.int32)
+        #- a fully masked pixel and a pixel with a single good value
+        self.masks[:, 0, 0] = 1
+        self.masks[1:, 0, 1] = 2
+
+    def test_masked_median(self):
+        """Test masked_median against numpy masked arrays"""
+        for n in (1, 2, 5, 6):
+            images, masks = self.images[:n], self.masks[:n]
+            ref = np.ma.median(np.ma.masked_array(images, mask=(masks!=0)), axis=0).data
+            median = masked_median(images, masks)
+            self.assertTrue(np.array_equal(median, ref))
+
+        median = masked_median(self.images)
+        self.assertTrue(np.array_equal(median, np.median(self.images, axis=0)))
+
+    def test_image_stack(self):
+        """Test stripe-by-stripe statistics of an ImageStack"""
+        nimages, shape = self.images.shape[0], self.images.shape[1:]
+        images = self.images.copy()
+        images[2, 10, 10] = 1000.
+        ref_median = masked_median(images, self.masks)
+        flat = images.reshape(nimages, -1)
+        ares = np.abs(flat - ref_median.ravel())
+        good = ares < 4*1.4826*np.median(ares, axis=0)
+        ref_mean = (np.sum(flat*good, axis=0)/np.sum(good, axis=0)).reshape(shape)
+
+        scratchdir = tempfile.mkdtemp()
+        with ImageStack(nimages, shape, masks=True, scratchdir=scratchdir) as stack:
+            for i in range(nimages):
+                stack.set(i, images[i], self.masks[i])
+
+            #- a budget of a few rows per stripe
+            max_memory = 3*stack.nimages*shape[1]*8*4/1024**3
+            stripes = list(stack.stripes(max_memory))
+            self.assertEqual(len(stripes), 11)
+            self.assertEqual(stripes[-1], slice(30, 31))
+
+            median, mean = stack.clipped_mean(nsig=4., max_memory=max_memory)
+
+        self.assertTrue(np.array_equal(median, ref_median))
+        self.assertTrue(np.array_equal(mean, ref_mean))
+        self.assertNotEqual(mean[10, 10], np.mean(images[:, 10, 10]))
+        #- scratch files are removed
+        self.assertEqual(os.listdir(scratchdir), [])
+        os.rmdir(scratchdir)
+
+if __name__ == '__main__':
+    unittest.main()
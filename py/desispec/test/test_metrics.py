@@ -0,0 +1,131 @@
+"""
+tests desispec.metrics
+"""
+
+import os
+import json
+import tempfile
+import unittest
+
+import numpy as np
+import desiutil.timer
+
+from desispec import metrics
+from desispec.io import iotime
+
+class TestMetrics(unittest.TestCase):
+
+    def setUp(self):
+        metrics.clear()
+        self.enabled = metrics.is_enabled()
+        metrics.set_context(enabled=True)
+        self.tmpdir = tempfile.mkdtemp()
+        self.filename = os.path.join(self.tmpdir, 'frame-b1-00001234.fits')
+        with open(self.filename, 'w') as fx:
+            fx.write('x'*100)
+
+    def tearDown(self):
+        metrics.clear()
+        metrics._context.clear()
+        metrics._context['rank'] = 0
+        metrics.set_context(enabled=self.enabled)
+        for filename in os.listdir(self.tmpdir):
+            os.remove(os.path.join(self.tmpdir, filename))
+        os.rmdir(self.tmpdir)
+
+    def test_records(self):
+        """Test step and I/O records"""
+        metrics.set_context(rank=3, expid=np.int64(1234))
+
+        def read_frame():
+            return iotime.format('read', self.filename, 0.5)
+
+        msg = read_frame()
+        self.assertTrue(msg.startswith('iotime 0.500 sec to read frame-b1-00001234.fits'))
+
+        with metrics.timed('extract', camera='r2'):
+            pass
+
+        @metrics.timed_function()
+        def fit():
+            return 42
+        self.assertEqual(fit(), 42)
+
+        with self.assertRaises(ValueError):
+            with metrics.timed('fail'):
+                raise ValueError
+
+        records = metrics.get_records()
+        self.assertEqual([r['step'] for r in records], ['read_frame', 'extract', 'fit', 'fail'])
+        io = records[0]
+        self.assertEqual(io['kind'], 'read')
+        self.assertEqual(io['function'], 'read_frame')
+        self.assertEqual(io['nbytes'], 100)
+        self.assertEqual(io['camera'], 'b1')
+        self.assertEqual(io['duration'], 0.5)
+        self.assertEqual(records[1]['camera'], 'r2')
+        for rec in records:
+            self.assertEqual(rec['rank'], 3)
+
+        #- JSON lines round trip
+        jsonfile = os.path.join(self.tmpdir, 'metrics.jsonl')
+        metrics.write_jsonl(jsonfile)
+        metrics.write_jsonl(jsonfile, records[0:1])
+        records2 = metrics.read_jsonl(jsonfile)
+        self.assertEqual(len(records2), 5)
+        self.assertEqual(records2[0]['filename'], self.filename)
+        self.assertEqual(records2[0]['expid'], 1234)
+
+        table = metrics.to_table(records2)
+        self.assertEqual(len(table), 5)
+        self.assertEqual(list(table['NBYTES']), [100, -1, -1, -1, 100])
+        self.assertEqual(table['CAMERA'][2], '')
+
+    def test_disabled(self):
+        """Test that nothing is kept when recording is disabled"""
+        metrics.set_context(enabled=False)
+        self.assertFalse(metrics.is_enabled())
+        msg = iotime.format('read', self.filename, 0.5)
+        self.assertTrue(msg.startswith('iotime 0.500 sec to read'))
+        self.assertIsNone(metrics.record_io('write', self.filename, 0.1))
+        with metrics.timed('extract'):
+            pass
+        rec = metrics.record('task', 2.0, kind='task')
+        self.assertEqual(rec['duration'], 2.0)
+        self.assertEqual(metrics.get_records(), [])
+
+        metrics.set_context(enabled=True)
+        metrics.record('task', 2.0, kind='task')
+        self.assertEqual(len(metrics.get_records()), 1)
+        metrics.clear()
+        self.assertEqual(metrics.get_records(), [])
+
+    def test_chrome_trace(self):
+        """Test Chrome trace format export"""
+        timer = desiutil.timer.Timer(silent=True)
+        timer.start('preproc')
+        timer.stop('preproc')
+        timer.start('unfinished')
+        records = metrics.from_timer(timer, rank=1)
+        self.assertEqual(len(records), 1)
+        self.assertEqual(len(metrics.get_records()), 0)
+
+        iotime.format('write', self.filename, 0.1)
+        records += metrics.get_records()
+        self.assertEqual(metrics.gather(None, records), records)
+
+        tracefile = os.path.join(self.tmpdir, 'trace.json')
+        metrics.write_chrome_trace(tracefile, records)
+        with open(tracefile) as fx:
+            trace = json.load(fx)
+
+        events = [e for e in trace['traceEvents'] if e['ph'] == 'X']
+        self.assertEqual([e['name'] for e in events], ['preproc', 'test_chrome_trace'])
+        self.assertEqual(events[1]['cat'], 'write')
+        self.assertAlmostEqual(events[1]['dur'], 0.1e6)
+        self.assertEqual(events[1]['args']['nbytes'], 100)
+        names = [e['args']['name'] for e in trace['traceEvents'] if e['name'] == 'process_name']
+        self.assertEqual(len(names), 1)
+
+if __name__ == '__main__':
+    unittest.main()
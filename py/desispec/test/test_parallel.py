@@ -162,6 +162,120 @@ class TestParallel(unittest.TestCase):
         groups = weighted_partition(weights, num_groups-3, groups_per_node=groups_per_node)
         check_weight_distribution(weights, groups, num_nodes, groups_per_node)
 
+    def test_karmarkar_karp_partition(self):
+        """test desispec.parallel.karmarkar_karp_partition"""
+        weights = np.array([8, 7, 6, 5, 4])
+
+        #- greedy LPT gives [8,5,4] [7,6] while KK gives [8,6] [7,5,4]
+        groups = weighted_partition(weights, 2)
+        self.assertEqual(sorted([np.sum(weights[ii]) for ii in groups]), [13, 17])
+        groups = karmarkar_karp_partition(weights, 2)
+        self.assertEqual(len(groups), 2)
+        self.assertEqual(sorted([np.sum(weights[ii]) for ii in groups]), [14, 16])
+
+        #- every item is assigned exactly once
+        weights = np.random.RandomState(0).uniform(1, 10, size=50)
+        for n in [1, 3, 7, 50, 60]:
+            groups = karmarkar_karp_partition(weights, n)
+            self.assertEqual(len(groups), n)
+            self.assertEqual(sorted([i for ii in groups for i in ii]), list(range(50)))
+            lpt = weighted_partition(weights, n)
+            kkmax = max([np.sum(weights[ii]) for ii in groups])
+            lptmax = max([np.sum(weights[ii]) for ii in lpt])
+            self.assertLessEqual(kkmax, 1.05*lptmax)
+
+        #- spread over nodes
+        weights = np.ones(28)
+        weights[0:3] = 3
+        groups = karmarkar_karp_partition(weights, 12, groups_per_node=4)
+        for i in range(3):
+            big = [np.max(weights[groups[j]]) == 3 for j in range(4*i, 4*i+4)]
+            self.assertEqual(np.sum(big), 1)
+
+        #- no items
+        self.assertEqual(karmarkar_karp_partition([], 3), [[], [], []])
+
+    def test_dynamic_range(self):
+        """test desispec.parallel.dynamic_range and SharedCounter"""
+        from desispec import metrics
+
+        counter = SharedCounter(None, start=3)
+        self.assertEqual([counter.next() for i in range(3)], [3, 4, 5])
+        self.assertEqual(counter.next(increment=10), 6)
+        self.assertEqual(counter.next(), 16)
+        counter.free()
+
+        #- without a communicator, all items in order
+        for schedule in ['static', 'dynamic']:
+            self.assertEqual(list(dynamic_range(5, schedule=schedule)), list(range(5)))
+        self.assertEqual(list(dynamic_range(0)), [])
+        with self.assertRaises(ValueError):
+            list(dynamic_range(5, schedule='guided'))
+
+        #- static: round-robin over ranks
+        class FakeComm(object):
+            def __init__(self, rank, size):
+                self.rank, self.size = rank, size
+
+        self.assertEqual(list(dynamic_range(7, FakeComm(1, 3), schedule='static')), [1, 4])
+
+        #- per-item records
+        metrics.clear()
+        enabled = metrics.is_enabled()
+        metrics.set_context(enabled=True)
+        names = ['b0', 'r0', 'z0']
+        try:
+            for i in dynamic_range(3, step='preproc', names=names):
+                pass
+            records = metrics.get_records()
+        finally:
+            metrics.set_context(enabled=enabled)
+            metrics.clear()
+        self.assertEqual([r['task'] for r in records], names)
+        self.assertTrue(all([r['step'] == 'preproc' for r in records]))
+
+    def test_dynamic_range_error(self):
+        """the shared counter is only freed if all items were processed"""
+        import sys
+        from unittest.mock import patch
+        import desispec.parallel
+
+        class FakeComm(object):
+            rank, size = 0, 2
+            aborted = None
+            def Abort(self, errorcode):
+                self.aborted = errorcode
+
+        class FakeCounter(object):
+            freed = 0
+            def __init__(self, comm):
+                self.value = 0
+            def next(self):
+                self.value += 1
+                return self.value - 1
+            def free(self):
+                FakeCounter.freed += 1
+
+        comm = FakeComm()
+        excepthook = sys.excepthook
+        sys.excepthook = lambda *args: None
+        try:
+            with patch.object(desispec.parallel, 'SharedCounter', FakeCounter):
+                self.assertEqual(list(dynamic_range(3, comm)), [0, 1, 2])
+                self.assertEqual(FakeCounter.freed, 1)
+
+                with self.assertRaises(RuntimeError):
+                    for i in dynamic_range(3, comm, names=['b0', 'r0', 'z0']):
+                        raise RuntimeError('camera failed')
+
+                #- no collective free; an uncaught exception aborts all ranks
+                self.assertEqual(FakeCounter.freed, 1)
+                self.assertIsNone(comm.aborted)
+                sys.excepthook(RuntimeError, RuntimeError('camera failed'), None)
+                self.assertEqual(comm.aborted, 1)
+        finally:
+            sys.excepthook = excepthook
+
 def test_suite():
     """Allows testing of only this module with the command::
 
@@ -3,10 +3,14 @@ tests desispec.io.photo
 
 """
 import os
+import shutil
+import tempfile
 import unittest
 
 import numpy as np
-from desispec.io.photo import gather_targetphot, gather_tractorphot, gather_targetdirs
+import fitsio
+from desispec.io.photo import (gather_targetphot, gather_tractorphot, gather_targetdirs,
+                               TargetPhotIndex, build_targetphot_index)
 
 if 'NERSC_HOST' in os.environ and \
         os.getenv('DESI_SPECTRO_DATA') == '/global/cfs/cdirs/desi/spectro/data':
@@ -80,6 +84,197 @@ class TestFibermap(unittest.TestCase):
         for col in self.tractorphot.colnames:
             self.assertTrue(np.all(tractorphot[col] == self.tractorphot[col]))
 
+    def _make_targets(self, topdir):
+        """Write a fake fiberassign file with primary, secondary and ToO targets"""
+        from astropy.io import fits
+        from astropy.table import Table
+        from desimodel.footprint import radec2pix
+
+        rng = np.random.default_rng(1)
+        nside = 2
+        primdir = os.path.join(topdir, 'targets', 'main', 'resolve', 'dark')
+        scnddir = os.path.join(topdir, 'targets', 'main', 'secondary', 'dark')
+        toodir = os.path.join(topdir, 'ToO')
+        for d in (primdir, scnddir, toodir):
+            os.makedirs(d)
+
+        ntarg = 200
+        ra = rng.uniform(0, 360, ntarg)
+        dec = rng.uniform(-30, 60, ntarg)
+        targetid = np.arange(ntarg, dtype=np.int64) + 1000
+        flux = rng.uniform(0, 10, ntarg).astype('f4')
+        pix = radec2pix(nside, ra, dec)
+        for p in np.unique(pix):
+            ii = np.where(pix == p)[0]
+            data = np.zeros(len(ii), dtype=[('TARGETID', 'i8'), ('RA', 'f8'), ('DEC', 'f8'), ('FLUX_R', 'f4')])
+            data['TARGETID'] = targetid[ii]
+            data['RA'] = ra[ii]
+            data['DEC'] = dec[ii]
+            data['FLUX_R'] = flux[ii]
+            fitsio.write(os.path.join(primdir, 'targets-dark-hp-{}.fits'.format(p)), data,
+                         extname='TARGETS', header=dict(FILENSID=nside))
+
+        #- secondary targets, including one duplicate of a primary target
+        scnd = np.zeros(5, dtype=[('TARGETID', 'i8'), ('RA', 'f8'), ('DEC', 'f8'), ('FLUX_W1', 'f4')])
+        scnd['TARGETID'] = [5000, 5001, 5002, 5003, targetid[0]]
+        scnd['FLUX_W1'] = [1, 2, 3, 4, 5]
+        fitsio.write(os.path.join(scnddir, 'targets-dark-secondary.fits'), scnd, extname='SCND_TARGETS')
+
+        toofile = os.path.join(toodir, 'ToO.ecsv')
+        too = Table()
+        too['TARGETID'] = np.array([6000, 6001], dtype=np.int64)
+        too['RA'] = [10.0, 20.0]
+        too['DEC'] = [0.0, 1.0]
+        too.write(toofile, format='ascii.ecsv')
+
+        fadir = os.path.join(topdir, 'fiberassign')
+        os.makedirs(os.path.join(fadir, '000'))
+        hdr = fits.Header(dict(TARG=primdir, SCND=scnddir, TOO=toofile))
+        fits.PrimaryHDU(header=hdr).writeto(os.path.join(fadir, '000', 'fiberassign-000001.fits'))
+
+        input_cat = Table()
+        ii = np.array([0, 3, 10, 50, 150, 199])
+        input_cat['TARGETID'] = np.hstack([targetid[ii], [5001, 5003, 6001, 7000]])
+        input_cat['TARGET_RA'] = np.hstack([ra[ii], [10.0, 20.0, 20.0, 30.0]])
+        input_cat['TARGET_DEC'] = np.hstack([dec[ii], [0.0, 1.0, 1.0, 2.0]])
+        input_cat['TILEID'] = 1
+
+        return input_cat, fadir, [primdir, scnddir, toofile]
+
+    def test_targetphot_index(self):
+        """Test gather_targetphot with a TARGETID index gives the same results as scanning"""
+        topdir = tempfile.mkdtemp()
+        try:
+            input_cat, fadir, targetdirs = self._make_targets(topdir)
+
+            indexfile = os.path.join(topdir, 'targetphot-index.fits')
+            index = build_targetphot_index(indexfile, tileids=[1], fiberassign_dir=fadir)
+            self.assertEqual(len(index), 200 + 5 + 2)
+            self.assertTrue(os.path.exists(indexfile))
+
+            index = TargetPhotIndex.read(indexfile)
+            self.assertTrue(np.all(np.diff(index.targetid) >= 0))
+            for targetdir in targetdirs:
+                self.assertTrue(index.has_targetdir(targetdir + '/'))
+
+            matches = index.match([1000, 5001, 6001, 7000])
+            self.assertEqual(len(matches), 3)
+            #- duplicate TARGETID in primary and secondary files
+            self.assertEqual(len(index.match([1000])), 2)
+            self.assertEqual(len(index.match([1000], targetdir=targetdirs[1])), 1)
+
+            scanned = gather_targetphot(input_cat, fiberassign_dir=fadir)
+            indexed = gather_targetphot(input_cat, fiberassign_dir=fadir, targetindex=indexfile)
+            self.assertEqual(scanned.colnames, indexed.colnames)
+            for col in scanned.colnames:
+                self.assertTrue(np.all(scanned[col] == indexed[col]), col)
+
+            self.assertTrue(np.all(indexed['TARGETID'] == input_cat['TARGETID']))
+            self.assertTrue(np.all(indexed['FLUX_R'][0:6] > 0))
+            self.assertEqual(indexed['FLUX_W1'][7], 4)
+            self.assertEqual(indexed['RA'][8], 20.0)
+        finally:
+            shutil.rmtree(topdir)
+
+    def _make_tractor(self, dr9dir):
+        """Write fake DR9 Tractor catalogs of two southern bricks"""
+        from astropy.table import Table
+        from desiutil.brick import Bricks
+
+        bricks = Bricks()
+        input_cat = Table()
+        targetid, ra, dec, release, brickid, brickname, objid, photsys = [], [], [], [], [], [], [], []
+        truth = dict()
+        for ibrick, (bra, bdec) in enumerate([(150.125, 2.125), (36.125, -5.125)]):
+            name = bricks.brickname(bra, bdec)
+            bid = bricks.brickid(bra, bdec)
+            nobj = 6
+            data = np.zeros(nobj, dtype=[('release', 'i2'), ('brickid', 'i4'), ('brickname', 'S8'),
+                                         ('objid', 'i4'), ('brick_primary', '?'), ('type', 'S3'),
+                                         ('ra', 'f8'), ('dec', 'f8'), ('flux_r', 'f4'),
+                                         ('apflux_g', 'f4', (8,)), ('not_in_datamodel', 'f4')])
+            data['release'] = 9010
+            data['brickid'] = bid
+            data['brickname'] = name
+            data['objid'] = np.arange(nobj)
+            data['brick_primary'] = True
+            data['type'] = 'PSF'
+            data['ra'] = bra - 0.1 + 0.04*np.arange(nobj)
+            data['dec'] = bdec
+            data['flux_r'] = 10*ibrick + np.arange(nobj) + 1
+            data['apflux_g'] = 1.0
+            outdir = os.path.join(dr9dir, 'south', 'tractor', name[:3])
+            os.makedirs(outdir, exist_ok=True)
+            fitsio.write(os.path.join(outdir, 'tractor-{}.fits'.format(name)), data)
+
+            #- two objects with DR9 ids, in reverse order, and one positional match
+            for i in (4, 1):
+                targetid.append(len(targetid)+1)
+                ra.append(data['ra'][i])
+                dec.append(data['dec'][i])
+                release.append(9010)
+                brickid.append(bid)
+                brickname.append(name)
+                objid.append(i)
+                photsys.append('S')
+                truth[targetid[-1]] = data['flux_r'][i]
+            targetid.append(len(targetid)+1)
+            ra.append(data['ra'][2] + 0.1/3600)
+            dec.append(data['dec'][2])
+            release.append(0)
+            brickid.append(0)
+            brickname.append('')
+            objid.append(0)
+            photsys.append('')
+            truth[targetid[-1]] = data['flux_r'][2]
+
+        #- one object without a match
+        targetid.append(len(targetid)+1)
+        ra.append(150.3)
+        dec.append(2.1)
+        release.append(0)
+        brickid.append(0)
+        brickname.append('')
+        objid.append(0)
+        photsys.append('')
+        truth[targetid[-1]] = 0.0
+
+        input_cat['TARGETID'] = np.array(targetid, dtype=np.int64)
+        input_cat['TARGET_RA'] = ra
+        input_cat['TARGET_DEC'] = dec
+        input_cat['RELEASE'] = np.array(release, dtype='i2')
+        input_cat['BRICKID'] = np.array(brickid, dtype='i4')
+        input_cat['BRICKNAME'] = np.array(brickname, dtype='U8')
+        input_cat['BRICK_OBJID'] = np.array(objid, dtype='i4')
+        input_cat['PHOTSYS'] = np.array(photsys, dtype='U1')
+
+        return input_cat, truth
+
+    def test_gather_tractorphot_parallel(self):
+        """Test serial and parallel gather_tractorphot on fake Tractor catalogs"""
+        dr9dir = tempfile.mkdtemp()
+        try:
+            input_cat, truth = self._make_tractor(dr9dir)
+            serial = gather_tractorphot(input_cat.copy(), dr9dir=dr9dir)
+            parallel = gather_tractorphot(input_cat.copy(), dr9dir=dr9dir, nproc=2)
+
+            self.assertTrue(np.all(serial['TARGETID'] == input_cat['TARGETID']))
+            for targetid, flux in truth.items():
+                i = np.where(serial['TARGETID'] == targetid)[0][0]
+                self.assertEqual(serial['FLUX_R'][i], flux)
+            self.assertTrue(np.all(serial['APFLUX_G'][serial['FLUX_R'] > 0] == 1.0))
+            self.assertTrue(np.all(serial['TYPE'][serial['FLUX_R'] > 0] == 'PSF'))
+            self.assertTrue(np.all((serial['LS_ID'] > 0) == (serial['FLUX_R'] > 0)))
+            self.assertNotIn('NOT_IN_DATAMODEL', serial.colnames)
+
+            for col in serial.colnames:
+                self.assertTrue(np.all(serial[col] == parallel[col]), col)
+
+            subset = gather_tractorphot(input_cat.copy(), dr9dir=dr9dir, columns=['TARGETID', 'FLUX_R'])
+            self.assertEqual(subset.colnames, ['TARGETID', 'FLUX_R'])
+        finally:
+            shutil.rmtree(dr9dir)
+
 def test_suite():
     """Allows testing of only this module with the command::
 
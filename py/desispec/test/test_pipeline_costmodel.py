@@ -0,0 +1,166 @@
+"""
+tests desispec.pipeline.costmodel
+"""
+
+import os
+import unittest
+import shutil
+import tempfile
+
+import numpy as np
+
+try:
+    from desispec.pipeline import costmodel
+    from desispec.pipeline.costmodel import (TaskCostModel, simulate_makespan,
+        task_band, task_features)
+    from desispec.pipeline.plan import compute_worker_tasks
+    from desispec.pipeline.tasks.base import task_classes
+    #- a previous failed import can leave the task classes incomplete
+    nopipeline = not all([tt in task_classes for tt in ['extract', 'redshift']])
+except ImportError:
+    #- the pipeline tasks import redrock, specter, etc.
+    nopipeline = True
+
+
+@unittest.skipIf(nopipeline, 'pipeline dependencies not installed')
+class TestCostModel(unittest.TestCase):
+
+    def setUp(self):
+        self.testdir = tempfile.mkdtemp()
+        #- extract tasks run on 20 procs; r takes twice as long as b, and
+        #- the duration grows with the exposure time
+        self.records = list()
+        start = 1000.0
+        for expid in range(1, 9):
+            exptime = 300.0 * expid
+            for band, scale in [('b', 1.0), ('r', 2.0)]:
+                for spec in range(2):
+                    name = 'extract_20200101_{}_{}_{:08d}'.format(band, spec, expid)
+                    duration = scale * (60.0 + 0.1*exptime) * 60.0 / 20
+                    self.records.append(dict(kind='task', step='extract',
+                        task=name, camera='{}{}'.format(band, spec), procs=20,
+                        duration=duration, start=start, exptime=exptime,
+                        failed=False))
+        for pixel in range(10):
+            name = 'redshift_64_{}'.format(pixel)
+            self.records.append(dict(kind='task', step='redshift', task=name,
+                procs=32, duration=600.0 + 60.0*pixel, start=start+100,
+                failed=False))
+        #- failed tasks and other records are ignored
+        self.records.append(dict(kind='task', step='redshift',
+            task='redshift_64_99', procs=32, duration=1.0, failed=True))
+        self.records.append(dict(kind='step', step='extract', duration=1.0))
+
+    def tearDown(self):
+        if os.path.exists(self.testdir):
+            shutil.rmtree(self.testdir)
+
+    def test_fit(self):
+        """Fit, predict, write and read a cost model"""
+        model = TaskCostModel.fit(self.records)
+        self.assertEqual(model.terms['redshift']['nsamp'], 10)
+        self.assertEqual(task_band('extract_20200101_r_0_00000001'), 'r')
+
+        #- proc-minutes 60+0.1*exptime for b, twice that for r
+        b = model.predict('extract_20200101_b_3_00000009', 10, exptime=1000.0)
+        r = model.predict('extract_20200101_r_3_00000009', 10, exptime=1000.0)
+        self.assertAlmostEqual(b, 16.0)
+        self.assertAlmostEqual(r, 32.0)
+        #- without features, the mean
+        b = model.predict('extract_20200101_b_3_00000009', 20)
+        self.assertAlmostEqual(b, (60.0 + 0.1*300*4.5)/20)
+        #- redshift has no band
+        z = model.predict('redshift_64_123', 32)
+        self.assertAlmostEqual(z, np.mean(600.0 + 60.0*np.arange(10))/60.0)
+
+        #- no records: static estimate
+        psf = 'psf_20200101_b_0_00000001'
+        self.assertFalse(model.has_tasktype('psf'))
+        self.assertEqual(model.predict(psf, 10),
+                         task_classes['psf'].run_time(psf, 10))
+
+        modelfile = os.path.join(self.testdir, 'costmodel.yaml')
+        model.write(modelfile)
+        model2 = TaskCostModel.read(modelfile)
+        self.assertEqual(model2.predict('extract_20200101_r_3_00000009', 10, exptime=1000.0),
+                         model.predict('extract_20200101_r_3_00000009', 10, exptime=1000.0))
+
+    def test_compute_worker_tasks(self):
+        """Distribute tasks with a cost model"""
+        model = TaskCostModel.fit(self.records)
+        tasks = [r['task'] for r in self.records
+                 if r['kind'] == 'task' and r['step'] == 'extract']
+        for method in ['lpt', 'kk']:
+            worktasks, weights, dist = compute_worker_tasks('extract', tasks,
+                1.0, 4, 20, costmodel=model, method=method)
+            self.assertEqual(len(dist), 4)
+            self.assertEqual(sorted([i for ii in dist for i in ii]),
+                             list(range(len(tasks))))
+            #- r tasks are predicted to take twice as long as b
+            self.assertEqual(weights[0], 2*(60.0 + 0.1*300*4.5)/20)
+
+        with self.assertRaises(ValueError):
+            compute_worker_tasks('extract', tasks, 1.0, 4, 20,
+                                 costmodel=model, method='painter')
+
+    def test_features(self):
+        """Task features from the raw data header and the pipeline DB"""
+        class FakeDB(object):
+            def select_healpix_frame(self, props):
+                if props['pixel'] == 7:
+                    return [dict(ntargets=10), dict(ntargets=25)]
+                return []
+
+        costmodel._exptime_cache[(20200101, 9)] = 2000.0
+        costmodel._exptime_cache[(20200101, 10)] = None
+        try:
+            self.assertEqual(task_features('extract_20200101_r_3_00000009'),
+                             dict(exptime=2000.0))
+            self.assertEqual(task_features('extract_20200101_r_3_00000010'), dict())
+            self.assertEqual(task_features('redshift_64_7', db=FakeDB()),
+                             dict(nspec=35))
+            self.assertEqual(task_features('redshift_64_8', db=FakeDB()), dict())
+            self.assertEqual(task_features('redshift_64_7'), dict())
+
+            #- compute_worker_tasks predicts with the features
+            model = TaskCostModel.fit(self.records)
+            tasks = ['extract_20200101_b_3_00000010',
+                     'extract_20200101_b_3_00000009']
+            worktasks, weights, dist = compute_worker_tasks('extract', tasks,
+                1.0, 2, 10, costmodel=model)
+            self.assertEqual(worktasks, tasks[::-1])
+            self.assertAlmostEqual(weights[0], model.predict(tasks[1], 10,
+                                                             exptime=2000.0))
+            self.assertAlmostEqual(weights[1], model.predict(tasks[0], 10))
+        finally:
+            del costmodel._exptime_cache[(20200101, 9)]
+            del costmodel._exptime_cache[(20200101, 10)]
+
+    def test_simulate(self):
+        """Replay tasks on several node counts"""
+        model = TaskCostModel.fit(self.records)
+        nodes = [1, 2, 4, 8]
+        results = simulate_makespan(self.records, nodes, 40, model=model)
+        self.assertEqual(list(results[1]['tasktypes'].keys()), ['extract', 'redshift'])
+        makespan = [results[n]['makespan'] for n in nodes]
+        self.assertTrue(makespan[0] > makespan[1] > makespan[2] > makespan[3])
+        #- with 8 nodes there is one redshift task per worker
+        self.assertAlmostEqual(results[8]['tasktypes']['redshift'], 1140.0/60)
+        for n in nodes:
+            total = np.sum([r['duration']/60*r['procs'] for r in self.records
+                            if r['kind'] == 'task' and not r['failed']])
+            self.assertGreaterEqual(results[n]['makespan'], total/(40*n) - 1e-6)
+
+        #- the model has no features to tell redshift tasks apart, so
+        #- partitioning with the recorded durations does better
+        oracle = simulate_makespan(self.records, [4], 40, method='kk')
+        self.assertLess(oracle[4]['tasktypes']['redshift'],
+                        results[4]['tasktypes']['redshift'])
+
+
+def test_suite():
+    """Allows testing of only this module with the command::
+
+        python setup.py test -m <modulename>
+    """
+    return unittest.defaultTestLoader.loadTestsFromName(__name__)
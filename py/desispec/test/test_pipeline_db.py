@@ -0,0 +1,110 @@
+"""
+tests desispec.pipeline.db
+"""
+
+import os
+import unittest
+import shutil
+import tempfile
+
+try:
+    from desispec.pipeline.db import DataBaseSqlite
+    from desispec.pipeline.tasks.base import task_classes
+    #- a previous failed import can leave the task classes incomplete
+    nopipeline = not all([tt in task_classes for tt in ['preproc', 'spectra', 'redshift']])
+except ImportError:
+    #- the pipeline tasks import redrock, specter, etc.
+    nopipeline = True
+
+
+@unittest.skipIf(nopipeline, 'pipeline dependencies not installed')
+class TestPipelineDB(unittest.TestCase):
+
+    def setUp(self):
+        self.testdir = tempfile.mkdtemp()
+        self.dbpath = os.path.join(self.testdir, 'pipe.db')
+        self.db = DataBaseSqlite(self.dbpath, 'w')
+
+        self.preproc = list()
+        with self.db.cursor() as cur:
+            for expid in range(1, 4):
+                for band in ['b', 'r', 'z']:
+                    props = dict(night=20200101, band=band, spec=0, expid=expid,
+                                 flavor='science', state='waiting')
+                    task_classes['preproc'].insert(cur, props)
+                    self.preproc.append(task_classes['preproc'].name_join(props))
+
+            #- healpix_frame rows per pixel: (expid, state)
+            self.pixframes = {10: [(1, 1), (2, 2)], 20: [(1, 2), (2, 2)],
+                              30: [(1, 3), (3, 3)], 40: [(2, 0), (3, 0)]}
+            for pixel, frames in self.pixframes.items():
+                for expid, state in frames:
+                    cur.execute('insert into healpix_frame (night,expid,spec,nside,pixel,ntargets,state) '
+                                'values (20200101,{},0,64,{},10,{})'.format(expid, pixel, state))
+                for tt in ['spectra', 'redshift']:
+                    task_classes[tt].insert(cur, dict(nside=64, pixel=pixel, state='waiting'))
+
+    def tearDown(self):
+        shutil.rmtree(self.testdir)
+
+    def test_indexes(self):
+        """Test that the state query indexes are created"""
+        with self.db.cursor() as cur:
+            cur.execute("select name from sqlite_master where type='index'")
+            indexes = [x for (x, ) in cur.fetchall()]
+        for name in ['preproc_night_state', 'spectra_nside_pixel',
+                     'healpix_frame_nside_pixel']:
+            self.assertIn(name, indexes)
+
+        #- reopening an existing DB doesn't fail on existing indexes
+        db = DataBaseSqlite(self.dbpath, 'w')
+        self.assertEqual(len(db.get_states_type('preproc', self.preproc)), 9)
+
+    def test_states(self):
+        """Test bulk get and set of task states"""
+        states = self.db.get_states_type('preproc', self.preproc)
+        self.assertEqual(states, {name: 'waiting' for name in self.preproc})
+
+        newstates = [(name, 'failed' if i % 2 else 'ready') for i, name in enumerate(self.preproc)]
+        self.db.set_states(newstates)
+        states = self.db.get_states(self.preproc + ['preproc_20200101_b0_00000099'])
+        self.assertEqual(states, dict(newstates))
+
+        #- unknown and duplicate names are ignored
+        states = self.db.get_states_type('preproc', self.preproc[0:2] + self.preproc[0:1] + ['blat'])
+        self.assertEqual(sorted(states.keys()), sorted(self.preproc[0:2]))
+
+        #- names with quotes are bound, not formatted, into the SQL
+        self.assertEqual(self.db.get_states_type('preproc', ["x' or '1'='1"]), dict())
+
+    def test_submitted(self):
+        """Test bulk submitted flags"""
+        self.db.set_submitted(self.preproc[0:4])
+        submitted = self.db.get_submitted(self.preproc)
+        self.assertEqual(sum(submitted.values()), 4)
+        self.db.set_submitted(self.preproc[0:2], unset=True)
+        submitted = self.db.get_submitted(self.preproc)
+        self.assertEqual([submitted[x] for x in self.preproc[0:4]], [0, 0, 1, 1])
+
+    def test_getready_healpix(self):
+        """Test spectra and redshift readiness from the healpix_frame states"""
+        #- no nightly tasks on that night, whose dependencies are not in the DB
+        self.db.getready(night=20200102)
+        expected = {
+            'spectra': {10: 'ready', 20: 'done', 30: 'waiting', 40: 'waiting'},
+            'redshift': {10: 'ready', 20: 'ready', 30: 'done', 40: 'waiting'},
+            }
+        for tt in ['spectra', 'redshift']:
+            names = {pixel: task_classes[tt].name_join(dict(nside=64, pixel=pixel))
+                     for pixel in self.pixframes}
+            states = self.db.get_states_type(tt, list(names.values()))
+            for pixel, name in names.items():
+                self.assertEqual(states[name], expected[tt][pixel], (tt, pixel))
+
+
+def test_suite():
+    """Allows testing of only this module with the command::
+
+        python setup.py test -m <modulename>
+    """
+    return unittest.defaultTestLoader.loadTestsFromName(__name__)
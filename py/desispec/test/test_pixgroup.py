@@ -14,7 +14,8 @@ from ..test.util import get_frame_data
 from ..io import findfile, write_frame, read_spectra, write_spectra, empty_fibermap, specprod_root, iterfiles
 from ..io.util import add_columns
 from ..scripts import group_spectra
-from ..pixgroup import SpectraLite
+from ..pixgroup import (SpectraLite, FrameLite, frames2spectra, frames2healpix_spectra,
+        FrameCache, update_frame_cache, healpix_framekeys, iter_healpix_frames)
 from desispec.maskbits import fibermask
 from desiutil.io import encode_table
 
@@ -265,6 +266,158 @@ class TestPixGroup(unittest.TestCase):
         with fits.open(self.specfile, memmap=True) as fx:
             mask = fx['B_MASK'].data
 
+    def test_regroup_coadd_max_memory(self):
+        """Test coadding the grouped spectra file in chunks"""
+        coaddfile = os.path.join(self.outdir, 'coadd.fits')
+        cmd = f'desi_group_spectra -o {self.specfile} -c {coaddfile}'
+        cmd += ' --inframes ' + ' '.join(self.framefiles)
+        group_spectra.main(group_spectra.parse(cmd.split()[1:]))
+        ref = read_spectra(coaddfile)
+
+        os.remove(coaddfile)
+        cmd += ' --coadd-max-memory 0.0001'
+        group_spectra.main(group_spectra.parse(cmd.split()[1:]))
+        coadds = read_spectra(coaddfile)
+
+        self.assertTrue(np.all(coadds.fibermap['TARGETID'] == ref.fibermap['TARGETID']))
+        for band in ref.bands:
+            self.assertTrue(np.allclose(coadds.flux[band], ref.flux[band]))
+            self.assertTrue(np.allclose(coadds.ivar[band], ref.ivar[band]))
+
+    def test_regroup_all_healpix(self):
+        """Test grouping all healpix of the input frames in one pass"""
+        outfile = os.path.join(self.outdir, '{hpixgroup}', 'spectra-{healpix}.fits')
+        cmd = f'desi_group_spectra -o {outfile} --all-healpix --nside 16'
+        cmd += ' --inframes ' + ' '.join(self.framefiles)
+
+        args = group_spectra.parse(cmd.split()[1:])
+        group_spectra.main(args)
+
+        frames = dict()
+        for filename in self.framefiles:
+            frame = FrameLite.read(filename)
+            frames[(frame.meta['NIGHT'], frame.meta['EXPID'], frame.meta['CAMERA'])] = frame
+
+        pixels = sorted(set(np.concatenate([f.healpix(16) for f in frames.values()])))
+        nspec = 0
+        for pix in pixels:
+            specfile = outfile.format(healpix=pix, hpixgroup=pix//100)
+            spectra = read_spectra(specfile)
+            ref = frames2spectra(frames, pix=pix, nside=16)
+            self.assertEqual(spectra.num_spectra(), ref.num_spectra())
+            self.assertTrue(np.all(spectra.fibermap['TARGETID'] == ref.fibermap['TARGETID']))
+            self.assertTrue(np.all(spectra.flux['r'] == ref.flux['r']))
+            nspec += spectra.num_spectra()
+
+        self.assertEqual(nspec, self.nspec_per_frame * self.nframe_per_night * len(self.nights))
+
+    def test_regroup_all_healpix_expfile(self):
+        """Test grouping all healpix of an exposure -> healpix map"""
+        frames = dict()
+        for filename in self.framefiles:
+            frame = FrameLite.read(filename)
+            frames[(frame.meta['NIGHT'], frame.meta['EXPID'], frame.meta['CAMERA'])] = frame
+
+        rows = list()
+        for (night, expid, camera), frame in frames.items():
+            for pix in np.unique(frame.healpix(16)):
+                rows.append((night, expid, 0, pix))
+
+        exp2pix = Table(rows=rows, names=('NIGHT', 'EXPID', 'SPECTRO', 'HEALPIX'))
+        expfile = os.path.join(self.outdir, 'exp2pix.csv')
+        exp2pix.write(expfile, overwrite=True)
+
+        outfile = os.path.join(self.outdir, 'exp2pix', 'spectra-{healpix}.fits')
+        cmd = f'desi_group_spectra -o {outfile} --all-healpix --nside 16'
+        cmd += f' --expfile {expfile}'
+        args = group_spectra.parse(cmd.split()[1:])
+        group_spectra.main(args)
+
+        pixels = sorted(set(exp2pix['HEALPIX']))
+        nspec = 0
+        for pix in pixels:
+            spectra = read_spectra(outfile.format(healpix=pix))
+            ref = frames2spectra(frames, pix=pix, nside=16)
+            self.assertEqual(spectra.num_spectra(), ref.num_spectra())
+            self.assertTrue(np.all(spectra.fibermap['TARGETID'] == ref.fibermap['TARGETID']))
+            self.assertTrue(np.all(spectra.flux['r'] == ref.flux['r']))
+            nspec += spectra.num_spectra()
+
+        self.assertEqual(nspec, self.nspec_per_frame * self.nframe_per_night * len(self.nights))
+
+    def test_frames2healpix_spectra(self):
+        """Test frames2healpix_spectra with targets spread over several healpix"""
+        frames = dict()
+        for filename in self.framefiles:
+            frame = FrameLite.read(filename)
+            frame.fibermap['TARGET_RA'] = 30.0*np.arange(self.nspec_per_frame)
+            frame.fibermap['TARGET_DEC'] = 10.0
+            frames[(frame.meta['NIGHT'], frame.meta['EXPID'], frame.meta['CAMERA'])] = frame
+
+        results = list(frames2healpix_spectra(frames, nside=16))
+        pixels = [pix for pix, spectra in results]
+        self.assertEqual(pixels, sorted(set(frames[next(iter(frames))].healpix(16))))
+        self.assertEqual(len(pixels), self.nspec_per_frame)
+
+        for pix, spectra in results:
+            ref = frames2spectra(frames, pix=pix, nside=16)
+            self.assertEqual(spectra.num_spectra(), ref.num_spectra())
+            self.assertTrue(np.all(spectra.fibermap['TARGETID'] == ref.fibermap['TARGETID']))
+            for band in ['b', 'r', 'z']:
+                self.assertTrue(np.all(spectra.flux[band] == ref.flux[band]))
+
+        #- restricted to some pixels
+        results = list(frames2healpix_spectra(frames, nside=16, pixels=pixels[0:2]))
+        self.assertEqual([pix for pix, spectra in results], pixels[0:2])
+
+    def test_frame_cache(self):
+        """Test FrameCache read-ahead and LRU eviction driven by exp2healpix map"""
+        #- two fake healpix covered by the exposures of the first two nights
+        rows = list()
+        for ii, night in enumerate(self.nights[0:2]):
+            for nfram in range(self.nframe_per_night):
+                expid = ii*self.nframe_per_night + nfram + 1
+                rows.append((night, expid, 0, 100+ii))
+                if ii == 1:
+                    rows.append((night, expid, 0, 102))
+
+        exp2pix = Table(rows=rows, names=('NIGHT', 'EXPID', 'SPECTRO', 'HEALPIX'))
+        pixkeys = healpix_framekeys(exp2pix, specprod_dir=specprod_root())
+        self.assertEqual(list(pixkeys.keys()), [100, 101, 102])
+        #- missing r0 frame is skipped
+        self.assertEqual(len(pixkeys[100]), 3*self.nframe_per_night - 1)
+        self.assertNotIn((self.nights[0], 1, 'r0'), pixkeys[100])
+
+        with FrameCache(nthreads=2) as cache:
+            for pix, frames in iter_healpix_frames(exp2pix, cache=cache):
+                self.assertEqual(sorted(frames.keys()), sorted(pixkeys[pix]))
+                for key, frame in frames.items():
+                    self.assertEqual(frame.meta['EXPID'], key[1])
+                    self.assertEqual(frame.meta['CAMERA'], key[2])
+
+            stats = cache.stats()
+            #- pix 100 read directly, 101 prefetched, 102 same frames as 101
+            self.assertEqual(stats['misses'], 0)
+            self.assertEqual(stats['prefetch_hits'], 11 + 12)
+            self.assertEqual(stats['hits'], 0)
+            self.assertEqual(stats['entries'], 23)
+            self.assertGreater(stats['bytes_read'], 0)
+
+            #- cached frames are reused
+            frames = dict()
+            update_frame_cache(frames, pixkeys[100], cache=cache)
+            self.assertEqual(cache.stats()['hits'], 11)
+
+        #- budget for a bit more than one healpix of frames
+        nbytes = stats['nbytes'] // 23
+        cache = FrameCache(max_bytes=13*nbytes, nthreads=0)
+        for pix, frames in iter_healpix_frames(exp2pix, cache=cache):
+            self.assertEqual(sorted(frames.keys()), sorted(pixkeys[pix]))
+        self.assertEqual(cache.stats()['misses'], 23)
+        self.assertEqual(cache.stats()['evictions'], 10)
+        self.assertLessEqual(cache.nbytes, 13*nbytes)
+        cache.close()
+
     def test_reduxdir(self):
         #- Test using a non-standard redux directory
         reduxdir = specprod_root()
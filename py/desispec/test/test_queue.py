@@ -0,0 +1,142 @@
+"""
+tests desispec.workflow.queue
+"""
+
+import os
+import unittest
+import shutil
+import tempfile
+
+import numpy as np
+from astropy.table import Table
+
+from desispec.workflow.queue import (FakeQueue, QueueCache, update_from_queue,
+    queue_info_from_qids)
+
+
+class TestQueueCache(unittest.TestCase):
+
+    def setUp(self):
+        self.testdir = tempfile.mkdtemp()
+        self.queue = FakeQueue()
+        self.qids = [self.queue.submit(f'arc-20211102-0010706{i}-a0123456789')
+                     for i in range(4)]
+
+    def tearDown(self):
+        if os.path.exists(self.testdir):
+            shutil.rmtree(self.testdir)
+
+    def test_query_qids(self):
+        """Only new or unfinished jobs are queried, at most once per min_interval"""
+        cache = QueueCache(self.queue, min_interval=0)
+        qtable = cache.query_qids(self.qids + [-99, 12])
+        self.assertEqual(list(qtable['JOBID']), self.qids)
+        self.assertEqual(list(qtable['STATE']), ['PENDING']*4)
+        self.assertEqual(self.queue.nqueries, 1)
+
+        self.queue.set_state(self.qids[0], 'COMPLETED')
+        self.queue.set_state(self.qids[1], 'TIMEOUT')
+        self.queue.set_state(self.qids[2], 'RUNNING')
+        qtable = cache.query_qids(self.qids)
+        self.assertEqual(list(qtable['STATE']),
+                         ['COMPLETED', 'TIMEOUT', 'RUNNING', 'PENDING'])
+        self.assertEqual(self.queue.nqueries, 2)
+
+        #- jobs in a final state are not queried again
+        self.queue.set_state(self.qids[2], 'COMPLETED')
+        self.queue.set_state(self.qids[3], 'COMPLETED')
+        cache.query_qids(self.qids[0:2])
+        self.assertEqual(self.queue.nqueries, 2)
+        qtable = cache.query_qids(self.qids)
+        self.assertEqual(list(qtable['STATE']),
+                         ['COMPLETED', 'TIMEOUT', 'COMPLETED', 'COMPLETED'])
+        self.assertEqual(self.queue.nqueries, 3)
+        cache.query_qids(self.qids)
+        self.assertEqual(self.queue.nqueries, 3)
+        cache.query_qids(self.qids, force=True)
+        self.assertEqual(self.queue.nqueries, 4)
+
+        #- minimum poll interval, except for new jobs
+        cache = QueueCache(self.queue, min_interval=3600)
+        cache.query_qids(self.qids[2:])
+        self.queue.set_state(self.qids[2], 'FAILED')
+        qtable = cache.query_qids(self.qids[2:])
+        self.assertEqual(list(qtable['STATE']), ['COMPLETED', 'COMPLETED'])
+        nqueries = self.queue.nqueries
+        newqid = self.queue.submit('psfnight-20211102')
+        qtable = cache.query_qids([newqid,])
+        self.assertEqual(list(qtable['STATE']), ['PENDING'])
+        self.assertEqual(self.queue.nqueries, nqueries+1)
+
+    def test_snapshot(self):
+        """The snapshot file is shared by caches"""
+        snapshot = os.path.join(self.testdir, 'queue.json')
+        cache1 = QueueCache(self.queue, snapshot=snapshot, min_interval=3600)
+        cache1.query_qids(self.qids)
+        self.assertTrue(os.path.exists(snapshot))
+        self.assertEqual(self.queue.nqueries, 1)
+
+        #- a new manager invocation does not query again
+        cache2 = QueueCache(self.queue, snapshot=snapshot, min_interval=3600)
+        qtable = cache2.query_qids(self.qids)
+        self.assertEqual(self.queue.nqueries, 1)
+        self.assertEqual(list(qtable['JOBID']), self.qids)
+
+        #- but picks up the jobs queried by another one
+        self.queue.set_state(self.qids[0], 'COMPLETED')
+        cache3 = QueueCache(self.queue, snapshot=snapshot, min_interval=0)
+        cache3.query_qids(self.qids[0:1])
+        self.assertEqual(self.queue.nqueries, 2)
+        qtable = cache2.query_qids(self.qids[0:1])
+        self.assertEqual(self.queue.nqueries, 2)
+        self.assertEqual(qtable['STATE'][0], 'COMPLETED')
+
+        #- corrupted snapshots are ignored
+        with open(snapshot, 'w') as fx:
+            fx.write('{')
+        cache4 = QueueCache(self.queue, snapshot=snapshot, min_interval=3600)
+        self.assertEqual(len(cache4.jobs), 0)
+
+    def test_time_window(self):
+        """Time window queries are incremental"""
+        cache = QueueCache(self.queue, min_interval=0)
+        qtable = cache.query_time_window('2000-01-01T00:00:00')
+        self.assertEqual(list(qtable['JOBID']), self.qids)
+        self.queue.set_state(self.qids[0], 'COMPLETED')
+        newqid = self.queue.submit('ztile-1234-thru20211102')
+        qtable = cache.query_time_window('2000-01-01T00:00:00')
+        self.assertEqual(list(qtable['JOBID']), self.qids + [newqid,])
+        self.assertEqual(qtable['STATE'][0], 'COMPLETED')
+        self.assertEqual(self.queue.nqueries, 2)
+
+        #- not more than once per min_interval
+        cache.min_interval = 3600
+        self.queue.set_state(self.qids[1], 'COMPLETED')
+        qtable = cache.query_time_window('2000-01-01T00:00:00')
+        self.assertEqual(self.queue.nqueries, 2)
+        self.assertEqual(qtable['STATE'][1], 'PENDING')
+
+    def test_update_from_queue(self):
+        """update_from_queue with a cache"""
+        ptable = Table()
+        ptable['LATEST_QID'] = np.array(self.qids + [-99,])
+        ptable['STATUS'] = np.array(['UNSUBMITTED']*5, dtype='U20')
+        ptable['EXPID'] = np.arange(5)
+        ptable['SCRIPTNAME'] = [f'arc-20211102-0010706{i}' for i in range(5)]
+        self.queue.set_state(self.qids[1], 'RUNNING')
+        cache = QueueCache(self.queue, min_interval=0)
+        ptable = update_from_queue(ptable, cache=cache)
+        self.assertEqual(list(ptable['STATUS']),
+                         ['PENDING', 'RUNNING', 'PENDING', 'PENDING', 'UNSUBMITTED'])
+
+        #- same columns as from sacct
+        qtable = queue_info_from_qids(self.qids, dry_run=1)
+        self.assertEqual(cache.table(self.qids).colnames[0:7], qtable.colnames[0:7])
+
+
+def test_suite():
+    """Allows testing of only this module with the command::
+
+        python setup.py test -m <modulename>
+    """
+    return unittest.defaultTestLoader.loadTestsFromName(__name__)
@@ -6,7 +6,7 @@ import unittest, os
 import numpy as np
 from math import log
 
-from desispec.interpolation import resample_flux
+from desispec.interpolation import resample_flux, resample_flux_batch, resampling_matrix
 
 class TestResample(unittest.TestCase):
     """
@@ -91,6 +91,38 @@ class TestResample(unittest.TestCase):
     #     z2 = resample_flux(xx, x, y2)
     #     self.assertTrue(np.all(z1 == z2))
 
+    def test_batch_resample(self):
+        """Test batched resampling against resample_flux"""
+        rng = np.random.RandomState(0)
+        x = np.sort(rng.uniform(0, 100, 200))
+        flux = rng.normal(size=(5, x.size))
+        ivar = rng.uniform(0.5, 1, size=flux.shape)
+        ivar[:, 10:20] = 0.
+        for xout in (np.linspace(-5, 105, 77), np.linspace(20, 30, 40), x[::3]):
+            for extrapolate in (False, True):
+                yout = resample_flux_batch(xout, x, flux, extrapolate=extrapolate)
+                self.assertEqual(yout.shape, (5, xout.size))
+                for i in range(flux.shape[0]):
+                    ref = resample_flux(xout, x, flux[i], extrapolate=extrapolate)
+                    self.assertTrue(np.allclose(yout[i], ref, rtol=1e-12, atol=1e-12))
+
+            yout, ivarout = resample_flux_batch(xout, x, flux, ivar)
+            for i in range(flux.shape[0]):
+                ref, refivar = resample_flux(xout, x, flux[i], ivar[i])
+                self.assertTrue(np.allclose(yout[i], ref, rtol=1e-12, atol=1e-12))
+                self.assertTrue(np.allclose(ivarout[i], refivar, rtol=1e-12, atol=1e-12))
+
+        #- 1D input
+        yout = resample_flux_batch(xout, x, flux[0])
+        self.assertTrue(np.allclose(yout, resample_flux(xout, x, flux[0]), rtol=1e-12, atol=1e-12))
+
+        #- operators are cached by grid
+        self.assertTrue(resampling_matrix(xout, x) is resampling_matrix(xout.copy(), x.copy()))
+        self.assertFalse(resampling_matrix(xout, x) is resampling_matrix(xout, x, extrapolate=True))
+
+        with self.assertRaises(ValueError):
+            resample_flux_batch(xout, x, flux, ivar, extrapolate=True)
+
     @unittest.expectedFailure
     def test_edges(self):
         '''Test for large edge effects in resampling'''
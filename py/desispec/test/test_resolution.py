@@ -145,6 +145,61 @@ class TestResolution(unittest.TestCase):
         self.assertTrue(data is data2)
         self.assertTrue(offsets is offsets2)
 
+    def test_apply_resolution(self):
+        """Test batched convolution against per-spectrum sparse products"""
+        rng = np.random.RandomState(0)
+        nspec, ndiag, nwave = 4, 11, 50
+        for dtype in (np.float64, np.float32, '>f4'):
+            rdata = rng.uniform(size=(nspec, ndiag, nwave)).astype(dtype)
+            flux = rng.normal(size=(nspec, nwave))
+            flux1d = rng.normal(size=nwave)
+            matrices = [Resolution(r) for r in rdata]
+
+            result = desispec.resolution.apply_resolution(rdata, flux)
+            for i, R in enumerate(matrices):
+                self.assertTrue(np.array_equal(result[i], R.dot(flux[i])))
+
+            result = desispec.resolution.apply_resolution(rdata, flux1d)
+            for i, R in enumerate(matrices):
+                self.assertTrue(np.array_equal(result[i], R.dot(flux1d)))
+
+            result = desispec.resolution.apply_resolution_transpose(rdata, flux)
+            for i, R in enumerate(matrices):
+                self.assertTrue(np.allclose(result[i], R.T.dot(flux[i])))
+
+        with self.assertRaises(ValueError):
+            desispec.resolution.apply_resolution(rdata, flux[:, 1:])
+        with self.assertRaises(ValueError):
+            desispec.resolution.apply_resolution(rdata[:, 1:], flux)
+
+    def test_resolution_list(self):
+        """Test lazy creation of resolution matrices"""
+        rng = np.random.RandomState(1)
+        rdata = rng.uniform(size=(5, 7, 30))
+        flux = rng.normal(size=(5, 30))
+        Rlist = desispec.resolution.ResolutionList(rdata)
+        self.assertEqual(len(Rlist), 5)
+        self.assertTrue(all([R is None for R in Rlist._matrices]))
+
+        R1 = Rlist[1]
+        self.assertTrue(isinstance(R1, Resolution))
+        self.assertTrue(Rlist[1] is R1)
+        self.assertEqual(sum([R is not None for R in Rlist._matrices]), 1)
+
+        subset = Rlist[[0, 1, 3]]
+        self.assertEqual(subset.shape, (3,))
+        self.assertTrue(subset[1] is R1)
+        self.assertTrue(np.array_equal(subset[2].toarray(), Resolution(rdata[3]).toarray()))
+        self.assertEqual(len(Rlist[1:4]), 3)
+
+        meanR = np.sum(Rlist) / len(Rlist)
+        self.assertTrue(np.allclose(meanR.toarray(), Resolution(np.mean(rdata, axis=0)).toarray()))
+
+        #- batched and per-matrix products agree
+        matrices = desispec.resolution.ResolutionList(list(np.array(Rlist)), builder=None)
+        self.assertTrue(np.array_equal(Rlist.dot(flux), matrices.dot(flux)))
+        self.assertTrue(np.allclose(Rlist.transpose_dot(flux), matrices.transpose_dot(flux)))
+
 #- This runs all test* functions in any TestCase class in this file
 if __name__ == '__main__':
     unittest.main()           
@@ -14,6 +14,12 @@ import numpy.testing as nt
 
 from astropy.table import Table, vstack
 
+try:
+    import h5py
+    h5py_available = True
+except ImportError:
+    h5py_available = False
+
 from desiutil.io import encode_table
 from desispec.io import empty_fibermap
 from desispec.io.util import add_columns
@@ -30,6 +36,7 @@ class TestSpectra(unittest.TestCase):
 
         #- Test data and files to work with
         self.fileio = "test_spectra.fits"
+        self.fileh5 = "test_spectra.h5"
         self.fileappend = "test_spectra_append.fits"
         self.filebuild = "test_spectra_build.fits"
         self.meta = {
@@ -112,6 +119,8 @@ class TestSpectra(unittest.TestCase):
             os.remove(self.fileappend)
         if os.path.exists(self.filebuild):
             os.remove(self.filebuild)
+        if os.path.exists(self.fileh5):
+            os.remove(self.fileh5)
         pass
 
 
@@ -183,6 +192,137 @@ class TestSpectra(unittest.TestCase):
             raise ValueError(f'Unrecognized extension for {self.fileio=}')
 
 
+    def test_read_rows(self):
+        """Test reading a subset of rows with read_spectra"""
+        spec = Spectra(bands=self.bands, wave=self.wave, flux=self.flux,
+            ivar=self.ivar, mask=self.mask, resolution_data=self.res,
+            fibermap=self.fmap1, exp_fibermap=self.efmap1, meta=self.meta,
+            extra=self.extra, scores=self.scores)
+        write_spectra(self.fileio, spec)
+
+        rows = [3, 0, 1]
+        comp = read_spectra(self.fileio, rows=rows)
+        self.assertEqual(comp.num_spectra(), 3)
+        nt.assert_array_equal(comp.fibermap['TARGETID'], self.fmap1['TARGETID'][[0,1,3]])
+        nt.assert_array_equal(comp.scores['BLAT'], [0, 1, 3])
+        self.assertEqual(len(comp.exp_fibermap), 6)
+        for band in self.bands:
+            nt.assert_array_almost_equal(comp.flux[band], self.flux[band][[0,1,3]])
+            nt.assert_array_equal(comp.mask[band], self.mask[band][[0,1,3]])
+            nt.assert_array_almost_equal(comp.resolution_data[band], self.res[band][[0,1,3]])
+            nt.assert_array_almost_equal(comp.extra[band]['FOO'], self.extra[band]['FOO'][[0,1,3]])
+
+    def test_read_partial(self):
+        """Test reading targets, bands and columns with read_spectra"""
+        spec = Spectra(bands=self.bands, wave=self.wave, flux=self.flux,
+            ivar=self.ivar, mask=self.mask, resolution_data=self.res,
+            fibermap=self.fmap1, exp_fibermap=self.efmap1, meta=self.meta,
+            extra=self.extra, scores=self.scores)
+        write_spectra(self.fileio, spec)
+
+        targets = [459, 456, 1]
+        comp = read_spectra(self.fileio, targets=targets, bands=['R', 'z'],
+                            columns=['FIBER'], dtype=np.float32)
+        self.assertEqual(comp.bands, ['r', 'z'])
+        self.assertEqual(comp.fibermap.dtype.names, ('TARGETID', 'FIBER'))
+        nt.assert_array_equal(comp.fibermap['TARGETID'], [456, 459])
+        nt.assert_array_equal(comp.exp_fibermap['TARGETID'], [456, 459, 456, 459])
+        for band in comp.bands:
+            self.assertEqual(comp.flux[band].dtype, np.float32)
+            nt.assert_array_almost_equal(comp.flux[band], self.flux[band][[0,3]])
+            nt.assert_array_almost_equal(comp.resolution_data[band], self.res[band][[0,3]])
+
+        #- targets combined with rows
+        comp = read_spectra(self.fileio, targets=targets, rows=[1, 3])
+        nt.assert_array_equal(comp.fibermap['TARGETID'], [459,])
+
+        with self.assertRaises(ValueError):
+            read_spectra(self.fileio, bands=['x',])
+
+    def test_lazy_resolution(self):
+        """Test deferred reading of the resolution data"""
+        spec = Spectra(bands=self.bands, wave=self.wave, flux=self.flux,
+            ivar=self.ivar, mask=self.mask, resolution_data=self.res,
+            fibermap=self.fmap1, meta=self.meta)
+        write_spectra(self.fileio, spec)
+
+        comp = read_spectra(self.fileio, rows=[1, 2], lazy_resolution=True)
+        for band in self.bands:
+            self.assertTrue(callable(comp._resolution_data[band]))
+        self.assertIsNone(comp._R)
+
+        self.assertEqual(comp.R['b'][0].shape, (self.nwave, self.nwave))
+        for band in self.bands:
+            self.assertEqual(comp.resolution_data[band].dtype, np.float64)
+            nt.assert_array_almost_equal(comp.resolution_data[band], self.res[band][1:3])
+
+    @unittest.skipUnless(h5py_available, "h5py not installed; skipping HDF5 spectra tests")
+    def test_hdf5(self):
+        """Test HDF5 spectra files"""
+        from desispec.io.spectra_hdf5 import write_spectra_hdf5, append_spectra_hdf5
+        from desispec.pixgroup import SpectraLite
+        spec = Spectra(bands=self.bands, wave=self.wave, flux=self.flux,
+            ivar=self.ivar, mask=self.mask, resolution_data=self.res,
+            fibermap=self.fmap1, exp_fibermap=self.efmap1, meta=self.meta,
+            extra=self.extra, scores=self.scores,
+            extra_catalog=self.extra_catalog)
+
+        #- write_spectra/read_spectra dispatch on the extension
+        write_spectra(self.fileh5, spec)
+        comp = read_spectra(self.fileh5)
+        self.verify(comp, self.fmap1)
+        nt.assert_array_equal(comp.exp_fibermap, self.efmap1)
+        nt.assert_array_equal(comp.scores['BLAT'], self.scores['BLAT'])
+
+        #- partial and lazy reads
+        comp = read_spectra(self.fileh5, targets=[459, 456], bands='r',
+                            columns=['FIBER'], lazy_resolution=True)
+        self.assertEqual(comp.bands, ['r',])
+        self.assertEqual(comp.fibermap.dtype.names, ('TARGETID', 'FIBER'))
+        nt.assert_array_equal(comp.fibermap['TARGETID'], [456, 459])
+        self.assertEqual(len(comp.exp_fibermap), 4)
+        self.assertTrue(callable(comp._resolution_data['r']))
+        nt.assert_array_almost_equal(comp.resolution_data['r'], self.res['r'][[0,3]])
+        nt.assert_array_almost_equal(comp.extra['r']['FOO'], self.extra['r']['FOO'][[0,3]])
+
+        #- append to a compressed file
+        write_spectra_hdf5(self.fileh5, spec, chunk_targets=2, compression='gzip')
+        other = Spectra(bands=self.bands, wave=self.wave, flux=self.flux,
+            ivar=self.ivar, mask=self.mask, resolution_data=self.res,
+            fibermap=self.fmap3, exp_fibermap=self.efmap3, meta=self.meta,
+            extra=self.extra, scores=self.scores,
+            extra_catalog=self.extra_catalog)
+        append_spectra_hdf5(self.fileh5, other)
+        comp = read_spectra(self.fileh5, targets=[1235, 457])
+        nt.assert_array_equal(comp.fibermap['TARGETID'], [457, 1235])
+        nt.assert_array_equal(comp.flux['b'], self.flux['b'][[1, 1]])
+        self.assertEqual(len(comp.exp_fibermap), 4)
+
+        with self.assertRaises(ValueError):
+            append_spectra_hdf5(self.fileh5, spec.select(bands=['b', 'r']))
+
+        #- SpectraLite keeps the on-disk float32
+        lite = SpectraLite.read(self.fileh5)
+        self.assertEqual(lite.num_spectra(), 2*self.nspec)
+        self.assertEqual(lite.flux['z'].dtype, np.float32)
+
+    def test_write_chunks(self):
+        """Test writing a spectra file in chunks of rows"""
+        spec = Spectra(bands=self.bands, wave=self.wave, flux=self.flux,
+            ivar=self.ivar, mask=self.mask, resolution_data=self.res,
+            fibermap=self.fmap1, meta=self.meta, scores=self.scores)
+        chunks = [spec[0:2], spec[2:3], spec[3:self.nspec]]
+        path = write_spectra_chunks(self.fileio, chunks, self.fmap1, meta=self.meta)
+        self.assertEqual(path, os.path.abspath(self.fileio))
+
+        comp = read_spectra(self.fileio)
+        self.verify(comp, self.fmap1)
+        nt.assert_array_equal(comp.scores['BLAT'], self.scores['BLAT'])
+
+        #- chunks must match the number of fibermap rows
+        with self.assertRaises(ValueError):
+            write_spectra_chunks(self.fileio, chunks[0:2], self.fmap1)
+
     def test_empty(self):
 
         spec = Spectra(meta=self.meta)
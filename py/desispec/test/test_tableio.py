@@ -0,0 +1,147 @@
+"""
+tests desispec.workflow.tableio
+"""
+
+import os
+import unittest
+import shutil
+import tempfile
+
+import numpy as np
+from astropy.table import Table
+
+from desispec.workflow.tableio import (load_table, write_table, append_table,
+    read_typed_csv, get_table_column_defs)
+from desispec.workflow.proctable import default_prow, instantiate_processing_table
+
+
+class TestTableIO(unittest.TestCase):
+
+    def setUp(self):
+        self.testdir = tempfile.mkdtemp()
+        self.cachedir = os.path.join(self.testdir, 'cache')
+        self.ptabfile = os.path.join(self.testdir, 'processing_table_test-20211102.csv')
+
+        rows = list()
+        for i in range(5):
+            prow = default_prow()
+            prow['EXPID'] = np.array([100+i, 200+i])
+            prow['OBSTYPE'] = 'science'
+            prow['TILEID'] = 1000+i
+            prow['NIGHT'] = 20211102
+            prow['BADAMPS'] = 'b7D,z8A'
+            prow['EXPFLAG'] = np.array(['aborted', 'short'][0:i%3], dtype=str)
+            prow['JOBDESC'] = 'tilenight'
+            prow['INTID'] = i
+            prow['LATEST_QID'] = 49482394+i
+            prow['SCRIPTNAME'] = f'tilenight-20211102-{1000+i}'
+            prow['STATUS'] = 'COMPLETED' if i < 3 else 'PENDING'
+            prow['ALL_QIDS'] = np.array([49482394+i])
+            rows.append(prow)
+        self.ptable = instantiate_processing_table(rows=rows)
+
+    def tearDown(self):
+        if os.path.exists(self.testdir):
+            shutil.rmtree(self.testdir)
+
+    def check_ptable(self, table, ptable=None):
+        if ptable is None:
+            ptable = self.ptable
+        colnames = get_table_column_defs('proctable')[0]
+        self.assertEqual(table.colnames, colnames)
+        self.assertEqual(len(table), len(ptable))
+        for nam in colnames:
+            for old, new in zip(ptable[nam], table[nam]):
+                if table[nam].dtype.kind == 'O':
+                    self.assertEqual(list(np.atleast_1d(old)), list(new), nam)
+                else:
+                    self.assertEqual(old, new, nam)
+        self.assertEqual(table['BADAMPS'][0], 'b7D,z8A')
+        self.assertEqual(table['BADAMPS'].dtype, np.dtype('S30'))
+        self.assertEqual(table['EXPID'][0].dtype.kind, 'i')
+        self.assertEqual(table['LATEST_DEP_QID'][0].size, 0)
+        self.assertEqual(table['TILEID'].dtype, np.dtype(int))
+
+    def test_roundtrip(self):
+        """write_table and load_table of a processing table"""
+        write_table(self.ptable, tablename=self.ptabfile)
+        with open(self.ptabfile) as fx:
+            lines = fx.readlines()
+        self.assertEqual(lines[0].strip().split(','), self.ptable.colnames)
+        self.assertIn('100|200|', lines[1])
+        self.assertIn('b7D;z8A', lines[1])
+
+        table = load_table(self.ptabfile, tabletype='proctable', suppress_logging=True)
+        self.check_ptable(table)
+        self.assertTrue(table['STATUS'][0] == 'COMPLETED')
+
+        #- the file is compatible with the astropy csv reader
+        raw = Table.read(self.ptabfile, format='ascii.csv')
+        self.assertEqual(list(raw['LATEST_QID']), list(self.ptable['LATEST_QID']))
+
+        #- column projection
+        table = load_table(self.ptabfile, tabletype='proctable', suppress_logging=True,
+                           columns=['ALL_QIDS', 'TILEID'])
+        self.assertEqual(table.colnames, ['TILEID', 'ALL_QIDS'])
+
+        #- empty table
+        emptyfile = os.path.join(self.testdir, 'processing_table_empty.csv')
+        write_table(self.ptable[0:0], tablename=emptyfile, write_empty=True)
+        table = load_table(emptyfile, tabletype='proctable', suppress_logging=True)
+        self.assertEqual(len(table), 0)
+        self.assertEqual(table.colnames, self.ptable.colnames)
+
+    def test_sidecar(self):
+        """The binary sidecar is used until the csv file changes"""
+        write_table(self.ptable, tablename=self.ptabfile)
+        table = read_typed_csv(self.ptabfile, 'proctable', cache_dir=self.cachedir)
+        self.assertEqual(len(os.listdir(self.cachedir)), 1)
+        sidecar = os.path.join(self.cachedir, os.listdir(self.cachedir)[0])
+        mtime = os.path.getmtime(sidecar)
+        table = read_typed_csv(self.ptabfile, 'proctable', cache_dir=self.cachedir)
+        self.check_ptable(table)
+        self.assertEqual(os.path.getmtime(sidecar), mtime)
+        table = read_typed_csv(self.ptabfile, 'proctable', cache_dir=self.cachedir,
+                               columns=['EXPID', 'STATUS'])
+        self.assertEqual(table.colnames, ['EXPID', 'STATUS'])
+        self.assertEqual(list(table['EXPID'][1]), [101, 201])
+
+        #- modified file
+        self.ptable['STATUS'][0] = 'FAILED'
+        write_table(self.ptable, tablename=self.ptabfile)
+        table = read_typed_csv(self.ptabfile, 'proctable', cache_dir=self.cachedir)
+        self.assertEqual(table['STATUS'][0], 'FAILED')
+
+    def test_append(self):
+        """append_table adds rows without rewriting the file"""
+        write_table(self.ptable[0:3], tablename=self.ptabfile)
+        with open(self.ptabfile) as fx:
+            head = fx.read()
+        append_table(self.ptable[3:], tablename=self.ptabfile)
+        with open(self.ptabfile) as fx:
+            self.assertTrue(fx.read().startswith(head))
+        table = load_table(self.ptabfile, tabletype='proctable', suppress_logging=True)
+        self.check_ptable(table)
+
+        #- new file
+        newfile = os.path.join(self.testdir, 'processing_table_new.csv')
+        append_table(self.ptable, tablename=newfile)
+        self.check_ptable(load_table(newfile, tabletype='proctable', suppress_logging=True))
+
+        #- different columns
+        otherfile = os.path.join(self.testdir, 'processing_table_other.csv')
+        write_table(self.ptable[0:2], tablename=otherfile)
+        ptable = self.ptable.copy()
+        ptable.remove_column('SCRIPTNAME')
+        append_table(ptable[2:], tablename=otherfile)
+        table = load_table(otherfile, tabletype='proctable', suppress_logging=True)
+        self.assertEqual(len(table), 5)
+        self.assertEqual(list(table['SCRIPTNAME'][1:3]), ['tilenight-20211102-1001', ''])
+
+
+def test_suite():
+    """Allows testing of only this module with the command::
+
+        python setup.py test -m <modulename>
+    """
+    return unittest.defaultTestLoader.loadTestsFromName(__name__)
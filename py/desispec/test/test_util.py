@@ -4,6 +4,7 @@ Test desispec.util.*
 
 import os
 import time
+import threading
 import unittest
 from uuid import uuid4
 import importlib
@@ -228,6 +229,35 @@ class TestRunCmd(unittest.TestCase):
 
         self.assertEqual(util.runcmd(blat)[0], 'hello')
 
+    def test_runcmd_cameras(self):
+        """Test running a command for several cameras, serially or with a pool"""
+        camera_kwargs = dict()
+        camera_kwargs['b0'] = dict(args=['echo', 'b0'])
+        camera_kwargs['r0'] = dict(args=['blargbitbatfoo'])
+        camera_kwargs['z0'] = dict(args=['echo', 'z0'], inputs=[uuid4().hex,])
+        camera_kwargs['b1'] = dict(args=['echo', 'b1'], outputs=[self.outfile,])
+        for ncamera_workers in (1, 2):
+            timing = util.runcmd_cameras('true &&', camera_kwargs,
+                                         ncamera_workers=ncamera_workers)
+            self.assertEqual(list(timing.keys()), ['b0', 'r0', 'z0', 'b1'])
+            success = [timing[camera][0] for camera in timing]
+            self.assertEqual(success, [True, False, False, True])
+            for camera in timing:
+                self.assertGreaterEqual(timing[camera][1], 0.0)
+
+        #- not forked while other threads are running
+        done = threading.Event()
+        thread = threading.Thread(target=done.wait)
+        thread.start()
+        try:
+            timing = util.runcmd_cameras('true &&', camera_kwargs,
+                                         ncamera_workers=2)
+        finally:
+            done.set()
+            thread.join()
+        success = [timing[camera][0] for camera in timing]
+        self.assertEqual(success, [True, False, False, True])
+
     def test_newer_input(self):
         """
         Even if clobber=False and outputs exist, run cmd if inputs are
@@ -191,6 +191,115 @@ def runcmd(cmd, args=None, expandargs=False, inputs=[], outputs=[], comm=None, c
     log.error(f'should not have gotten here')
     return None, False
 
+def _runcmd_camera(camera, cmd, kwargs):
+    """
+    Run :func:`runcmd` for a single camera, returning (camera, success, seconds)
+
+    Module-level so that it can be used with multiprocessing.Pool
+    """
+    t0 = time.time()
+    result, success = runcmd(cmd, **kwargs)
+    return camera, success, time.time() - t0
+
+#- environment variables setting the number of threads of BLAS and OpenMP
+_thread_env_vars = ('OMP_NUM_THREADS', 'OPENBLAS_NUM_THREADS',
+                    'MKL_NUM_THREADS', 'NUMEXPR_NUM_THREADS')
+_camera_worker_limits = None
+
+def _init_camera_worker(nthreads):
+    """
+    Limit the BLAS/OpenMP threads of a runcmd_cameras pool worker to nthreads
+
+    The environment variables cover command strings run as subprocesses;
+    libraries already loaded by the parent are limited with threadpoolctl
+    if it is installed.
+    """
+    for name in _thread_env_vars:
+        os.environ[name] = str(nthreads)
+
+    try:
+        from threadpoolctl import threadpool_limits
+    except ImportError:
+        return
+
+    #- keep a reference so that the limits last for the life of the worker
+    global _camera_worker_limits
+    _camera_worker_limits = threadpool_limits(limits=nthreads)
+
+def runcmd_cameras(cmd, camera_kwargs, ncamera_workers=1, stepname=None):
+    """
+    Run a command for several cameras, optionally with a process pool
+
+    Args:
+        cmd : function object or command string to run with :func:`runcmd`
+        camera_kwargs : dict camera -> dict of :func:`runcmd` keyword
+            arguments for that camera (args, inputs, outputs, ...)
+
+    Options:
+        ncamera_workers (int): number of processes to run cameras concurrently
+        stepname (str): step name used when logging per-camera timing
+
+    Returns:
+        dict camera -> (success, duration_seconds), in camera_kwargs order
+
+    Notes:
+
+      * This does not distribute cameras across MPI ranks; callers pass
+        the cameras already assigned to this rank.  The workers must not
+        use MPI, i.e. camera_kwargs must not include a comm.
+      * Each worker runs cmd with its own arguments and reads its own
+        inputs; nothing is preloaded by the parent process.
+      * The CPUs available to this process are split between the workers
+        by capping their BLAS/OpenMP threads, to avoid oversubscription.
+      * Forking a process with live threads is unsafe, so the cameras are
+        run serially if this process has other threads running, e.g. the
+        background writers of :mod:`desispec.io.asyncwrite`; call
+        :func:`~desispec.io.asyncwrite.flush_writes` first to stop them.
+      * With ncamera_workers>1, cmd must be picklable (e.g. a module-level
+        function such as a script main).
+    """
+    import threading
+    log = get_logger()
+    if stepname is None:
+        stepname = cmd.__module__ + '.' + cmd.__name__ if callable(cmd) else cmd
+
+    tasks = [(camera, cmd, kwargs) for camera, kwargs in camera_kwargs.items()]
+    nproc = min(ncamera_workers, len(tasks))
+    if nproc > 1 and threading.active_count() > 1:
+        log.warning(f'Running {stepname} serially instead of with {nproc} '
+                    f'processes since this process has '
+                    f'{threading.active_count()-1} other thread(s) running')
+        nproc = 1
+
+    if nproc > 1:
+        import multiprocessing
+        if 'fork' in multiprocessing.get_all_start_methods():
+            context = multiprocessing.get_context('fork')
+        else:
+            context = multiprocessing.get_context()
+
+        if hasattr(os, 'sched_getaffinity'):
+            ncpu = len(os.sched_getaffinity(0))
+        else:
+            ncpu = multiprocessing.cpu_count()
+        nthreads = max(1, ncpu // nproc)
+
+        log.info(f'Running {stepname} for {len(tasks)} cameras with {nproc} '
+                 f'processes of {nthreads} thread(s)')
+        with context.Pool(nproc, initializer=_init_camera_worker,
+                          initargs=(nthreads,)) as pool:
+            results = pool.starmap(_runcmd_camera, tasks)
+    else:
+        results = [_runcmd_camera(*task) for task in tasks]
+
+    timing = dict()
+    for camera, success, duration in results:
+        status = 'succeeded' if success else 'FAILED'
+        log.info(f'{stepname} {camera} {status} in {duration:.1f} sec')
+        timing[camera] = (success, duration)
+
+    return timing
+
 def mpi_count_failures(num_cmd, num_err, comm=None):
     """
     Sum num_cmd and num_err across MPI ranks
@@ -87,6 +87,12 @@ def get_shared_desi_proc_parser():
     parser.add_argument("--gpuextract", action="store_true", help="Use GPU extraction")
     parser.add_argument("--mpistdstars", action="store_true", help="Use MPI parallelism in stdstar fitting instead of multiprocessing")
     parser.add_argument("--skygradpca", action="store_true", help="Fit sky gradient")
+    parser.add_argument("--ncamera-workers", type=int, default=1,
+                        help="Number of processes per rank for concurrent per-camera fiberflat, sky and fluxcalib steps; "
+                             "each process reads its own inputs")
+    parser.add_argument("--schedule", type=str, default="static", choices=["static", "dynamic"],
+                        help="Per-camera loop scheduling over MPI ranks: static round-robin, "
+                             "or dynamic where ranks take the next camera when done")
 
     return parser
 
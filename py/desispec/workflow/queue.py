@@ -1,12 +1,16 @@
 
 
 import os
+import json
 import numpy as np
 from astropy.table import Table
 import subprocess
 from desiutil.log import get_logger
 import time
 
+#- default sacct columns of the queue queries
+default_queue_columns = 'jobid,jobname,partition,submit,eligible,start,end,elapsed,state,exitcode'
+
 
 def get_resubmission_states():
     """
@@ -194,7 +198,8 @@ def queue_info_from_qids(qids, columns='jobid,jobname,partition,submit,'+
         queue_info_table.rename_column(col, col.upper())
     return queue_info_table
 
-def update_from_queue(ptable, qtable=None, dry_run=0, ignore_scriptnames=False):
+def update_from_queue(ptable, qtable=None, dry_run=0, ignore_scriptnames=False,
+                      cache=None):
     """
     Given an input prcessing table (ptable) and query table from the Slurm queue (qtable) it cross matches the
     Slurm job ID's and updates the 'state' in the table using the current state in the Slurm scheduler system.
@@ -210,6 +215,8 @@ def update_from_queue(ptable, qtable=None, dry_run=0, ignore_scriptnames=False):
         The following are only used if qtable is not provided:
             dry_run, int. Whether this is a simulated run or real run. If nonzero, it is a simulation and it returns a default
                            table that doesn't query the Slurm scheduler.
+            cache, QueueCache. Queue state cache used to query the jobs. Default is the cache of this
+                           process returned by get_queue_cache().
 
     Returns:
         ptable, Table. The same processing table as the input except that the "STATUS" column in ptable for all jobs is
@@ -222,7 +229,12 @@ def update_from_queue(ptable, qtable=None, dry_run=0, ignore_scriptnames=False):
         qids = np.array(ptable['LATEST_QID'])
         ## Avoid null valued QID's (set to -99)
         qids = qids[qids > 0]
-        qtable = queue_info_from_qids(qids, dry_run=dry_run)
+        if dry_run:
+            qtable = queue_info_from_qids(qids, dry_run=dry_run)
+        else:
+            if cache is None:
+                cache = get_queue_cache()
+            qtable = cache.query_qids(qids)
 
     log.info(f"Slurm returned information on {len(qtable)} jobs out of "
              +f"{len(ptable)} jobs in the ptable. Updating those now.")
@@ -266,3 +278,298 @@ def any_jobs_not_complete(statuses, termination_states=None):
     if termination_states is None:
         termination_states = get_termination_states()
     return np.any([status not in termination_states for status in statuses])
+
+
+class SlurmQueue(object):
+    """
+    Queue backend querying the Slurm accounting database with sacct.
+
+    A queue backend has the methods query_qids(qids, columns) and
+    query_time_window(start_time, end_time, user, columns), each returning
+    a Table with upper case column names, as used by QueueCache.
+    """
+    def query_qids(self, qids, columns=default_queue_columns):
+        return queue_info_from_qids(qids, columns=columns)
+
+    def query_time_window(self, start_time, end_time=None, user=None,
+                          columns=default_queue_columns):
+        return queue_info_from_time_window(start_time=start_time, end_time=end_time,
+                                           user=user, columns=columns)
+
+
+class FakeQueue(object):
+    """
+    Local fake scheduler with the interface of SlurmQueue, e.g. for tests.
+
+    Jobs are submitted with submit() and change state with set_state();
+    nqueries counts the queries, i.e. the sacct calls that would have been
+    made.
+
+    Args:
+        first_qid, int. Slurm QID of the first submitted job.
+    """
+    def __init__(self, first_qid=1000):
+        self.jobs = dict()
+        self.next_qid = first_qid
+        self.nqueries = 0
+
+    @staticmethod
+    def _now():
+        return time.strftime('%Y-%m-%dT%H:%M:%S')
+
+    def submit(self, jobname, partition='realtime', state='PENDING'):
+        """Add a job to the fake queue and return its QID"""
+        qid = self.next_qid
+        self.next_qid += 1
+        now = self._now()
+        self.jobs[qid] = dict(JOBID=qid, JOBNAME=jobname, PARTITION=partition,
+                              SUBMIT=now, ELIGIBLE=now, START='Unknown',
+                              END='Unknown', ELAPSED='00:00:00', STATE='PENDING',
+                              EXITCODE='0:0')
+        if state != 'PENDING':
+            self.set_state(qid, state)
+        return qid
+
+    def set_state(self, qid, state):
+        """Change the state of job qid, setting its START and END times"""
+        job = self.jobs[qid]
+        now = self._now()
+        if state != 'PENDING' and job['START'] == 'Unknown':
+            job['START'] = now
+        if state not in ('PENDING', 'RUNNING', 'REQUEUED', 'SUSPENDED'):
+            job['END'] = now
+        if state not in ('COMPLETED', 'PENDING', 'RUNNING'):
+            job['EXITCODE'] = '1:0'
+        job['STATE'] = state
+
+    def _table(self, qids, columns):
+        colnames = [col.upper() for col in columns.split(',')]
+        rows = [[self.jobs[qid][col] for col in colnames] for qid in qids]
+        dtype = [int if col == 'JOBID' else object for col in colnames]
+        return Table(rows=rows, names=colnames, dtype=dtype)
+
+    def query_qids(self, qids, columns=default_queue_columns):
+        self.nqueries += 1
+        qids = [int(qid) for qid in np.atleast_1d(qids) if int(qid) in self.jobs]
+        return self._table(qids, columns)
+
+    def query_time_window(self, start_time, end_time=None, user=None,
+                          columns=default_queue_columns):
+        self.nqueries += 1
+        qids = list()
+        for qid, job in self.jobs.items():
+            if end_time is not None and job['SUBMIT'] > end_time:
+                continue
+            if job['END'] != 'Unknown' and job['END'] < start_time:
+                continue
+            qids.append(qid)
+        return self._table(qids, columns)
+
+
+class QueueCache(object):
+    """
+    Cache of the Slurm queue state, to limit the number of sacct queries.
+
+    Only jobs that are not yet known or are not in a final state are
+    queried, and each job at most once per min_interval seconds.  Queries
+    of a time window only ask for the jobs which changed since the previous
+    query of that window.  The cache can be kept in a JSON snapshot file,
+    shared by the successive (or concurrent) invocations of the daily
+    manager or the scheduler; it is re-read before each query and written
+    after each query.
+
+    Args:
+        backend, object. Queue backend, see SlurmQueue; default SlurmQueue().
+        snapshot, str. JSON snapshot file; default $DESI_QUEUE_SNAPSHOT if set, otherwise the
+                       cache is kept in memory only.
+        min_interval, float. Minimum number of seconds between two queries of the same job;
+                       default $DESI_QUEUE_MIN_POLL_INTERVAL or 60.
+        columns, str. Comma separated sacct column names, which must include jobid and state.
+    """
+    #- Job states that never change again for a QID; unlike
+    #- get_termination_states() this includes the failures that require a
+    #- resubmission under a new QID, but not PREEMPTED or NODE_FAIL, after
+    #- which Slurm can requeue the job with the same QID.
+    final_states = ['COMPLETED', 'CANCELLED', 'FAILED', 'TIMEOUT', 'OUT_OF_MEMORY',
+                    'BOOT_FAIL', 'DEADLINE']
+
+    def __init__(self, backend=None, snapshot=None, min_interval=None,
+                 columns=default_queue_columns):
+        if backend is None:
+            backend = SlurmQueue()
+        if snapshot is None:
+            snapshot = os.getenv('DESI_QUEUE_SNAPSHOT')
+        if min_interval is None:
+            min_interval = float(os.getenv('DESI_QUEUE_MIN_POLL_INTERVAL', 60))
+        self.backend = backend
+        self.snapshot = snapshot
+        self.min_interval = min_interval
+        self.columns = columns
+        self.colnames = [col.upper() for col in columns.split(',')]
+
+        #- rows by QID, time of the last query and of the last state change
+        self.jobs = dict()
+        self.polled = dict()
+        self.changed = dict()
+        #- QIDs and time of the last query of each time window
+        self.windows = dict()
+        self.nqueries = 0
+
+        if self.snapshot is not None:
+            self.load()
+
+    def _state(self, qid):
+        return str(self.jobs[qid]['STATE']).split(' ')[0]
+
+    def _needs_poll(self, qid, now):
+        if qid not in self.jobs:
+            return True
+        if self._state(qid) in self.final_states:
+            return False
+        return now - self.polled.get(qid, 0.0) >= self.min_interval
+
+    def _update(self, qtable, now):
+        for row in qtable:
+            qid = int(row['JOBID'])
+            job = dict()
+            for col in self.colnames:
+                value = row[col] if col in qtable.colnames else ''
+                if np.ma.is_masked(value):
+                    value = ''
+                job[col] = qid if col == 'JOBID' else str(value)
+            if qid not in self.jobs or self.jobs[qid]['STATE'] != job['STATE']:
+                self.changed[qid] = now
+            self.jobs[qid] = job
+            self.polled[qid] = now
+
+    def table(self, qids):
+        """Return a Table of the cached rows of the given QIDs, as from sacct"""
+        qids = [int(qid) for qid in qids if int(qid) in self.jobs]
+        rows = [[self.jobs[qid][col] for col in self.colnames] for qid in qids]
+        dtype = [int if col == 'JOBID' else object for col in self.colnames]
+        return Table(rows=rows, names=self.colnames, dtype=dtype)
+
+    def query_qids(self, qids, force=False):
+        """
+        Return the queue information of the given jobs, querying only those that may have changed.
+
+        Args:
+            qids, list or array of ints. Slurm QIDs.
+            force, bool. Query all of the jobs, even if cached.
+
+        Returns:
+            Table. As returned by queue_info_from_qids, for the jobs known to the queue.
+        """
+        log = get_logger()
+        qids = np.unique(np.atleast_1d(qids).astype(int))
+        qids = qids[qids > 0]
+        if self.snapshot is not None:
+            self.load()
+
+        now = time.time()
+        topoll = [qid for qid in qids if force or self._needs_poll(qid, now)]
+        if len(topoll) > 0:
+            qtable = self.backend.query_qids(topoll, columns=self.columns)
+            self.nqueries += 1
+            self._update(qtable, now)
+            self.save()
+        log.info(f"Queue cache: queried {len(topoll)} of {len(qids)} jobs")
+
+        return self.table(qids)
+
+    def query_time_window(self, start_time, end_time=None, user=None, force=False):
+        """
+        Return the queue information of the jobs in a time window, querying only what changed.
+
+        The first query of a window asks for all of its jobs, and the
+        following ones only for the jobs active since the previous query
+        (with a margin of min_interval), and not more than once per
+        min_interval seconds.
+
+        Args:
+            start_time, str. String of the form YYYY-mm-ddTHH:MM:SS.
+            end_time, str. String of the form YYYY-mm-ddTHH:MM:SS, or None for now.
+            user, str. The username of the jobs.
+            force, bool. Query the whole window.
+
+        Returns:
+            Table. As returned by queue_info_from_time_window.
+        """
+        if self.snapshot is not None:
+            self.load()
+
+        key = f'{start_time}|{end_time}|{user}'
+        now = time.time()
+        window = self.windows.get(key)
+        query_start = start_time
+        if window is not None and not force:
+            if now - window['polled'] < self.min_interval:
+                return self.table(window['qids'])
+            since = time.strftime('%Y-%m-%dT%H:%M:%S',
+                                  time.localtime(window['polled'] - self.min_interval))
+            query_start = max(start_time, since)
+
+        if end_time is not None and query_start > end_time:
+            qtable = self.table([])
+        else:
+            qtable = self.backend.query_time_window(query_start, end_time, user,
+                                                    columns=self.columns)
+            self.nqueries += 1
+        self._update(qtable, now)
+
+        qids = list() if window is None or force else window['qids']
+        qids = sorted(set(qids) | set([int(qid) for qid in qtable['JOBID']]))
+        self.windows[key] = dict(qids=qids, polled=now)
+        self.save()
+
+        return self.table(qids)
+
+    def load(self):
+        """Merge the snapshot file into the cache, keeping the most recent query of each job"""
+        if self.snapshot is None or not os.path.exists(self.snapshot):
+            return
+        log = get_logger()
+        try:
+            with open(self.snapshot) as fx:
+                snap = json.load(fx)
+        except ValueError as err:
+            log.warning(f"Ignoring unreadable queue snapshot {self.snapshot}: {err}")
+            return
+
+        for qid, job in snap['jobs'].items():
+            qid = int(qid)
+            polled = snap['polled'].get(str(qid), 0.0)
+            if polled > self.polled.get(qid, -1.0):
+                self.jobs[qid] = job
+                self.polled[qid] = polled
+                self.changed[qid] = snap['changed'].get(str(qid), polled)
+        for key, window in snap['windows'].items():
+            if key not in self.windows or window['polled'] > self.windows[key]['polled']:
+                self.windows[key] = window
+
+    def save(self):
+        """Write the cache to the snapshot file, if any, merged with any newer content of the file"""
+        if self.snapshot is None:
+            return
+        self.load()
+        snap = dict(jobs={str(qid): job for qid, job in self.jobs.items()},
+                    polled={str(qid): t for qid, t in self.polled.items()},
+                    changed={str(qid): t for qid, t in self.changed.items()},
+                    windows=self.windows)
+        tmpfile = f'{self.snapshot}.tmp{os.getpid()}'
+        with open(tmpfile, 'w') as fx:
+            json.dump(snap, fx)
+        os.replace(tmpfile, self.snapshot)
+
+
+_queue_cache = None
+
+def get_queue_cache():
+    """
+    Returns the QueueCache of this process, creating it with the default backend and
+    environment settings on the first call.
+    """
+    global _queue_cache
+    if _queue_cache is None:
+        _queue_cache = QueueCache()
+    return _queue_cache
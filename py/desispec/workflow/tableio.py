@@ -1,4 +1,6 @@
 import os
+import csv
+import hashlib
 import numpy as np
 from astropy.table import Table
 
@@ -136,6 +138,11 @@ def write_table(origtable, tablename=None, tabletype=None, joinsymb='|', overwri
     temp_name = f'{basename}.temp{ext}'
     if verbose:
         log.info(ext ,temp_name)
+    if ext == '.csv':
+        write_typed_csv(origtable, temp_name, joinsymb=joinsymb, comma_replacement=comma_replacement)
+        os.rename(temp_name, tablename)
+        return
+
     table = origtable.copy()
 
     if ext in ['.csv', '.ecsv']:
@@ -179,6 +186,354 @@ def write_table(origtable, tablename=None, tabletype=None, joinsymb='|', overwri
     if verbose:
         log.info("Written table: ", table.info)
 
+
+###################################################
+############  Typed csv reader/writer  ############
+###################################################
+
+#- version of the binary sidecar format of the typed csv reader
+_sidecar_version = 1
+
+def get_table_column_defs(tabletype):
+    """
+    Returns the column definitions of a table type, as used by the typed csv reader.
+
+    Args:
+        tabletype, str. 'exptable', 'proctable', or 'unproctable' (or any value understood by
+                        standardize_tabletype).
+
+    Returns:
+        colnames, coltypes, coldefaults, lists. The column names, datatypes, and default values,
+                                                or None if tabletype isn't known.
+    """
+    from desispec.workflow.exptable import get_exposure_table_column_defs
+    from desispec.workflow.proctable import get_processing_table_column_defs
+    tabletype = standardize_tabletype(tabletype)
+    if tabletype in ['exptable', 'unproctable']:
+        return get_exposure_table_column_defs(return_default_values=True)
+    elif tabletype == 'proctable':
+        return get_processing_table_column_defs(return_default_values=True)
+    else:
+        return None
+
+def _is_array_type(typ):
+    return typ in [list, np.array, np.ndarray]
+
+def _parse_array_cells(cells, joinsymb='|'):
+    """
+    Splits the joinsymb-joined strings of an array column all at once.
+
+    Args:
+        cells, list of str. Non-empty cells of the column, e.g. '123|456|'.
+        joinsymb, str. The symbol used to join values in a list/array when saving.
+
+    Returns:
+        values, np.array of str. The values of all cells, stripped of tabs and spaces.
+        counts, np.array of int. The number of values of each cell.
+        isint, np.array of bool. Whether the values of each cell are integers, based on the first
+                                 value as in split_str.
+    """
+    cells = [cell.strip(joinsymb) for cell in cells]
+    counts = np.array([0 if cell == '' else cell.count(joinsymb)+1 for cell in cells], dtype=int)
+    nonempty = [cell for cell in cells if cell != '']
+    if len(nonempty) > 0:
+        values = np.char.strip(np.array(joinsymb.join(nonempty).split(joinsymb)), '\t ')
+    else:
+        values = np.zeros(0, dtype='U1')
+    first = np.cumsum(counts) - counts
+    isint = np.zeros(len(cells), dtype=bool)
+    isint[counts > 0] = np.char.isnumeric(values[first[counts > 0]])
+    return values, counts, isint
+
+def _build_array_column(values, counts, isint):
+    """
+    Returns an object np.array with one np.array per cell from the output of _parse_array_cells
+    """
+    out = np.ndarray(shape=(len(counts),), dtype=object)
+    #- convert all integer values at once
+    intvalues = np.repeat(isint, counts)
+    ints = np.zeros(len(values), dtype=int)
+    if np.any(intvalues):
+        ints[intvalues] = values[intvalues].astype(int)
+    stops = np.cumsum(counts)
+    for ii, (stop, count) in enumerate(zip(stops, counts)):
+        if count == 0:
+            out[ii] = np.array([], dtype=object)
+        elif isint[ii]:
+            out[ii] = ints[stop-count:stop]
+        else:
+            out[ii] = values[stop-count:stop]
+    return out
+
+def _parse_column(name, cells, typ, default, joinsymb='|', comma_replacement=';'):
+    """
+    Converts the csv strings of a column into a Table.Column of type typ, filling empty cells
+    with default, as load_table does with process_column.
+
+    Returns:
+        col, Table.Column.
+        arrays, tuple or None. The (values, counts, isint, mask) parsed for an array column.
+    """
+    cells = np.asarray(cells, dtype=str)
+    mask = (cells == '')
+    arrays = None
+    if _is_array_type(typ):
+        values, counts, isint = _parse_array_cells(list(cells[~mask]), joinsymb=joinsymb)
+        arrays = (values, counts, isint, mask)
+        data = _array_column_from_parsed(values, counts, isint, mask, default)
+        return Table.Column(name=name, data=data, dtype=typ), arrays
+
+    if typ in [int, float, bool] or (np.dtype(typ).kind in 'iufb'):
+        data = np.zeros(len(cells), dtype=typ)
+        data[mask] = default
+        if np.dtype(typ).kind == 'b':
+            data[~mask] = np.char.lower(cells[~mask]) == 'true'
+        else:
+            try:
+                data[~mask] = cells[~mask].astype(float if np.dtype(typ).kind == 'f' else int)
+            except ValueError:
+                data[~mask] = cells[~mask].astype(float)
+    else:
+        cells = np.char.replace(cells, comma_replacement, ',')
+        data = np.where(mask, str(default), cells)
+    return Table.Column(name=name, data=data, dtype=typ), arrays
+
+def _array_column_from_parsed(values, counts, isint, mask, default):
+    data = np.ndarray(shape=(len(mask),), dtype=object)
+    data[~mask] = _build_array_column(values, counts, isint)
+    for ii in np.where(mask)[0]:
+        data[ii] = np.atleast_1d(default)
+    return data
+
+def _sidecar_name(tablename, cache_dir):
+    """Returns the pathname of the binary sidecar of tablename in cache_dir"""
+    abspath = os.path.abspath(tablename)
+    digest = hashlib.sha1(abspath.encode()).hexdigest()[0:12]
+    base = os.path.splitext(os.path.basename(tablename))[0]
+    return os.path.join(cache_dir, f'{base}-{digest}.npz')
+
+def _read_sidecar(sidecar, tablename, colnames, coltypes, coldefaults):
+    """
+    Returns the dict of columns in the sidecar if it is valid for the current tablename, otherwise None
+    """
+    if not os.path.exists(sidecar):
+        return None
+    stat = os.stat(tablename)
+    try:
+        with np.load(sidecar, allow_pickle=False) as npz:
+            meta = npz['__meta']
+            if (int(meta[0]) != _sidecar_version or int(meta[1]) != stat.st_mtime_ns
+                    or int(meta[2]) != stat.st_size):
+                return None
+            if list(npz['__schema']) != [f'{nam}:{typ}' for nam, typ in zip(colnames, coltypes)]:
+                return None
+            columns = dict()
+            for nam, typ, default in zip(colnames, coltypes, coldefaults):
+                if f'{nam}__data' in npz:
+                    columns[nam] = Table.Column(name=nam, data=npz[f'{nam}__data'], dtype=typ)
+                elif f'{nam}__values' in npz:
+                    data = _array_column_from_parsed(npz[f'{nam}__values'], npz[f'{nam}__counts'],
+                                                     npz[f'{nam}__isint'], npz[f'{nam}__mask'], default)
+                    columns[nam] = Table.Column(name=nam, data=data, dtype=typ)
+            return columns
+    except (OSError, ValueError, KeyError):
+        return None
+
+def _write_sidecar(sidecar, tablename, colnames, coltypes, columns, arrays):
+    """Writes the parsed columns of tablename to the binary sidecar"""
+    stat = os.stat(tablename)
+    out = dict()
+    out['__meta'] = np.array([_sidecar_version, stat.st_mtime_ns, stat.st_size], dtype=np.int64)
+    out['__schema'] = np.array([f'{nam}:{typ}' for nam, typ in zip(colnames, coltypes)])
+    for nam, col in columns.items():
+        if nam in arrays:
+            values, counts, isint, mask = arrays[nam]
+            out[f'{nam}__values'] = values
+            out[f'{nam}__counts'] = counts
+            out[f'{nam}__isint'] = isint
+            out[f'{nam}__mask'] = mask
+        else:
+            out[f'{nam}__data'] = col.data
+    os.makedirs(os.path.dirname(os.path.abspath(sidecar)), exist_ok=True)
+    tmpfile = f'{sidecar}.tmp{os.getpid()}.npz'
+    np.savez(tmpfile, **out)
+    os.replace(tmpfile, sidecar)
+
+def read_typed_csv(tablename, tabletype, columns=None, joinsymb='|', comma_replacement=';',
+                   cache_dir=None):
+    """
+    Reads an exposure, processing, or unprocessed table csv file using the column definitions of its
+    tabletype, giving the same result as load_table with process_mixins=True.
+
+    Args:
+        tablename, str. Full pathname of the csv table.
+        tabletype, str. 'exptable', 'proctable', or 'unproctable'.
+        columns, list of str. Only read these columns (in the order of the column definitions).
+                              Default is all columns.
+        joinsymb, str. The symbol used to join values in a list/array when saving. Should not be a comma.
+        comma_replacement, str. Replace instances of this symbol with commas in scalar string columns.
+        cache_dir, str. Directory of a binary sidecar of the parsed table, used instead of parsing the csv
+                        file as long as the modification time and size of the file are unchanged. Default is
+                        $DESI_WORKFLOW_TABLE_CACHE if set, otherwise no sidecar is used.
+
+    Returns:
+        table, Table. The table, with array columns as object columns of np.array's.
+    """
+    log = get_logger()
+    colnames, coltypes, coldefaults = get_table_column_defs(tabletype)
+    if cache_dir is None:
+        cache_dir = os.getenv('DESI_WORKFLOW_TABLE_CACHE')
+
+    parsed = None
+    sidecar = None
+    if cache_dir is not None:
+        sidecar = _sidecar_name(tablename, cache_dir)
+        parsed = _read_sidecar(sidecar, tablename, colnames, coltypes, coldefaults)
+
+    if parsed is None:
+        with open(tablename, newline='') as fx:
+            rows = list(csv.reader(fx))
+        header = rows[0] if len(rows) > 0 else list()
+        rows = rows[1:]
+        if len(rows) == 0:
+            return Table(names=colnames, dtype=coltypes)
+
+        missing = [nam for nam in colnames if nam not in header]
+        if len(missing) > 0:
+            log.warning(f"{missing} not in column names of loaded table: {header}")
+
+        #- parse everything if the result is cached, otherwise just the requested columns
+        parse = [nam for nam in colnames if nam in header]
+        if sidecar is None and columns is not None:
+            parse = [nam for nam in parse if nam in columns]
+
+        celllists = list(zip(*rows))
+        parsed, arrays = dict(), dict()
+        for nam, typ, default in zip(colnames, coltypes, coldefaults):
+            if nam in parse:
+                cells = celllists[header.index(nam)]
+                parsed[nam], parsedarrays = _parse_column(nam, cells, typ, default, joinsymb=joinsymb,
+                                                          comma_replacement=comma_replacement)
+                if parsedarrays is not None:
+                    arrays[nam] = parsedarrays
+
+        if sidecar is not None:
+            try:
+                _write_sidecar(sidecar, tablename, colnames, coltypes, parsed, arrays)
+            except OSError as err:
+                log.warning(f"Couldn't write table cache {sidecar}: {err}")
+
+    outnames = [nam for nam in colnames if nam in parsed and (columns is None or nam in columns)]
+    return Table([parsed[nam] for nam in outnames])
+
+def _format_column(col, joinsymb='|', comma_replacement=';'):
+    """
+    Returns the csv strings of a Table column, joining multi-valued cells with joinsymb (with a
+    trailing joinsymb) as in ensure_scalar, and writing masked cells as empty strings.
+    """
+    if col.dtype.kind == 'O' or col.ndim > 1:
+        cells = list()
+        for row in col:
+            if isinstance(row, bytes):
+                cells.append(row.decode())
+            elif row is None or np.ma.is_masked(row):
+                cells.append('')
+            elif isinstance(row, str) or np.isscalar(row):
+                cells.append(str(row))
+            else:
+                cells.append(joinsymb.join(np.atleast_1d(row).astype(str)) + joinsymb)
+    elif col.dtype.kind == 'S':
+        cells = [cell.decode() for cell in np.asarray(col)]
+    else:
+        cells = [str(cell) for cell in np.asarray(col)]
+
+    if col.dtype.kind in 'SUO':
+        cells = [cell.replace(',', comma_replacement) for cell in cells]
+    if isinstance(col, Table.MaskedColumn) and np.any(col.mask):
+        for ii in np.where(col.mask)[0]:
+            cells[ii] = ''
+    return cells
+
+def _format_rows(table, joinsymb='|', comma_replacement=';'):
+    """Returns the csv lines (without the header) of table"""
+    columns = [_format_column(table[nam], joinsymb=joinsymb, comma_replacement=comma_replacement)
+               for nam in table.colnames]
+    lines = list()
+    for row in zip(*columns):
+        row = [f'"{cell}"'.replace('"', '""')[1:-1] if ('"' in cell or '\n' in cell) else cell
+               for cell in row]
+        lines.append(','.join(row) + '\n')
+    return lines
+
+def write_typed_csv(table, tablename, joinsymb='|', comma_replacement=';'):
+    """
+    Writes a table to a csv file, joining multi-valued cells with joinsymb, in the same format as
+    the astropy csv writer used by write_table for other formats.
+
+    Args:
+        table, Table. Table to write.
+        tablename, str. Full pathname of the output csv file. This is written directly; see write_table for
+                        writing through a temporary file.
+        joinsymb, str. The symbol used to join values in a list/array when saving. Should not be a comma.
+        comma_replacement, str. Symbol replacing commas in string values.
+    """
+    with open(tablename, 'w') as fx:
+        fx.write(','.join(table.colnames) + '\n')
+        fx.writelines(_format_rows(table, joinsymb=joinsymb, comma_replacement=comma_replacement))
+
+def append_table(origtable, tablename=None, tabletype=None, joinsymb='|', comma_replacement=';',
+                 use_specprod=True):
+    """
+    Appends the rows of a table to a csv table on disk without rewriting the existing rows.
+
+    If the file doesn't exist, isn't a csv file, or has different columns than origtable,
+    the full table is read, stacked with origtable, and rewritten with write_table.
+
+    Args:
+        origtable, Table. Rows to append, e.g. new rows of an exposure or processing table.
+        tablename, str. Full pathname of the table. If None, it looks up the default for tabletype.
+        tabletype, str. Used if tablename is None to get the default name for the type of table.
+        joinsymb, str. The symbol used to join values in a list/array when saving. Should not be a comma.
+        comma_replacement, str. Symbol replacing commas in string values.
+        use_specprod, bool. If True and tablename not specified and tabletype is exposure table, this looks for the
+                            table in the SPECPROD rather than the exptab repository. Default is True.
+
+    Returns:
+        Nothing.
+    """
+    from astropy.table import vstack
+    log = get_logger()
+    if tablename is None:
+        tablename = translate_type_to_pathname(tabletype, use_specprod=use_specprod)
+
+    if len(origtable) == 0:
+        return
+
+    ext = os.path.splitext(tablename)[1]
+    header = None
+    if ext == '.csv' and os.path.isfile(tablename):
+        with open(tablename, newline='') as fx:
+            header = next(csv.reader(fx), None)
+
+    if header is None:
+        write_table(origtable, tablename=tablename, tabletype=tabletype, joinsymb=joinsymb,
+                    comma_replacement=comma_replacement)
+    elif header != origtable.colnames:
+        log.warning(f"Columns of {tablename} differ from those of the appended rows; rewriting the table")
+        table = load_table(tablename=tablename, tabletype=tabletype, joinsymb=joinsymb,
+                           suppress_logging=True)
+        write_table(vstack([table, origtable]), tablename=tablename, tabletype=tabletype,
+                    joinsymb=joinsymb, comma_replacement=comma_replacement)
+    else:
+        lines = _format_rows(origtable, joinsymb=joinsymb, comma_replacement=comma_replacement)
+        with open(tablename, 'rb+') as fx:
+            fx.seek(0, os.SEEK_END)
+            if fx.tell() > 0:
+                fx.seek(-1, os.SEEK_END)
+                if fx.read(1) != b'\n':
+                    fx.write(b'\n')
+            fx.write(''.join(lines).encode())
+
 def standardize_tabletype(tabletype):
     """
     Given the user defined type of table it returns the proper 'tabletype' expected by the pipeline
@@ -226,7 +581,8 @@ def translate_type_to_pathname(tabletype, use_specprod=True):
     return tablename
 
 def load_table(tablename=None, tabletype=None, joinsymb='|', verbose=False,
-               process_mixins=True, use_specprod=True, suppress_logging=False):
+               process_mixins=True, use_specprod=True, suppress_logging=False,
+               columns=None):
     """
     Workflow function to read in exposure, processing, and unprocessed tables. It allows for multi-valued table cells, which are
     generated from strings using the joinsymb. It reads from the file given by tablename (or the default for table of
@@ -250,10 +606,16 @@ def load_table(tablename=None, tabletype=None, joinsymb='|', verbose=False,
         suppress_logging, bool. If True, the log.info() messages are skipped. This
                            is useful in scripts looping over many tables to reduce the
                            amount of things printed to the screen.
+        columns, list of str. Only return these columns. Default is all columns. For csv exposure,
+                              processing, and unprocessed tables only these columns are parsed.
 
     Returns:
         table, Table. Either exposure table or processing table that was loaded from tablename (or from default name
                       based on tabletype). Returns None if the file doesn't exist.
+
+    Note:
+        csv exposure, processing, and unprocessed tables are read with read_typed_csv, which uses the
+        binary sidecar cache in $DESI_WORKFLOW_TABLE_CACHE if that is set.
     """
     from desispec.workflow.exptable import instantiate_exposure_table, get_exposure_table_column_defs
     from desispec.workflow.proctable import instantiate_processing_table, get_processing_table_column_defs
@@ -306,7 +668,12 @@ def load_table(tablename=None, tabletype=None, joinsymb='|', verbose=False,
         return None
 
     basename, ext = os.path.splitext(tablename)
-    if ext in ['.csv', '.ecsv']:
+    if ext == '.csv' and process_mixins and tabletype in ['exptable', 'unproctable', 'proctable']:
+        table = read_typed_csv(tablename, tabletype, columns=columns, joinsymb=joinsymb)
+        if verbose:
+            log.info("Expanded table: ", table.info)
+        return table
+    elif ext in ['.csv', '.ecsv']:
         table = Table.read(tablename, format=f'ascii{ext}')
 
         if verbose:
@@ -354,6 +721,9 @@ def load_table(tablename=None, tabletype=None, joinsymb='|', verbose=False,
     else:
         table = Table.read(tablename)
 
+    if columns is not None:
+        table = table[[nam for nam in table.colnames if nam in columns]]
+
     if verbose:
         log.info("Expanded table: ", table.info)
     return table